@@ -1,12 +1,11 @@
 import app.services.ai_services as ais
 import app.clients.rama_judicial_client as rjc
-import fitz
-import io
 from app.db import crud # We will create this file next
 import streamlit as st
 from app.db.database import engine, create_db_and_tables, proceso_table, actuacion_table
 import datetime
 from app.models.models import Proceso, Actuacion
+from app.services.document_services import obtener_texto_documento, resumir_documento
 
 def main():
     # Example usage of the AI service
@@ -61,6 +60,7 @@ def main():
     print(f"\\n--- Test: Consultar Documentos de Actuación ({test_id_reg_actuacion_docs}) ---")
     documentos_actuacion = rjc.consultar_documentos_actuacion(test_id_reg_actuacion_docs)
     test_id_reg_documento_descarga = None
+    documento_contenido = None
     if documentos_actuacion and isinstance(documentos_actuacion, list) and documentos_actuacion:
         print(f"Found {len(documentos_actuacion)} documento(s) for actuación {test_id_reg_actuacion_docs}.")
         for doc in documentos_actuacion[:1]: # Print first document info
@@ -91,18 +91,17 @@ def main():
     
     rjc.logging.info("Finished testing Rama Judicial API client.")
 
-    pdfstream = io.BytesIO(documento_contenido)
+    create_db_and_tables()
 
-    with fitz.open(stream=pdfstream, filetype="pdf") as doc:
-        for page_num, page in enumerate(doc, start=1):
-         text = page.get_text()
+    # Extract the text of all pages (in parallel for large PDFs, cached by checksum)
+    documento = obtener_texto_documento(engine, documento_contenido, id_reg_documento=test_id_reg_documento_descarga) if documento_contenido else None
+    text = documento.texto if documento else ""
 
-    responseLLM = ais.generar_resumen_actuacion(texto_actuacion=text)
+    # Long documents don't fit in a single prompt: summarize them map-reduce style
+    responseLLM = resumir_documento(engine, documento) if documento else ais.generar_resumen_actuacion(texto_actuacion=text)
     urgenciaLLM = ais.clasificar_urgencia_actuacion(texto_actuacion=text)
 
 
-    create_db_and_tables()
-
     st.set_page_config(layout="wide", page_title="Judicial AI Process Explorer")
 
     st.title("🤖 Judicial AI Process Explorer")
@@ -1,29 +1,111 @@
 import streamlit as st
 import datetime
+import math
+import uuid
+import pandas as pd
 from app.clients.rama_judicial_client import (
     consultar_procesos_por_nombre,
-    consultar_detalle_proceso,
-    consultar_actuaciones_proceso,
     consultar_procesos_por_numero_radicacion, # Added
     consultar_documentos_actuacion, # Added
     descargar_documento_actuacion # Added
 )
 from app.services.ai_services import (
-    generar_resumen_actuacion,
+    generar_resumen_actuacion_stream,
+    acumular_stream,
     clasificar_urgencia_actuacion
 )
 from app.db.database import engine, create_db_and_tables, proceso_table, actuacion_table
-from app.models.models import Proceso, Actuacion
 from app.db import crud # We will create this file next
-
-# Ensure database and tables are created
-create_db_and_tables()
+from app.services.enrichment import obtener_cola
+from app.services.prefetch import obtener_precargador, ESTADO_PENDIENTE, ESTADO_EN_CURSO
+from app.services.assistant import responder_pregunta
+from app.services.event_extraction import obtener_calendario
+from app.services.entity_resolution import resolver_empresa, vigilar_empresa, resumen_empresas_vigiladas
+from app.services.change_detection import sincronizar_empresa, describir_cambio
+from app.services.sujetos import normalizar_nombre
+from app.services.notificaciones import Filtro, obtener_notificador
 
 st.set_page_config(layout="wide", page_title="Judicial AI Process Explorer")
 
+TTL_CONSULTAS_API_S = 600 # Search and document-list responses are reused for 10 minutes
+TTL_AGENDA_S = 300 # The .ics agenda of the sidebar is rebuilt at most every 5 minutes
+INTERVALO_REFRESCO_S = 1.0 # How often the page polls an ingestion running in the background
+INTERVALO_AVISOS_S = 5.0 # How often a session drains its pushed urgent-actuacion alerts
+MAX_AVISOS = 3 # Toasts shown per drain; the rest are summarized
+ACTUACIONES_POR_PAGINA = 50
+LOTE_ENRIQUECIMIENTO = 500 # Most recent actuaciones enqueued for AI enrichment per proceso load
+URGENCIAS = ["ALTA", "MEDIA", "BAJA", "SIN CLASIFICAR"]
+
+@st.cache_resource
+def iniciar_recursos():
+    # Runs once per server process, not on every rerun: the schema check and migrations, and the
+    # background workers shared by all sessions (the engine and the LLM backends are module-level singletons)
+    create_db_and_tables()
+    return obtener_precargador(engine), obtener_cola(engine), obtener_notificador(engine)
+
+class SinRespuestaAPI(Exception):
+    '''Raised inside cached API lookups so that failed calls are not cached.'''
+
+def _consulta_cacheada(funcion, *args, **kwargs):
+    try:
+        return funcion(*args, **kwargs)
+    except SinRespuestaAPI:
+        return None
+
+@st.cache_data(ttl=TTL_CONSULTAS_API_S, show_spinner=False)
+def _buscar_por_nombre(nombre: str, codificacion_despacho: str | None):
+    respuesta = consultar_procesos_por_nombre(nombre=nombre, codificacion_despacho=codificacion_despacho)
+    if respuesta is None:
+        raise SinRespuestaAPI()
+    return respuesta
+
+@st.cache_data(ttl=TTL_CONSULTAS_API_S, show_spinner=False)
+def _buscar_por_radicado(numero_radicacion: str):
+    respuesta = consultar_procesos_por_numero_radicacion(numero_radicacion=numero_radicacion)
+    if respuesta is None:
+        raise SinRespuestaAPI()
+    return respuesta
+
+@st.cache_data(ttl=TTL_CONSULTAS_API_S, show_spinner=False)
+def _documentos_actuacion(id_reg_actuacion: str):
+    respuesta = consultar_documentos_actuacion(id_reg_actuacion)
+    if respuesta is None:
+        raise SinRespuestaAPI()
+    return respuesta
+
+@st.cache_data(ttl=TTL_AGENDA_S, show_spinner=False)
+def _agenda_ics(dias: int) -> str:
+    # The download button needs its data on every rerun; the events change far less often
+    return obtener_calendario(engine, dias=dias)
+
+precargador, cola_enriquecimiento, notificador = iniciar_recursos()
+
+@st.fragment(run_every=INTERVALO_REFRESCO_S)
+def mostrar_ingesta_en_curso(proceso_id_str: str):
+    # Re-runs on its own every INTERVALO_REFRESCO_S while the rest of the page stays interactive;
+    # a full rerun renders the proceso normally once the background ingestion ends
+    if precargador.estado(proceso_id_str) not in (ESTADO_PENDIENTE, ESTADO_EN_CURSO):
+        st.rerun()
+    proceso = crud.get_proceso_by_idrama(engine, proceso_id_str)
+    if not proceso:
+        st.info(f"⏳ Obteniendo detalles y actuaciones para el proceso {proceso_id_str} por primera vez...")
+        return
+    recientes = crud.get_actuaciones_pagina(engine, proceso.id, 1, ACTUACIONES_POR_PAGINA)
+    st.info(f"⏳ Descargando actuaciones: {recientes['total']} guardada(s) hasta ahora...")
+    st.caption(f"{proceso.despacho or 'N/A'} | {proceso.tipoProceso or 'N/A'} / {proceso.claseProceso or 'N/A'}")
+    if recientes["actuaciones"]:
+        st.dataframe([{"Fecha": (a["fechaActuacion"] or "")[:10], "Actuación": a["actuacion"], "Anotación": a["anotacion"]}
+                      for a in recientes["actuaciones"]], use_container_width=True, hide_index=True)
+
 st.title("🤖 Judicial AI Process Explorer")
 st.caption(f"Reto 1 Celerix - {datetime.date.today().strftime('%B %d, %Y')}")
 
+MAX_ALIAS_API = 3 # Extra API searches per query when searching with the known aliases
+
+# Identifies this browser session to the prefetcher: a new search cancels the pending prefetches of the previous one
+if "id_sesion" not in st.session_state:
+    st.session_state.id_sesion = uuid.uuid4().hex
+
 # --- Search Section ---
 st.sidebar.header("Buscar Procesos")
 
@@ -38,6 +120,12 @@ numero_radicacion = ""
 if search_method == "Nombre o Razón Social":
     nombre_razon_social = st.sidebar.text_input("Nombre o Razón Social", "")
     cod_despacho = st.sidebar.text_input("Código Despacho (Opcional)", "", help="Ej: 05001 para Medellín")
+    # Other spellings of the same company already seen locally ("BANCOLOMBIA SA", "BANCO LOMBIA", ...)
+    alias_busqueda = [a for a in resolver_empresa(engine, nombre_razon_social) if a.nombre_normalizado != normalizar_nombre(nombre_razon_social)] if nombre_razon_social else []
+    incluir_alias = False
+    if alias_busqueda:
+        st.sidebar.caption("Alias conocidos: " + ", ".join(a.nombre for a in alias_busqueda))
+        incluir_alias = st.sidebar.checkbox("Buscar también con los alias", value=True)
 else: # Número de Radicación
     numero_radicacion = st.sidebar.text_input("Número de Radicación Completo", "", help="Ej: 05001418900820250032700")
 
@@ -45,6 +133,7 @@ else: # Número de Radicación
 if st.sidebar.button("🔍 Buscar Procesos"):
     st.session_state.search_results = []
     st.session_state.selected_proceso_id = None # Reset selected process
+    precargador.cancelar(st.session_state.id_sesion)
     api_procesos_raw = None
 
     if search_method == "Nombre o Razón Social":
@@ -52,24 +141,30 @@ if st.sidebar.button("🔍 Buscar Procesos"):
             st.sidebar.error("Por favor, ingrese un nombre o razón social.")
         else:
             with st.spinner(f"Buscando procesos para '{nombre_razon_social}'..."):
-                api_procesos_raw = consultar_procesos_por_nombre(
-                    nombre=nombre_razon_social,
-                    codificacion_despacho=cod_despacho if cod_despacho else None
-                )
+                api_procesos_raw = _consulta_cacheada(_buscar_por_nombre, nombre_razon_social, cod_despacho if cod_despacho else None)
+                if incluir_alias and api_procesos_raw is not None:
+                    # Merge the results of the alias spellings, one entry per idProceso
+                    procesos_alias = {str(p.get("idProceso")): p for p in api_procesos_raw.get("procesos") or []}
+                    for alias in alias_busqueda[:MAX_ALIAS_API]:
+                        respuesta_alias = _consulta_cacheada(_buscar_por_nombre, alias.nombre, cod_despacho if cod_despacho else None)
+                        for p in (respuesta_alias or {}).get("procesos") or []:
+                            procesos_alias.setdefault(str(p.get("idProceso")), p)
+                    api_procesos_raw = {**api_procesos_raw, "procesos": list(procesos_alias.values())}
     elif search_method == "Número de Radicación":
         if not numero_radicacion:
             st.sidebar.error("Por favor, ingrese el número de radicación.")
         else:
             with st.spinner(f"Buscando proceso por radicado '{numero_radicacion}'..."):
                 # solo_activos for numero_radicacion is False by default in client
-                api_procesos_raw = consultar_procesos_por_numero_radicacion(
-                    numero_radicacion=numero_radicacion 
-                )
+                api_procesos_raw = _consulta_cacheada(_buscar_por_radicado, numero_radicacion)
     
     if api_procesos_raw:
         if api_procesos_raw.get("procesos"):
             st.session_state.search_results = api_procesos_raw.get("procesos")
             st.sidebar.success(f"{len(st.session_state.search_results)} proceso(s) encontrado(s).")
+            # Start fetching the top results before the user picks one
+            precargador.precargar(st.session_state.id_sesion, st.session_state.search_results,
+                                  nombre_busqueda=nombre_razon_social if search_method == "Nombre o Razón Social" else None)
         elif search_method == "Número de Radicación" and isinstance(api_procesos_raw, dict) and "idProceso" in api_procesos_raw:
             # If search by numero_radicacion returns a single process directly (not in a "procesos" list)
             # This depends on the actual API response structure for this endpoint.
@@ -86,6 +181,63 @@ if st.sidebar.button("🔍 Buscar Procesos"):
          (search_method == "Número de Radicación" and numero_radicacion):
         st.sidebar.error("Error al consultar la API de la Rama Judicial.")
 
+# --- Assistant Section ---
+st.sidebar.header("Asistente")
+pregunta_asistente = st.sidebar.text_input("Pregunta", "", help="Ej: ¿Qué procesos activos tiene la empresa ACME? / ¿Qué actuaciones recientes son críticas?")
+redactar_con_ia = st.sidebar.checkbox("Redactar respuesta con IA", value=False, help="Más natural, pero más lento.")
+if st.sidebar.button("💬 Preguntar") and pregunta_asistente:
+    # Answered from the local database; the LLM only helps with intent and phrasing
+    st.session_state.respuesta_asistente = responder_pregunta(engine, pregunta_asistente, redactar_con_ia=redactar_con_ia)
+
+# --- Watchlist Section ---
+st.sidebar.header("Empresas Vigiladas")
+empresa_nueva = st.sidebar.text_input("Empresa a vigilar", "", help="Se agrupan automáticamente sus variantes: 'BANCOLOMBIA S.A.', 'BANCOLOMBIA SA', 'BANCO LOMBIA'...")
+if st.sidebar.button("👁️ Vigilar") and empresa_nueva:
+    if vigilar_empresa(engine, empresa_nueva):
+        st.sidebar.success(f"'{empresa_nueva}' agregada a las empresas vigiladas.")
+    else:
+        st.sidebar.error("No se pudo agregar la empresa.")
+
+st.sidebar.download_button(
+    "📅 Descargar agenda (.ics)",
+    data=_agenda_ics(90),
+    file_name="agenda_judicial.ics",
+    mime="text/calendar",
+    help="Términos, audiencias y requerimientos de los próximos 90 días."
+)
+
+# --- Alerts Section ---
+st.sidebar.header("Avisos")
+avisos_activos = st.sidebar.checkbox("🔔 Avisar urgencias ALTA", value=True, help="Actuaciones nuevas o clasificadas ALTA, mientras la página esté abierta.")
+
+@st.fragment(run_every=INTERVALO_AVISOS_S)
+def mostrar_avisos():
+    # Drains this session's subscription to the shared notifier: the outbox is read once per
+    # server process, not once per session
+    avisos = st.session_state.suscripcion_avisos.recibir(0)
+    for aviso in avisos[-MAX_AVISOS:]:
+        st.toast(f"**{aviso['empresa'] or 'Proceso'} · {aviso['numeroRadicacion'] or aviso['idProceso']}**  \n"
+                 f"{(aviso['fechaActuacion'] or '')[:10]} {aviso['actuacion'] or ''}: {aviso['anotacion']}", icon="🚨")
+    if len(avisos) > MAX_AVISOS:
+        st.toast(f"Y {len(avisos) - MAX_AVISOS} actuación(es) urgente(s) más.", icon="🚨")
+
+if avisos_activos:
+    if "suscripcion_avisos" not in st.session_state or st.session_state.suscripcion_avisos.cerrada:
+        st.session_state.suscripcion_avisos = notificador.suscribir(Filtro(urgencias=["ALTA"]))
+    with st.sidebar:
+        mostrar_avisos()
+elif "suscripcion_avisos" in st.session_state:
+    notificador.cancelar(st.session_state.pop("suscripcion_avisos"))
+
+if st.session_state.get("respuesta_asistente"):
+    respuesta_asistente = st.session_state.respuesta_asistente
+    st.subheader("Respuesta del Asistente")
+    st.markdown(respuesta_asistente.respuesta)
+    st.caption(f"Consulta: {respuesta_asistente.consulta.intencion} | {respuesta_asistente.duracion_ms:.0f} ms")
+    if respuesta_asistente.filas:
+        with st.expander(f"Ver datos ({len(respuesta_asistente.filas)} filas)"):
+            st.dataframe(respuesta_asistente.filas, use_container_width=True)
+
 # --- Display Search Results ---
 if 'search_results' in st.session_state and st.session_state.search_results:
     st.subheader("Resultados de la Búsqueda")
@@ -126,96 +278,33 @@ if 'selected_proceso_id' in st.session_state and st.session_state.selected_proce
     proceso_id_str = str(st.session_state.selected_proceso_id)
     st.header(f"Detalles del Proceso ID: {proceso_id_str}")
 
-    # 1. Check if process is in DB, if not, fetch, process, and store
+    # 1. Check if process is in DB; if not, ingest it in the background (shared with the prefetcher,
+    # so reruns and other sessions never fetch it twice) and render it as it lands in the DB
     proceso_db = crud.get_proceso_by_idrama(engine, proceso_id_str)
+    estado_ingesta = precargador.estado(proceso_id_str)
+    if not proceso_db and estado_ingesta is None:
+        # Stored without AI fields; summaries and urgency are generated afterwards by the enrichment queue
+        sujetos_busqueda = next((p.get("sujetosProcesales") for p in st.session_state.get("search_results", [])
+                                 if str(p.get("idProceso")) == proceso_id_str), None)
+        precargador.solicitar(proceso_id_str, nombre_busqueda=st.session_state.get("nombre_busqueda_cache"),
+                              sujetos_procesales=sujetos_busqueda)
+        estado_ingesta = precargador.estado(proceso_id_str)
+
+    if estado_ingesta in (ESTADO_PENDIENTE, ESTADO_EN_CURSO):
+        mostrar_ingesta_en_curso(proceso_id_str)
+        proceso_db = None # Rendered in full once the ingestion ends
+    elif not proceso_db:
+        st.error(f"No se pudieron obtener o guardar los detalles del proceso {proceso_id_str}. {precargador.error(proceso_id_str) or ''}")
+        if st.button("🔁 Reintentar"):
+            precargador.solicitar(proceso_id_str, nombre_busqueda=st.session_state.get("nombre_busqueda_cache"))
+            st.rerun()
+    else:
+        # Schedule AI enrichment of whatever is still missing, most recent / likely urgent first.
+        # Once per proceso load, not on every rerun: the queue keeps them until they are done
+        if st.session_state.get("proceso_enriquecimiento_encolado") != proceso_db.id:
+            cola_enriquecimiento.encolar(crud.get_actuaciones_sin_enriquecer(engine, proceso_db.id, limit=LOTE_ENRIQUECIMIENTO))
+            st.session_state.proceso_enriquecimiento_encolado = proceso_db.id
 
-    if not proceso_db:
-        with st.spinner(f"Obteniendo detalles y actuaciones para el proceso {proceso_id_str} por primera vez..."):
-            # Fetch details
-            detalle_raw = consultar_detalle_proceso(proceso_id_str)
-            if not detalle_raw or not detalle_raw.get("idProceso"): # API might return list for detail
-                st.error(f"No se pudieron obtener los detalles para el proceso {proceso_id_str}.")
-                st.stop()
-
-            # The detail endpoint might return a list with one element
-            if isinstance(detalle_raw, list) and detalle_raw:
-                detalle_data = detalle_raw[0]
-            elif isinstance(detalle_raw, dict) and detalle_raw.get("idProceso"):
-                 detalle_data = detalle_raw
-            else:
-                st.error(f"Formato inesperado para detalles del proceso {proceso_id_str}.")
-                st.json(detalle_raw)
-                st.stop()
-
-
-            # Create Proceso Pydantic model from API data
-            proceso_data_for_db = Proceso(
-                idProceso=str(detalle_data.get("idProceso")),
-                numeroRadicacion=detalle_data.get("numero"), # Assuming 'numero' is numeroRadicacion
-                despacho=detalle_data.get("despacho"),
-                ponente=detalle_data.get("ponente"),
-                sujetos=str(detalle_data.get("sujetosProcesales")), # Convert list/dict to str if necessary
-                fechaRadicacion=detalle_data.get("fechaProceso") or detalle_data.get("fechaRadicacion"),
-                tipoProceso=detalle_data.get("tipoProceso"),
-                claseProceso=detalle_data.get("claseProceso"),
-                ubicacionExpediente=detalle_data.get("ubicacionExpediente") or detalle_data.get("ubicacion"),
-                demandante=detalle_data.get("demandanteNombre") or detalle_data.get("sujetosProcesales", [{}])[0].get("nombre") if isinstance(detalle_data.get("sujetosProcesales"), list) and detalle_data.get("sujetosProcesales") else "N/A",
-                demandado=detalle_data.get("demandadoNombre") or detalle_data.get("sujetosProcesales", [{}, {}])[1].get("nombre") if isinstance(detalle_data.get("sujetosProcesales"), list) and len(detalle_data.get("sujetosProcesales")) > 1 else "N/A",
-                nombre_busqueda=st.session_state.get("nombre_busqueda_cache") # Use cached search name
-            )
-            proceso_db_id = crud.create_proceso(engine, proceso_data_for_db)
-            if not proceso_db_id:
-                st.error("Error al guardar el proceso en la base de datos.")
-                st.stop()
-            
-            proceso_db = crud.get_proceso_by_idrama(engine, proceso_id_str) # Fetch again to get the full object
-
-            # Fetch actuaciones
-            actuaciones_raw = consultar_actuaciones_proceso(proceso_id_str)
-            actuaciones_list = []
-            if actuaciones_raw:
-                # Determine if 'actuaciones_raw' is a list directly or a dict containing a list
-                if isinstance(actuaciones_raw, list):
-                    actuaciones_list = actuaciones_raw
-                elif isinstance(actuaciones_raw, dict) and 'actuaciones' in actuaciones_raw and isinstance(actuaciones_raw['actuaciones'], list):
-                    actuaciones_list = actuaciones_raw['actuaciones']
-                elif isinstance(actuaciones_raw, dict) and 'listaActuaciones' in actuaciones_raw and isinstance(actuaciones_raw['listaActuaciones'], list):
-                    actuaciones_list = actuaciones_raw['listaActuaciones']    
-                else:
-                    st.warning(f"Formato inesperado para actuaciones del proceso {proceso_id_str}. Se intentará procesar si es una lista.")
-                    if isinstance(actuaciones_raw, list): # If it's a list at the top level
-                         actuaciones_list = actuaciones_raw
-                    else: # Log or display the unexpected structure
-                        st.json(actuaciones_raw)
-
-
-            if actuaciones_list:
-                st.write(f"Procesando {len(actuaciones_list)} actuaciones...")
-                progress_bar = st.progress(0)
-                for i, act_raw in enumerate(actuaciones_list):
-                    anotacion = act_raw.get("anotacion", "")
-                    resumen = generar_resumen_actuacion(anotacion)
-                    clasificacion = clasificar_urgencia_actuacion(act_raw.get("actuacion"), anotacion)
-
-                    actuacion_data_for_db = Actuacion(
-                        idRegActuacion=str(act_raw.get("idRegActuacion")),
-                        proceso_db_id=proceso_db.id, # Use the DB id of the parent proceso
-                        fechaActuacion=act_raw.get("fechaActuacion"),
-                        actuacion=act_raw.get("actuacion"),
-                        anotacion=anotacion,
-                        fechaIniciaTermino=act_raw.get("fechaIniciaTermino"),
-                        fechaFinalizaTermino=act_raw.get("fechaFinalizaTermino"),
-                        fechaRegistro=act_raw.get("fechaRegistro"),
-                        conDocumentos=act_raw.get("conDocumentos", False),
-                        resumen_ia=resumen,
-                        clasificacion_urgencia_ia=clasificacion
-                    )
-                    crud.create_actuacion(engine, actuacion_data_for_db)
-                    progress_bar.progress((i + 1) / len(actuaciones_list))
-                st.success("Actuaciones procesadas y guardadas.")
-            else:
-                st.info("No se encontraron actuaciones para este proceso o el formato fue inesperado.")
-    
     # Display Proceso Details from DB
     if proceso_db:
         st.subheader("Información General del Proceso (Desde BD)")
@@ -229,27 +318,107 @@ if 'selected_proceso_id' in st.session_state and st.session_state.selected_proce
             st.text_input("Ubicación Expediente", proceso_db.ubicacionExpediente or "N/A", disabled=True)
             st.text_input("Fecha Radicación", proceso_db.fechaRadicacion or "N/A", disabled=True)
 
-        st.text_area("Sujetos Procesales", proceso_db.sujetos or "N/A", height=100, disabled=True)
+        sujetos_db = crud.get_sujetos_by_proceso_db_id(engine, proceso_db.id)
+        if sujetos_db:
+            st.markdown("**Sujetos Procesales**")
+            st.dataframe([{"Rol": s.rol, "Nombre": s.nombre, "NIT": s.nit or ""} for s in sujetos_db], use_container_width=True, hide_index=True)
+        else:
+            st.text_area("Sujetos Procesales", proceso_db.sujetos or "N/A", height=100, disabled=True)
         st.caption(f"ID Rama Judicial: {proceso_db.idProceso} | ID Base de Datos: {proceso_db.id}")
         st.caption(f"Consultado via API por: '{proceso_db.nombre_busqueda}' el {proceso_db.fecha_consulta_api}")
         st.caption(f"Registro en BD creado: {proceso_db.fecha_creacion_db}, actualizado: {proceso_db.fecha_actualizacion_db}")
 
         # Display Actuaciones from DB
         st.subheader("Actuaciones del Proceso (Desde BD)")
-        actuaciones_db = crud.get_actuaciones_by_proceso_db_id(engine, proceso_db.id)
-        if actuaciones_db:
-            for idx, act in enumerate(actuaciones_db):
+        tipos_actuacion = crud.get_tipos_actuacion(engine, proceso_db.id)
+        if tipos_actuacion:
+            en_cola = cola_enriquecimiento.pendientes()
+            if en_cola:
+                col_cola, col_refrescar = st.columns([4, 1])
+                col_cola.caption(f"🤖 {en_cola} actuación(es) en cola de análisis IA (recientes y urgentes primero).")
+                if col_refrescar.button("🔄 Actualizar"):
+                    st.rerun()
+
+            # Filters and pagination run in SQL: one page of light rows is loaded and rendered, whatever
+            # the size of the proceso, and the full actuación is loaded for the selected row only
+            col_urgencia, col_tipo, col_desde, col_hasta = st.columns(4)
+            urgencias = col_urgencia.multiselect("Urgencia", URGENCIAS, key=f"filtro_urgencia_{proceso_db.id}")
+            tipo = col_tipo.selectbox("Tipo de actuación", ["Todos"] + [t for t in tipos_actuacion if t], key=f"filtro_tipo_{proceso_db.id}")
+            desde = col_desde.date_input("Desde", value=None, key=f"filtro_desde_{proceso_db.id}")
+            hasta = col_hasta.date_input("Hasta", value=None, key=f"filtro_hasta_{proceso_db.id}")
+            filtros = {
+                "urgencias": urgencias or None,
+                "tipo": None if tipo == "Todos" else tipo,
+                "desde": desde.isoformat() if desde else None,
+                "hasta": hasta.isoformat() if hasta else None,
+            }
+
+            clave_pagina = f"pagina_actuaciones_{proceso_db.id}"
+            pagina = st.session_state.get(clave_pagina, 1)
+            pagina_actuaciones = crud.get_actuaciones_pagina(engine, proceso_db.id, pagina, ACTUACIONES_POR_PAGINA, **filtros)
+            paginas = max(1, math.ceil(pagina_actuaciones["total"] / ACTUACIONES_POR_PAGINA))
+            if pagina > paginas: # The filters left fewer pages
+                st.session_state[clave_pagina] = pagina = paginas
+                pagina_actuaciones = crud.get_actuaciones_pagina(engine, proceso_db.id, pagina, ACTUACIONES_POR_PAGINA, **filtros)
+            filas = pagina_actuaciones["actuaciones"]
+            tabla = st.dataframe(
+                [{
+                    "Fecha": (f["fechaActuacion"] or "")[:10],
+                    "Actuación": f["actuacion"],
+                    "Urgencia": f["clasificacion_urgencia_ia"] or "N/A",
+                    "Resumen IA": "✓" if f["con_resumen_ia"] else "",
+                    "Docs": "📎" if f["conDocumentos"] else "",
+                    "Anotación": (f["anotacion"] or "") + ("…" if f["anotacion_truncada"] else ""),
+                } for f in filas],
+                use_container_width=True, hide_index=True, on_select="rerun", selection_mode="single-row",
+                # A new page or new filters start without a selection
+                key=f"tabla_actuaciones_{proceso_db.id}_{pagina}_{hash(str(filtros))}"
+            )
+            col_pagina, col_total = st.columns([1, 3])
+            col_pagina.number_input("Página", min_value=1, max_value=paginas, step=1, key=clave_pagina)
+            col_total.caption(f"{pagina_actuaciones['total']} actuación(es) · página {pagina} de {paginas}")
+
+            filas_seleccionadas = tabla.selection.rows
+            act = None
+            if filas_seleccionadas and filas_seleccionadas[0] < len(filas):
+                act = crud.get_actuacion_by_db_id(engine, filas[filas_seleccionadas[0]]["id"])
+            if act is None:
+                st.caption("Seleccione una actuación en la tabla para ver su detalle.")
+            else:
                 urgency_color = {
                     "ALTA": "red",
                     "MEDIA": "orange",
                     "BAJA": "green"
                 }.get(act.clasificacion_urgencia_ia, "blue")
 
-                with st.expander(f"{act.fechaActuacion} - {act.actuacion} - Urgencia: :{urgency_color}[{act.clasificacion_urgencia_ia or 'N/A'}]", expanded=idx==0):
+                with st.container(border=True):
+                    st.markdown(f"**{act.fechaActuacion} - {act.actuacion} - Urgencia: :{urgency_color}[{act.clasificacion_urgencia_ia or 'N/A'}]**")
                     st.markdown(f"**Anotación:**")
                     st.text_area(f"anotacion_{act.id}", act.anotacion or "N/A", height=150, disabled=True, key=f"anot_orig_{act.id}")
                     st.markdown(f"**Resumen IA:**")
-                    st.text_area(f"resumen_ia_{act.id}", act.resumen_ia or "No disponible.", height=100, disabled=True, key=f"anot_ia_{act.id}")
+                    if act.resumen_ia:
+                        st.text_area(f"resumen_ia_{act.id}", act.resumen_ia, height=100, disabled=True, key=f"anot_ia_{act.id}")
+                    elif st.button("✨ Analizar con IA ahora", key=f"gen_resumen_{act.id}"):
+                        # On demand: take the actuación out of the queue and render the summary
+                        # token by token; it is persisted once the stream ends
+                        if cola_enriquecimiento.reclamar(act.id):
+                            try:
+                                st.write_stream(acumular_stream(
+                                    generar_resumen_actuacion_stream(act.anotacion or ""),
+                                    lambda texto, act_id=act.id: crud.update_actuacion_ia(engine, act_id, resumen_ia=texto)
+                                ))
+                                if not act.clasificacion_urgencia_ia:
+                                    clasificacion = clasificar_urgencia_actuacion(act.anotacion or act.actuacion or "")
+                                    crud.update_actuacion_ia(engine, act.id, clasificacion_urgencia_ia=clasificacion)
+                                    st.caption(f"Urgencia: {clasificacion or 'N/A'}")
+                            finally:
+                                cola_enriquecimiento.liberar(act.id)
+                        else:
+                            st.info("El análisis IA de esta actuación ya está en curso.")
+                    elif cola_enriquecimiento.esta_pendiente(act.id):
+                        st.caption("En cola de análisis IA.")
+                    else:
+                        st.caption("No disponible.")
                     
                     col1_act, col2_act, col3_act, col4_act = st.columns(4)
                     col1_act.text_input("Fecha Registro", act.fechaRegistro or "N/A", disabled=True, key=f"freg_{act.id}")
@@ -270,7 +439,7 @@ if 'selected_proceso_id' in st.session_state and st.session_state.selected_proce
                     if st.session_state.get("actuacion_docs_id_to_show") == str(act.idRegActuacion):
                         if st.session_state.get("documentos_list") is None: # Fetch only once or if reset
                             with st.spinner(f"Consultando documentos para actuación {act.idRegActuacion}..."):
-                                docs = consultar_documentos_actuacion(str(act.idRegActuacion))
+                                docs = _consulta_cacheada(_documentos_actuacion, str(act.idRegActuacion))
                                 if docs and isinstance(docs, list):
                                     st.session_state.documentos_list = docs
                                 elif docs: # API returned something but not a list
@@ -321,6 +490,57 @@ if 'selected_proceso_id' in st.session_state and st.session_state.selected_proce
 else:
     st.info("Realice una búsqueda para ver los procesos y sus detalles.")
 
+    # --- Portfolio Dashboard (materialized aggregates, cheap on every rerun) ---
+    st.subheader("Panel de la Cartera")
+    conteo_urgencias = crud.count_actuaciones_por_urgencia(engine)
+    if conteo_urgencias:
+        columnas_urgencia = st.columns(len(conteo_urgencias))
+        for columna, urgencia in zip(columnas_urgencia, sorted(conteo_urgencias)):
+            columna.metric(f"Urgencia {urgencia}", conteo_urgencias[urgencia])
+
+        hoy = datetime.date.today()
+        por_dia = crud.get_actuaciones_por_dia(engine, desde=(hoy - datetime.timedelta(days=90)).isoformat())
+        if por_dia:
+            st.markdown("**Actuaciones por día (últimos 90 días)**")
+            st.bar_chart(pd.DataFrame(por_dia).pivot_table(index="dia", columns="urgencia", values="total", fill_value=0))
+
+        col_despachos, col_eventos = st.columns(2)
+        with col_despachos:
+            st.markdown("**Procesos por despacho**")
+            st.dataframe(crud.get_procesos_por_despacho(engine, limit=15), use_container_width=True, hide_index=True)
+        with col_eventos:
+            st.markdown("**Próximos 15 días por empresa**")
+            st.dataframe(crud.get_eventos_por_empresa(engine, hoy.isoformat(), (hoy + datetime.timedelta(days=15)).isoformat()),
+                         use_container_width=True, hide_index=True)
+
+    empresas_vigiladas = resumen_empresas_vigiladas(engine)
+    if empresas_vigiladas:
+        st.subheader("Empresas Vigiladas")
+        for vigilada in empresas_vigiladas:
+            with st.expander(f"{vigilada['empresa'].nombre} — {len(vigilada['procesos'])} proceso(s), {len(vigilada['alias'])} alias"):
+                if vigilada["alias"]:
+                    st.caption("Alias: " + ", ".join(f"{a.nombre} ({a.similitud:.0%})" for a in vigilada["alias"]))
+                st.dataframe(vigilada["procesos"], use_container_width=True, hide_index=True)
+                cambios = crud.get_cambios_proceso(engine, vigilada["empresa"].id, limit=20)
+                if cambios:
+                    st.markdown("**Cambios recientes**")
+                    for cambio in cambios:
+                        st.caption(f"{cambio.fecha_deteccion:%Y-%m-%d %H:%M} · {describir_cambio(cambio)}")
+                col_sync, col_dejar = st.columns(2)
+                if col_sync.button("🔄 Detectar cambios", key=f"sincronizar_{vigilada['empresa'].id}"):
+                    with st.spinner(f"Comparando los procesos activos de {vigilada['empresa'].nombre}..."):
+                        resumen = sincronizar_empresa(engine, vigilada["empresa"])
+                    if resumen is None:
+                        st.error("Error al consultar la API de la Rama Judicial.")
+                    elif resumen["linea_base"]:
+                        st.info(f"Línea base registrada: {resumen['procesos']} procesos activos.")
+                    else:
+                        st.success(f"{resumen['nuevos']} nuevos, {resumen['desaparecidos']} desaparecidos, "
+                                   f"{resumen['modificados']} modificados ({resumen['sin_cambios']} sin cambios).")
+                if col_dejar.button("Dejar de vigilar", key=f"dejar_vigilar_{vigilada['empresa'].id}"):
+                    crud.delete_empresa_vigilada(engine, vigilada["empresa"].id)
+                    st.rerun()
+
 st.sidebar.markdown("---_---")
 st.sidebar.caption("GitHub Copilot Demo")
 
@@ -0,0 +1,263 @@
+'''
+Async JSON API over the local store, for other internal systems.
+
+Endpoints (all require an API key as a bearer token, see app/auth/oauth2_login_fastapi.py):
+
+    GET /procesos?empresa=...|nit=...           procesos of a company (any of its aliases) or of a NIT
+    GET /procesos/{id_proceso}                   a proceso and its sujetos
+    GET /procesos/{id_proceso}/actuaciones       one page of its actuaciones, with filters
+    GET /actuaciones/{actuacion_db_id}           one actuacion with its full text
+    GET /eventos                                 upcoming terms, hearings and deadlines
+    GET /buscar?q=...                            semantic search over actuaciones and documents
+    GET /exportaciones/actuaciones?empresa=...   every actuacion of a company, as NDJSON or CSV
+    GET /notificaciones                          Server-Sent Events of new and classified actuaciones
+
+The crud layer is synchronous, so each query runs on the threadpool and the event loop only
+waits for it. Exports are streamed: the procesos of the company are resolved once, through its aliases
+as in /procesos, then their actuaciones are read in batches of TAMANO_LOTE_EXPORTACION by ID
+(keyset) and each batch is serialized and sent before the next one is read, so memory does
+not grow with the size of the company.
+
+    uvicorn app.api.main:app --host 0.0.0.0 --port 8000
+'''
+import asyncio
+import csv
+import io
+import json
+import logging
+import math
+import re
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
+from typing import Literal
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.auth.oauth2_login_fastapi import CacheClaves, verificar_token
+from app.db import crud
+from app.db.database import create_db_and_tables, engine
+from app.services import retrieval
+from app.services.entity_resolution import procesos_de_empresa
+from app.services.notificaciones import Filtro, formato_sse, obtener_notificador
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+URGENCIAS = ['ALTA', 'MEDIA', 'BAJA', 'SIN CLASIFICAR']
+MAX_POR_PAGINA = 200
+MAX_RESULTADOS = 1000
+TAMANO_LOTE_EXPORTACION = 1000 # Actuaciones read and sent per step of an export
+MAX_PROCESOS_EXPORTACION = 100_000 # Procesos of a company included in an export
+PROCESOS_POR_CONSULTA = 500 # Proceso IDs per IN (...) of an export query, under SQLite's parameter limit
+COLUMNAS_EXPORTACION = [
+    "id", "idProceso", "numeroRadicacion", "despacho", "nombre_busqueda", "idRegActuacion",
+    "fechaActuacion", "actuacion", "anotacion", "fechaIniciaTermino", "fechaFinalizaTermino",
+    "fechaRegistro", "conDocumentos", "clasificacion_urgencia_ia", "resumen_ia", "fecha_actualizacion_db",
+]
+LATIDO_SSE_S = 15.0 # Comment sent on idle notification streams, so proxies keep them open
+
+router = APIRouter(dependencies=[Depends(verificar_token)])
+
+def _db(request: Request):
+    return request.app.state.db_engine
+
+async def _proceso_o_404(db_engine, id_proceso: str):
+    proceso = await run_in_threadpool(crud.get_proceso_by_idrama, db_engine, id_proceso)
+    if proceso is None:
+        raise HTTPException(status_code=404, detail=f"Proceso {id_proceso} no encontrado")
+    return proceso
+
+@router.get("/procesos")
+async def listar_procesos(
+    request: Request,
+    empresa: str | None = Query(None, min_length=3),
+    nit: str | None = None,
+    rol: str | None = None,
+    limit: int = Query(100, ge=1, le=MAX_RESULTADOS)
+):
+    db_engine = _db(request)
+    if nit:
+        procesos = await run_in_threadpool(crud.get_procesos_by_sujeto, db_engine, nit=nit.strip(), rol=rol, limit=limit)
+        return {"alias": [], "procesos": procesos}
+    if empresa:
+        alias, procesos = await run_in_threadpool(procesos_de_empresa, db_engine, empresa, rol=rol, limit=limit)
+        return {"alias": alias, "procesos": procesos}
+    raise HTTPException(status_code=422, detail="Indique empresa o nit")
+
+@router.get("/procesos/{id_proceso}")
+async def obtener_proceso(request: Request, id_proceso: str):
+    db_engine = _db(request)
+    proceso = await _proceso_o_404(db_engine, id_proceso)
+    sujetos = await run_in_threadpool(crud.get_sujetos_by_proceso_db_id, db_engine, proceso.id)
+    return {"proceso": proceso, "sujetos": sujetos}
+
+@router.get("/procesos/{id_proceso}/actuaciones")
+async def listar_actuaciones(
+    request: Request,
+    id_proceso: str,
+    pagina: int = Query(1, ge=1),
+    por_pagina: int = Query(50, ge=1, le=MAX_POR_PAGINA),
+    urgencia: list[str] | None = Query(None),
+    tipo: str | None = None,
+    desde: date | None = None,
+    hasta: date | None = None
+):
+    db_engine = _db(request)
+    proceso = await _proceso_o_404(db_engine, id_proceso)
+    resultado = await run_in_threadpool(
+        crud.get_actuaciones_pagina, db_engine, proceso.id, pagina, por_pagina,
+        [u for u in urgencia or [] if u in URGENCIAS], tipo,
+        desde.isoformat() if desde else None, hasta.isoformat() if hasta else None
+    )
+    return {**resultado, "paginas": max(1, math.ceil(resultado["total"] / por_pagina))}
+
+@router.get("/actuaciones/{actuacion_db_id}")
+async def obtener_actuacion(request: Request, actuacion_db_id: int):
+    actuacion = await run_in_threadpool(crud.get_actuacion_by_db_id, _db(request), actuacion_db_id)
+    if actuacion is None:
+        raise HTTPException(status_code=404, detail=f"Actuación {actuacion_db_id} no encontrada")
+    return actuacion
+
+@router.get("/eventos")
+async def listar_eventos(
+    request: Request,
+    desde: date | None = None,
+    hasta: date | None = None,
+    dias: int = Query(90, ge=1, le=366),
+    tipo: list[str] | None = Query(None),
+    empresa: str | None = None,
+    id_proceso: str | None = None,
+    limit: int = Query(500, ge=1, le=MAX_RESULTADOS)
+):
+    db_engine = _db(request)
+    desde = desde or date.today()
+    hasta = hasta or desde + timedelta(days=dias)
+    proceso_db_id = (await _proceso_o_404(db_engine, id_proceso)).id if id_proceso else None
+    eventos = await run_in_threadpool(
+        crud.get_eventos_entre, db_engine, desde.isoformat(), hasta.isoformat() + "T23:59:59",
+        tipos=tipo, empresa=empresa, proceso_db_id=proceso_db_id, limit=limit
+    )
+    return {"desde": desde, "hasta": hasta, "eventos": eventos}
+
+@router.get("/buscar")
+async def buscar(
+    request: Request,
+    q: str = Query(..., min_length=3),
+    k: int = Query(8, ge=1, le=50),
+    empresa: str | None = None,
+    urgencia: list[str] | None = Query(None),
+    desde: date | None = None,
+    hasta: date | None = None
+):
+    resultados = await run_in_threadpool(
+        retrieval.buscar_contexto, _db(request), q, k=k, empresa=empresa,
+        urgencias=urgencia, fecha_desde=desde, fecha_hasta=hasta
+    )
+    return {"resultados": resultados}
+
+async def _lotes_actuaciones_empresa(db_engine, empresa: str):
+    _, procesos = await run_in_threadpool(procesos_de_empresa, db_engine, empresa, limit=MAX_PROCESOS_EXPORTACION)
+    ids = sorted(p["id"] for p in procesos)
+    for inicio in range(0, len(ids), PROCESOS_POR_CONSULTA):
+        grupo = ids[inicio:inicio + PROCESOS_POR_CONSULTA]
+        # Keyset over actuacion.id: one short query per batch, no connection held between batches
+        ultimo_id = 0
+        while True:
+            lote = await run_in_threadpool(
+                crud.get_actuaciones_procesos_after_id, db_engine, grupo, ultimo_id, TAMANO_LOTE_EXPORTACION
+            )
+            if not lote:
+                break
+            yield lote
+            if len(lote) < TAMANO_LOTE_EXPORTACION:
+                break
+            ultimo_id = lote[-1]["id"]
+
+async def _ndjson(lotes):
+    async for lote in lotes:
+        yield "".join(
+            json.dumps({c: fila.get(c) for c in COLUMNAS_EXPORTACION}, ensure_ascii=False, default=str) + "\n"
+            for fila in lote
+        )
+
+async def _csv(lotes):
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=COLUMNAS_EXPORTACION, extrasaction="ignore")
+    escritor.writeheader()
+    async for lote in lotes:
+        escritor.writerows(lote)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue() # Header only: the company has no actuaciones
+
+@router.get("/exportaciones/actuaciones")
+async def exportar_actuaciones(
+    request: Request,
+    empresa: str = Query(..., min_length=3),
+    formato: Literal["ndjson", "csv"] = "ndjson"
+):
+    lotes = _lotes_actuaciones_empresa(_db(request), empresa)
+    archivo = re.sub(r"[^A-Za-z0-9]+", "_", empresa).strip("_").lower() or "empresa"
+    if formato == "csv":
+        contenido, tipo = _csv(lotes), "text/csv; charset=utf-8"
+    else:
+        contenido, tipo = _ndjson(lotes), "application/x-ndjson"
+    return StreamingResponse(
+        contenido, media_type=tipo,
+        headers={"Content-Disposition": f'attachment; filename="actuaciones_{archivo}.{formato}"'}
+    )
+
+async def _flujo_notificaciones(request: Request, notificador, suscripcion):
+    try:
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            notificaciones = await suscripcion.recibir_async(LATIDO_SSE_S)
+            yield "".join(formato_sse(n) for n in notificaciones) if notificaciones else ": latido\n\n"
+    finally:
+        notificador.cancelar(suscripcion)
+
+@router.get("/notificaciones")
+async def notificaciones(
+    request: Request,
+    empresa: list[str] | None = Query(None),
+    id_proceso: list[str] | None = Query(None),
+    urgencia: list[str] | None = Query(None)
+):
+    ultimo = request.headers.get("last-event-id", "")
+    notificador = obtener_notificador(_db(request))
+    suscripcion = await run_in_threadpool(
+        notificador.suscribir, Filtro(empresa, id_proceso, urgencia),
+        int(ultimo) if ultimo.isdigit() else None, asyncio.get_running_loop()
+    )
+    return StreamingResponse(
+        _flujo_notificaciones(request, notificador, suscripcion), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def crear_app(db_engine=None) -> FastAPI:
+    '''
+    Builds the API over a database.
+
+    Args:
+        db_engine: Optional. The SQLAlchemy engine (default: the application database).
+
+    Returns:
+        The FastAPI application.
+    '''
+    db_engine = db_engine or engine
+
+    @asynccontextmanager
+    async def ciclo_de_vida(api: FastAPI):
+        await run_in_threadpool(create_db_and_tables, db_engine)
+        obtener_notificador(db_engine) # Starts its thread, which also purges the outbox
+        yield
+
+    api = FastAPI(title="Judicial AI API", version="1.0", lifespan=ciclo_de_vida)
+    api.state.db_engine = db_engine
+    api.state.claves = CacheClaves(db_engine)
+    api.include_router(router)
+    return api
+
+app = crear_app()
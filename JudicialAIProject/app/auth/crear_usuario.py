@@ -1,19 +1,28 @@
-from sqlalchemy.orm import Session
-from oauth2_login_fastapi import SessionLocal, User, pwd_context
+'''
+Creates or revokes the API keys of the client systems of the JSON service.
 
-# Crear sesión
-db: Session = SessionLocal()
+    python -m app.auth.crear_usuario erp-juridico
+    python -m app.auth.crear_usuario erp-juridico --revocar
+'''
+import argparse
+from app.auth.oauth2_login_fastapi import generar_clave_api, TTL_CLAVES_S
+from app.db import crud
+from app.db.database import create_db_and_tables, engine
 
-# Crear usuario nuevo
-nuevo_usuario = User(
-    username="user1",
-    full_name="Usuario Uno",
-    hashed_password=pwd_context.hash("123456")
-)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea o revoca las claves de API de un sistema cliente.")
+    parser.add_argument("nombre", help="Nombre del sistema cliente")
+    parser.add_argument("--revocar", action="store_true", help="Revoca todas las claves activas del sistema")
+    args = parser.parse_args()
 
-# Guardar en base de datos
-db.add(nuevo_usuario)
-db.commit()
-db.refresh(nuevo_usuario)
-print("✅ Usuario creado:", nuevo_usuario.username)
-db.close()
\ No newline at end of file
+    create_db_and_tables()
+    if args.revocar:
+        revocadas = crud.revoke_claves_api(engine, args.nombre)
+        print(f"Claves revocadas: {revocadas} (efectivo en menos de {TTL_CLAVES_S} s)")
+    else:
+        clave = generar_clave_api(engine, args.nombre)
+        if clave is None:
+            print("❌ No se pudo crear la clave.")
+        else:
+            print(f"✅ Clave creada para {args.nombre} (guárdela: no se puede recuperar):")
+            print(clave)
@@ -0,0 +1,101 @@
+'''
+Token authentication of the JSON service (app/api/main.py).
+
+Client systems send an API key as a bearer token (`Authorization: Bearer jai_...`). Only the
+SHA-256 of each key is stored (clave_api table); keys are long random strings, so a plain hash is
+enough and lets a key be found with a dictionary lookup. The active keys are held in memory and
+reloaded from the database at most every TTL_CLAVES_S seconds, so validating a request costs one
+hash and one lookup, without a query. A new or revoked key takes effect within that interval.
+
+    clave = generar_clave_api(engine, "erp-juridico")  # shown once, give it to the client system
+'''
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from app.db import crud
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TTL_CLAVES_S = 60 # Seconds between reloads of the active keys
+PREFIJO_CLAVE = "jai_" # Makes keys recognizable in configs and secret scanners
+
+def hash_clave(clave: str) -> str:
+    return hashlib.sha256(clave.encode("utf-8")).hexdigest()
+
+def generar_clave_api(db_engine, nombre: str) -> str | None:
+    '''
+    Creates a new API key for a client system.
+
+    Args:
+        db_engine: The SQLAlchemy engine.
+        nombre: Name of the client system.
+
+    Returns:
+        The key (it cannot be recovered later), or None if it could not be stored.
+    '''
+    clave = PREFIJO_CLAVE + secrets.token_urlsafe(32)
+    if crud.create_clave_api(db_engine, nombre.strip(), hash_clave(clave)) is None:
+        return None
+    return clave
+
+class CacheClaves:
+    '''In-memory copy of the active API keys of a database (see module docstring).'''
+
+    def __init__(self, db_engine, ttl_segundos: float = TTL_CLAVES_S):
+        self.db_engine = db_engine
+        self.ttl_segundos = ttl_segundos
+        self._claves = {} # hash_clave -> nombre
+        self._expira = 0.0 # time.monotonic() of the next reload
+        self._lock = threading.Lock()
+
+    def vigente(self) -> bool:
+        return time.monotonic() < self._expira
+
+    def recargar(self) -> None:
+        '''Reloads the active keys. On a database error the previous keys are kept until the next attempt.'''
+        with self._lock:
+            if self.vigente():
+                return # Another request reloaded them meanwhile
+            claves = crud.get_claves_api_activas(self.db_engine)
+            if claves is not None:
+                self._claves = claves
+            self._expira = time.monotonic() + self.ttl_segundos
+
+    def cliente(self, clave: str) -> str | None:
+        '''Returns the client system of a key, or None if the key is unknown or revoked.'''
+        return self._claves.get(hash_clave(clave))
+
+_esquema_bearer = HTTPBearer(auto_error=False)
+
+async def verificar_token(
+    request: Request,
+    credenciales: HTTPAuthorizationCredentials | None = Depends(_esquema_bearer)
+) -> str:
+    '''
+    FastAPI dependency: validates the bearer token against `request.app.state.claves` (a CacheClaves).
+    FastAPI resolves it once per request, however many routes or dependencies use it.
+
+    Returns:
+        The name of the client system.
+
+    Raises:
+        HTTPException: 401 if the token is missing, unknown or revoked.
+    '''
+    claves = request.app.state.claves
+    if not claves.vigente():
+        await run_in_threadpool(claves.recargar)
+    cliente = claves.cliente(credenciales.credentials) if credenciales else None
+    if cliente is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido o ausente",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    request.state.cliente = cliente
+    return cliente
@@ -0,0 +1,106 @@
+'''
+In-process read-through cache of Rama Judicial API responses.
+
+Entries expire after a TTL and the least recently used ones are evicted beyond MAX_ENTRADAS.
+Concurrent requests for the same missing key wait for a single API call instead of all
+hitting the API (single flight). Failed calls (None) are not cached. Cached values are shared
+between callers: read them, do not mutate them.
+
+    respuesta, obtenida_en = cache_api.obtener(("detalle", id_proceso), lambda: consultar_detalle_proceso(id_proceso))
+'''
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TTL_SEGUNDOS = 600
+MAX_ENTRADAS = 2000
+ESPERA_CARGA_S = 60.0 # Longest wait for a load of the same key started by another thread
+
+class CacheRespuestas:
+    '''LRU cache with TTL and single-flight loads (see module docstring).'''
+
+    def __init__(self, ttl_segundos: float = TTL_SEGUNDOS, max_entradas: int = MAX_ENTRADAS):
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict() # clave -> (valor, obtenida_en, expira_monotonic)
+        self._cargando = {} # clave -> threading.Event set when the load ends
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _vigente(self, clave):
+        # Caller holds the lock
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if entrada[2] <= time.monotonic():
+            del self._entradas[clave]
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def obtener(self, clave, cargar, ttl_segundos: float | None = None) -> tuple:
+        '''
+        Returns the cached value of `clave`, calling `cargar()` on a miss.
+
+        Args:
+            clave: Hashable key, e.g. ("detalle", id_proceso).
+            cargar: Callable returning the value, or None on failure (not cached).
+            ttl_segundos: Optional. Lifetime of this entry (default: the cache TTL).
+
+        Returns:
+            (valor, obtenida_en): the value and when it was fetched (UTC), or (None, None) if the load failed.
+        '''
+        with self._lock:
+            entrada = self._vigente(clave)
+            if entrada is not None:
+                self.aciertos += 1
+                return entrada[0], entrada[1]
+            self.fallos += 1
+            evento = self._cargando.get(clave)
+            propia = evento is None
+            if propia:
+                evento = self._cargando[clave] = threading.Event()
+        if not propia:
+            evento.wait(ESPERA_CARGA_S)
+            with self._lock:
+                entrada = self._vigente(clave)
+            if entrada is not None:
+                return entrada[0], entrada[1]
+            # The other load failed or is too slow: try once more, uncached
+            valor = cargar()
+            return (valor, datetime.now(timezone.utc)) if valor is not None else (None, None)
+        try:
+            valor = cargar()
+            if valor is None:
+                return None, None
+            obtenida_en = datetime.now(timezone.utc)
+            with self._lock:
+                self._entradas[clave] = (valor, obtenida_en, time.monotonic() + (ttl_segundos or self.ttl_segundos))
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+            return valor, obtenida_en
+        finally:
+            with self._lock:
+                self._cargando.pop(clave, None)
+            evento.set()
+
+    def invalidar(self, clave=None) -> None:
+        '''Drops one entry, or every entry if no key is given.'''
+        with self._lock:
+            if clave is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(clave, None)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"entradas": len(self._entradas), "aciertos": self.aciertos, "fallos": self.fallos}
+
+cache_api = CacheRespuestas()
@@ -3,6 +3,7 @@ Client for interacting with the Rama Judicial API.
 '''
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -80,12 +81,13 @@ def consultar_detalle_proceso(id_proceso: str) -> dict | None:
         logging.error(f"Error fetching process details for {id_proceso}: {req_err}")
     return None
 
-def consultar_actuaciones_proceso(id_proceso: str) -> dict | None:
+def consultar_actuaciones_proceso(id_proceso: str, pagina: int = 1) -> dict | None:
     '''
     Retrieves the actions (actuaciones) of a specific process using its ID.
 
     Args:
         id_proceso: The unique identifier of the process.
+        pagina: Optional. Page number for processes with many actuaciones.
 
     Returns:
         A dictionary with the process actions or None if an error occurs.
@@ -95,7 +97,7 @@ def consultar_actuaciones_proceso(id_proceso: str) -> dict | None:
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
     try:
-        response = requests.get(endpoint, timeout=30, headers=headers)
+        response = requests.get(endpoint, params={"pagina": pagina} if pagina > 1 else None, timeout=30, headers=headers)
         response.raise_for_status()
         # The response for actuaciones is often a list directly, not a dict with a key
         # However, to be safe and consistent with other functions, we check if it's a dict
@@ -192,6 +194,60 @@ def descargar_documento_actuacion(id_reg_documento: str) -> bytes | None:
         logging.error(f"Error downloading document {id_reg_documento}: {req_err}")
     return None
 
+class ResultadoPaginado(list):
+    '''
+    Items of every result page, in page order. `completo` is False when the listing is known to
+    be partial: a page after the first could not be fetched, or the result had more than max_paginas pages.
+    '''
+
+    def __init__(self, items=(), completo: bool = True):
+        super().__init__(items)
+        self.completo = completo
+
+def consultar_todas_las_paginas(consulta, max_paginas: int = 10, hilos: int = 1, clave: str = "procesos") -> ResultadoPaginado | None:
+    '''
+    Collects the items of every result page of a paginated endpoint.
+
+    Args:
+        consulta: Callable taking the page number and returning the API response, e.g.
+            lambda p: consultar_procesos_por_nombre("ACME", pagina=p).
+        max_paginas: Maximum number of pages to read.
+        hilos: Optional. Concurrent requests for the pages after the first (which gives the page count).
+        clave: Optional. Key of the item list in each response ("actuaciones" for consultar_actuaciones_proceso).
+
+    Returns:
+        The list of items in page order (a ResultadoPaginado: check `completo` before treating an
+        item missing from it as gone), or None if the first page could not be fetched.
+    '''
+    primera = consulta(1)
+    if primera is None:
+        return None
+    if isinstance(primera, list): # Unpaginated response
+        return ResultadoPaginado(primera)
+    items = ResultadoPaginado(primera.get(clave) or [])
+    total_paginas = (primera.get("paginacion") or {}).get("cantidadPaginas") or 1
+    cantidad_paginas = min(total_paginas, max_paginas)
+    if total_paginas > max_paginas:
+        logging.warning(f"El resultado tiene {total_paginas} páginas; solo se leen {max_paginas}.")
+        items.completo = False
+    paginas = range(2, cantidad_paginas + 1)
+    if hilos > 1 and len(paginas) > 1:
+        with ThreadPoolExecutor(max_workers=min(hilos, len(paginas))) as executor:
+            respuestas = list(executor.map(consulta, paginas))
+    else:
+        respuestas = []
+        for pagina in paginas:
+            respuestas.append(consulta(pagina))
+            if respuestas[-1] is None:
+                break
+    for pagina, respuesta in zip(paginas, respuestas):
+        if respuesta is None:
+            logging.warning(f"Página {pagina} de resultados no disponible; se usan las anteriores.")
+            items.completo = False
+            break
+        items.extend(respuesta.get(clave) or [])
+    return items
+
 # Example Usage (for testing purposes):
 if __name__ == "__main__":
     logging.info("Testing Rama Judicial API client...")
@@ -0,0 +1,74 @@
+'''
+Deterministic offline chat model for tests and benchmarks.
+
+It never calls the network: the same prompt always produces the same answer, and an
+optional fixed latency makes benchmarks of the AI pipeline reproducible.
+'''
+import hashlib
+import re
+import time
+from typing import Any, Iterator, List, Optional
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Keywords used to fake an urgency classification, checked in order
+PALABRAS_URGENCIA = {
+    "ALTA": ("AUDIENCIA", "VENCE", "TÉRMINO", "TERMINO", "REQUIERE", "CITACI", "SENTENCIA", "MANDAMIENTO"),
+    "MEDIA": ("AUTO", "TRASLADO", "ADMITE", "DECRETA", "MEMORIAL"),
+}
+
+class DeterministicFakeChatModel(BaseChatModel):
+    latencia_ms: int = 0 # Simulated latency of every call
+    palabras_por_token: int = 1 # Words emitted per streamed chunk
+
+    @property
+    def _llm_type(self) -> str:
+        return "deterministic-fake"
+
+    def _responder(self, messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        huella = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+
+        if "ALTA, MEDIA, o BAJA" in prompt:
+            texto = prompt.upper().rsplit("ANOTACIÓN DE LA ACTUACIÓN:", 1)[-1]
+            for categoria, palabras in PALABRAS_URGENCIA.items():
+                if any(palabra in texto for palabra in palabras):
+                    return categoria
+            return "BAJA"
+
+        # Summaries: echo the first words of the last non-empty text block of the prompt
+        bloques = [b.strip() for b in re.split(r"\n\s*\n", prompt) if b.strip()]
+        fuente = bloques[-2] if len(bloques) > 1 else (bloques[0] if bloques else "")
+        palabras = fuente.split()[:40]
+        return f"Resumen [{huella}]: {' '.join(palabras)}"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._responder(messages)))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        palabras = self._responder(messages).split(" ")
+        pausa = self.latencia_ms / 1000 / max(len(palabras), 1)
+        for i in range(0, len(palabras), self.palabras_por_token):
+            if pausa:
+                time.sleep(pausa)
+            texto = " ".join(palabras[i:i + self.palabras_por_token])
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=texto if i == 0 else " " + texto))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -5,6 +5,7 @@ import os
 import logging
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
+from app.config.fake_llm import DeterministicFakeChatModel
 # from langchain_groq import ChatGroq # Uncomment if you add Groq  #otra alternativa a Google por si las moscas
 
 # Configure basic logging
@@ -17,9 +18,13 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(os.path.dir
 # --- Google Generative AI Configuration ---
 google_api_key = os.getenv("GOOGLE_API_KEY") #OJO SE DEBE BORRAR, NO COMPARTIR
 
+# Seconds before a call to a provider is abandoned; the router counts it as an error of the backend
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+
 if not google_api_key:
     logging.warning("GOOGLE_API_KEY not found in .env file. Google GenAI services will not be available.")
     llm_google = None
+    llm_google_pro = None
 else:
     try:
         # Initialize the Google Generative AI model
@@ -29,6 +34,7 @@ else:
             model="gemini-1.5-flash-latest", 
             google_api_key=google_api_key,
             temperature=0.3, # Adjust for creativity vs. factuality
+            timeout=LLM_TIMEOUT_S,
             # convert_system_message_to_human=True # Depending on model and Langchain version
         )
         logging.info("Google GenAI model initialized successfully (gemini-1.5-flash-latest).")
@@ -36,6 +42,19 @@ else:
         logging.error(f"Failed to initialize Google GenAI model: {e}")
         llm_google = None
 
+    try:
+        # Stronger (slower and more expensive) model, routed to long document summaries
+        llm_google_pro = ChatGoogleGenerativeAI(
+            model="gemini-1.5-pro-latest",
+            google_api_key=google_api_key,
+            temperature=0.3,
+            timeout=LLM_TIMEOUT_S,
+        )
+        logging.info("Google GenAI model initialized successfully (gemini-1.5-pro-latest).")
+    except Exception as e:
+        logging.error(f"Failed to initialize Google GenAI pro model: {e}")
+        llm_google_pro = None
+
 # --- Groq Configuration (Optional) ---
 # groq_api_key = os.getenv("GROQ_API_KEY")
 # llm_groq = None
@@ -56,12 +75,48 @@ else:
 #         logging.error(f"Failed to initialize Groq model: {e}")
 #         llm_groq = None
 
+# --- Offline Fake Model ---
+# LLM_OFFLINE=1 replaces every backend with a deterministic fake model (tests, benchmarks, no API key needed).
+# LLM_FAKE_LATENCY_MS simulates the latency of each call.
+llm_offline = os.getenv("LLM_OFFLINE", "").lower() in ("1", "true", "yes")
+llm_fake = DeterministicFakeChatModel(latencia_ms=int(os.getenv("LLM_FAKE_LATENCY_MS", "0")))
+
+# --- Provider Registry ---
+# Name -> configured chat model. The router in app/services/llm_router.py picks one per task.
+if llm_offline:
+    LLM_PROVIDERS = {"fake": llm_fake}
+    logging.info("LLM_OFFLINE is set. Using the deterministic fake model for every task.")
+else:
+    LLM_PROVIDERS = {
+        name: llm for name, llm in {
+            "gemini-flash": llm_google,
+            "gemini-pro": llm_google_pro,
+            # "groq-llama3": llm_groq,  # Uncomment if you configure Groq
+        }.items() if llm
+    }
+
+# Ordered backend preferences per task: cheap/fast models first for high-volume tasks,
+# the stronger model first for long document summaries. Unknown names are ignored.
+LLM_TASK_PREFERENCES = {
+    "urgencia": ["gemini-flash", "groq-llama3", "gemini-pro", "fake"],
+    "resumen_actuacion": ["gemini-flash", "gemini-pro", "groq-llama3", "fake"],
+    "resumen_documento": ["gemini-pro", "gemini-flash", "groq-llama3", "fake"],
+    # Assistant: short prompts where latency matters more than depth
+    "intencion_asistente": ["groq-llama3", "gemini-flash", "fake"],
+    "respuesta_asistente": ["gemini-flash", "groq-llama3", "fake"],
+}
+
+# Hedged requests: when enabled, a slow call is duplicated on the next backend and the first answer wins
+LLM_HEDGING = os.getenv("LLM_HEDGING", "").lower() in ("1", "true", "yes")
+
 # --- Default LLM Selection ---
 # You can set a default LLM to be used by other modules
 # For now, let's prioritize Google if available.
 
 default_llm = None
-if llm_google:
+if llm_offline:
+    default_llm = llm_fake
+elif llm_google:
     default_llm = llm_google
     logging.info("Using Google GenAI as the default LLM.")
 # elif llm_groq:  # Uncomment if you configure Groq
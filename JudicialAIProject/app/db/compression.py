@@ -0,0 +1,242 @@
+'''
+Transparent zstd compression of the long text columns (actuacion.anotacion and resumen_ia).
+
+Annotations are short, highly repetitive legal Spanish, so a plain compressor barely helps;
+a zstd dictionary trained on our own anotaciones captures the shared vocabulary
+("AUTO QUE ORDENA SEGUIR ADELANTE LA EJECUCIÓN", "SE FIJA EN LISTA DE TRASLADO"...) and
+typically shrinks them to a fraction of their size.
+
+`TextoComprimido` is a column type: values are compressed when written and stored as a
+BLOB; they are decompressed only when a query selects the column, so listings that do not
+read the text (dashboards, exports, calendars) never pay for it. Short values, and values
+written before a dictionary exists, stay as TEXT and are returned unchanged; the migration
+trains the dictionary once there are enough anotaciones and compresses the existing rows.
+Every frame records the ID of its dictionary, so retraining does not break older rows; the
+dictionaries live in data/zstd_dicts/ and must be backed up with the database. Another process
+(the migration, a CLI) may train a dictionary at any time: the directory is rescanned every
+INTERVALO_RECARGA_S seconds, and immediately when a value names a dictionary not loaded yet.
+'''
+import glob
+import logging
+import os
+import threading
+import time
+import zstandard
+from sqlalchemy import LargeBinary, bindparam, Text, case, cast, column, func, select, update
+from sqlalchemy.types import TypeDecorator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NIVEL_COMPRESION = 6
+MIN_BYTES = 64 # Shorter values are stored as plain text: the frame header would eat the gain
+TAMANO_DICCIONARIO = 112 * 1024
+MUESTRAS_ENTRENAMIENTO = 20_000
+MIN_MUESTRAS = 500 # zstd needs enough samples to build a useful dictionary
+INTERVALO_RECARGA_S = 60 # Rescan of the directory for dictionaries trained by other processes
+
+_estado = threading.local() # zstd (de)compressors are not thread safe
+_diccionarios: dict[int, zstandard.ZstdCompressionDict] = {}
+_diccionario_activo: int | None = None
+_rutas_cargadas: dict[str, int] = {} # Dictionary file -> dict_id
+_proxima_recarga = 0.0 # time.monotonic() of the next rescan; also caches "no dictionary yet"
+_lock = threading.Lock()
+
+def directorio_diccionarios() -> str:
+    from app.db.database import DATA_DIR
+    return os.path.join(DATA_DIR, "zstd_dicts")
+
+def _cargar_diccionarios(forzar: bool = False) -> None:
+    # Loads the dictionaries on disk not loaded yet; the newest one compresses new values.
+    # Between rescans (and while there is no dictionary at all) this costs a clock read
+    global _diccionario_activo, _proxima_recarga
+    if not forzar and time.monotonic() < _proxima_recarga:
+        return
+    with _lock:
+        if not forzar and time.monotonic() < _proxima_recarga:
+            return # Another thread rescanned meanwhile
+        rutas = sorted(glob.glob(os.path.join(directorio_diccionarios(), "*.dict")), key=os.path.getmtime)
+        for ruta in rutas:
+            if ruta not in _rutas_cargadas:
+                with open(ruta, "rb") as f:
+                    diccionario = zstandard.ZstdCompressionDict(f.read())
+                _diccionarios[diccionario.dict_id()] = diccionario
+                _rutas_cargadas[ruta] = diccionario.dict_id()
+        if rutas:
+            _diccionario_activo = _rutas_cargadas[rutas[-1]]
+        _proxima_recarga = time.monotonic() + INTERVALO_RECARGA_S
+
+def _compresor() -> zstandard.ZstdCompressor | None:
+    # None until a dictionary has been trained
+    _cargar_diccionarios()
+    if _diccionario_activo is None:
+        return None
+    if getattr(_estado, "dict_id", None) != _diccionario_activo:
+        _estado.compresor = zstandard.ZstdCompressor(level=NIVEL_COMPRESION, dict_data=_diccionarios[_diccionario_activo])
+        _estado.dict_id = _diccionario_activo
+    return _estado.compresor
+
+def _descompresor(dict_id: int) -> zstandard.ZstdDecompressor:
+    descompresores = getattr(_estado, "descompresores", None)
+    if descompresores is None:
+        descompresores = _estado.descompresores = {}
+    if dict_id not in descompresores:
+        _cargar_diccionarios()
+        if dict_id and dict_id not in _diccionarios:
+            _cargar_diccionarios(forzar=True) # Trained by another process since the last rescan
+        if dict_id and dict_id not in _diccionarios:
+            raise ValueError(f"Diccionario zstd {dict_id} no encontrado en {directorio_diccionarios()}")
+        descompresores[dict_id] = zstandard.ZstdDecompressor(dict_data=_diccionarios[dict_id]) if dict_id else zstandard.ZstdDecompressor()
+    return descompresores[dict_id]
+
+def comprimir(texto: str | None):
+    '''
+    Compresses a text with the active dictionary. Returns bytes, or the text itself if there
+    is no dictionary yet or compressing does not pay off.
+    '''
+    if texto is None:
+        return None
+    datos = texto.encode("utf-8")
+    compresor = _compresor() if len(datos) >= MIN_BYTES else None
+    if compresor is None:
+        return texto
+    comprimido = compresor.compress(datos)
+    return comprimido if len(comprimido) < len(datos) else texto
+
+def descomprimir(valor) -> str | None:
+    '''Inverse of `comprimir`: accepts the stored value (bytes or plain text).'''
+    if valor is None or isinstance(valor, str):
+        return valor
+    datos = bytes(valor)
+    dict_id = zstandard.get_frame_parameters(datos).dict_id
+    return _descompresor(dict_id).decompress(datos).decode("utf-8")
+
+class TextoComprimido(TypeDecorator):
+    '''Text column stored zstd-compressed (see module docstring).'''
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return comprimir(value)
+
+    def process_result_value(self, value, dialect):
+        return descomprimir(value)
+
+def entrenar_diccionario(db_engine, muestras: int = MUESTRAS_ENTRENAMIENTO, tamano: int = TAMANO_DICCIONARIO) -> int | None:
+    '''
+    Trains a zstd dictionary on a sample of the stored anotaciones and summaries and makes it the active one.
+
+    Returns:
+        The ID of the new dictionary, or None if there are not enough anotaciones yet.
+    '''
+    global _diccionario_activo
+    from app.db.database import actuacion_table
+    textos = []
+    with db_engine.connect() as connection:
+        # Mostly anotaciones, plus some AI summaries, which share most of their vocabulary
+        for columna, limite in ((actuacion_table.c.anotacion, muestras * 3 // 4), (actuacion_table.c.resumen_ia, muestras // 4)):
+            stmt = select(columna).where(columna.isnot(None)).order_by(func.random()).limit(limite)
+            textos.extend(t for t in connection.execute(stmt).scalars() if t)
+    if len(textos) < MIN_MUESTRAS:
+        logger.info(f"Solo {len(textos)} anotaciones; se necesitan {MIN_MUESTRAS} para entrenar el diccionario.")
+        return None
+    diccionario = zstandard.train_dictionary(tamano, [t.encode("utf-8") for t in textos], level=NIVEL_COMPRESION)
+    os.makedirs(directorio_diccionarios(), exist_ok=True)
+    ruta = os.path.join(directorio_diccionarios(), f"{diccionario.dict_id()}.dict")
+    with open(ruta, "wb") as f:
+        f.write(diccionario.as_bytes())
+    with _lock:
+        _diccionarios[diccionario.dict_id()] = diccionario
+        _rutas_cargadas[ruta] = diccionario.dict_id()
+        _diccionario_activo = diccionario.dict_id()
+    logger.info(f"Diccionario zstd {diccionario.dict_id()} entrenado con {len(textos)} anotaciones ({len(diccionario.as_bytes())} bytes).")
+    return diccionario.dict_id()
+
+def comprimir_existentes(db_engine, tamano_lote: int = 5000) -> int:
+    '''
+    Rewrites the actuaciones whose anotacion or resumen_ia is still stored as plain text
+    (in batches, by ID). Returns the number of rows rewritten.
+    '''
+    from app.db.database import actuacion_table
+    columnas = (actuacion_table.c.anotacion, actuacion_table.c.resumen_ia)
+    pendiente = func.typeof(columnas[0]) == "text"
+    for columna in columnas[1:]:
+        pendiente = pendiente | (func.typeof(columna) == "text")
+    ultimo_id, total = 0, 0
+    while True:
+        with db_engine.connect() as connection:
+            filas = connection.execute(
+                select(actuacion_table.c.id, *columnas)
+                .where(actuacion_table.c.id > ultimo_id, pendiente)
+                .order_by(actuacion_table.c.id).limit(tamano_lote)
+            ).fetchall()
+            if not filas:
+                break
+            # Values are re-bound through TextoComprimido; fecha_actualizacion_db is kept so
+            # the rows are not exported again as modified
+            connection.execute(
+                update(actuacion_table).where(actuacion_table.c.id == bindparam("b_id"))
+                .values(anotacion=bindparam("b_anotacion"), resumen_ia=bindparam("b_resumen_ia"),
+                        fecha_actualizacion_db=actuacion_table.c.fecha_actualizacion_db),
+                [{"b_id": f.id, "b_anotacion": f.anotacion, "b_resumen_ia": f.resumen_ia} for f in filas]
+            )
+            connection.commit()
+        ultimo_id = filas[-1].id
+        total += len(filas)
+    return total
+
+def informe_compresion(db_engine, muestras: int = 2000) -> dict:
+    '''
+    Size and speed report of the compressed columns.
+
+    Returns:
+        A dict with the stored vs. original bytes of each column, the compression ratio,
+        the compression/decompression throughput (MB/s) on a sample, and the database file size.
+    '''
+    from app.db.database import actuacion_table
+    _cargar_diccionarios()
+    informe = {"diccionario": _diccionario_activo}
+    with db_engine.connect() as connection:
+        for nombre in ("anotacion", "resumen_ia"):
+            # The raw column, without TextoComprimido, to measure what is actually stored
+            crudo = column(nombre)
+            fila = connection.execute(select(
+                func.count(crudo),
+                func.sum(func.length(cast(crudo, LargeBinary))),
+                func.sum(case((func.typeof(crudo) == "blob", 1), else_=0)),
+            ).select_from(actuacion_table)).one()
+            informe[nombre] = {"filas": fila[0], "bytes_almacenados": fila[1] or 0, "filas_comprimidas": fila[2] or 0}
+        textos = [t for t in connection.execute(
+            select(actuacion_table.c.anotacion).where(actuacion_table.c.anotacion.isnot(None)).limit(muestras)
+        ).scalars() if t]
+
+    datos = [t.encode("utf-8") for t in textos]
+    inicio = time.perf_counter()
+    comprimidos = [comprimir(t) for t in textos]
+    tiempo_compresion = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    for valor in comprimidos:
+        descomprimir(valor)
+    tiempo_descompresion = time.perf_counter() - inicio
+    bytes_originales = sum(len(d) for d in datos)
+    bytes_comprimidos = sum(len(c) if isinstance(c, bytes) else len(c.encode("utf-8")) for c in comprimidos)
+    informe["muestra"] = {
+        "textos": len(textos),
+        "bytes_originales": bytes_originales,
+        "bytes_comprimidos": bytes_comprimidos,
+        "ratio": round(bytes_originales / bytes_comprimidos, 2) if bytes_comprimidos else None,
+        "compresion_mb_s": round(bytes_originales / 1e6 / tiempo_compresion, 1) if tiempo_compresion else None,
+        "descompresion_mb_s": round(bytes_originales / 1e6 / tiempo_descompresion, 1) if tiempo_descompresion else None,
+    }
+    ruta = db_engine.url.database
+    informe["tamano_archivo_bytes"] = os.path.getsize(ruta) if ruta and os.path.exists(ruta) else None
+    return informe
+
+if __name__ == "__main__":
+    import json
+    import sys
+    from app.db.database import engine
+    if "--entrenar" in sys.argv:
+        entrenar_diccionario(engine)
+        print(f"{comprimir_existentes(engine)} filas en texto plano comprimidas.")
+    print(json.dumps(informe_compresion(engine), indent=2))
@@ -1,9 +1,15 @@
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, func, or_, and_, bindparam
 from sqlalchemy.orm import Session
-from app.db.database import proceso_table, actuacion_table, engine
-from app.models.models import Proceso as ProcesoPydantic, Actuacion as ActuacionPydantic
+from app.db.database import (
+    proceso_table, actuacion_table, documento_table, documento_chunk_table, evento_table, sujeto_table, empresa_vigilada_table,
+    snapshot_empresa_table, cambio_proceso_table, sondeo_proceso_table, clave_api_table, notificacion_table,
+    agregado_urgencia_table, agregado_actuacion_dia_table, agregado_despacho_table, agregado_evento_dia_table, engine
+)
+from app.models.models import Proceso as ProcesoPydantic, Actuacion as ActuacionPydantic, Documento as DocumentoPydantic, ChunkDocumento as ChunkDocumentoPydantic, Evento as EventoPydantic, Sujeto as SujetoPydantic, EmpresaVigilada as EmpresaVigiladaPydantic, CambioProceso as CambioProcesoPydantic
 from typing import List, Optional
+import json
 import logging
+from datetime import datetime, timedelta
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -66,6 +72,421 @@ def get_proceso_by_db_id(db_engine, proceso_db_id: int) -> Optional[ProcesoPydan
         logger.error(f"Error getting proceso by db_id {proceso_db_id}: {e}")
         return None
 
+def get_procesos_after_id(db_engine, after_id: int, limit: int = 1000) -> List[ProcesoPydantic]:
+    """Retrieves a batch of procesos with ID greater than `after_id`, by ID (keyset pagination for batch jobs)."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(proceso_table).where(proceso_table.c.id > after_id).order_by(proceso_table.c.id).limit(limit)
+            results = connection.execute(stmt).fetchall()
+            return [ProcesoPydantic(**row._asdict()) for row in results]
+    except Exception as e:
+        logger.error(f"Error getting procesos after id {after_id}: {e}")
+        return []
+
+def replace_sujetos_proceso(db_engine, proceso_db_id: int, sujetos: List[SujetoPydantic]) -> int:
+    """
+    Replaces the parties (sujetos) of a proceso in a single transaction.
+    Returns the number of sujetos stored, or -1 if an error occurs.
+    """
+    return replace_sujetos_procesos(db_engine, {proceso_db_id: sujetos})
+
+def replace_sujetos_procesos(db_engine, sujetos_por_proceso: dict[int, List[SujetoPydantic]]) -> int:
+    """
+    Replaces the parties of several procesos ({proceso_db_id: sujetos}) in a single transaction.
+    Returns the number of sujetos stored, or -1 if an error occurs.
+    """
+    if not sujetos_por_proceso:
+        return 0
+    filas = [
+        sujeto.model_dump(exclude={"id"}) | {"proceso_db_id": proceso_db_id}
+        for proceso_db_id, sujetos in sujetos_por_proceso.items() for sujeto in sujetos
+    ]
+    try:
+        with db_engine.connect() as connection:
+            connection.execute(delete(sujeto_table).where(sujeto_table.c.proceso_db_id.in_(list(sujetos_por_proceso))))
+            if filas:
+                connection.execute(sujeto_table.insert(), filas)
+            connection.commit()
+            return len(filas)
+    except Exception as e:
+        logger.error(f"Error replacing sujetos of {len(sujetos_por_proceso)} procesos: {e}")
+        return -1
+
+def get_sujetos_by_proceso_db_id(db_engine, proceso_db_id: int) -> List[SujetoPydantic]:
+    """Retrieves the parties of a proceso."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(sujeto_table).where(sujeto_table.c.proceso_db_id == proceso_db_id).order_by(sujeto_table.c.id)
+            return [SujetoPydantic(**row._asdict()) for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting sujetos for proceso_db_id {proceso_db_id}: {e}")
+        return []
+
+def get_procesos_by_sujeto(
+    db_engine,
+    nombre_normalizado: Optional[str] = None,
+    nit: Optional[str] = None,
+    rol: Optional[str] = None,
+    prefijo: bool = False,
+    limit: int = 100
+) -> List[dict]:
+    """
+    Retrieves the procesos where a party (by normalized name or NIT) appears, optionally with a role.
+    With prefijo=True the name matches as a prefix ("BANCOLOMBIA" finds "BANCOLOMBIA SA"); both
+    forms use the (nombre_normalizado, rol) index.
+    """
+    if not nombre_normalizado and not nit:
+        return []
+    stmt = (
+        select(
+            proceso_table.c.id, proceso_table.c.idProceso, proceso_table.c.numeroRadicacion,
+            proceso_table.c.despacho, proceso_table.c.fechaRadicacion, proceso_table.c.nombre_busqueda,
+            sujeto_table.c.rol, sujeto_table.c.nombre, sujeto_table.c.nit
+        )
+        .join(proceso_table, sujeto_table.c.proceso_db_id == proceso_table.c.id)
+        .order_by(proceso_table.c.id.desc())
+        .limit(limit)
+    )
+    if nit:
+        stmt = stmt.where(sujeto_table.c.nit == nit)
+    elif prefijo:
+        # Range instead of LIKE so SQLite can use the index
+        stmt = stmt.where(sujeto_table.c.nombre_normalizado >= nombre_normalizado,
+                          sujeto_table.c.nombre_normalizado < nombre_normalizado + "\uffff")
+    else:
+        stmt = stmt.where(sujeto_table.c.nombre_normalizado == nombre_normalizado)
+    if rol:
+        stmt = stmt.where(sujeto_table.c.rol == rol)
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting procesos by sujeto (nombre={nombre_normalizado}, nit={nit}, rol={rol}): {e}")
+        return []
+
+def get_nombres_sujetos_after_id(db_engine, after_id: int, limit: int = 10000) -> List[dict]:
+    """Retrieves (id, nombre, nombre_normalizado) of the sujetos with ID greater than `after_id`, by ID."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(sujeto_table.c.id, sujeto_table.c.nombre, sujeto_table.c.nombre_normalizado)
+                .where(sujeto_table.c.id > after_id).order_by(sujeto_table.c.id).limit(limit)
+            )
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting sujeto names after id {after_id}: {e}")
+        return []
+
+def get_nombres_busqueda_after_id(db_engine, after_id: int, limit: int = 10000) -> List[dict]:
+    """Retrieves (id, nombre_busqueda) of the procesos with ID greater than `after_id` that have a search name, by ID."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(proceso_table.c.id, proceso_table.c.nombre_busqueda)
+                .where(proceso_table.c.id > after_id, proceso_table.c.nombre_busqueda.isnot(None), proceso_table.c.nombre_busqueda != "")
+                .order_by(proceso_table.c.id).limit(limit)
+            )
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting nombre_busqueda after id {after_id}: {e}")
+        return []
+
+def get_procesos_by_alias(
+    db_engine,
+    nombres_normalizados: List[str],
+    nombres_busqueda: Optional[List[str]] = None,
+    rol: Optional[str] = None,
+    limit: int = 100
+) -> List[dict]:
+    """
+    Retrieves the procesos of a company known under several names: the ones with a party
+    whose normalized name is in `nombres_normalizados` (optionally with a role), plus the
+    ones searched by any of `nombres_busqueda`. Each proceso appears once.
+    """
+    if not nombres_normalizados and not nombres_busqueda:
+        return []
+    condiciones = []
+    if nombres_normalizados:
+        sujetos = select(sujeto_table.c.proceso_db_id).where(sujeto_table.c.nombre_normalizado.in_(nombres_normalizados))
+        if rol:
+            sujetos = sujetos.where(sujeto_table.c.rol == rol)
+        condiciones.append(proceso_table.c.id.in_(sujetos))
+    if nombres_busqueda and not rol:
+        condiciones.append(proceso_table.c.nombre_busqueda.in_(nombres_busqueda))
+    stmt = (
+        select(
+            proceso_table.c.id, proceso_table.c.idProceso, proceso_table.c.numeroRadicacion,
+            proceso_table.c.despacho, proceso_table.c.fechaRadicacion, proceso_table.c.nombre_busqueda,
+            proceso_table.c.demandante, proceso_table.c.demandado
+        )
+        .where(or_(*condiciones))
+        .order_by(proceso_table.c.id.desc())
+        .limit(limit)
+    )
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting procesos by alias ({len(nombres_normalizados)} names): {e}")
+        return []
+
+def create_empresa_vigilada(db_engine, empresa: EmpresaVigiladaPydantic) -> Optional[int]:
+    """
+    Adds a company to the watchlist. If it is already there (same normalized name), its name
+    and threshold are updated. Returns the database ID, or None if an error occurs.
+    """
+    try:
+        with db_engine.connect() as connection:
+            existente = connection.execute(
+                select(empresa_vigilada_table.c.id).where(empresa_vigilada_table.c.nombre_normalizado == empresa.nombre_normalizado)
+            ).scalar_one_or_none()
+            if existente:
+                connection.execute(
+                    update(empresa_vigilada_table).where(empresa_vigilada_table.c.id == existente)
+                    .values(nombre=empresa.nombre, umbral_similitud=empresa.umbral_similitud)
+                )
+                connection.commit()
+                return existente
+            result = connection.execute(empresa_vigilada_table.insert().values(**empresa.model_dump(exclude={"id"})))
+            connection.commit()
+            return result.inserted_primary_key[0] if result.inserted_primary_key else None
+    except Exception as e:
+        logger.error(f"Error creating empresa vigilada {empresa.nombre}: {e}")
+        return None
+
+def get_empresas_vigiladas(db_engine) -> List[EmpresaVigiladaPydantic]:
+    """Retrieves the watchlist, by name."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(empresa_vigilada_table).order_by(empresa_vigilada_table.c.nombre)
+            return [EmpresaVigiladaPydantic(**row._asdict()) for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting empresas vigiladas: {e}")
+        return []
+
+def delete_empresa_vigilada(db_engine, empresa_vigilada_id: int) -> bool:
+    """Removes a company from the watchlist. Returns True if it was removed."""
+    try:
+        with db_engine.connect() as connection:
+            connection.execute(delete(snapshot_empresa_table).where(snapshot_empresa_table.c.empresa_vigilada_id == empresa_vigilada_id))
+            connection.execute(delete(cambio_proceso_table).where(cambio_proceso_table.c.empresa_vigilada_id == empresa_vigilada_id))
+            result = connection.execute(delete(empresa_vigilada_table).where(empresa_vigilada_table.c.id == empresa_vigilada_id))
+            connection.commit()
+            return result.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error deleting empresa vigilada {empresa_vigilada_id}: {e}")
+        return False
+
+def get_procesos_by_idsrama(db_engine, ids_proceso_rama: List[str]) -> dict:
+    """Retrieves the stored procesos among `ids_proceso_rama`, as {idProceso: Proceso}."""
+    procesos = {}
+    ids = list(ids_proceso_rama)
+    try:
+        with db_engine.connect() as connection:
+            for i in range(0, len(ids), 500): # Stay below the SQLite variable limit
+                stmt = select(proceso_table).where(proceso_table.c.idProceso.in_(ids[i:i + 500]))
+                procesos.update({row.idProceso: ProcesoPydantic(**row._asdict()) for row in connection.execute(stmt).fetchall()})
+        return procesos
+    except Exception as e:
+        logger.error(f"Error getting {len(ids)} procesos by idProceso: {e}")
+        return {}
+
+def update_huellas_busqueda(db_engine, huellas: dict) -> int:
+    """Stores the search fingerprint of several procesos ({idProceso: huella}). Returns the number of rows given, or -1 on error."""
+    if not huellas:
+        return 0
+    try:
+        with db_engine.connect() as connection:
+            connection.execute(
+                update(proceso_table).where(proceso_table.c.idProceso == bindparam("b_id"))
+                .values(huella_busqueda=bindparam("b_huella"), fecha_consulta_api=datetime.utcnow()),
+                [{"b_id": id_proceso, "b_huella": huella} for id_proceso, huella in huellas.items()]
+            )
+            connection.commit()
+            return len(huellas)
+    except Exception as e:
+        logger.error(f"Error updating search fingerprints of {len(huellas)} procesos: {e}")
+        return -1
+
+def get_snapshot_empresa(db_engine, empresa_vigilada_id: int) -> dict:
+    """Retrieves the last search snapshot of a watched company, as {idProceso: {"huella_busqueda", "fechaUltimaActuacion"}}."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(snapshot_empresa_table).where(snapshot_empresa_table.c.empresa_vigilada_id == empresa_vigilada_id)
+            return {row.idProceso: {"huella_busqueda": row.huella_busqueda, "fechaUltimaActuacion": row.fechaUltimaActuacion}
+                    for row in connection.execute(stmt).fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting snapshot of empresa vigilada {empresa_vigilada_id}: {e}")
+        return {}
+
+def apply_snapshot_empresa(
+    db_engine,
+    empresa_vigilada_id: int,
+    vistos: List[dict],
+    desaparecidos: List[str],
+    cambios: List[CambioProcesoPydantic]
+) -> bool:
+    """
+    Updates the snapshot of a watched company and records its changes in a single transaction.
+    `vistos` are the new or changed snapshot entries ({"idProceso", "huella_busqueda", "fechaUltimaActuacion"}),
+    `desaparecidos` the idProceso values no longer returned. Returns True on success.
+    """
+    try:
+        with db_engine.connect() as connection:
+            borrar = [v["idProceso"] for v in vistos] + list(desaparecidos)
+            for i in range(0, len(borrar), 500):
+                connection.execute(delete(snapshot_empresa_table).where(
+                    snapshot_empresa_table.c.empresa_vigilada_id == empresa_vigilada_id,
+                    snapshot_empresa_table.c.idProceso.in_(borrar[i:i + 500])
+                ))
+            if vistos:
+                connection.execute(snapshot_empresa_table.insert(), [v | {"empresa_vigilada_id": empresa_vigilada_id} for v in vistos])
+            if cambios:
+                connection.execute(cambio_proceso_table.insert(), [
+                    cambio.model_dump(exclude={"id"}) | {"campos": json.dumps(cambio.campos, ensure_ascii=False, default=str)} for cambio in cambios
+                ])
+            connection.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error applying snapshot of empresa vigilada {empresa_vigilada_id}: {e}")
+        return False
+
+def get_cambios_proceso(
+    db_engine,
+    empresa_vigilada_id: Optional[int] = None,
+    desde: Optional[datetime] = None,
+    tipos: Optional[List[str]] = None,
+    limit: int = 200
+) -> List[CambioProcesoPydantic]:
+    """Retrieves the change feed of the watched companies, newest first, optionally filtered."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(cambio_proceso_table)
+            if empresa_vigilada_id is not None:
+                stmt = stmt.where(cambio_proceso_table.c.empresa_vigilada_id == empresa_vigilada_id)
+            if desde is not None:
+                stmt = stmt.where(cambio_proceso_table.c.fecha_deteccion >= desde)
+            if tipos:
+                stmt = stmt.where(cambio_proceso_table.c.tipo.in_(tipos))
+            stmt = stmt.order_by(cambio_proceso_table.c.fecha_deteccion.desc(), cambio_proceso_table.c.id.desc()).limit(limit)
+            cambios = []
+            for row in connection.execute(stmt).fetchall():
+                data = row._asdict()
+                data["campos"] = json.loads(data.get("campos") or "{}")
+                cambios.append(CambioProcesoPydantic(**data))
+            return cambios
+    except Exception as e:
+        logger.error(f"Error getting cambios de procesos: {e}")
+        return []
+
+def get_proceso_db_ids(db_engine) -> List[int]:
+    """Retrieves the database IDs of all the procesos."""
+    try:
+        with db_engine.connect() as connection:
+            return list(connection.execute(select(proceso_table.c.id).order_by(proceso_table.c.id)).scalars())
+    except Exception as e:
+        logger.error(f"Error getting proceso IDs: {e}")
+        return []
+
+def get_edades_actuaciones(db_engine, ahora: datetime) -> List[tuple]:
+    """Age in days (relative to `ahora`) of every stored actuación, as (proceso_db_id, edad_dias) tuples."""
+    try:
+        with db_engine.connect() as connection:
+            edad = func.julianday(ahora.isoformat(timespec="seconds")) - func.julianday(actuacion_table.c.fechaActuacion)
+            stmt = select(actuacion_table.c.proceso_db_id, edad).where(actuacion_table.c.fechaActuacion.isnot(None))
+            return [(fila[0], fila[1]) for fila in connection.execute(stmt) if fila[1] is not None]
+    except Exception as e:
+        logger.error(f"Error getting ages of actuaciones: {e}")
+        return []
+
+def get_dias_proximo_evento(db_engine, ahora: datetime, dias: int) -> dict:
+    """Days from `ahora` to the next event (hearing, deadline...) of each proceso within `dias` days, as {proceso_db_id: dias}."""
+    try:
+        with db_engine.connect() as connection:
+            fecha_ahora = ahora.isoformat(timespec="seconds")
+            stmt = (
+                select(evento_table.c.proceso_db_id, func.min(func.julianday(evento_table.c.fecha)) - func.julianday(fecha_ahora))
+                .where(evento_table.c.fecha >= fecha_ahora, evento_table.c.fecha <= (ahora + timedelta(days=dias)).isoformat(timespec="seconds"))
+                .group_by(evento_table.c.proceso_db_id)
+            )
+            return {fila[0]: fila[1] for fila in connection.execute(stmt)}
+    except Exception as e:
+        logger.error(f"Error getting upcoming events per proceso: {e}")
+        return {}
+
+def get_procesos_actividad_reciente(db_engine, desde: datetime) -> set:
+    """
+    IDs of the procesos whose last actuación, as reported by the search API in the snapshots of the
+    watched companies, is on or after `desde` (the "últimos 30 días" signal of the Rama Judicial search).
+    """
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(proceso_table.c.id).distinct()
+                .join(snapshot_empresa_table, snapshot_empresa_table.c.idProceso == proceso_table.c.idProceso)
+                .where(snapshot_empresa_table.c.fechaUltimaActuacion >= desde.isoformat(timespec="seconds"))
+            )
+            return set(connection.execute(stmt).scalars())
+    except Exception as e:
+        logger.error(f"Error getting procesos with recent activity: {e}")
+        return set()
+
+def get_sondeos(db_engine) -> dict:
+    """Retrieves the polling schedule, as {proceso_db_id: row dict}."""
+    try:
+        with db_engine.connect() as connection:
+            return {row.proceso_db_id: row._asdict() for row in connection.execute(select(sondeo_proceso_table)).fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting polling schedule: {e}")
+        return {}
+
+def replace_sondeos(db_engine, sondeos: List[dict]) -> int:
+    """Replaces the whole polling schedule in a single transaction. Returns the number of rows stored, or -1 on error."""
+    try:
+        with db_engine.connect() as connection:
+            connection.execute(delete(sondeo_proceso_table))
+            if sondeos:
+                connection.execute(sondeo_proceso_table.insert(), sondeos)
+            connection.commit()
+            return len(sondeos)
+    except Exception as e:
+        logger.error(f"Error replacing polling schedule: {e}")
+        return -1
+
+def get_sondeos_vencidos(db_engine, ahora: datetime, limit: Optional[int] = None) -> List[dict]:
+    """Procesos due for a check (proxima_consulta <= ahora), most overdue first, with their idProceso and nombre_busqueda."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(sondeo_proceso_table, proceso_table.c.idProceso, proceso_table.c.nombre_busqueda)
+                .join(proceso_table, proceso_table.c.id == sondeo_proceso_table.c.proceso_db_id)
+                .where(sondeo_proceso_table.c.proxima_consulta <= ahora)
+                .order_by(sondeo_proceso_table.c.proxima_consulta)
+            )
+            if limit:
+                stmt = stmt.limit(limit)
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting due polling checks: {e}")
+        return []
+
+def update_sondeos_consultados(db_engine, proximas: dict, ahora: datetime) -> int:
+    """Records a check of several procesos ({proceso_db_id: next check time}). Returns the number of rows given, or -1 on error."""
+    if not proximas:
+        return 0
+    try:
+        with db_engine.connect() as connection:
+            connection.execute(
+                update(sondeo_proceso_table).where(sondeo_proceso_table.c.proceso_db_id == bindparam("b_id"))
+                .values(ultima_consulta=ahora, proxima_consulta=bindparam("b_proxima")),
+                [{"b_id": proceso_db_id, "b_proxima": proxima} for proceso_db_id, proxima in proximas.items()]
+            )
+            connection.commit()
+            return len(proximas)
+    except Exception as e:
+        logger.error(f"Error recording polling checks: {e}")
+        return -1
+
 def create_actuacion(db_engine, actuacion: ActuacionPydantic) -> Optional[int]:
     """
     Creates a new actuacion in the database.
@@ -101,6 +522,44 @@ def create_actuacion(db_engine, actuacion: ActuacionPydantic) -> Optional[int]:
         logger.error(f"Error creating/updating actuacion for proceso_db_id {actuacion.proceso_db_id}: {e}")
         return None
 
+def create_actuaciones(db_engine, actuaciones: List[ActuacionPydantic]) -> List[Optional[int]]:
+    """
+    Creates (or updates, matching by idRegActuacion and proceso_db_id) several actuaciones in a single transaction.
+    Returns their database IDs in the same order, or a list of None if an error occurs.
+    """
+    if not actuaciones:
+        return []
+    try:
+        with db_engine.connect() as connection:
+            existentes = {}
+            claves = [(a.proceso_db_id, a.idRegActuacion) for a in actuaciones if a.idRegActuacion]
+            for proceso_db_id in {p for p, _ in claves}:
+                ids_reg = [i for p, i in claves if p == proceso_db_id]
+                filas = connection.execute(
+                    select(actuacion_table.c.id, actuacion_table.c.idRegActuacion)
+                    .where(actuacion_table.c.proceso_db_id == proceso_db_id, actuacion_table.c.idRegActuacion.in_(ids_reg))
+                ).fetchall()
+                existentes.update({(proceso_db_id, fila.idRegActuacion): fila.id for fila in filas})
+            ids = []
+            for actuacion in actuaciones:
+                existente = existentes.get((actuacion.proceso_db_id, actuacion.idRegActuacion)) if actuacion.idRegActuacion else None
+                if existente:
+                    connection.execute(
+                        update(actuacion_table).where(actuacion_table.c.id == existente)
+                        .values(**actuacion.model_dump(exclude_unset=True, exclude_none=True, exclude={"id", "fecha_creacion_db"}))
+                    )
+                    ids.append(existente)
+                else:
+                    result = connection.execute(actuacion_table.insert().values(**actuacion.model_dump(exclude_unset=True, exclude_none=True, exclude={"id"})))
+                    ids.append(result.inserted_primary_key[0])
+                    if actuacion.idRegActuacion: # Repeated in the same batch: update the row just inserted
+                        existentes[(actuacion.proceso_db_id, actuacion.idRegActuacion)] = ids[-1]
+            connection.commit()
+            return ids
+    except Exception as e:
+        logger.error(f"Error creating/updating {len(actuaciones)} actuaciones: {e}")
+        return [None] * len(actuaciones)
+
 def get_actuaciones_by_proceso_db_id(db_engine, proceso_db_id: int) -> List[ActuacionPydantic]:
     """Retrieves all actuaciones for a given proceso_db_id, ordered by fechaActuacion descending."""
     try:
@@ -116,4 +575,798 @@ def get_actuaciones_by_proceso_db_id(db_engine, proceso_db_id: int) -> List[Actu
         logger.error(f"Error getting actuaciones for proceso_db_id {proceso_db_id}: {e}")
         return []
 
+def _filtros_actuaciones(proceso_db_id: int, urgencias: Optional[List[str]] = None, tipo: Optional[str] = None,
+                         desde: Optional[str] = None, hasta: Optional[str] = None) -> list:
+    condiciones = [actuacion_table.c.proceso_db_id == proceso_db_id]
+    if urgencias:
+        # "SIN CLASIFICAR" stands for actuaciones not classified yet, as in the dashboard aggregates
+        clasificadas = [u for u in urgencias if u != "SIN CLASIFICAR"]
+        condicion = actuacion_table.c.clasificacion_urgencia_ia.in_(clasificadas)
+        if "SIN CLASIFICAR" in urgencias:
+            condicion = or_(condicion, actuacion_table.c.clasificacion_urgencia_ia.is_(None))
+        condiciones.append(condicion)
+    if tipo:
+        condiciones.append(actuacion_table.c.actuacion == tipo)
+    if desde:
+        condiciones.append(actuacion_table.c.fechaActuacion >= desde)
+    if hasta:
+        # fechaActuacion is an ISO datetime: the whole `hasta` day is included
+        condiciones.append(actuacion_table.c.fechaActuacion <= hasta + "T23:59:59")
+    return condiciones
+
+def get_actuaciones_pagina(
+    db_engine,
+    proceso_db_id: int,
+    pagina: int = 1,
+    por_pagina: int = 50,
+    urgencias: Optional[List[str]] = None,
+    tipo: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    largo_anotacion: int = 120
+) -> dict:
+    """
+    Retrieves one page of the actuaciones of a proceso (most recent first) with only the columns a
+    list view needs and the annotation truncated, plus the total matching the filters. Uses the
+    (proceso_db_id, fechaActuacion) index, so the cost depends on the page, not on the size of the proceso.
+
+    Returns:
+        {"actuaciones": [dict], "total": int, "pagina": int, "por_pagina": int}, or an empty page on error.
+    """
+    vacia = {"actuaciones": [], "total": 0, "pagina": pagina, "por_pagina": por_pagina}
+    try:
+        with db_engine.connect() as connection:
+            condiciones = _filtros_actuaciones(proceso_db_id, urgencias, tipo, desde, hasta)
+            total = connection.execute(select(func.count()).select_from(actuacion_table).where(*condiciones)).scalar()
+            stmt = (
+                select(
+                    actuacion_table.c.id,
+                    actuacion_table.c.idRegActuacion,
+                    actuacion_table.c.fechaActuacion,
+                    actuacion_table.c.actuacion,
+                    actuacion_table.c.anotacion,
+                    actuacion_table.c.clasificacion_urgencia_ia,
+                    actuacion_table.c.resumen_ia.is_not(None).label("con_resumen_ia"),
+                    actuacion_table.c.conDocumentos,
+                )
+                .where(*condiciones)
+                .order_by(actuacion_table.c.fechaActuacion.desc(), actuacion_table.c.id.desc())
+                .limit(por_pagina)
+                .offset((max(pagina, 1) - 1) * por_pagina)
+            )
+            actuaciones = []
+            for row in connection.execute(stmt):
+                # Truncated after reading: stored anotaciones may be zstd-compressed BLOBs, which SQL substr() would cut
+                fila = row._asdict()
+                anotacion = fila["anotacion"] or ""
+                fila["anotacion"], fila["anotacion_truncada"] = anotacion[:largo_anotacion], len(anotacion) > largo_anotacion
+                actuaciones.append(fila)
+            return {**vacia, "actuaciones": actuaciones, "total": total}
+    except Exception as e:
+        logger.error(f"Error getting page {pagina} of actuaciones for proceso_db_id {proceso_db_id}: {e}")
+        return vacia
+
+def get_version_actuaciones(db_engine, proceso_db_id: int) -> tuple:
+    """
+    Number of actuaciones of a proceso and the last time any of them was created or updated, as
+    (total, datetime or None): a cheap validator for HTTP caching. Returns (0, None) on error.
+    """
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(func.count(), func.max(actuacion_table.c.fecha_actualizacion_db))
+                .where(actuacion_table.c.proceso_db_id == proceso_db_id)
+            )
+            total, ultima = connection.execute(stmt).first()
+            return total, ultima
+    except Exception as e:
+        logger.error(f"Error getting the version of the actuaciones of proceso_db_id {proceso_db_id}: {e}")
+        return 0, None
+
+def get_tipos_actuacion(db_engine, proceso_db_id: int) -> List[str]:
+    """Distinct actuación types (the `actuacion` field, None included) of a proceso, most frequent first, for filters."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(actuacion_table.c.actuacion)
+                .where(actuacion_table.c.proceso_db_id == proceso_db_id)
+                .group_by(actuacion_table.c.actuacion)
+                .order_by(func.count().desc())
+            )
+            return [row[0] for row in connection.execute(stmt)]
+    except Exception as e:
+        logger.error(f"Error getting actuación types for proceso_db_id {proceso_db_id}: {e}")
+        return []
+
+def get_actuacion_by_db_id(db_engine, actuacion_db_id: int) -> Optional[ActuacionPydantic]:
+    """Retrieves an actuacion by its database ID."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(actuacion_table).where(actuacion_table.c.id == actuacion_db_id)
+            result = connection.execute(stmt).first()
+            if result:
+                return ActuacionPydantic(**result._asdict())
+            return None
+    except Exception as e:
+        logger.error(f"Error getting actuacion by db_id {actuacion_db_id}: {e}")
+        return None
+
+def get_actuaciones_sin_enriquecer(
+    db_engine,
+    proceso_db_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    ahora: Optional[datetime] = None
+) -> List[ActuacionPydantic]:
+    """
+    Retrieves actuaciones missing their AI summary or urgency, optionally for one proceso_db_id.
+    Actuaciones whose last enrichment attempt failed are left out until their proximo_intento_ia.
+    """
+    ahora = ahora or datetime.utcnow()
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(actuacion_table).where(
+                (actuacion_table.c.resumen_ia.is_(None)) | (actuacion_table.c.clasificacion_urgencia_ia.is_(None)),
+                (actuacion_table.c.proximo_intento_ia.is_(None)) | (actuacion_table.c.proximo_intento_ia <= ahora)
+            )
+            if proceso_db_id is not None:
+                stmt = stmt.where(actuacion_table.c.proceso_db_id == proceso_db_id)
+            stmt = stmt.order_by(actuacion_table.c.fechaActuacion.desc())
+            if limit:
+                stmt = stmt.limit(limit)
+            results = connection.execute(stmt).fetchall()
+            return [ActuacionPydantic(**row._asdict()) for row in results]
+    except Exception as e:
+        logger.error(f"Error getting actuaciones without AI fields: {e}")
+        return []
+
+def update_actuacion_ia_fallida(
+    db_engine,
+    actuacion_db_id: int,
+    ahora: datetime,
+    espera_base: timedelta,
+    espera_max: timedelta
+) -> Optional[datetime]:
+    """
+    Records a failed enrichment attempt of an actuacion: increments intentos_ia and sets
+    proximo_intento_ia to `ahora` plus an exponential backoff (espera_base doubled per previous
+    failure, capped at espera_max). Returns proximo_intento_ia, or None if an error occurs.
+    """
+    try:
+        with db_engine.connect() as connection:
+            intentos = connection.execute(
+                select(actuacion_table.c.intentos_ia).where(actuacion_table.c.id == actuacion_db_id)
+            ).scalar() or 0
+            proximo = ahora + min(espera_base * 2 ** min(intentos, 30), espera_max)
+            connection.execute(
+                update(actuacion_table).where(actuacion_table.c.id == actuacion_db_id)
+                .values(intentos_ia=intentos + 1, proximo_intento_ia=proximo)
+            )
+            connection.commit()
+            return proximo
+    except Exception as e:
+        logger.error(f"Error recording failed enrichment of actuacion {actuacion_db_id}: {e}")
+        return None
+
+def get_actuaciones_after_id(db_engine, after_id: int, limit: int = 1000) -> List[ActuacionPydantic]:
+    """Retrieves a batch of actuaciones with ID greater than `after_id`, by ID (keyset pagination for batch jobs)."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(actuacion_table)
+                .where(actuacion_table.c.id > after_id)
+                .order_by(actuacion_table.c.id)
+                .limit(limit)
+            )
+            results = connection.execute(stmt).fetchall()
+            return [ActuacionPydantic(**row._asdict()) for row in results]
+    except Exception as e:
+        logger.error(f"Error getting actuaciones after id {after_id}: {e}")
+        return []
+
+def get_actuacion_by_idreg(db_engine, id_reg_actuacion: str) -> Optional[ActuacionPydantic]:
+    """Retrieves an actuacion by its Rama Judicial ID (idRegActuacion)."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(actuacion_table).where(actuacion_table.c.idRegActuacion == id_reg_actuacion)
+            result = connection.execute(stmt).first()
+            if result:
+                return ActuacionPydantic(**result._asdict())
+            return None
+    except Exception as e:
+        logger.error(f"Error getting actuacion by idRegActuacion {id_reg_actuacion}: {e}")
+        return None
+
+def update_actuacion_ia(
+    db_engine,
+    actuacion_db_id: int,
+    resumen_ia: Optional[str] = None,
+    clasificacion_urgencia_ia: Optional[str] = None
+) -> bool:
+    """Stores the AI fields of an actuacion; fields left as None are not modified. Returns True on success."""
+    values = {k: v for k, v in {"resumen_ia": resumen_ia, "clasificacion_urgencia_ia": clasificacion_urgencia_ia}.items() if v is not None}
+    if not values:
+        return True
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                update(actuacion_table)
+                .where(actuacion_table.c.id == actuacion_db_id)
+                .values(**values, fecha_actualizacion_db=datetime.utcnow())
+            )
+            connection.execute(stmt)
+            connection.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error updating AI fields of actuacion {actuacion_db_id}: {e}")
+        return False
+
+def update_actuaciones_ia(db_engine, valores: List[dict]) -> int:
+    """
+    Stores the AI fields of several actuaciones in a single transaction.
+    `valores` is a list of {"id", "resumen_ia", "clasificacion_urgencia_ia"}; None fields keep their stored value.
+    Returns the number of actuaciones updated, or -1 if an error occurs.
+    """
+    if not valores:
+        return 0
+    ahora = datetime.utcnow()
+    try:
+        with db_engine.connect() as connection:
+            connection.execute(
+                update(actuacion_table).where(actuacion_table.c.id == bindparam("b_id"))
+                .values(
+                    resumen_ia=func.coalesce(bindparam("b_resumen_ia", type_=actuacion_table.c.resumen_ia.type), actuacion_table.c.resumen_ia),
+                    clasificacion_urgencia_ia=func.coalesce(bindparam("b_urgencia"), actuacion_table.c.clasificacion_urgencia_ia),
+                    fecha_actualizacion_db=ahora
+                ),
+                [{"b_id": v["id"], "b_resumen_ia": v.get("resumen_ia"), "b_urgencia": v.get("clasificacion_urgencia_ia")} for v in valores]
+            )
+            connection.commit()
+            return len(valores)
+    except Exception as e:
+        logger.error(f"Error updating AI fields of {len(valores)} actuaciones: {e}")
+        return -1
+
+def _row_to_documento(row) -> DocumentoPydantic:
+    data = row._asdict()
+    data["paginas"] = json.loads(data.get("paginas") or "[]")
+    data["texto"] = data.get("texto") or ""
+    return DocumentoPydantic(**data)
+
+def create_documento(db_engine, documento: DocumentoPydantic) -> Optional[int]:
+    """
+    Creates a new documento in the database, or updates the one with the same checksum.
+    Returns the ID of the documento, or None if an error occurs.
+    """
+    values = documento.model_dump(exclude_none=True, exclude={"id", "fecha_creacion_db"})
+    values["paginas"] = json.dumps(values.get("paginas", []))
+    try:
+        with db_engine.connect() as connection:
+            stmt_select = select(documento_table.c.id).where(documento_table.c.checksum == documento.checksum)
+            existing_documento = connection.execute(stmt_select).first()
+            if existing_documento:
+                logger.info(f"Documento with checksum {documento.checksum[:12]} already exists. Updating.")
+                stmt_update = (
+                    update(documento_table)
+                    .where(documento_table.c.id == existing_documento.id)
+                    .values(**values)
+                )
+                connection.execute(stmt_update)
+                connection.commit()
+                return existing_documento.id
+
+            result = connection.execute(documento_table.insert().values(**values))
+            connection.commit()
+            logger.info(f"Documento {documento.checksum[:12]} created with DB ID: {result.inserted_primary_key[0]}")
+            return result.inserted_primary_key[0]
+    except Exception as e:
+        logger.error(f"Error creating/updating documento {documento.checksum[:12]}: {e}")
+        return None
+
+def get_documento_by_checksum(db_engine, checksum: str) -> Optional[DocumentoPydantic]:
+    """Retrieves a documento (with its extracted text) by the checksum of its content."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(documento_table).where(documento_table.c.checksum == checksum)
+            result = connection.execute(stmt).first()
+            if result:
+                return _row_to_documento(result)
+            return None
+    except Exception as e:
+        logger.error(f"Error getting documento by checksum {checksum[:12]}: {e}")
+        return None
+
+def get_documento_by_db_id(db_engine, documento_db_id: int) -> Optional[DocumentoPydantic]:
+    """Retrieves a documento (with its extracted text) by its database ID."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(documento_table).where(documento_table.c.id == documento_db_id)
+            result = connection.execute(stmt).first()
+            if result:
+                return _row_to_documento(result)
+            return None
+    except Exception as e:
+        logger.error(f"Error getting documento by db_id {documento_db_id}: {e}")
+        return None
+
+def update_documento_resumen(db_engine, documento_db_id: int, resumen_ia: str) -> bool:
+    """Stores the AI summary of a documento. Returns True on success."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                update(documento_table)
+                .where(documento_table.c.id == documento_db_id)
+                .values(resumen_ia=resumen_ia, fecha_actualizacion_db=datetime.utcnow())
+            )
+            connection.execute(stmt)
+            connection.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error updating resumen of documento {documento_db_id}: {e}")
+        return False
+
+def get_chunks_by_documento_db_id(db_engine, documento_db_id: int) -> List[ChunkDocumentoPydantic]:
+    """Retrieves the stored chunk summaries of a documento, ordered by chunk position."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = (
+                select(documento_chunk_table)
+                .where(documento_chunk_table.c.documento_db_id == documento_db_id)
+                .order_by(documento_chunk_table.c.indice)
+            )
+            results = connection.execute(stmt).fetchall()
+            return [ChunkDocumentoPydantic(**row._asdict()) for row in results]
+    except Exception as e:
+        logger.error(f"Error getting chunks for documento_db_id {documento_db_id}: {e}")
+        return []
+
+def create_documento_chunks(db_engine, chunks: List[ChunkDocumentoPydantic]) -> int:
+    """
+    Stores chunk summaries in a single transaction, replacing any summary with the same huella.
+    Returns the number of chunks stored.
+    """
+    if not chunks:
+        return 0
+    try:
+        with db_engine.connect() as connection:
+            for chunk in chunks:
+                connection.execute(
+                    delete(documento_chunk_table).where(
+                        documento_chunk_table.c.documento_db_id == chunk.documento_db_id,
+                        documento_chunk_table.c.huella == chunk.huella
+                    )
+                )
+            connection.execute(
+                documento_chunk_table.insert(),
+                [chunk.model_dump(exclude={"id", "texto"}) for chunk in chunks]
+            )
+            connection.commit()
+            return len(chunks)
+    except Exception as e:
+        logger.error(f"Error creating chunks for documento_db_id {chunks[0].documento_db_id}: {e}")
+        return 0
+
+def _contains_pattern(texto: str) -> str:
+    """LIKE pattern for `texto` anywhere in a column, with its % and _ taken literally (use with escape="\\")."""
+    escapado = texto.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escapado}%"
+
+def _empresa_condition(empresa: str):
+    return proceso_table.c.nombre_busqueda.ilike(_contains_pattern(empresa), escape="\\")
+
+def replace_eventos_actuacion(db_engine, actuacion_db_id: int, eventos: List[EventoPydantic]) -> int:
+    """
+    Replaces the extracted events of an actuacion in a single transaction.
+    Returns the number of events stored, or -1 if an error occurs.
+    """
+    try:
+        with db_engine.connect() as connection:
+            connection.execute(delete(evento_table).where(evento_table.c.actuacion_db_id == actuacion_db_id))
+            if eventos:
+                connection.execute(evento_table.insert(), [evento.model_dump(exclude={"id"}) for evento in eventos])
+            connection.commit()
+            return len(eventos)
+    except Exception as e:
+        logger.error(f"Error replacing eventos of actuacion {actuacion_db_id}: {e}")
+        return -1
+
+def get_eventos_entre(
+    db_engine,
+    desde: str,
+    hasta: str,
+    tipos: Optional[List[str]] = None,
+    empresa: Optional[str] = None,
+    proceso_db_id: Optional[int] = None,
+    limit: Optional[int] = None
+) -> List[dict]:
+    """
+    Retrieves the events dated between `desde` and `hasta` (ISO strings, inclusive), soonest first,
+    with the actuacion type and the identifiers of their proceso.
+    """
+    stmt = (
+        select(
+            evento_table, actuacion_table.c.actuacion, actuacion_table.c.clasificacion_urgencia_ia,
+            proceso_table.c.idProceso, proceso_table.c.numeroRadicacion, proceso_table.c.despacho,
+            proceso_table.c.nombre_busqueda
+        )
+        .join(actuacion_table, evento_table.c.actuacion_db_id == actuacion_table.c.id)
+        .join(proceso_table, evento_table.c.proceso_db_id == proceso_table.c.id)
+        .where(evento_table.c.fecha >= desde, evento_table.c.fecha <= hasta)
+        .order_by(evento_table.c.fecha.asc())
+    )
+    if tipos:
+        stmt = stmt.where(evento_table.c.tipo.in_(tipos))
+    if empresa:
+        stmt = stmt.where(_empresa_condition(empresa))
+    if proceso_db_id is not None:
+        stmt = stmt.where(evento_table.c.proceso_db_id == proceso_db_id)
+    if limit:
+        stmt = stmt.limit(limit)
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting eventos between {desde} and {hasta}: {e}")
+        return []
+
+def get_actuaciones_procesos_after_id(db_engine, proceso_db_ids: List[int], after_id: int, limit: int = 1000) -> List[dict]:
+    """
+    Retrieves a batch of actuaciones of the given procesos with ID greater than `after_id`, by ID,
+    with the identifiers of their proceso (keyset pagination for streaming exports).
+    The proceso_db_id index serves each proceso from `after_id` on, so a batch does not rescan the earlier ones.
+    """
+    if not proceso_db_ids:
+        return []
+    stmt = (
+        select(
+            actuacion_table, proceso_table.c.idProceso, proceso_table.c.numeroRadicacion,
+            proceso_table.c.despacho, proceso_table.c.nombre_busqueda
+        )
+        .join(proceso_table, actuacion_table.c.proceso_db_id == proceso_table.c.id)
+        .where(actuacion_table.c.proceso_db_id.in_(proceso_db_ids), actuacion_table.c.id > after_id)
+        .order_by(actuacion_table.c.id)
+        .limit(limit)
+    )
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting actuaciones of {len(proceso_db_ids)} procesos after id {after_id}: {e}")
+        return []
+
+# --- Read-only queries for the assistant (app/services/assistant.py) ---
+# Dates from the API are ISO strings ("2024-05-20T00:00:00"), so ranges compare as strings.
+
+def get_procesos_activos(
+    db_engine,
+    empresa: Optional[str] = None,
+    desde: Optional[str] = None,
+    limit: int = 100
+) -> List[dict]:
+    """
+    Retrieves processes with at least one actuacion since `desde`, most recently active first.
+    Each row includes the date of the last actuacion and the number of actuaciones.
+    """
+    ultima = func.max(actuacion_table.c.fechaActuacion).label("ultima_actuacion")
+    stmt = (
+        select(
+            proceso_table.c.id, proceso_table.c.idProceso, proceso_table.c.numeroRadicacion,
+            proceso_table.c.despacho, proceso_table.c.demandante, proceso_table.c.demandado,
+            proceso_table.c.nombre_busqueda, ultima,
+            func.count(actuacion_table.c.id).label("num_actuaciones")
+        )
+        .join(actuacion_table, actuacion_table.c.proceso_db_id == proceso_table.c.id)
+        .group_by(proceso_table.c.id)
+        .order_by(ultima.desc())
+        .limit(limit)
+    )
+    if empresa:
+        stmt = stmt.where(_empresa_condition(empresa))
+    if desde:
+        stmt = stmt.having(ultima >= desde)
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting active procesos (empresa={empresa}): {e}")
+        return []
+
+def get_actuaciones_con_proceso(
+    db_engine,
+    empresa: Optional[str] = None,
+    urgencias: Optional[List[str]] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    numero_radicacion: Optional[str] = None,
+    limit: int = 50
+) -> List[dict]:
+    """Retrieves actuaciones with the identifiers of their proceso, newest first, with optional filters."""
+    stmt = (
+        select(
+            actuacion_table.c.id, actuacion_table.c.proceso_db_id, actuacion_table.c.fechaActuacion,
+            actuacion_table.c.actuacion, actuacion_table.c.anotacion, actuacion_table.c.fechaFinalizaTermino,
+            actuacion_table.c.resumen_ia, actuacion_table.c.clasificacion_urgencia_ia,
+            proceso_table.c.idProceso, proceso_table.c.numeroRadicacion, proceso_table.c.nombre_busqueda
+        )
+        .join(proceso_table, actuacion_table.c.proceso_db_id == proceso_table.c.id)
+        .order_by(actuacion_table.c.fechaActuacion.desc())
+        .limit(limit)
+    )
+    if empresa:
+        stmt = stmt.where(_empresa_condition(empresa))
+    if urgencias:
+        stmt = stmt.where(actuacion_table.c.clasificacion_urgencia_ia.in_(urgencias))
+    if desde:
+        stmt = stmt.where(actuacion_table.c.fechaActuacion >= desde)
+    if hasta:
+        stmt = stmt.where(actuacion_table.c.fechaActuacion <= hasta)
+    if numero_radicacion:
+        stmt = stmt.where(proceso_table.c.numeroRadicacion == numero_radicacion)
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting actuaciones (empresa={empresa}, urgencias={urgencias}): {e}")
+        return []
+
+def count_actuaciones_por_urgencia(db_engine, empresa: Optional[str] = None, desde: Optional[str] = None) -> dict:
+    """
+    Counts actuaciones per AI urgency ("SIN CLASIFICAR" for the ones not enriched yet).
+    Reads the materialized aggregates: per-day counts when `desde` is given, totals otherwise.
+    """
+    if desde:
+        tabla = agregado_actuacion_dia_table
+        stmt = select(tabla.c.urgencia, func.sum(tabla.c.total).label("total")).where(tabla.c.dia >= desde[:10])
+    else:
+        tabla = agregado_urgencia_table
+        stmt = select(tabla.c.urgencia, func.sum(tabla.c.total).label("total"))
+    stmt = stmt.group_by(tabla.c.urgencia)
+    if empresa:
+        stmt = stmt.where(tabla.c.empresa.ilike(_contains_pattern(empresa), escape="\\"))
+    try:
+        with db_engine.connect() as connection:
+            return {row.urgencia: row.total for row in connection.execute(stmt).fetchall() if row.total}
+    except Exception as e:
+        logger.error(f"Error counting actuaciones by urgency (empresa={empresa}): {e}")
+        return {}
+
+# --- Readers of the materialized portfolio aggregates (maintained by triggers, see database.py) ---
+
+def get_actuaciones_por_dia(
+    db_engine,
+    empresa: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None
+) -> List[dict]:
+    """Number of actuaciones per day (date of the actuacion) and urgency, oldest first."""
+    tabla = agregado_actuacion_dia_table
+    stmt = (
+        select(tabla.c.dia, tabla.c.urgencia, func.sum(tabla.c.total).label("total"))
+        .where(tabla.c.total > 0, tabla.c.dia != "")
+        .group_by(tabla.c.dia, tabla.c.urgencia)
+        .order_by(tabla.c.dia)
+    )
+    if empresa:
+        stmt = stmt.where(tabla.c.empresa.ilike(_contains_pattern(empresa), escape="\\"))
+    if desde:
+        stmt = stmt.where(tabla.c.dia >= desde[:10])
+    if hasta:
+        stmt = stmt.where(tabla.c.dia <= hasta[:10])
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting actuaciones per day (empresa={empresa}): {e}")
+        return []
+
+def get_procesos_por_despacho(db_engine, empresa: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+    """Number of procesos per despacho, largest first."""
+    tabla = agregado_despacho_table
+    total = func.sum(tabla.c.total).label("total")
+    stmt = (
+        select(tabla.c.despacho, total)
+        .where(tabla.c.total > 0)
+        .group_by(tabla.c.despacho)
+        .order_by(total.desc())
+    )
+    if empresa:
+        stmt = stmt.where(tabla.c.empresa.ilike(_contains_pattern(empresa), escape="\\"))
+    if limit:
+        stmt = stmt.limit(limit)
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting procesos per despacho (empresa={empresa}): {e}")
+        return []
+
+def get_eventos_por_empresa(
+    db_engine,
+    desde: str,
+    hasta: str,
+    tipos: Optional[List[str]] = None
+) -> List[dict]:
+    """Number of upcoming events (terms, hearings, deadlines) per company and type between two dates."""
+    tabla = agregado_evento_dia_table
+    total = func.sum(tabla.c.total).label("total")
+    stmt = (
+        select(tabla.c.empresa, tabla.c.tipo, total, func.min(tabla.c.dia).label("proximo"))
+        .where(tabla.c.dia >= desde[:10], tabla.c.dia <= hasta[:10], tabla.c.total > 0)
+        .group_by(tabla.c.empresa, tabla.c.tipo)
+        .order_by(total.desc())
+    )
+    if tipos:
+        stmt = stmt.where(tabla.c.tipo.in_(tipos))
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting eventos per empresa between {desde} and {hasta}: {e}")
+        return []
+
+# --- API keys of the JSON service (app/auth/oauth2_login_fastapi.py) ---
+
+def create_clave_api(db_engine, nombre: str, hash_clave: str) -> Optional[int]:
+    """Stores a new API key (its hash) for a client system. Returns its database ID, or None on error."""
+    try:
+        with db_engine.connect() as connection:
+            result = connection.execute(clave_api_table.insert().values(nombre=nombre, hash_clave=hash_clave, activa=True))
+            connection.commit()
+            return result.inserted_primary_key[0]
+    except Exception as e:
+        logger.error(f"Error creating API key for {nombre}: {e}")
+        return None
+
+def get_claves_api_activas(db_engine) -> Optional[dict]:
+    """Retrieves the active API keys, as {hash_clave: nombre}. Returns None on error (not an empty set of keys)."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = select(clave_api_table.c.hash_clave, clave_api_table.c.nombre).where(clave_api_table.c.activa.is_(True))
+            return {row.hash_clave: row.nombre for row in connection.execute(stmt).fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting active API keys: {e}")
+        return None
+
+def revoke_claves_api(db_engine, nombre: str) -> int:
+    """Deactivates every API key of a client system. Returns the number of keys revoked, or -1 on error."""
+    try:
+        with db_engine.connect() as connection:
+            result = connection.execute(
+                update(clave_api_table)
+                .where(clave_api_table.c.nombre == nombre, clave_api_table.c.activa.is_(True))
+                .values(activa=False)
+            )
+            connection.commit()
+            return result.rowcount
+    except Exception as e:
+        logger.error(f"Error revoking API keys of {nombre}: {e}")
+        return -1
+
+# --- Notification outbox (written by triggers, read by app/services/notificaciones.py) ---
+
+def _select_notificaciones():
+    # The actuacion may have been deleted since: its fields are then None
+    return (
+        select(
+            notificacion_table, actuacion_table.c.fechaActuacion, actuacion_table.c.actuacion,
+            actuacion_table.c.anotacion, proceso_table.c.idProceso, proceso_table.c.numeroRadicacion,
+            proceso_table.c.nombre_busqueda
+        )
+        .outerjoin(actuacion_table, actuacion_table.c.id == notificacion_table.c.actuacion_db_id)
+        .outerjoin(proceso_table, proceso_table.c.id == notificacion_table.c.proceso_db_id)
+        .order_by(notificacion_table.c.id)
+    )
+
+def get_notificaciones_after_id(db_engine, after_id: int, limit: int = 500) -> List[dict]:
+    """Retrieves the notifications with ID greater than `after_id`, by ID, with their actuacion and proceso."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = _select_notificaciones().where(notificacion_table.c.id > after_id).limit(limit)
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting notificaciones after id {after_id}: {e}")
+        return []
+
+def get_ultimo_id_notificacion(db_engine) -> Optional[int]:
+    """ID of the last notification (0 if there are none), or None on error."""
+    try:
+        with db_engine.connect() as connection:
+            return connection.execute(select(func.coalesce(func.max(notificacion_table.c.id), 0))).scalar()
+    except Exception as e:
+        logger.error(f"Error getting last notificacion id: {e}")
+        return None
+
+def get_notificaciones_pendientes(db_engine, limit: int = 500) -> List[dict]:
+    """Retrieves the notifications not delivered to the sinks yet, oldest first."""
+    try:
+        with db_engine.connect() as connection:
+            stmt = _select_notificaciones().where(notificacion_table.c.despachada_en.is_(None)).limit(limit)
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting pending notificaciones: {e}")
+        return []
+
+def update_notificaciones_despachadas(db_engine, ids: List[int], cuando: datetime) -> int:
+    """Marks notifications as delivered to the sinks. Returns the number of rows updated, or -1 on error."""
+    if not ids:
+        return 0
+    try:
+        with db_engine.connect() as connection:
+            result = connection.execute(
+                update(notificacion_table).where(notificacion_table.c.id.in_(ids)).values(despachada_en=cuando)
+            )
+            connection.commit()
+            return result.rowcount
+    except Exception as e:
+        logger.error(f"Error marking {len(ids)} notificaciones as delivered: {e}")
+        return -1
+
+def delete_notificaciones_anteriores(db_engine, antes: datetime, solo_despachadas: bool = True) -> int:
+    """
+    Deletes the notifications written before `antes`; by default only those already delivered
+    to the sinks, so an outage of a sink does not lose them. Returns the number of rows deleted, or -1 on error.
+    """
+    try:
+        with db_engine.connect() as connection:
+            stmt = delete(notificacion_table).where(notificacion_table.c.fecha_creacion_db < antes)
+            if solo_despachadas:
+                stmt = stmt.where(notificacion_table.c.despachada_en.isnot(None))
+            result = connection.execute(stmt)
+            connection.commit()
+            return result.rowcount
+    except Exception as e:
+        logger.error(f"Error deleting notificaciones before {antes}: {e}")
+        return -1
+
+# --- Incremental export (app/services/parquet_export.py) ---
+
+def _modified_since(table, desde: Optional[datetime], after_id: int):
+    # Keyset on (fecha_actualizacion_db, id): rows updated after the watermark, ties broken by ID
+    if desde is None:
+        return table.c.id > after_id
+    return or_(
+        table.c.fecha_actualizacion_db > desde,
+        and_(table.c.fecha_actualizacion_db == desde, table.c.id > after_id)
+    )
+
+def get_procesos_modificados(db_engine, desde: Optional[datetime], after_id: int = 0, limit: int = 10000) -> List[dict]:
+    """Retrieves a batch of procesos created or updated after the (fecha_actualizacion_db, id) watermark."""
+    stmt = (
+        select(proceso_table)
+        .where(_modified_since(proceso_table, desde, after_id))
+        .order_by(proceso_table.c.fecha_actualizacion_db, proceso_table.c.id)
+        .limit(limit)
+    )
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting procesos modified since {desde}: {e}")
+        return []
+
+def get_actuaciones_modificadas(db_engine, desde: Optional[datetime], after_id: int = 0, limit: int = 10000) -> List[dict]:
+    """
+    Retrieves a batch of actuaciones created or updated after the (fecha_actualizacion_db, id) watermark,
+    with the company and despacho of their proceso.
+    """
+    stmt = (
+        select(
+            actuacion_table.c.id, actuacion_table.c.proceso_db_id, actuacion_table.c.idRegActuacion,
+            actuacion_table.c.fechaActuacion, actuacion_table.c.actuacion, actuacion_table.c.fechaIniciaTermino,
+            actuacion_table.c.fechaFinalizaTermino, actuacion_table.c.fechaRegistro, actuacion_table.c.conDocumentos,
+            actuacion_table.c.clasificacion_urgencia_ia, actuacion_table.c.fecha_creacion_db,
+            actuacion_table.c.fecha_actualizacion_db,
+            proceso_table.c.nombre_busqueda, proceso_table.c.despacho
+        )
+        .join(proceso_table, actuacion_table.c.proceso_db_id == proceso_table.c.id)
+        .where(_modified_since(actuacion_table, desde, after_id))
+        .order_by(actuacion_table.c.fecha_actualizacion_db, actuacion_table.c.id)
+        .limit(limit)
+    )
+    try:
+        with db_engine.connect() as connection:
+            return [row._asdict() for row in connection.execute(stmt).fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting actuaciones modified since {desde}: {e}")
+        return []
+
 # Potentially add update/delete functions if needed later
@@ -2,9 +2,10 @@
 Database setup and table creation using SQLAlchemy Core for SQLite.
 '''
 import sqlalchemy
-from sqlalchemy import (Table, Column, Integer, String, Boolean, DateTime, ForeignKey, MetaData, create_engine, Text)
+from sqlalchemy import (Table, Column, Integer, String, Boolean, DateTime, ForeignKey, MetaData, create_engine, Float, Text, UniqueConstraint, Index, event, text)
 from datetime import datetime
 import os
+from app.db.compression import TextoComprimido
 
 # Define the database URL. Creates a file named `judicial_data.sqlite` in the data directory.
 # Construct the path to the data directory relative to this file's location
@@ -43,9 +44,31 @@ proceso_table = Table(
     Column("demandante", String, nullable=True),
     Column("demandado", String, nullable=True),
     Column("nombre_busqueda", String, nullable=True, index=True), # Name/NIT used for search
+    # Content fingerprints for change detection (see app/services/change_detection.py)
+    Column("huella_busqueda", String, nullable=True), # Of the search result (includes fechaUltimaActuacion)
+    Column("huella_detalle", String, nullable=True), # Of the detail fields (despacho, ponente, clase, ubicación...)
     Column("fecha_consulta_api", DateTime, default=datetime.utcnow),
     Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
-    Column("fecha_actualizacion_db", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    Column("fecha_actualizacion_db", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow),
+    # Incremental export watermark (see app/services/parquet_export.py)
+    Index("ix_proceso_actualizacion", "fecha_actualizacion_db", "id")
+)
+
+# Table definition for Sujeto (normalized parties of a proceso, parsed from sujetosProcesales)
+sujeto_table = Table(
+    "sujeto",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("proceso_db_id", Integer, ForeignKey("proceso.id"), nullable=False, index=True),
+    Column("rol", String, nullable=False), # DEMANDANTE, DEMANDADO, ...
+    Column("nombre", String, nullable=False),
+    Column("nombre_normalizado", String, nullable=False),
+    Column("nit", String, nullable=True),
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
+    UniqueConstraint("proceso_db_id", "rol", "nombre_normalizado", name="uq_sujeto_proceso_rol_nombre"),
+    # "All processes where X is demandado": lookups by name or NIT, optionally by role
+    Index("ix_sujeto_nombre_rol", "nombre_normalizado", "rol"),
+    Index("ix_sujeto_nit_rol", "nit", "rol")
 )
 
 # Table definition for Actuacion
@@ -57,29 +80,378 @@ actuacion_table = Table(
     Column("proceso_db_id", Integer, ForeignKey("proceso.id"), nullable=False, index=True),
     Column("fechaActuacion", String, nullable=True),
     Column("actuacion", String, nullable=True), # Tipo de actuación
-    Column("anotacion", Text, nullable=True), # Can be very long
+    Column("anotacion", TextoComprimido, nullable=True), # Can be very long; zstd-compressed (app/db/compression.py)
     Column("fechaIniciaTermino", String, nullable=True),
     Column("fechaFinalizaTermino", String, nullable=True),
     Column("fechaRegistro", String, nullable=True),
     Column("conDocumentos", Boolean, default=False),
-    Column("resumen_ia", Text, nullable=True),
+    Column("resumen_ia", TextoComprimido, nullable=True),
     Column("clasificacion_urgencia_ia", String, nullable=True),
+    Column("intentos_ia", Integer, nullable=True), # Failed enrichment attempts (app/services/enrichment.py)
+    Column("proximo_intento_ia", DateTime, nullable=True), # Not enqueued for enrichment again before this
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
+    Column("fecha_actualizacion_db", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow),
+    # Composite indexes for the assistant queries (latest actuaciones per process, by urgency, by term end)
+    Index("ix_actuacion_proceso_fecha", "proceso_db_id", "fechaActuacion"),
+    Index("ix_actuacion_urgencia_fecha", "clasificacion_urgencia_ia", "fechaActuacion"),
+    Index("ix_actuacion_actualizacion", "fecha_actualizacion_db", "id")
+)
+
+# Table definition for Evento (dated events extracted from an actuación: term ends, hearings, deadlines)
+evento_table = Table(
+    "evento",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("actuacion_db_id", Integer, ForeignKey("actuacion.id"), nullable=False, index=True),
+    Column("proceso_db_id", Integer, ForeignKey("proceso.id"), nullable=False, index=True),
+    Column("tipo", String, nullable=False), # AUDIENCIA, VENCIMIENTO_TERMINO, INICIO_TERMINO, REQUERIMIENTO
+    Column("fecha", String, nullable=False), # ISO "YYYY-MM-DDTHH:MM:SS", same format as the API dates
+    Column("con_hora", Boolean, default=False), # False for all-day events
+    Column("estimada", Boolean, default=False), # True when computed from a relative term ("dentro de 5 días")
+    Column("descripcion", Text, nullable=True), # Snippet of the text the event was extracted from
+    Column("fuente", String, nullable=False), # API field name, or "anotacion"
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
+    Index("ix_evento_fecha_tipo", "fecha", "tipo")
+)
+
+# Table definition for Documento (text extracted from files attached to an actuación)
+documento_table = Table(
+    "documento",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("idRegDocumento", String, index=True, nullable=True), # From Rama Judicial API
+    Column("actuacion_db_id", Integer, ForeignKey("actuacion.id"), nullable=True, index=True),
+    Column("nombre", String, nullable=True),
+    Column("checksum", String, unique=True, index=True, nullable=False), # SHA-256 of the file, extraction cache key
+    Column("num_paginas", Integer, default=0),
+    Column("texto", Text, nullable=True), # Full extracted text, can be very long
+    Column("paginas", Text, nullable=True), # JSON list of per-page offsets into `texto`
+    Column("resumen_ia", Text, nullable=True),
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
+    Column("fecha_actualizacion_db", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+)
+
+# Table definition for the chunk summaries of a Documento (map step of map-reduce summarization)
+documento_chunk_table = Table(
+    "documento_chunk",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("documento_db_id", Integer, ForeignKey("documento.id"), nullable=False, index=True),
+    Column("indice", Integer, nullable=False),
+    Column("pagina_inicio", Integer, nullable=False),
+    Column("pagina_fin", Integer, nullable=False),
+    Column("huella", String, nullable=False, index=True), # Hash of chunk text + map prompt
+    Column("resumen_ia", Text, nullable=True),
     Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
+    UniqueConstraint("documento_db_id", "huella", name="uq_documento_chunk_huella")
+)
+
+# Table definition for the company watchlist (aliases are resolved by app/services/entity_resolution.py)
+empresa_vigilada_table = Table(
+    "empresa_vigilada",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("nombre", String, nullable=False),
+    Column("nombre_normalizado", String, nullable=False, unique=True),
+    Column("umbral_similitud", Float, nullable=False, default=0.75),
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow)
+)
+
+# Table definition for the last search snapshot of each watched company: the procesos returned and their fingerprints
+snapshot_empresa_table = Table(
+    "snapshot_empresa",
+    metadata,
+    Column("empresa_vigilada_id", Integer, ForeignKey("empresa_vigilada.id", ondelete="CASCADE"), primary_key=True),
+    Column("idProceso", String, primary_key=True),
+    Column("huella_busqueda", String, nullable=False),
+    Column("fechaUltimaActuacion", String, nullable=True),
+    Column("fecha_visto", DateTime, default=datetime.utcnow)
+)
+
+# Table definition for CambioProceso (change feed between two snapshots of a watched company)
+cambio_proceso_table = Table(
+    "cambio_proceso",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("empresa_vigilada_id", Integer, ForeignKey("empresa_vigilada.id", ondelete="CASCADE"), nullable=False),
+    Column("idProceso", String, nullable=False),
+    Column("proceso_db_id", Integer, ForeignKey("proceso.id"), nullable=True),
+    Column("tipo", String, nullable=False), # nuevo, desaparecido, modificado
+    Column("campos", Text, nullable=True), # JSON {campo: [antes, después]}
+    Column("fecha_deteccion", DateTime, default=datetime.utcnow),
+    Index("ix_cambio_proceso_empresa_fecha", "empresa_vigilada_id", "fecha_deteccion"),
+    Index("ix_cambio_proceso_fecha", "fecha_deteccion")
+)
+
+# Table definition for the adaptive polling schedule of each proceso (see app/services/polling.py)
+sondeo_proceso_table = Table(
+    "sondeo_proceso",
+    metadata,
+    Column("proceso_db_id", Integer, ForeignKey("proceso.id"), primary_key=True),
+    Column("tasa_estimada", Float, nullable=False), # Expected actuaciones per day
+    Column("peso", Float, nullable=False, default=1.0), # Boost for upcoming deadlines and recent activity
+    Column("frecuencia_dia", Float, nullable=False), # Checks per day assigned within the budget
+    Column("ultima_consulta", DateTime, nullable=True),
+    Column("proxima_consulta", DateTime, nullable=False, index=True),
     Column("fecha_actualizacion_db", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 )
 
-def create_db_and_tables():
+# Table definition for Trabajo (durable job queue drained by worker processes, see app/db/job_queue.py)
+trabajo_table = Table(
+    "trabajo",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("tipo", String, nullable=False), # fetch-process, fetch-actuaciones, download-document, extract-text, enrich-ai
+    Column("clave", String, nullable=False, unique=True), # Idempotency key, e.g. "fetch-process:12345"
+    Column("payload", Text, nullable=True), # JSON
+    Column("estado", String, nullable=False, default="pendiente"), # pendiente, en_proceso, completado, fallido
+    Column("prioridad", Integer, nullable=False, default=0), # Higher first
+    Column("intentos", Integer, nullable=False, default=0),
+    Column("max_intentos", Integer, nullable=False, default=5),
+    Column("disponible_en", DateTime, nullable=False, default=datetime.utcnow), # Retries are delayed (backoff)
+    Column("worker", String, nullable=True), # Holder of the lease
+    Column("lease_hasta", DateTime, nullable=True), # Expired leases can be claimed by another worker
+    Column("ultimo_error", Text, nullable=True),
+    Column("resultado", Text, nullable=True), # JSON
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
+    Column("fecha_actualizacion_db", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow),
+    # Claiming: next available jobs by state, time and priority
+    Index("ix_trabajo_estado_disponible", "estado", "disponible_en", "prioridad"),
+    Index("ix_trabajo_estado_lease", "estado", "lease_hasta")
+)
+
+# Table definition for the API keys of the JSON service (see app/auth/oauth2_login_fastapi.py)
+clave_api_table = Table(
+    "clave_api",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("nombre", String, nullable=False), # Client system, e.g. "erp-juridico"
+    Column("hash_clave", String, nullable=False, unique=True), # SHA-256 of the token; the token itself is never stored
+    Column("activa", Boolean, nullable=False, default=True),
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow),
+    Column("fecha_actualizacion_db", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+)
+
+# Table definition for the notification outbox: one row per new or (re)classified actuacion, written
+# by triggers (below) and tailed by app/services/notificaciones.py
+notificacion_table = Table(
+    "notificacion",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True), # Also the SSE event ID
+    Column("tipo", String, nullable=False), # nueva, clasificada
+    Column("actuacion_db_id", Integer, nullable=False),
+    Column("proceso_db_id", Integer, nullable=False),
+    Column("urgencia", String, nullable=True), # Urgency when the notification was written
+    Column("fecha_creacion_db", DateTime, nullable=False, index=True),
+    Column("despachada_en", DateTime, nullable=True), # Delivered to the email/webhook sinks
+    Index("ix_notificacion_despacho", "despachada_en", "id")
+)
+
+# Table definition for the applied data migrations (see app/db/migrations.py)
+migracion_table = Table(
+    "migracion",
+    metadata,
+    Column("nombre", String, primary_key=True),
+    Column("fecha_aplicacion", DateTime, default=datetime.utcnow)
+)
+
+# --- Materialized aggregates for the portfolio dashboard ---
+# Kept up to date by SQLite triggers on proceso/actuacion/evento, so every write path
+# (crud upserts, bulk inserts, AI enrichment, event re-extraction) maintains them and
+# dashboard reads cost O(number of groups) instead of a scan of the actuaciones.
+# "empresa" is proceso.nombre_busqueda ('' when unknown).
+
+agregado_urgencia_table = Table(
+    "agregado_urgencia",
+    metadata,
+    Column("empresa", String, primary_key=True),
+    Column("urgencia", String, primary_key=True), # 'SIN CLASIFICAR' until enriched
+    Column("total", Integer, nullable=False, default=0)
+)
+
+agregado_actuacion_dia_table = Table(
+    "agregado_actuacion_dia",
+    metadata,
+    Column("empresa", String, primary_key=True),
+    Column("dia", String, primary_key=True), # Date part of fechaActuacion, "YYYY-MM-DD"
+    Column("urgencia", String, primary_key=True),
+    Column("total", Integer, nullable=False, default=0)
+)
+
+agregado_despacho_table = Table(
+    "agregado_despacho",
+    metadata,
+    Column("despacho", String, primary_key=True), # 'SIN DESPACHO' when unknown
+    Column("empresa", String, primary_key=True),
+    Column("total", Integer, nullable=False, default=0) # Number of procesos
+)
+
+agregado_evento_dia_table = Table(
+    "agregado_evento_dia",
+    metadata,
+    Column("empresa", String, primary_key=True),
+    Column("dia", String, primary_key=True), # Date part of evento.fecha
+    Column("tipo", String, primary_key=True),
+    Column("total", Integer, nullable=False, default=0)
+)
+
+def _empresa_sql(fila: str) -> str:
+    return f"COALESCE((SELECT nombre_busqueda FROM proceso WHERE id = {fila}.proceso_db_id), '')"
+
+def _upsert_sql(tabla: str, columnas: tuple, valores: tuple, delta: int) -> str:
+    claves = ", ".join(columnas)
+    return (f"INSERT INTO {tabla} ({claves}, total) VALUES ({', '.join(valores)}, {delta}) "
+            f"ON CONFLICT ({claves}) DO UPDATE SET total = total + excluded.total;")
+
+def _upserts_actuacion(fila: str, delta: int) -> str:
+    urgencia = f"COALESCE({fila}.clasificacion_urgencia_ia, 'SIN CLASIFICAR')"
+    return (_upsert_sql("agregado_urgencia", ("empresa", "urgencia"), (_empresa_sql(fila), urgencia), delta)
+            + _upsert_sql("agregado_actuacion_dia", ("empresa", "dia", "urgencia"),
+                          (_empresa_sql(fila), f"COALESCE(substr({fila}.fechaActuacion, 1, 10), '')", urgencia), delta))
+
+def _upserts_despacho(fila: str, delta: int) -> str:
+    return _upsert_sql("agregado_despacho", ("despacho", "empresa"),
+                       (f"COALESCE({fila}.despacho, 'SIN DESPACHO')", f"COALESCE({fila}.nombre_busqueda, '')"), delta)
+
+def _upserts_evento(fila: str, delta: int) -> str:
+    return _upsert_sql("agregado_evento_dia", ("empresa", "dia", "tipo"),
+                       (_empresa_sql(fila), f"substr({fila}.fecha, 1, 10)", f"{fila}.tipo"), delta)
+
+def _mover_empresa_sql(signo: str, fila: str) -> str:
+    # Moves the actuacion/evento counts of a proceso when its nombre_busqueda changes
+    empresa = f"COALESCE({fila}.nombre_busqueda, '')"
+    return f"""
+    INSERT INTO agregado_urgencia (empresa, urgencia, total)
+        SELECT {empresa}, COALESCE(clasificacion_urgencia_ia, 'SIN CLASIFICAR'), {signo}COUNT(*) FROM actuacion
+        WHERE proceso_db_id = NEW.id GROUP BY 2
+        ON CONFLICT (empresa, urgencia) DO UPDATE SET total = total + excluded.total;
+    INSERT INTO agregado_actuacion_dia (empresa, dia, urgencia, total)
+        SELECT {empresa}, COALESCE(substr(fechaActuacion, 1, 10), ''), COALESCE(clasificacion_urgencia_ia, 'SIN CLASIFICAR'), {signo}COUNT(*) FROM actuacion
+        WHERE proceso_db_id = NEW.id GROUP BY 2, 3
+        ON CONFLICT (empresa, dia, urgencia) DO UPDATE SET total = total + excluded.total;
+    INSERT INTO agregado_evento_dia (empresa, dia, tipo, total)
+        SELECT {empresa}, substr(fecha, 1, 10), tipo, {signo}COUNT(*) FROM evento
+        WHERE proceso_db_id = NEW.id GROUP BY 2, 3
+        ON CONFLICT (empresa, dia, tipo) DO UPDATE SET total = total + excluded.total;"""
+
+TRIGGERS_AGREGADOS = {
+    "trg_agregados_actuacion_insert": f"AFTER INSERT ON actuacion BEGIN {_upserts_actuacion('NEW', 1)} END",
+    "trg_agregados_actuacion_delete": f"AFTER DELETE ON actuacion BEGIN {_upserts_actuacion('OLD', -1)} END",
+    "trg_agregados_actuacion_update": (
+        "AFTER UPDATE OF proceso_db_id, fechaActuacion, clasificacion_urgencia_ia ON actuacion "
+        f"BEGIN {_upserts_actuacion('OLD', -1)} {_upserts_actuacion('NEW', 1)} END"
+    ),
+    "trg_agregados_proceso_insert": f"AFTER INSERT ON proceso BEGIN {_upserts_despacho('NEW', 1)} END",
+    "trg_agregados_proceso_delete": f"AFTER DELETE ON proceso BEGIN {_upserts_despacho('OLD', -1)} END",
+    "trg_agregados_proceso_update": (
+        "AFTER UPDATE OF despacho, nombre_busqueda ON proceso "
+        f"BEGIN {_upserts_despacho('OLD', -1)} {_upserts_despacho('NEW', 1)} END"
+    ),
+    "trg_agregados_proceso_empresa": (
+        "AFTER UPDATE OF nombre_busqueda ON proceso "
+        "WHEN COALESCE(OLD.nombre_busqueda, '') <> COALESCE(NEW.nombre_busqueda, '') "
+        f"BEGIN {_mover_empresa_sql('-', 'OLD')} {_mover_empresa_sql('', 'NEW')} END"
+    ),
+    "trg_agregados_evento_insert": f"AFTER INSERT ON evento BEGIN {_upserts_evento('NEW', 1)} END",
+    "trg_agregados_evento_delete": f"AFTER DELETE ON evento BEGIN {_upserts_evento('OLD', -1)} END",
+}
+
+def _notificacion_sql(tipo: str) -> str:
+    return ("INSERT INTO notificacion (tipo, actuacion_db_id, proceso_db_id, urgencia, fecha_creacion_db) "
+            f"VALUES ('{tipo}', NEW.id, NEW.proceso_db_id, NEW.clasificacion_urgencia_ia, CURRENT_TIMESTAMP);")
+
+# Outbox of notifications: like the aggregates, written by every path that stores actuaciones
+TRIGGERS_NOTIFICACIONES = {
+    "trg_notificacion_actuacion_insert": f"AFTER INSERT ON actuacion BEGIN {_notificacion_sql('nueva')} END",
+    "trg_notificacion_actuacion_urgencia": (
+        "AFTER UPDATE OF clasificacion_urgencia_ia ON actuacion "
+        "WHEN NEW.clasificacion_urgencia_ia IS NOT NULL AND NEW.clasificacion_urgencia_ia IS NOT OLD.clasificacion_urgencia_ia "
+        f"BEGIN {_notificacion_sql('clasificada')} END"
+    ),
+}
+
+RECONSTRUIR_AGREGADOS = (
+    """INSERT INTO agregado_urgencia (empresa, urgencia, total)
+        SELECT COALESCE(p.nombre_busqueda, ''), COALESCE(a.clasificacion_urgencia_ia, 'SIN CLASIFICAR'), COUNT(*)
+        FROM actuacion a LEFT JOIN proceso p ON p.id = a.proceso_db_id GROUP BY 1, 2""",
+    """INSERT INTO agregado_actuacion_dia (empresa, dia, urgencia, total)
+        SELECT COALESCE(p.nombre_busqueda, ''), COALESCE(substr(a.fechaActuacion, 1, 10), ''), COALESCE(a.clasificacion_urgencia_ia, 'SIN CLASIFICAR'), COUNT(*)
+        FROM actuacion a LEFT JOIN proceso p ON p.id = a.proceso_db_id GROUP BY 1, 2, 3""",
+    """INSERT INTO agregado_despacho (despacho, empresa, total)
+        SELECT COALESCE(despacho, 'SIN DESPACHO'), COALESCE(nombre_busqueda, ''), COUNT(*) FROM proceso GROUP BY 1, 2""",
+    """INSERT INTO agregado_evento_dia (empresa, dia, tipo, total)
+        SELECT COALESCE(p.nombre_busqueda, ''), substr(e.fecha, 1, 10), e.tipo, COUNT(*)
+        FROM evento e LEFT JOIN proceso p ON p.id = e.proceso_db_id GROUP BY 1, 2, 3""",
+)
+
+def reconstruir_agregados(connection) -> None:
+    '''Recomputes every aggregate table from scratch and (re)creates its triggers, in the given transaction.'''
+    for nombre in TRIGGERS_AGREGADOS:
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {nombre}"))
+    for tabla in (agregado_urgencia_table, agregado_actuacion_dia_table, agregado_despacho_table, agregado_evento_dia_table):
+        connection.execute(tabla.delete())
+    for sentencia in RECONSTRUIR_AGREGADOS:
+        connection.execute(text(sentencia))
+    for nombre, cuerpo in TRIGGERS_AGREGADOS.items():
+        connection.execute(text(f"CREATE TRIGGER {nombre} {cuerpo}"))
+
+@event.listens_for(metadata, "after_create")
+def _crear_agregados(target, connection, **kw):
+    # Aggregates are backfilled the first time the triggers are installed (new or pre-existing database)
+    if connection.dialect.name != "sqlite":
+        return
+    existentes = {fila[0] for fila in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+    if not set(TRIGGERS_AGREGADOS) <= existentes:
+        reconstruir_agregados(connection)
+    # Notifications start when the triggers are installed: existing actuaciones are not notified
+    for nombre, cuerpo in TRIGGERS_NOTIFICACIONES.items():
+        if nombre not in existentes:
+            connection.execute(text(f"CREATE TRIGGER {nombre} {cuerpo}"))
+
+def agregar_columnas_faltantes(db_engine) -> list[str]:
+    '''
+    Adds to the existing tables the nullable columns defined here after they were created
+    (SQLite ALTER TABLE ADD COLUMN). Returns the columns added, as "table.column".
+    '''
+    agregadas = []
+    with db_engine.connect() as connection:
+        for table in metadata.sorted_tables:
+            existentes = {fila[1] for fila in connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}
+            if not existentes: # Not created yet
+                continue
+            for columna in table.columns:
+                if columna.name in existentes or not columna.nullable or columna.primary_key:
+                    continue
+                tipo = columna.type.compile(dialect=db_engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{columna.name}" {tipo}')
+                agregadas.append(f"{table.name}.{columna.name}")
+        connection.commit()
+    if agregadas:
+        print(f"Columnas agregadas: {', '.join(agregadas)}")
+    return agregadas
+
+def create_db_and_tables(db_engine=None):
     '''
     Creates the database and all defined tables if they don't already exist.
+    Uses the default engine unless another one (e.g. a tenant shard) is given.
     '''
+    db_engine = db_engine or engine
     try:
         # Check if the SQLite file exists. If not, create_all will create it.
         # For other DBs, this would connect to an existing server and create tables.
-        db_file_path = engine.url.database
+        db_file_path = db_engine.url.database
         if db_file_path and not os.path.exists(db_file_path):
             print(f"Database file {db_file_path} not found, will be created.")
         
-        metadata.create_all(bind=engine)
+        metadata.create_all(bind=db_engine)
+        # create_all skips existing tables, so columns and indexes added later are created here
+        agregar_columnas_faltantes(db_engine)
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db_engine, checkfirst=True)
+        # Data migrations (backfills of new tables/columns) that were not applied yet
+        from app.db.migrations import aplicar_migraciones
+        aplicar_migraciones(db_engine)
         print("Database and tables created successfully (if they didn't exist).")
         if db_file_path:
             print(f"Database file is at: {os.path.abspath(db_file_path)}")
@@ -0,0 +1,292 @@
+'''
+Durable job queue with leases, for ingestion work drained by any number of worker processes.
+
+Jobs are rows of the `trabajo` table. A worker claims jobs by taking a lease (worker name +
+expiry) in a single UPDATE ... RETURNING, renews it with heartbeats while it works, and
+completes or fails the job only while it still holds the lease. A worker that dies simply
+lets its lease expire and the job is claimed again, unless it has used its max_intentos: a job
+that keeps crashing its worker is marked fallido. Failures are retried with exponential
+backoff (plus jitter) up to max_intentos. Every job has an idempotency key: enqueuing an
+existing key is a no-op, so completed work is not repeated.
+
+`BackendCola` is the interface; `BackendColaSQL` works on any SQLAlchemy engine: SQLite
+serializes the claims of the worker processes of one machine, and a server database (e.g.
+PostgreSQL, reachable from every machine) lets workers on several machines drain the same
+queue. Other backends are registered in BACKENDS and chosen with JOB_QUEUE_BACKEND.
+'''
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, update, func, or_, and_
+from app.db.database import trabajo_table
+from app.models.models import Trabajo
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TIPOS_TRABAJO = ("fetch-process", "fetch-actuaciones", "download-document", "extract-text", "enrich-ai")
+LEASE_SEGUNDOS = 120
+BACKOFF_BASE_SEGUNDOS = 10
+BACKOFF_MAX_SEGUNDOS = 3600
+
+def clave_trabajo(tipo: str, *partes) -> str:
+    '''Idempotency key of a job, e.g. clave_trabajo("fetch-process", "12345") -> "fetch-process:12345".'''
+    return ":".join([tipo, *(str(p) for p in partes)])
+
+def espera_reintento(intentos: int) -> float:
+    '''Seconds to wait before retrying after `intentos` failures: exponential, capped, with jitter.'''
+    espera = min(BACKOFF_BASE_SEGUNDOS * 2 ** max(intentos - 1, 0), BACKOFF_MAX_SEGUNDOS)
+    return espera * random.uniform(0.8, 1.2)
+
+class BackendCola:
+    '''Interface of a job queue backend.'''
+
+    def encolar(self, tipo: str, payload: dict, clave: str | None = None, prioridad: int = 0,
+                max_intentos: int = 5, disponible_en: datetime | None = None) -> Optional[int]:
+        raise NotImplementedError
+
+    def reclamar(self, worker: str, tipos: list[str] | None = None, limite: int = 1, lease_segundos: int = LEASE_SEGUNDOS) -> list[Trabajo]:
+        raise NotImplementedError
+
+    def renovar(self, ids: list[int], worker: str, lease_segundos: int = LEASE_SEGUNDOS) -> int:
+        raise NotImplementedError
+
+    def completar(self, trabajo_id: int, worker: str, resultado: dict | None = None) -> bool:
+        raise NotImplementedError
+
+    def fallar(self, trabajo_id: int, worker: str, error: str, reintentar: bool = True) -> bool:
+        raise NotImplementedError
+
+    def hay_trabajo(self, tipos: list[str] | None = None) -> bool:
+        raise NotImplementedError
+
+    def estadisticas(self) -> dict:
+        raise NotImplementedError
+
+class BackendColaSQL(BackendCola):
+    '''Job queue on the `trabajo` table of a SQLAlchemy engine.'''
+
+    def __init__(self, db_engine):
+        self.db_engine = db_engine
+
+    def encolar(self, tipo: str, payload: dict, clave: str | None = None, prioridad: int = 0,
+                max_intentos: int = 5, disponible_en: datetime | None = None) -> Optional[int]:
+        '''
+        Adds a job unless one with the same idempotency key exists (in any state).
+
+        Args:
+            tipo: One of TIPOS_TRABAJO.
+            payload: JSON-serializable arguments of the job.
+            clave: Optional. Idempotency key (default: tipo + payload).
+            prioridad: Optional. Higher is claimed first.
+            max_intentos: Optional. Attempts before the job is marked as fallido.
+            disponible_en: Optional. Not claimable before this time (UTC).
+
+        Returns:
+            The ID of the new or existing job, or None if an error occurs.
+        '''
+        if tipo not in TIPOS_TRABAJO:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        clave = clave or clave_trabajo(tipo, json.dumps(payload, sort_keys=True, default=str))
+        try:
+            with self.db_engine.connect() as connection:
+                existente = connection.execute(select(trabajo_table.c.id).where(trabajo_table.c.clave == clave)).scalar_one_or_none()
+                if existente is not None:
+                    return existente
+                result = connection.execute(trabajo_table.insert().values(
+                    tipo=tipo, clave=clave, payload=json.dumps(payload, default=str), prioridad=prioridad,
+                    max_intentos=max_intentos, disponible_en=disponible_en or datetime.utcnow()
+                ))
+                connection.commit()
+                return result.inserted_primary_key[0]
+        except Exception as e:
+            # Another worker may have inserted the same key concurrently (unique constraint)
+            with self.db_engine.connect() as connection:
+                existente = connection.execute(select(trabajo_table.c.id).where(trabajo_table.c.clave == clave)).scalar_one_or_none()
+            if existente is None:
+                logger.error(f"Error enqueuing job {clave}: {e}")
+            return existente
+
+    def _reclamable(self, ahora: datetime, tipos: list[str] | None):
+        condicion = or_(
+            and_(trabajo_table.c.estado == "pendiente", trabajo_table.c.disponible_en <= ahora),
+            # Lease expired: the worker died or hung (attempts left)
+            and_(trabajo_table.c.estado == "en_proceso", trabajo_table.c.lease_hasta < ahora,
+                 trabajo_table.c.intentos < trabajo_table.c.max_intentos),
+        )
+        return and_(condicion, trabajo_table.c.tipo.in_(tipos)) if tipos else condicion
+
+    def _descartar_vencidos(self, connection, ahora: datetime) -> int:
+        # Expired leases without attempts left: the job crashed or hung its worker every time
+        result = connection.execute(
+            update(trabajo_table)
+            .where(trabajo_table.c.estado == "en_proceso", trabajo_table.c.lease_hasta < ahora,
+                   trabajo_table.c.intentos >= trabajo_table.c.max_intentos)
+            .values(estado="fallido", lease_hasta=None, ultimo_error="Lease vencido en el último intento (el worker murió o se colgó)")
+        )
+        if result.rowcount:
+            logger.warning(f"{result.rowcount} jobs marked as fallido after their last lease expired.")
+        return result.rowcount
+
+    def reclamar(self, worker: str, tipos: list[str] | None = None, limite: int = 1, lease_segundos: int = LEASE_SEGUNDOS) -> list[Trabajo]:
+        '''
+        Atomically leases up to `limite` available jobs (highest priority, oldest first) to `worker`.
+        The claim condition is repeated in the outer UPDATE so that two workers racing for the
+        same row cannot both take it.
+        '''
+        ahora = datetime.utcnow()
+        candidatos = (
+            select(trabajo_table.c.id).where(self._reclamable(ahora, tipos))
+            .order_by(trabajo_table.c.prioridad.desc(), trabajo_table.c.id).limit(limite)
+        )
+        stmt = (
+            update(trabajo_table)
+            .where(trabajo_table.c.id.in_(candidatos), self._reclamable(ahora, tipos))
+            .values(estado="en_proceso", worker=worker, lease_hasta=ahora + timedelta(seconds=lease_segundos),
+                    intentos=trabajo_table.c.intentos + 1)
+            .returning(*trabajo_table.c)
+        )
+        try:
+            with self.db_engine.connect() as connection:
+                self._descartar_vencidos(connection, ahora)
+                filas = connection.execute(stmt).fetchall()
+                connection.commit()
+        except Exception as e:
+            logger.error(f"Error claiming jobs for worker {worker}: {e}")
+            return []
+        return [self._a_trabajo(fila) for fila in filas]
+
+    def renovar(self, ids: list[int], worker: str, lease_segundos: int = LEASE_SEGUNDOS) -> int:
+        '''Heartbeat: extends the leases still held by `worker`. Returns how many were extended.'''
+        if not ids:
+            return 0
+        try:
+            with self.db_engine.connect() as connection:
+                result = connection.execute(
+                    update(trabajo_table)
+                    .where(trabajo_table.c.id.in_(ids), trabajo_table.c.worker == worker, trabajo_table.c.estado == "en_proceso")
+                    .values(lease_hasta=datetime.utcnow() + timedelta(seconds=lease_segundos))
+                )
+                connection.commit()
+                return result.rowcount
+        except Exception as e:
+            logger.error(f"Error renewing leases of worker {worker}: {e}")
+            return 0
+
+    def completar(self, trabajo_id: int, worker: str, resultado: dict | None = None) -> bool:
+        '''Marks a job as completado. Returns False if the worker no longer holds its lease.'''
+        return self._cerrar(trabajo_id, worker, estado="completado", resultado=json.dumps(resultado, default=str) if resultado is not None else None)
+
+    def fallar(self, trabajo_id: int, worker: str, error: str, reintentar: bool = True) -> bool:
+        '''
+        Records a failed attempt: the job goes back to pendiente after a backoff delay, or to
+        fallido once it has used its max_intentos (or if reintentar is False).
+        Returns False if the worker no longer holds its lease.
+        '''
+        try:
+            with self.db_engine.connect() as connection:
+                fila = connection.execute(
+                    select(trabajo_table.c.intentos, trabajo_table.c.max_intentos).where(trabajo_table.c.id == trabajo_id)
+                ).first()
+        except Exception as e:
+            logger.error(f"Error reading job {trabajo_id}: {e}")
+            return False
+        if fila is None:
+            return False
+        if reintentar and fila.intentos < fila.max_intentos:
+            disponible_en = datetime.utcnow() + timedelta(seconds=espera_reintento(fila.intentos))
+            return self._cerrar(trabajo_id, worker, estado="pendiente", ultimo_error=error[:2000], disponible_en=disponible_en)
+        return self._cerrar(trabajo_id, worker, estado="fallido", ultimo_error=error[:2000])
+
+    def _cerrar(self, trabajo_id: int, worker: str, **valores) -> bool:
+        try:
+            with self.db_engine.connect() as connection:
+                result = connection.execute(
+                    update(trabajo_table)
+                    .where(trabajo_table.c.id == trabajo_id, trabajo_table.c.worker == worker, trabajo_table.c.estado == "en_proceso")
+                    .values(lease_hasta=None, **valores)
+                )
+                connection.commit()
+                if result.rowcount == 0:
+                    logger.warning(f"Worker {worker} lost the lease of job {trabajo_id}; result discarded.")
+                return result.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error closing job {trabajo_id}: {e}")
+            return False
+
+    def obtener(self, trabajo_id: int) -> Optional[Trabajo]:
+        try:
+            with self.db_engine.connect() as connection:
+                fila = connection.execute(select(trabajo_table).where(trabajo_table.c.id == trabajo_id)).first()
+                return self._a_trabajo(fila) if fila else None
+        except Exception as e:
+            logger.error(f"Error getting job {trabajo_id}: {e}")
+            return None
+
+    def hay_trabajo(self, tipos: list[str] | None = None) -> bool:
+        '''
+        Whether work may still become claimable: a pendiente job (of `tipos`), even if waiting for
+        its retry, or a job en_proceso of any type, which may fail and be retried or enqueue follow-ups.
+        '''
+        pendientes = trabajo_table.c.estado == "pendiente"
+        if tipos:
+            pendientes = and_(pendientes, trabajo_table.c.tipo.in_(tipos))
+        try:
+            with self.db_engine.connect() as connection:
+                return connection.execute(
+                    select(trabajo_table.c.id).where(or_(pendientes, trabajo_table.c.estado == "en_proceso")).limit(1)
+                ).first() is not None
+        except Exception as e:
+            logger.error(f"Error checking for pending jobs: {e}")
+            return True # Keep waiting rather than leave work behind
+
+    def estadisticas(self) -> dict:
+        '''Number of jobs per (tipo, estado), e.g. {"fetch-process": {"pendiente": 3, "completado": 10}}.'''
+        try:
+            with self.db_engine.connect() as connection:
+                filas = connection.execute(
+                    select(trabajo_table.c.tipo, trabajo_table.c.estado, func.count())
+                    .group_by(trabajo_table.c.tipo, trabajo_table.c.estado)
+                ).fetchall()
+        except Exception as e:
+            logger.error(f"Error getting job statistics: {e}")
+            return {}
+        conteo = {}
+        for tipo, estado, total in filas:
+            conteo.setdefault(tipo, {})[estado] = total
+        return conteo
+
+    def reintentar_fallidos(self, tipo: str | None = None) -> int:
+        '''Puts the fallido jobs (optionally of one type) back in the queue with their attempts reset.'''
+        stmt = update(trabajo_table).where(trabajo_table.c.estado == "fallido")
+        if tipo:
+            stmt = stmt.where(trabajo_table.c.tipo == tipo)
+        try:
+            with self.db_engine.connect() as connection:
+                result = connection.execute(stmt.values(estado="pendiente", intentos=0, disponible_en=datetime.utcnow(), worker=None))
+                connection.commit()
+                return result.rowcount
+        except Exception as e:
+            logger.error(f"Error retrying failed jobs: {e}")
+            return 0
+
+    @staticmethod
+    def _a_trabajo(fila) -> Trabajo:
+        datos = fila._asdict()
+        datos["payload"] = json.loads(datos["payload"]) if datos.get("payload") else {}
+        datos["resultado"] = json.loads(datos["resultado"]) if datos.get("resultado") else None
+        return Trabajo(**datos)
+
+BACKENDS = {"sql": BackendColaSQL}
+
+def obtener_backend(db_engine=None) -> BackendCola:
+    '''Returns the job queue backend selected by JOB_QUEUE_BACKEND (default "sql") on the application database.'''
+    nombre = os.getenv("JOB_QUEUE_BACKEND", "sql")
+    if nombre not in BACKENDS:
+        raise ValueError(f"Backend de cola desconocido: {nombre}. Disponibles: {list(BACKENDS)}")
+    if db_engine is None:
+        from app.db.database import engine as db_engine
+    return BACKENDS[nombre](db_engine)
@@ -0,0 +1,88 @@
+'''
+Data migrations: one-off backfills that bring existing rows up to date with a schema change.
+
+`create_db_and_tables` creates new tables and indexes; the migrations listed here fill them
+from the data already stored. Each one runs once per database and is recorded in the
+`migracion` table. Run them with `python -m app.db.migrations` or through create_db_and_tables.
+'''
+import logging
+from sqlalchemy import select
+from app.db.database import migracion_table
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 1000
+
+def _backfill_sujetos(db_engine) -> None:
+    # Parses the stored proceso.sujetos text (Python repr or "Rol: Nombre | ...") into the sujeto table
+    from app.db import crud
+    from app.services.sujetos import sujetos_de_proceso
+    ultimo_id, total = 0, 0
+    while True:
+        procesos = crud.get_procesos_after_id(db_engine, ultimo_id, TAMANO_LOTE)
+        if not procesos:
+            break
+        # One transaction per batch
+        guardados = crud.replace_sujetos_procesos(db_engine, {p.id: sujetos_de_proceso(p) for p in procesos})
+        if guardados < 0:
+            raise RuntimeError(f"No se pudieron guardar los sujetos de los procesos después del ID {ultimo_id}")
+        total += guardados
+        ultimo_id = procesos[-1].id
+    logger.info(f"Backfill de sujetos: {total} sujetos de procesos hasta el ID {ultimo_id}.")
+
+def _comprimir_textos_actuacion(db_engine) -> bool:
+    # Trains the zstd dictionary on the existing anotaciones (if there is none yet), rewrites
+    # anotacion/resumen_ia compressed and returns the freed pages to the file system
+    from app.db import compression
+    compression._cargar_diccionarios(forzar=True)
+    if not compression._diccionarios and compression.entrenar_diccionario(db_engine) is None:
+        return False # Not enough anotaciones yet: retried on the next run
+    total = compression.comprimir_existentes(db_engine)
+    logger.info(f"Textos de actuaciones comprimidos: {total} filas.")
+    if total:
+        with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+    return True
+
+# Applied in order; never rename an entry once it has shipped
+MIGRACIONES = [
+    ("0001_backfill_sujetos", _backfill_sujetos),
+    ("0002_comprimir_textos_actuacion", _comprimir_textos_actuacion),
+]
+
+def aplicar_migraciones(db_engine) -> list[str]:
+    '''
+    Applies the migrations not yet recorded in the database, in order.
+    A failing migration is logged and stops the run, so it is retried next time; a migration
+    returning False is postponed (not recorded) and the next ones still run.
+
+    Returns:
+        The names of the migrations applied.
+    '''
+    with db_engine.connect() as connection:
+        aplicadas = set(connection.execute(select(migracion_table.c.nombre)).scalars())
+    nuevas = []
+    for nombre, migracion in MIGRACIONES:
+        if nombre in aplicadas:
+            continue
+        logger.info(f"Aplicando migración {nombre}...")
+        try:
+            resultado = migracion(db_engine)
+        except Exception as e:
+            logger.error(f"Error applying migration {nombre}: {e}")
+            break
+        if resultado is False:
+            # The migration cannot run yet (e.g. not enough data); it is not recorded
+            logger.info(f"Migración {nombre} pospuesta.")
+            continue
+        with db_engine.connect() as connection:
+            connection.execute(migracion_table.insert().values(nombre=nombre))
+            connection.commit()
+        nuevas.append(nombre)
+    return nuevas
+
+if __name__ == "__main__":
+    from app.db.database import engine, metadata
+    metadata.create_all(bind=engine)
+    print(aplicar_migraciones(engine))
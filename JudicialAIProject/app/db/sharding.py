@@ -0,0 +1,307 @@
+'''
+Tenant-sharded storage: one SQLite database per client company.
+
+A small catalog database (data/catalogo.sqlite) lists the tenants and routes company names
+to them; each tenant has its own directory with its database and local indexes:
+
+    data/tenants/<clave>/judicial.sqlite
+    data/tenants/<clave>/vector_index_<embedder>/
+
+Every tenant database has the full schema (tables, aggregates, migrations), so the crud
+and service functions work unchanged on a tenant engine. Writes of different tenants never
+share a SQLite write lock: `ingerir_en_paralelo` ingests each tenant in its own process.
+Cross-tenant reads fan out over a thread pool (sqlite3 releases the GIL while a query runs)
+and are merged. A tenant can be exported as a single consistent file, or deleted.
+
+The default single database (app/db/database.py) keeps working for single-company setups;
+`python -m app.services.bulk_import cartera.csv --cliente "ACME S.A." --tenant` imports a
+client portfolio into its tenant.
+'''
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy import (Table, Column, Integer, String, DateTime, ForeignKey, MetaData, create_engine, event, select, delete)
+from app.db.database import DATA_DIR, create_db_and_tables
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CATALOGO_URL = f"sqlite:///{os.path.join(DATA_DIR, 'catalogo.sqlite')}"
+TENANTS_DIR = os.path.join(DATA_DIR, "tenants")
+ARCHIVO_TENANT = "judicial.sqlite"
+MAX_HILOS = 8 # Fan-out threads for cross-tenant reads
+
+catalogo_metadata = MetaData()
+
+# Table definition for Tenant (one database file per client company)
+tenant_table = Table(
+    "tenant",
+    catalogo_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("clave", String, unique=True, nullable=False), # Directory name, e.g. "bancolombia"
+    Column("nombre", String, nullable=False),
+    Column("fecha_creacion_db", DateTime, default=datetime.utcnow)
+)
+
+# Company names (normalized) routed to each tenant; a tenant may group several companies
+empresa_tenant_table = Table(
+    "empresa_tenant",
+    catalogo_metadata,
+    Column("nombre_normalizado", String, primary_key=True),
+    Column("tenant_id", Integer, ForeignKey("tenant.id"), nullable=False, index=True)
+)
+
+_catalogo = None
+_engines = {}
+_lock = threading.Lock()
+
+def _activar_wal(dbapi_connection, connection_record):
+    # WAL: readers (fan-out queries, the UI) do not block the tenant's writer
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def catalogo():
+    '''Returns the engine of the tenant catalog, creating its tables on first use.'''
+    global _catalogo
+    with _lock:
+        if _catalogo is None:
+            _catalogo = create_engine(CATALOGO_URL, connect_args={"check_same_thread": False})
+            catalogo_metadata.create_all(bind=_catalogo)
+        return _catalogo
+
+def _normalizar(nombre: str) -> str:
+    from app.services.sujetos import normalizar_nombre
+    return normalizar_nombre(nombre or "")
+
+def ruta_tenant(clave: str) -> str:
+    return os.path.join(TENANTS_DIR, clave)
+
+def abrir_engine(ruta_db: str):
+    '''Opens (and creates the schema of) a tenant database file. Engines are cached per path.'''
+    with _lock:
+        db_engine = _engines.get(ruta_db)
+        if db_engine is not None:
+            return db_engine
+        os.makedirs(os.path.dirname(ruta_db), exist_ok=True)
+        db_engine = create_engine(f"sqlite:///{ruta_db}", connect_args={"check_same_thread": False})
+        event.listen(db_engine, "connect", _activar_wal)
+        create_db_and_tables(db_engine)
+        _engines[ruta_db] = db_engine
+        return db_engine
+
+def engine_tenant(clave: str):
+    '''Returns the engine of a tenant by its clave.'''
+    return abrir_engine(os.path.join(ruta_tenant(clave), ARCHIVO_TENANT))
+
+def listar_tenants() -> list[dict]:
+    '''Returns the registered tenants (id, clave, nombre, fecha_creacion_db), by clave.'''
+    try:
+        with catalogo().connect() as connection:
+            return [row._asdict() for row in connection.execute(select(tenant_table).order_by(tenant_table.c.clave)).fetchall()]
+    except Exception as e:
+        logger.error(f"Error listing tenants: {e}")
+        return []
+
+def registrar_tenant(nombre: str, empresas: list[str] | None = None) -> str | None:
+    '''
+    Registers a tenant (or returns the existing one with the same clave) and routes companies to it.
+
+    Args:
+        nombre: Tenant name, usually the client company.
+        empresas: Optional. Company names routed to this tenant; `nombre` is always included.
+
+    Returns:
+        The tenant clave, or None if an error occurs.
+    '''
+    clave = _normalizar(nombre).lower().replace(" ", "_")
+    if not clave:
+        return None
+    try:
+        with catalogo().connect() as connection:
+            tenant_id = connection.execute(select(tenant_table.c.id).where(tenant_table.c.clave == clave)).scalar_one_or_none()
+            if tenant_id is None:
+                tenant_id = connection.execute(tenant_table.insert().values(clave=clave, nombre=nombre.strip())).inserted_primary_key[0]
+            for empresa in {_normalizar(e) for e in [nombre, *(empresas or [])]} - {""}:
+                connection.execute(delete(empresa_tenant_table).where(empresa_tenant_table.c.nombre_normalizado == empresa))
+                connection.execute(empresa_tenant_table.insert().values(nombre_normalizado=empresa, tenant_id=tenant_id))
+            connection.commit()
+    except Exception as e:
+        logger.error(f"Error registering tenant {nombre}: {e}")
+        return None
+    engine_tenant(clave) # Creates the database file and schema
+    return clave
+
+def tenant_de_empresa(nombre_empresa: str, crear: bool = True) -> str | None:
+    '''
+    Routes a company to its tenant.
+
+    Args:
+        nombre_empresa: Company name (nombre_busqueda), any spelling of accents or punctuation.
+        crear: Optional. Registers a new tenant for an unknown company (default True).
+
+    Returns:
+        The tenant clave, or None if the company is unknown and crear is False.
+    '''
+    nombre_normalizado = _normalizar(nombre_empresa)
+    with catalogo().connect() as connection:
+        clave = connection.execute(
+            select(tenant_table.c.clave)
+            .join(empresa_tenant_table, empresa_tenant_table.c.tenant_id == tenant_table.c.id)
+            .where(empresa_tenant_table.c.nombre_normalizado == nombre_normalizado)
+        ).scalar_one_or_none()
+    if clave is None and crear:
+        clave = registrar_tenant(nombre_empresa)
+    return clave
+
+def engine_para_empresa(nombre_empresa: str):
+    '''Returns the engine where the data of a company is stored (creating its tenant if needed).'''
+    clave = tenant_de_empresa(nombre_empresa)
+    if clave is None:
+        raise ValueError(f"No se pudo asignar un tenant a la empresa '{nombre_empresa}'")
+    return engine_tenant(clave)
+
+def consultar_todos(funcion, *args, claves: list[str] | None = None, max_hilos: int = MAX_HILOS, **kwargs) -> dict:
+    '''
+    Runs `funcion(engine, *args, **kwargs)` on every tenant (or on `claves`) in parallel.
+    Any crud reader works, e.g. consultar_todos(crud.count_actuaciones_por_urgencia), and so does
+    consultar_todos(retrieval.buscar_contexto, "consulta"): each tenant is searched in its own index.
+
+    Returns:
+        {clave: resultado}. A tenant that fails is logged and left out.
+    '''
+    claves = claves if claves is not None else [t["clave"] for t in listar_tenants()]
+    resultados = {}
+    if not claves:
+        return resultados
+    with ThreadPoolExecutor(max_workers=min(max_hilos, len(claves))) as executor:
+        futuros = {executor.submit(funcion, engine_tenant(clave), *args, **kwargs): clave for clave in claves}
+        for futuro in as_completed(futuros):
+            try:
+                resultados[futuros[futuro]] = futuro.result()
+            except Exception as e:
+                logger.error(f"Error querying tenant {futuros[futuro]}: {e}")
+    return resultados
+
+def fusionar_filas(resultados: dict, orden: str | None = None, descendente: bool = False, limite: int | None = None) -> list[dict]:
+    '''
+    Merges the row lists returned by `consultar_todos`, adding a "tenant" key to each row.
+    Pydantic models are converted to dicts.
+
+    Args:
+        orden: Optional. Key to sort the merged rows by (rows without it go last).
+        descendente: Optional. Sort order.
+        limite: Optional. Maximum number of rows after sorting.
+    '''
+    filas = []
+    for clave, lista in resultados.items():
+        for fila in lista or []:
+            fila = fila.model_dump() if hasattr(fila, "model_dump") else dict(fila)
+            fila["tenant"] = clave
+            filas.append(fila)
+    if orden:
+        con_valor = [f for f in filas if f.get(orden) is not None]
+        sin_valor = [f for f in filas if f.get(orden) is None]
+        filas = sorted(con_valor, key=lambda f: f[orden], reverse=descendente) + sin_valor
+    return filas[:limite] if limite is not None else filas
+
+def fusionar_conteos(resultados: dict) -> dict:
+    '''Adds up the {clave: cantidad} dicts returned by `consultar_todos` (e.g. counts per urgency).'''
+    total = {}
+    for conteo in resultados.values():
+        for clave, cantidad in (conteo or {}).items():
+            total[clave] = total.get(clave, 0) + cantidad
+    return total
+
+def _ingerir_tenant(ruta_directorio: str, nombre_empresa: str, ids_proceso: list[str]) -> int:
+    # Runs in a worker process: its own SQLite file, and so its own vector index directory
+    from app.services.ingestion import ingerir_procesos
+    db_engine = abrir_engine(os.path.join(ruta_directorio, ARCHIVO_TENANT))
+    metricas = ingerir_procesos(db_engine, ({"id_proceso": i, "nombre_busqueda": nombre_empresa} for i in ids_proceso), enriquecer=False)
+    persist = next(m for m in metricas if m["etapa"] == "persist")
+    return persist["recibidos"] - persist["errores"]
+
+def ingerir_en_paralelo(trabajos: dict[str, list[str]], max_procesos: int | None = None) -> dict[str, int]:
+    '''
+    Ingests the procesos of several companies, one worker process per tenant, so writes of
+    different tenants run on separate cores and never wait on each other's lock.
+
+    Args:
+        trabajos: {company name: [idProceso, ...]}. Companies are routed (and registered) here.
+        max_procesos: Optional. Worker processes (default: number of CPUs).
+
+    Returns:
+        {company name: number of procesos ingested}.
+    '''
+    if not trabajos:
+        return {}
+    rutas = {empresa: ruta_tenant(tenant_de_empresa(empresa)) for empresa in trabajos}
+    max_procesos = min(max_procesos or os.cpu_count() or 1, len(trabajos))
+    resultados = {}
+    # spawn: the parent may have live threads (enrichment queue, Streamlit) that fork would copy
+    with ProcessPoolExecutor(max_workers=max_procesos, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futuros = {executor.submit(_ingerir_tenant, rutas[empresa], empresa, ids): empresa for empresa, ids in trabajos.items()}
+        for futuro in as_completed(futuros):
+            empresa = futuros[futuro]
+            try:
+                resultados[empresa] = futuro.result()
+            except Exception as e:
+                logger.error(f"Error ingesting tenant of {empresa}: {e}")
+                resultados[empresa] = 0
+    return resultados
+
+def exportar_tenant(clave: str, destino: str) -> str:
+    '''
+    Writes a consistent copy of a tenant database to `destino` (SQLite online backup, safe
+    while the tenant is being written). Returns the destination path.
+    Compressed texts need the zstd dictionaries in data/zstd_dicts/ to be read elsewhere.
+    '''
+    db_engine = engine_tenant(clave)
+    os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+    origen = db_engine.raw_connection()
+    copia = sqlite3.connect(destino)
+    try:
+        origen.driver_connection.backup(copia)
+    finally:
+        copia.close()
+        origen.close()
+    logger.info(f"Tenant {clave} exportado a {destino}.")
+    return destino
+
+def eliminar_tenant(clave: str) -> bool:
+    '''Deletes a tenant: its catalog entries and its directory (database and indexes). Returns True if it existed.'''
+    try:
+        with catalogo().connect() as connection:
+            tenant_id = connection.execute(select(tenant_table.c.id).where(tenant_table.c.clave == clave)).scalar_one_or_none()
+            if tenant_id is None:
+                return False
+            connection.execute(delete(empresa_tenant_table).where(empresa_tenant_table.c.tenant_id == tenant_id))
+            connection.execute(delete(tenant_table).where(tenant_table.c.id == tenant_id))
+            connection.commit()
+    except Exception as e:
+        logger.error(f"Error deleting tenant {clave}: {e}")
+        return False
+    with _lock:
+        db_engine = _engines.pop(os.path.join(ruta_tenant(clave), ARCHIVO_TENANT), None)
+    if db_engine is not None:
+        db_engine.dispose()
+    shutil.rmtree(ruta_tenant(clave), ignore_errors=True)
+    logger.info(f"Tenant {clave} eliminado.")
+    return True
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) == 4 and sys.argv[1] == "--exportar":
+        print(exportar_tenant(sys.argv[2], sys.argv[3]))
+    elif len(sys.argv) == 3 and sys.argv[1] == "--eliminar":
+        print(eliminar_tenant(sys.argv[2]))
+    else:
+        for tenant in listar_tenants():
+            ruta = os.path.join(ruta_tenant(tenant["clave"]), ARCHIVO_TENANT)
+            print(f"{tenant['clave']}\t{tenant['nombre']}\t{os.path.getsize(ruta) if os.path.exists(ruta) else 0} bytes")
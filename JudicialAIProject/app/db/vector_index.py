@@ -0,0 +1,372 @@
+'''
+Local vector index persisted as memory-mapped NumPy arrays.
+
+Vectors and their metadata (company, process, urgency, date, source) live in flat
+`.bin` files under data/vector_index/, so opening the index is instant and the OS
+page cache does the rest. Search is brute force over the rows that pass the metadata
+filters, or IVF (k-means inverted lists, probing only the closest lists) once the index
+is large enough for it to pay off: it is trained automatically when it reaches MIN_FILAS_IVF
+rows and retrained each time it grows FACTOR_REENTRENAMIENTO times.
+
+Re-indexing a source appends a new row and deactivates the old one; when inactive rows pass
+FRACCION_INACTIVAS_COMPACTAR of the index, the active ones are moved down over them (compactar).
+Each row keeps a fingerprint of its source (`huella`), so callers can skip sources that did
+not change since they were indexed (huellas).
+
+Several processes (the Streamlit app, the Flask frontend, the API, the workers) may share
+one index. Writes take an exclusive lock on `indice.lock` and first reload `estado.json`,
+so each process appends after the rows the others wrote; searches hold a shared lock and
+reload the state whenever `estado.json` changed on disk. Threads of one process share an instance.
+
+    python -m app.services.retrieval --entrenar --compactar   # maintenance of the shared index
+'''
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+import numpy as np
+try:
+    import fcntl
+except ImportError: # Windows: only the in-process lock applies
+    fcntl = None
+from app.db.database import DATA_DIR
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_DIR = os.path.join(DATA_DIR, "vector_index")
+CAPACIDAD_INICIAL = 4096
+MIN_FILAS_IVF = 50_000 # Below this, brute force is already a few milliseconds
+FACTOR_REENTRENAMIENTO = 4 # Retrain IVF when the index grows this many times since the last training
+N_PROBE = 8 # IVF lists scanned per query
+FRACCION_INACTIVAS_COMPACTAR = 0.5 # Compact when more than this fraction of the rows are inactive
+MIN_FILAS_COMPACTAR = 4096 # Smaller indexes are not worth compacting
+FILAS_BLOQUE = 65_536 # Rows read at once when scoring, training or compacting
+FRACCION_DENSA = 0.25 # Above this fraction of candidate rows, score contiguous blocks instead of gathering rows
+
+URGENCIAS = {"ALTA": 3, "MEDIA": 2, "BAJA": 1}
+TIPOS_FUENTE = {"actuacion": 1, "documento_chunk": 2}
+
+# Metadata columns: name -> dtype. `lista` is the IVF list of the row (-1 until trained).
+COLUMNAS_META = {
+    "empresa": np.int32,
+    "proceso": np.int64,
+    "urgencia": np.int8,
+    "fecha": np.int32, # date.toordinal(), 0 when unknown
+    "tipo": np.int8,
+    "ref": np.int64, # Source reference: actuacion.id, or documento.id * 100000 + chunk indice
+    "activo": np.int8,
+    "lista": np.int32,
+    "huella": np.int64, # Fingerprint of the indexed text and metadata, 0 when unknown
+}
+
+def _ordinal(fecha) -> int:
+    if isinstance(fecha, datetime):
+        return fecha.date().toordinal()
+    if isinstance(fecha, date):
+        return fecha.toordinal()
+    if isinstance(fecha, str) and fecha:
+        try:
+            return datetime.fromisoformat(fecha[:10]).date().toordinal()
+        except ValueError:
+            return 0
+    return 0
+
+class IndiceVectorial:
+    def __init__(self, directorio: str, dim: int):
+        self.directorio = directorio
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._profundidad = 0 # Nesting of _bloqueo() in the thread holding self._lock
+        os.makedirs(directorio, exist_ok=True)
+        self._ruta_estado = os.path.join(directorio, "estado.json")
+        self._ruta_bloqueo = os.path.join(directorio, "indice.lock")
+        self.filas = 0
+        self.capacidad = 0
+        self.empresas = {} # nombre normalizado -> código
+        self.n_listas = 0
+        self.centroides = None
+        self.filas_entrenadas = 0 # Rows when IVF was last trained
+        self.generacion = 0 # Incremented by every compaction, which moves rows
+        self._claves = {} # (tipo, ref) -> fila of the active row, to replace rows when a source is re-indexed
+        self._version_estado = None # Identity of estado.json when it was last read or written
+        with self._bloqueo(exclusivo=False):
+            self._recargar_estado()
+
+    @contextmanager
+    def _bloqueo(self, exclusivo: bool = True):
+        # Thread lock plus, on the outermost level, a file lock shared with the other processes
+        with self._lock:
+            if self._profundidad or fcntl is None:
+                self._profundidad += 1
+                try:
+                    yield
+                finally:
+                    self._profundidad -= 1
+                return
+            with open(self._ruta_bloqueo, "a") as archivo:
+                fcntl.flock(archivo, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+                self._profundidad += 1
+                try:
+                    yield
+                finally:
+                    self._profundidad -= 1
+                    fcntl.flock(archivo, fcntl.LOCK_UN)
+
+    def _version_en_disco(self):
+        try:
+            info = os.stat(self._ruta_estado)
+        except FileNotFoundError:
+            return None
+        return (info.st_ino, info.st_mtime_ns, info.st_size) # Every write replaces the file: a new inode
+
+    def _recargar_estado(self) -> None:
+        # Called with the lock held: adopts the rows, companies and IVF lists written by other processes
+        version = self._version_en_disco()
+        if version is not None and version == self._version_estado:
+            return
+        if version is not None:
+            with open(self._ruta_estado, encoding="utf-8") as f:
+                estado = json.load(f)
+            if estado["dim"] != self.dim:
+                raise ValueError(f"El índice en {self.directorio} tiene dimensión {estado['dim']}, no {self.dim}.")
+        else:
+            estado = {"dim": self.dim, "filas": 0, "capacidad": 0, "empresas": {}, "n_listas": 0}
+        if estado.get("generacion", 0) != self.generacion:
+            # Another process compacted the index: row numbers changed, rebuild the keys
+            self._claves, self.filas, self.generacion = {}, 0, estado.get("generacion", 0)
+        capacidad = max(estado["capacidad"], CAPACIDAD_INICIAL)
+        if capacidad != self.capacidad:
+            self._abrir(capacidad)
+        if estado["n_listas"] != self.n_listas or (estado["n_listas"] and self.centroides is None):
+            ruta_centroides = os.path.join(self.directorio, "centroides.npy")
+            self.centroides = np.load(ruta_centroides) if estado["n_listas"] and os.path.exists(ruta_centroides) else None
+        self.empresas = estado["empresas"]
+        self.n_listas = estado["n_listas"]
+        self.filas_entrenadas = estado.get("filas_entrenadas", 0)
+        # Only the rows appended since the last reload need to be added to the keys
+        desde = min(self.filas, estado["filas"])
+        self.filas = estado["filas"]
+        activos = desde + np.flatnonzero(self._meta["activo"][desde:self.filas])
+        self._claves.update(zip(zip(self._meta["tipo"][activos].tolist(), self._meta["ref"][activos].tolist()), activos.tolist()))
+        self._version_estado = version
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.directorio, f"{nombre}.bin")
+
+    def _memmap(self, nombre: str, dtype, forma) -> np.memmap:
+        ruta = self._ruta(nombre)
+        tamano = int(np.prod(forma)) * np.dtype(dtype).itemsize
+        if not os.path.exists(ruta) or os.path.getsize(ruta) < tamano:
+            with open(ruta, "ab") as f:
+                f.truncate(tamano) # Grows the file with zeros, keeping existing rows
+        return np.memmap(ruta, dtype=dtype, mode="r+", shape=forma)
+
+    def _abrir(self, capacidad: int) -> None:
+        self.capacidad = capacidad
+        self._vectores = self._memmap("vectores", np.float32, (capacidad, self.dim))
+        self._meta = {nombre: self._memmap(nombre, dtype, (capacidad,)) for nombre, dtype in COLUMNAS_META.items()}
+
+    def _guardar_estado(self) -> None:
+        for arreglo in [self._vectores, *self._meta.values()]:
+            arreglo.flush()
+        temporal = self._ruta_estado + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "filas": self.filas, "capacidad": self.capacidad, "empresas": self.empresas,
+                       "n_listas": self.n_listas, "filas_entrenadas": self.filas_entrenadas, "generacion": self.generacion}, f)
+        os.replace(temporal, self._ruta_estado)
+        self._version_estado = self._version_en_disco()
+
+    def codigo_empresa(self, empresa: str | None, crear: bool = False) -> int:
+        clave = (empresa or "").strip().upper()
+        if not clave:
+            return 0
+        if clave not in self.empresas and crear:
+            self.empresas[clave] = len(self.empresas) + 1
+        return self.empresas.get(clave, -1)
+
+    def agregar(self, vectores: np.ndarray, metadatos: list[dict]) -> None:
+        '''
+        Adds (or replaces, by tipo/ref) vectors with their metadata.
+
+        Each metadata dict has: tipo ("actuacion" | "documento_chunk"), ref (source DB ID) and
+        optionally empresa, proceso_db_id, urgencia, fecha and huella (see huellas()).
+        Trains IVF or compacts the index when it is due.
+        '''
+        if len(vectores) == 0:
+            return
+        with self._bloqueo():
+            self._recargar_estado()
+            necesarias = self.filas + len(vectores)
+            if necesarias > self.capacidad:
+                capacidad = self.capacidad
+                while capacidad < necesarias:
+                    capacidad *= 2
+                for arreglo in [self._vectores, *self._meta.values()]:
+                    arreglo.flush()
+                self._abrir(capacidad)
+
+            inicio, fin = self.filas, self.filas + len(vectores)
+            self._vectores[inicio:fin] = vectores.astype(np.float32)
+            for i, meta in enumerate(metadatos):
+                fila = inicio + i
+                clave = (TIPOS_FUENTE[meta["tipo"]], int(meta["ref"]))
+                anterior = self._claves.get(clave)
+                if anterior is not None:
+                    self._meta["activo"][anterior] = 0
+                self._claves[clave] = fila
+                self._meta["empresa"][fila] = self.codigo_empresa(meta.get("empresa"), crear=True)
+                self._meta["proceso"][fila] = meta.get("proceso_db_id") or 0
+                self._meta["urgencia"][fila] = URGENCIAS.get((meta.get("urgencia") or "").upper(), 0)
+                self._meta["fecha"][fila] = _ordinal(meta.get("fecha"))
+                self._meta["tipo"][fila] = clave[0]
+                self._meta["ref"][fila] = clave[1]
+                self._meta["activo"][fila] = 1
+                self._meta["huella"][fila] = meta.get("huella") or 0
+            self._meta["lista"][inicio:fin] = self._asignar_listas(vectores) if self.centroides is not None else -1
+            self.filas = fin
+            self._guardar_estado()
+            if self.filas >= MIN_FILAS_COMPACTAR and self.filas - len(self._claves) > FRACCION_INACTIVAS_COMPACTAR * self.filas:
+                self.compactar()
+            if self.filas >= MIN_FILAS_IVF and (self.centroides is None or self.filas >= FACTOR_REENTRENAMIENTO * self.filas_entrenadas):
+                self.entrenar_ivf()
+
+    def huellas(self, tipo: str, refs: list[int]) -> list[int | None]:
+        '''Returns the fingerprint stored with each source when it was indexed, or None if it is not indexed.'''
+        with self._bloqueo(exclusivo=False):
+            self._recargar_estado()
+            filas = [self._claves.get((TIPOS_FUENTE[tipo], int(ref))) for ref in refs]
+            return [None if fila is None else int(self._meta["huella"][fila]) for fila in filas]
+
+    def compactar(self) -> int:
+        '''Drops the inactive rows, moving the active ones down in place. Returns how many rows were dropped.'''
+        with self._bloqueo():
+            self._recargar_estado()
+            activos = np.flatnonzero(self._meta["activo"][:self.filas])
+            descartadas = self.filas - len(activos)
+            if descartadas == 0:
+                return 0
+            # Every row moves to a lower (or the same) position, so blocks copied in order never overwrite rows still to be read
+            for inicio in range(0, len(activos), FILAS_BLOQUE):
+                origen = activos[inicio:inicio + FILAS_BLOQUE]
+                fin = inicio + len(origen)
+                self._vectores[inicio:fin] = self._vectores[origen]
+                for arreglo in self._meta.values():
+                    arreglo[inicio:fin] = arreglo[origen]
+            self.filas = len(activos)
+            self.generacion += 1
+            claves = zip(self._meta["tipo"][:self.filas].tolist(), self._meta["ref"][:self.filas].tolist())
+            self._claves = {clave: fila for fila, clave in enumerate(claves)}
+            self._guardar_estado()
+            logging.info(f"Índice vectorial compactado: {descartadas} filas inactivas descartadas, {self.filas} activas.")
+            return descartadas
+
+    def _asignar_listas(self, vectores: np.ndarray) -> np.ndarray:
+        return np.argmax(vectores @ self.centroides.T, axis=1).astype(np.int32)
+
+    def entrenar_ivf(self, n_listas: int | None = None, iteraciones: int = 10, muestra: int = 100_000, semilla: int = 0) -> None:
+        '''Trains IVF centroids with spherical k-means on a sample and assigns every row to a list.'''
+        with self._bloqueo():
+            self._recargar_estado()
+            if self.filas == 0:
+                return
+            n_listas = n_listas or max(1, int(np.sqrt(self.filas)))
+            rng = np.random.default_rng(semilla)
+            indices = rng.choice(self.filas, size=min(muestra, self.filas), replace=False)
+            datos = np.asarray(self._vectores[np.sort(indices)])
+            centroides = datos[rng.choice(len(datos), size=min(n_listas, len(datos)), replace=False)].copy()
+            for _ in range(iteraciones):
+                asignacion = np.argmax(datos @ centroides.T, axis=1)
+                for j in range(len(centroides)):
+                    miembros = datos[asignacion == j]
+                    if len(miembros):
+                        centroide = miembros.mean(axis=0)
+                        centroides[j] = centroide / (np.linalg.norm(centroide) or 1.0)
+            self.centroides = centroides.astype(np.float32)
+            np.save(os.path.join(self.directorio, "centroides.npy"), self.centroides)
+            self.n_listas = len(self.centroides)
+            # Assign in blocks so the whole matrix is never loaded at once
+            for inicio in range(0, self.filas, FILAS_BLOQUE):
+                fin = min(inicio + FILAS_BLOQUE, self.filas)
+                self._meta["lista"][inicio:fin] = self._asignar_listas(np.asarray(self._vectores[inicio:fin]))
+            self.filas_entrenadas = self.filas
+            self._guardar_estado()
+            logging.info(f"Índice IVF entrenado con {self.n_listas} listas sobre {self.filas} vectores.")
+
+    def buscar(
+        self,
+        consulta: np.ndarray,
+        k: int = 10,
+        empresa: str | None = None,
+        proceso_db_id: int | None = None,
+        urgencias: list[str] | None = None,
+        fecha_desde=None,
+        fecha_hasta=None,
+        tipo: str | None = None,
+        n_probe: int = N_PROBE,
+    ) -> list[dict]:
+        '''
+        Returns the top-k rows by cosine similarity that pass the metadata filters.
+
+        Each result is a dict with puntaje, tipo, ref, proceso_db_id, urgencia and fecha.
+        '''
+        # Shared lock for the whole search: a compaction in another process moves rows
+        with self._bloqueo(exclusivo=False):
+            self._recargar_estado()
+            n = self.filas
+            if n == 0:
+                return []
+            meta = {nombre: arreglo[:n] for nombre, arreglo in self._meta.items()}
+            mascara = meta["activo"] == 1
+            if empresa:
+                mascara &= meta["empresa"] == self.codigo_empresa(empresa)
+            if proceso_db_id is not None:
+                mascara &= meta["proceso"] == proceso_db_id
+            if urgencias:
+                mascara &= np.isin(meta["urgencia"], [URGENCIAS.get(u.upper(), -1) for u in urgencias])
+            if fecha_desde:
+                mascara &= meta["fecha"] >= _ordinal(fecha_desde)
+            if fecha_hasta:
+                mascara &= meta["fecha"] <= _ordinal(fecha_hasta)
+            if tipo:
+                mascara &= meta["tipo"] == TIPOS_FUENTE[tipo]
+
+            consulta = consulta.astype(np.float32).reshape(-1)
+            if self.centroides is not None and n >= MIN_FILAS_IVF:
+                listas = np.argsort(self.centroides @ consulta)[::-1][:n_probe]
+                mascara_ivf = mascara & np.isin(meta["lista"], listas)
+                # Fall back to brute force when the filters leave too few rows in the probed lists
+                if np.count_nonzero(mascara_ivf) >= k:
+                    mascara = mascara_ivf
+
+            candidatos = np.flatnonzero(mascara)
+            if len(candidatos) == 0:
+                return []
+            if len(candidatos) >= FRACCION_DENSA * n:
+                # Most rows pass: scoring contiguous blocks of the memmap avoids copying the candidate vectors
+                todos = np.empty(n, dtype=np.float32)
+                for inicio in range(0, n, FILAS_BLOQUE):
+                    todos[inicio:inicio + FILAS_BLOQUE] = self._vectores[inicio:min(inicio + FILAS_BLOQUE, n)] @ consulta
+                puntajes = todos[candidatos]
+            else:
+                puntajes = self._vectores[candidatos] @ consulta
+            k = min(k, len(candidatos))
+            mejores = np.argpartition(-puntajes, k - 1)[:k]
+            mejores = mejores[np.argsort(-puntajes[mejores])]
+
+            inverso_urgencia = {v: u for u, v in URGENCIAS.items()}
+            inverso_tipo = {v: t for t, v in TIPOS_FUENTE.items()}
+            resultados = []
+            for posicion in mejores:
+                fila = candidatos[posicion]
+                resultados.append({
+                    "puntaje": float(puntajes[posicion]),
+                    "tipo": inverso_tipo.get(int(meta["tipo"][fila])),
+                    "ref": int(meta["ref"][fila]),
+                    "proceso_db_id": int(meta["proceso"][fila]) or None,
+                    "urgencia": inverso_urgencia.get(int(meta["urgencia"][fila])),
+                    "fecha": date.fromordinal(int(meta["fecha"][fila])) if meta["fecha"][fila] else None,
+                })
+            return resultados
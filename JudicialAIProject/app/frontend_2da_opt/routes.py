@@ -1,15 +1,147 @@
-from flask import Blueprint, render_template, request, redirect, url_for
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, render_template, request, redirect, url_for, Response, stream_with_context, make_response
 from app.clients.rama_judicial_client import (
 
     consultar_procesos_por_nombre,
     consultar_detalle_proceso,
-    consultar_actuaciones_proceso
+    consultar_todas_las_paginas
 )
+from app.clients.cache_respuestas import cache_api
+from app.services.ai_services import generar_resumen_actuacion_stream, acumular_stream
+from app.services.event_extraction import obtener_calendario
+from app.services.ingestion import ingerir_proceso, extraer_detalle, consultar_actuaciones_completas
+from app.services.notificaciones import Filtro, formato_sse, obtener_notificador
+from app.services.sujetos import parsear_sujetos, nombres_por_rol, ROL_DEMANDANTE, ROL_DEMANDADO
+from app.db.database import engine
+from app.db import crud
 
 
 
 main_bp = Blueprint('main', __name__)
 
+PROCESOS_POR_PAGINA = 50
+ACTUACIONES_POR_PAGINA = 50
+URGENCIAS = ['ALTA', 'MEDIA', 'BAJA', 'SIN CLASIFICAR']
+LARGO_ANOTACION = 120
+MAX_PAGINAS_API = 20 # Result pages read from the API per search or per proceso
+TTL_PROCESO_S = 3600 # A stored proceso older than this is fetched again in the background when viewed
+HILOS_API = 4 # Concurrent API requests
+MAX_DIAS_CALENDARIO = 366 # Horizon limit of the .ics feed
+LATIDO_SSE_S = 15.0 # Comment sent on idle notification streams; also how soon a closed tab frees its thread
+VERSION = str(time.time_ns()) # Part of every ETag: a restart (possibly with new templates) invalidates them
+
+# Reads the missing pieces of a view concurrently; storing them runs on its own pool so that
+# a store waiting for its fetches never holds a thread the fetches need
+_consultas = ThreadPoolExecutor(max_workers=HILOS_API, thread_name_prefix="flask-api")
+_almacenamiento = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flask-almacenamiento")
+_almacenando = set()
+_almacenando_lock = threading.Lock()
+_refrescos = {} # idProceso -> time.monotonic() of its last background refresh, so a failing API is not retried on every view
+
+def _utc(fecha: datetime | None) -> datetime | None:
+    # The DB stores naive UTC datetimes
+    return fecha.replace(tzinfo=timezone.utc) if fecha and fecha.tzinfo is None else fecha
+
+def _etag(*partes) -> str:
+    # The query string is part of the validator: every page / filter / selection is its own representation
+    contenido = "|".join([VERSION, request.full_path] + [str(p) for p in partes])
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+def _respuesta_condicional(etag: str, ultima_modificacion: datetime | None, generar):
+    '''
+    Answers 304 Not Modified when the client's copy is current, rendering the page only otherwise.
+    The validators come from cheap metadata (DB timestamps, cache fetch times), so a repeat view
+    costs a couple of indexed queries and no template rendering.
+    '''
+    ultima_modificacion = _utc(ultima_modificacion)
+    if ultima_modificacion:
+        ultima_modificacion = ultima_modificacion.replace(microsecond=0) # HTTP dates have second precision
+    if request.if_none_match:
+        vigente = request.if_none_match.contains(etag)
+    else:
+        vigente = bool(ultima_modificacion and request.if_modified_since and ultima_modificacion <= request.if_modified_since)
+    respuesta = Response(status=304) if vigente else make_response(generar())
+    respuesta.set_etag(etag)
+    if ultima_modificacion:
+        respuesta.last_modified = ultima_modificacion
+    # Browsers and proxies may keep the page but must revalidate it on every view
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+def _buscar_api(nombre, tipo_persona, solo_activos, codificacion_despacho):
+    # Every result page, fetched concurrently after the first one
+    return cache_api.obtener(
+        ("procesos_nombre", nombre, tipo_persona, solo_activos, codificacion_despacho),
+        lambda: consultar_todas_las_paginas(
+            lambda p: consultar_procesos_por_nombre(nombre, tipo_persona=tipo_persona, solo_activos=solo_activos,
+                                                    codificacion_despacho=codificacion_despacho, pagina=p),
+            MAX_PAGINAS_API, hilos=HILOS_API
+        )
+    )
+
+def _detalle_api(id_proceso):
+    return cache_api.obtener(("detalle", id_proceso), lambda: extraer_detalle(consultar_detalle_proceso(id_proceso)))
+
+def _actuaciones_api(id_proceso):
+    return cache_api.obtener(("actuaciones", id_proceso), lambda: consultar_actuaciones_completas(id_proceso, MAX_PAGINAS_API, hilos=HILOS_API))
+
+def _almacenar(id_proceso, futuro_detalle, futuro_actuaciones, refrescar=False):
+    # Read-through: once both pieces are in, the proceso is stored so the next view is served from the DB
+    # (or, when refreshing, the stored copy is updated: the upserts keep the AI fields)
+    try:
+        detalle, _ = futuro_detalle.result()
+        actuaciones, _ = futuro_actuaciones.result()
+        if detalle and actuaciones is not None and (refrescar or not crud.get_proceso_by_idrama(engine, id_proceso)):
+            ingerir_proceso(engine, id_proceso, respuesta_detalle=detalle, respuesta_actuaciones=actuaciones)
+    except Exception as e:
+        logging.error(f"Error al almacenar el proceso {id_proceso}: {e}")
+    finally:
+        with _almacenando_lock:
+            _almacenando.discard(id_proceso)
+
+def _consultar_proceso_api(id_proceso):
+    '''
+    Fetches the detail and the actuaciones of a proceso not stored yet, concurrently and through
+    the response cache, and stores them in the background. Returns the two futures,
+    each resolving to (valor, obtenida_en).
+    '''
+    futuro_detalle = _consultas.submit(_detalle_api, id_proceso)
+    futuro_actuaciones = _consultas.submit(_actuaciones_api, id_proceso)
+    with _almacenando_lock:
+        nuevo = id_proceso not in _almacenando
+        _almacenando.add(id_proceso)
+    if nuevo:
+        _almacenamiento.submit(_almacenar, id_proceso, futuro_detalle, futuro_actuaciones)
+    return futuro_detalle, futuro_actuaciones
+
+def _refrescar_si_vencido(proceso_db):
+    '''
+    Stored procesos are served from the DB; once their copy is older than TTL_PROCESO_S the
+    detail and actuaciones are fetched again and stored in the background, so the view that
+    notices it is not delayed and the next one shows the new actuaciones.
+    '''
+    actualizado = proceso_db.fecha_actualizacion_db
+    if actualizado and datetime.utcnow() - actualizado < timedelta(seconds=TTL_PROCESO_S):
+        return
+    id_proceso = proceso_db.idProceso
+    with _almacenando_lock:
+        ultimo = _refrescos.get(id_proceso)
+        if id_proceso in _almacenando or (ultimo and time.monotonic() - ultimo < TTL_PROCESO_S):
+            return
+        _almacenando.add(id_proceso)
+        ahora = time.monotonic()
+        for vencido in [i for i, t in _refrescos.items() if ahora - t >= TTL_PROCESO_S]:
+            del _refrescos[vencido] # Their throttle has lapsed anyway; keeps the dict to the last hour's refreshes
+        _refrescos[id_proceso] = ahora
+    futuro_detalle = _consultas.submit(_detalle_api, id_proceso)
+    futuro_actuaciones = _consultas.submit(_actuaciones_api, id_proceso)
+    _almacenamiento.submit(_almacenar, id_proceso, futuro_detalle, futuro_actuaciones, True)
+
 @main_bp.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -32,50 +164,172 @@ def procesos():
     tipo_persona = request.args.get('tipo_persona', 'jur')
     solo_activos = request.args.get('solo_activos', 'True') == 'True'
     codificacion_despacho = request.args.get('codificacion_despacho') or None
-    pagina = int(request.args.get('pagina', 1))
-
-    data = consultar_procesos_por_nombre(
-        nombre,
-        tipo_persona=tipo_persona,
-        solo_activos=solo_activos,
-        codificacion_despacho=codificacion_despacho,
-        pagina=pagina
-    )
+    pagina = max(int(request.args.get('pagina', 1)), 1)
+    parametros = {'nombre': nombre, 'tipo_persona': tipo_persona, 'solo_activos': solo_activos,
+                  'codificacion_despacho': codificacion_despacho}
 
-    procesos = []
-    if data and "procesos" in data:
-        for p in data["procesos"]:
-            sujetos = p.get("sujetosProcesales", "")
-            demandante = "-"
-            demandado = "-"
+    # All the API result pages are read (and cached) once; this route paginates them locally
+    todos, obtenidos_en = _buscar_api(nombre, tipo_persona, solo_activos, codificacion_despacho)
+    if todos is None:
+        return render_template('procesos.html', nombre=nombre, procesos=[], error=True, parametros=parametros,
+                               pagina=1, paginas=1, total=0)
+    paginas = max(1, -(-len(todos) // PROCESOS_POR_PAGINA))
 
-            partes = sujetos.split("|")
-            for parte in partes:
-                if "demandante" in parte.lower():
-                    demandante = parte.split(":")[1].strip()
-                elif "demandado" in parte.lower():
-                    demandado = parte.split(":")[1].strip()
-            p["demandante"] = demandante
-            p["demandado"] = demandado
-            procesos.append(p)
+    def generar():
+        procesos = []
+        for p in todos[(pagina - 1) * PROCESOS_POR_PAGINA:pagina * PROCESOS_POR_PAGINA]:
+            sujetos = parsear_sujetos(p.get("sujetosProcesales", ""))
+            # Cached results are shared: decorate a copy
+            procesos.append({**p, "demandante": ", ".join(nombres_por_rol(sujetos, ROL_DEMANDANTE)) or "-",
+                             "demandado": ", ".join(nombres_por_rol(sujetos, ROL_DEMANDADO)) or "-"})
+        return render_template('procesos.html', nombre=nombre, procesos=procesos, parametros=parametros,
+                               pagina=pagina, paginas=paginas, total=len(todos), completo=todos.completo)
 
-    return render_template('procesos.html', nombre=nombre, procesos=procesos)
+    return _respuesta_condicional(_etag(len(todos), todos.completo, obtenidos_en), obtenidos_en, generar)
 
 
 
 @main_bp.route('/detalle/<id_proceso>')
 def detalle(id_proceso):
-    detalles = consultar_detalle_proceso(id_proceso)
-    return render_template('detalle.html', detalles=detalles)
+    proceso_db = crud.get_proceso_by_idrama(engine, id_proceso)
+    if proceso_db:
+        _refrescar_si_vencido(proceso_db)
+        return _respuesta_condicional(_etag(proceso_db.id, proceso_db.fecha_actualizacion_db), proceso_db.fecha_actualizacion_db,
+                                      lambda: render_template('detalle.html', detalles=proceso_db))
+    # The actuaciones are fetched along with the detail: they are likely the next view
+    futuro_detalle, _ = _consultar_proceso_api(id_proceso)
+    detalles, obtenido_en = futuro_detalle.result()
+    if not detalles:
+        return render_template('detalle.html', detalles={'idProceso': id_proceso}), 502
+    return _respuesta_condicional(_etag(obtenido_en), obtenido_en, lambda: render_template('detalle.html', detalles=detalles))
+
+def _pagina_actuaciones_api(lista, pagina, urgencias=None, tipo=None, desde=None, hasta=None):
+    # Processes not stored yet: the API returns every actuación at once, so filters and the page
+    # slice are applied here and only the page is rendered. They have no urgency yet.
+    filtradas = [
+        a for a in lista
+        if (not urgencias or 'SIN CLASIFICAR' in urgencias)
+        and (not tipo or a.get('actuacion') == tipo)
+        and (not desde or (a.get('fechaActuacion') or '')[:10] >= desde)
+        and (not hasta or (a.get('fechaActuacion') or '')[:10] <= hasta)
+    ]
+    inicio = (pagina - 1) * ACTUACIONES_POR_PAGINA
+    filas = [{
+        'id': None,
+        'idRegActuacion': a.get('idRegActuacion'),
+        'fechaActuacion': a.get('fechaActuacion'),
+        'actuacion': a.get('actuacion'),
+        'anotacion': (a.get('anotacion') or '')[:LARGO_ANOTACION],
+        'anotacion_truncada': len(a.get('anotacion') or '') > LARGO_ANOTACION,
+        'clasificacion_urgencia_ia': None,
+        'con_resumen_ia': False,
+        'conDocumentos': a.get('conDocumentos'),
+    } for a in filtradas[inicio:inicio + ACTUACIONES_POR_PAGINA]]
+    return {'actuaciones': filas, 'total': len(filtradas), 'pagina': pagina, 'por_pagina': ACTUACIONES_POR_PAGINA}
 
 @main_bp.route('/actuaciones/<id_proceso>')
 def actuaciones(id_proceso):
-    detalles = consultar_detalle_proceso(id_proceso)
-    data = consultar_actuaciones_proceso(id_proceso)
-    if isinstance(data, list):
-        actuaciones = data
-    elif isinstance(data, dict) and 'actuaciones' in data:
-        actuaciones = data['actuaciones']
+    # Paginated table with filters; the full actuación is rendered only for the selected row (?seleccion=idRegActuacion)
+    pagina = max(int(request.args.get('pagina', 1)), 1)
+    filtros = {
+        'urgencia': [u for u in request.args.getlist('urgencia') if u in URGENCIAS],
+        'tipo': request.args.get('tipo') or None,
+        'desde': request.args.get('desde') or None,
+        'hasta': request.args.get('hasta') or None,
+    }
+    seleccion = request.args.get('seleccion')
+
+    def generar(detalles, tipos, resultado, seleccionada):
+        paginas = max(1, -(-resultado['total'] // ACTUACIONES_POR_PAGINA))
+        return render_template('actuaciones.html', detalles=detalles, id_proceso=id_proceso, actuaciones=resultado['actuaciones'],
+                               total=resultado['total'], pagina=pagina, paginas=paginas, filtros=filtros, tipos=tipos,
+                               urgencias=URGENCIAS, seleccion=seleccion, seleccionada=seleccionada)
+
+    proceso_db = crud.get_proceso_by_idrama(engine, id_proceso)
+    if proceso_db:
+        _refrescar_si_vencido(proceso_db)
+        # Stored processes are paginated in SQL, so the cost does not grow with their size;
+        # the validators change whenever the proceso or any of its actuaciones is written
+        total, ultima_actuacion = crud.get_version_actuaciones(engine, proceso_db.id)
+        ultima = max(filter(None, (proceso_db.fecha_actualizacion_db, ultima_actuacion)), default=None)
+
+        def generar_db():
+            tipos = [t for t in crud.get_tipos_actuacion(engine, proceso_db.id) if t]
+            resultado = crud.get_actuaciones_pagina(engine, proceso_db.id, pagina, ACTUACIONES_POR_PAGINA,
+                                                    urgencias=filtros['urgencia'] or None, tipo=filtros['tipo'],
+                                                    desde=filtros['desde'], hasta=filtros['hasta'])
+            seleccionada = crud.get_actuacion_by_idreg(engine, seleccion) if seleccion else None
+            return generar(proceso_db, tipos, resultado, seleccionada)
+
+        return _respuesta_condicional(_etag(proceso_db.id, total, ultima), ultima, generar_db)
+
+    futuro_detalle, futuro_actuaciones = _consultar_proceso_api(id_proceso)
+    (detalles, detalle_en), (lista, actuaciones_en) = futuro_detalle.result(), futuro_actuaciones.result()
+    if lista is None:
+        return generar(detalles or {'idProceso': id_proceso}, [], _pagina_actuaciones_api([], 1), None), 502
+    ultima = max(filter(None, (detalle_en, actuaciones_en)), default=None)
+
+    def generar_api():
+        tipos = sorted({a.get('actuacion') for a in lista if a.get('actuacion')})
+        resultado = _pagina_actuaciones_api(lista, pagina, filtros['urgencia'], filtros['tipo'], filtros['desde'], filtros['hasta'])
+        seleccionada = next((a for a in lista if seleccion and str(a.get('idRegActuacion')) == seleccion), None)
+        return generar(detalles or {'idProceso': id_proceso}, tipos, resultado, seleccionada)
+
+    return _respuesta_condicional(_etag(detalle_en, actuaciones_en), ultima, generar_api)
+
+@main_bp.route('/actuaciones/<id_proceso>/resumen/<id_reg_actuacion>')
+def resumen_actuacion_stream(id_proceso, id_reg_actuacion):
+    # Prefer the local copy of the actuación; fall back to the (cached) API response for processes not stored yet
+    actuacion_db = crud.get_actuacion_by_idreg(engine, id_reg_actuacion)
+    if actuacion_db:
+        anotacion = actuacion_db.anotacion
     else:
-        actuaciones = []
-    return render_template('actuaciones.html', detalles=detalles, actuaciones=actuaciones)
+        lista, _ = _actuaciones_api(id_proceso)
+        anotacion = next((a.get('anotacion') for a in lista or [] if str(a.get('idRegActuacion')) == str(id_reg_actuacion)), None)
+    if not anotacion:
+        return Response("Actuación no encontrada.", status=404, mimetype='text/plain')
+
+    tokens = generar_resumen_actuacion_stream(anotacion)
+    if actuacion_db:
+        tokens = acumular_stream(tokens, lambda texto: crud.update_actuacion_ia(engine, actuacion_db.id, resumen_ia=texto))
+    # X-Accel-Buffering disables proxy buffering so tokens reach the browser as they are produced
+    return Response(stream_with_context(tokens), mimetype='text/plain; charset=utf-8',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
+
+@main_bp.route('/calendario.ics')
+def calendario():
+    # iCalendar feed of the upcoming terms, hearings and deadlines; calendar apps can subscribe to this URL
+    empresa = request.args.get('empresa') or None
+    dias = min(max(request.args.get('dias', 90, type=int), 1), MAX_DIAS_CALENDARIO)
+    tipos = request.args.getlist('tipo') or None
+    contenido = obtener_calendario(engine, dias=dias, empresa=empresa, tipos=tipos)
+    respuesta = Response(contenido, mimetype='text/calendar; charset=utf-8',
+                         headers={'Content-Disposition': 'inline; filename="agenda_judicial.ics"'})
+    # Subscribed calendar apps poll this URL: an unchanged feed is answered with 304
+    respuesta.add_etag()
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
+@main_bp.route('/notificaciones')
+def notificaciones_stream():
+    # Server-Sent Events of new and classified actuaciones, pushed from the shared notifier
+    # (no query per client); EventSource resumes with Last-Event-ID after a reconnection, and
+    # a new EventSource (the page closes it while hidden) with ?ultimo_id=
+    ultimo = request.headers.get('Last-Event-ID', '')
+    notificador = obtener_notificador(engine)
+    suscripcion = notificador.suscribir(
+        Filtro(request.args.getlist('empresa'), request.args.getlist('id_proceso'), request.args.getlist('urgencia')),
+        int(ultimo) if ultimo.isdigit() else request.args.get('ultimo_id', type=int)
+    )
+
+    def eventos():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                notificaciones = suscripcion.recibir(LATIDO_SSE_S)
+                yield "".join(formato_sse(n) for n in notificaciones) if notificaciones else ": latido\n\n"
+        finally:
+            notificador.cancelar(suscripcion)
+
+    return Response(stream_with_context(eventos()), mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
@@ -50,6 +50,8 @@ class Proceso(BaseModel):
 
     # Metadata for our system
     nombre_busqueda: Optional[str] = None # The name/NIT used to find this process
+    huella_busqueda: Optional[str] = None # Fingerprint of the search result (see app/services/change_detection.py)
+    huella_detalle: Optional[str] = None # Fingerprint of the detail fields
     fecha_consulta_api: datetime = Field(default_factory=datetime.utcnow)
     
     # Timestamps for local record
@@ -63,6 +65,152 @@ class Proceso(BaseModel):
         orm_mode = True
         anystr_strip_whitespace = True
 
+class PaginaDocumento(BaseModel):
+    numero: int # 1-based page number inside the document
+    inicio: int # Offset of the page text inside Documento.texto
+    fin: int    # End offset (exclusive) of the page text inside Documento.texto
+    es_imagen: bool = False # True when the page has images but no extractable text (needs OCR)
+
+class Documento(BaseModel):
+    id: Optional[int] = Field(default=None, primary_key=True) # Database ID
+    idRegDocumento: Optional[str] = None # From API: "idRegDocumento"
+    actuacion_db_id: Optional[int] = Field(default=None, foreign_key="actuacion.id") # Foreign key to local Actuacion table
+    nombre: Optional[str] = None # From API: "nombre"
+    checksum: str # SHA-256 of the downloaded bytes, used as extraction cache key
+
+    num_paginas: int = 0
+    texto: str = "" # Full extracted text, pages joined in order
+    paginas: List[PaginaDocumento] = [] # Per-page offsets into `texto`
+
+    # Field to be populated by GenAI (map-reduce summary of the whole document)
+    resumen_ia: Optional[str] = None
+
+    # Timestamps for local record
+    fecha_creacion_db: datetime = Field(default_factory=datetime.utcnow)
+    fecha_actualizacion_db: datetime = Field(default_factory=datetime.utcnow)
+
+    def texto_pagina(self, numero: int) -> str:
+        '''Returns the extracted text of the given 1-based page number.'''
+        pagina = self.paginas[numero - 1]
+        return self.texto[pagina.inicio:pagina.fin]
+
+    @property
+    def paginas_imagen(self) -> List[int]:
+        '''Page numbers that look scanned (image-only) and were skipped.'''
+        return [p.numero for p in self.paginas if p.es_imagen]
+
+    class Config:
+        orm_mode = True
+
+class ChunkDocumento(BaseModel):
+    id: Optional[int] = Field(default=None, primary_key=True) # Database ID
+    documento_db_id: Optional[int] = Field(default=None, foreign_key="documento.id")
+    indice: int # Position of the chunk inside the document
+    pagina_inicio: int
+    pagina_fin: int
+    huella: str # Hash of the chunk text and the map prompt; a summary is reused while it matches
+    texto: str = "" # Not persisted, rebuilt from Documento.texto when chunking
+    resumen_ia: Optional[str] = None
+
+    fecha_creacion_db: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        orm_mode = True
+
+class Evento(BaseModel):
+    id: Optional[int] = Field(default=None, primary_key=True) # Database ID
+    actuacion_db_id: Optional[int] = Field(default=None, foreign_key="actuacion.id")
+    proceso_db_id: Optional[int] = Field(default=None, foreign_key="proceso.id")
+    tipo: str # AUDIENCIA, VENCIMIENTO_TERMINO, INICIO_TERMINO, REQUERIMIENTO
+    fecha: str # ISO "YYYY-MM-DDTHH:MM:SS"
+    con_hora: bool = False
+    estimada: bool = False
+    descripcion: Optional[str] = None
+    fuente: str # API field name, or "anotacion"
+
+    fecha_creacion_db: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        orm_mode = True
+
+class Sujeto(BaseModel):
+    id: Optional[int] = Field(default=None, primary_key=True) # Database ID
+    proceso_db_id: Optional[int] = Field(default=None, foreign_key="proceso.id")
+    rol: str # e.g. DEMANDANTE, DEMANDADO (upper case, without accents)
+    nombre: str # As published by the API
+    nombre_normalizado: str # Upper case, without accents or punctuation; lookup key
+    nit: Optional[str] = None # Digits only, without the verification digit
+
+    fecha_creacion_db: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        orm_mode = True
+
+class EmpresaVigilada(BaseModel):
+    id: Optional[int] = Field(default=None, primary_key=True) # Database ID
+    nombre: str # As entered by the user
+    nombre_normalizado: str # Unique; see app/services/entity_resolution.py
+    umbral_similitud: float = 0.75 # Minimum trigram similarity for a name to count as an alias
+
+    fecha_creacion_db: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        orm_mode = True
+
+class CambioProceso(BaseModel):
+    id: Optional[int] = Field(default=None, primary_key=True) # Database ID
+    empresa_vigilada_id: int
+    idProceso: str
+    proceso_db_id: Optional[int] = None
+    tipo: str # nuevo, desaparecido (no longer in the active procesos of the company), modificado
+    campos: dict = Field(default_factory=dict) # {campo: [antes, después]}
+    fecha_deteccion: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        orm_mode = True
+
+class CandidatoEmpresa(BaseModel):
+    nombre: str # Most frequent spelling seen
+    nombre_normalizado: str # Key in sujeto.nombre_normalizado
+    similitud: float # Trigram similarity with the query, 0..1
+    apariciones: int = 0 # Number of times the name was seen (parties and searches)
+    nombres_busqueda: List[str] = [] # proceso.nombre_busqueda values with this name
+
+class Trabajo(BaseModel):
+    id: Optional[int] = Field(default=None, primary_key=True) # Database ID
+    tipo: str # fetch-process, fetch-actuaciones, download-document, extract-text, enrich-ai
+    clave: str # Idempotency key: enqueuing the same key again is a no-op
+    payload: dict = {}
+    estado: str = "pendiente" # pendiente, en_proceso, completado, fallido
+    prioridad: int = 0
+    intentos: int = 0
+    max_intentos: int = 5
+    disponible_en: datetime = Field(default_factory=datetime.utcnow)
+    worker: Optional[str] = None
+    lease_hasta: Optional[datetime] = None
+    ultimo_error: Optional[str] = None
+    resultado: Optional[dict] = None
+
+    fecha_creacion_db: datetime = Field(default_factory=datetime.utcnow)
+    fecha_actualizacion_db: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        orm_mode = True
+
+class ConsultaAsistente(BaseModel):
+    intencion: str # One of assistant.INTENCIONES
+    empresa: Optional[str] = None # Company (nombre_busqueda) mentioned in the question
+    numero_radicacion: Optional[str] = None
+    rol: Optional[str] = None # Party role for "procesos_por_parte" (DEMANDANTE / DEMANDADO)
+    dias: Optional[int] = None # Time window in days, backwards (or forwards for terms)
+    texto: str = "" # Original question, used by the semantic search fallback
+
+class RespuestaAsistente(BaseModel):
+    consulta: ConsultaAsistente
+    respuesta: str # Answer for the user, in Spanish
+    filas: List[dict] = [] # Rows the answer is based on, for tables and links in the UI
+    duracion_ms: float = 0
+
 # Example of how you might receive data from the API for an Actuacion
 # This is based on the Reto1.txt and typical API structures
 # actuacion_api_example = {
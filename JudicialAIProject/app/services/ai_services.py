@@ -2,10 +2,10 @@
 Services for interacting with Generative AI models for summarization and classification.
 '''
 import logging
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator
 from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-# Assuming llm_config.py is in the same directory and default_llm is configured
-from app.config.llm_config import default_llm 
+# The router picks, per task, one of the LLM backends configured in llm_config.py
+from app.services.llm_router import router
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -50,6 +50,52 @@ classification_prompt = PromptTemplate(
     template=classification_template_text
 )
 
+# Prompts for map-reduce summarization of long documents.
+# The map step summarizes one chunk (a few pages) of the document; the reduce step
+# merges partial summaries. Chunk summaries are persisted keyed by the map prompt,
+# so editing only the reduce prompt does not invalidate them.
+document_map_template_text = """
+Eres un asistente legal experto en el sistema judicial colombiano.
+El siguiente texto es un fragmento (páginas {paginas}) de un documento de un expediente judicial.
+Resume el fragmento de manera concisa, conservando partes, decisiones, fechas, plazos y requerimientos mencionados.
+
+Fragmento del documento:
+{texto_fragmento}
+
+Resumen del fragmento:
+"""
+document_map_prompt = PromptTemplate(
+    input_variables=["paginas", "texto_fragmento"],
+    template=document_map_template_text
+)
+
+document_reduce_template_text = """
+Eres un asistente legal experto en el sistema judicial colombiano.
+A continuación tienes resúmenes parciales, en orden, de las partes de un mismo documento judicial.
+Combínalos en un único resumen coherente y conciso para un abogado que necesita entender rápidamente el documento.
+Enfócate en el propósito del documento, las decisiones tomadas, las fechas importantes y cualquier requerimiento o plazo.
+
+Resúmenes parciales:
+{resumenes}
+
+Resumen del documento:
+"""
+document_reduce_prompt = PromptTemplate(
+    input_variables=["resumenes"],
+    template=document_reduce_template_text
+)
+
+# --- Token budgeting ---
+
+CARACTERES_POR_TOKEN = 4 # Rough average for Spanish text with Gemini/GPT tokenizers
+MAX_TOKENS_FRAGMENTO = 6000 # Token budget of a chunk sent to the map step
+MAX_TOKENS_REDUCCION = 6000 # Token budget of the partial summaries merged in one reduce call
+MAX_CONCURRENCIA_LLM = 8 # Concurrent LLM calls per map/reduce level
+
+def estimar_tokens(texto: str) -> int:
+    '''Cheap token estimate used for budgeting, without calling a tokenizer.'''
+    return len(texto) // CARACTERES_POR_TOKEN + 1
+
 # --- Service Functions ---
 
 def generar_resumen_actuacion(texto_actuacion: str) -> str | None:
@@ -62,7 +108,7 @@ def generar_resumen_actuacion(texto_actuacion: str) -> str | None:
     Returns:
         The generated summary as a string, or None if an error occurs or LLM is not available.
     '''
-    if not default_llm:
+    if not router.disponible("resumen_actuacion"):
         logging.warning("LLM not available. Cannot generate summary.")
         return None
     if not texto_actuacion or not texto_actuacion.strip():
@@ -70,15 +116,65 @@ def generar_resumen_actuacion(texto_actuacion: str) -> str | None:
         return ""
 
     try:
-        # Create the chain: prompt | llm | output_parser
-        chain = summarization_prompt | default_llm | StrOutputParser()
-        summary = chain.invoke({"texto_actuacion": texto_actuacion})
+        # Runs the chain prompt | llm | output_parser on the backend chosen for the task
+        summary = router.invoke("resumen_actuacion", summarization_prompt, {"texto_actuacion": texto_actuacion})
         logging.info(f"Resumen generado para la actuación (primeros 50 chars): {texto_actuacion[:50]}...")
         return summary.strip()
     except Exception as e:
         logging.error(f"Error al generar resumen con LLM: {e}")
         return None
 
+def generar_resumen_actuacion_stream(texto_actuacion: str) -> Iterator[str]:
+    '''
+    Streaming variant of generar_resumen_actuacion: yields the summary as the LLM produces it.
+
+    Args:
+        texto_actuacion: The text (anotacion) of the judicial action.
+
+    Yields:
+        Text fragments of the summary. Yields nothing if the LLM is not available or fails.
+    '''
+    if not router.disponible("resumen_actuacion"):
+        logging.warning("LLM not available. Cannot generate summary.")
+        return
+    if not texto_actuacion or not texto_actuacion.strip():
+        logging.warning("Texto de actuación vacío o nulo. No se generará resumen.")
+        return
+
+    try:
+        yield from router.stream("resumen_actuacion", summarization_prompt, {"texto_actuacion": texto_actuacion})
+        logging.info(f"Resumen transmitido para la actuación (primeros 50 chars): {texto_actuacion[:50]}...")
+    except Exception as e:
+        logging.error(f"Error al transmitir resumen con LLM: {e}")
+
+async def agenerar_resumen_actuacion_stream(texto_actuacion: str) -> AsyncIterator[str]:
+    '''Async variant of generar_resumen_actuacion_stream.'''
+    if not router.disponible("resumen_actuacion"):
+        logging.warning("LLM not available. Cannot generate summary.")
+        return
+    if not texto_actuacion or not texto_actuacion.strip():
+        logging.warning("Texto de actuación vacío o nulo. No se generará resumen.")
+        return
+
+    try:
+        async for token in router.astream("resumen_actuacion", summarization_prompt, {"texto_actuacion": texto_actuacion}):
+            yield token
+    except Exception as e:
+        logging.error(f"Error al transmitir resumen con LLM: {e}")
+
+def acumular_stream(tokens: Iterable[str], al_terminar: Callable[[str], Any]) -> Iterator[str]:
+    '''
+    Passes the tokens of a stream through and, once it ends, calls `al_terminar` with the
+    full stripped text (e.g. to persist it). Nothing is stored for an empty stream.
+    '''
+    partes = []
+    for token in tokens:
+        partes.append(token)
+        yield token
+    texto = "".join(partes).strip()
+    if texto:
+        al_terminar(texto)
+
 def clasificar_urgencia_actuacion(texto_actuacion: str) -> str | None:
     '''
     Classifies the urgency of a given judicial action using the configured LLM.
@@ -90,7 +186,7 @@ def clasificar_urgencia_actuacion(texto_actuacion: str) -> str | None:
     Returns:
         The urgency classification (e.g., "ALTA", "MEDIA", "BAJA") or None if an error occurs.
     '''
-    if not default_llm:
+    if not router.disponible("urgencia"):
         logging.warning("LLM not available. Cannot classify urgency.")
         return None
     if not texto_actuacion or not texto_actuacion.strip():
@@ -98,9 +194,7 @@ def clasificar_urgencia_actuacion(texto_actuacion: str) -> str | None:
         return "BAJA" # Default to BAJA if no text to analyze
 
     try:
-        chain = classification_prompt | default_llm | StrOutputParser()
-        classification = chain.invoke({
-            
+        classification = router.invoke("urgencia", classification_prompt, {
             "texto_actuacion": texto_actuacion
         })
         # Ensure the output is one of the expected categories
@@ -116,6 +210,93 @@ def clasificar_urgencia_actuacion(texto_actuacion: str) -> str | None:
         logging.error(f"Error al clasificar urgencia con LLM: {e}")
         return None
 
+def resumir_fragmentos(fragmentos: list[tuple[str, str]]) -> list[str | None]:
+    '''
+    Map step: summarizes document chunks concurrently.
+
+    Args:
+        fragmentos: (paginas, texto) pairs, e.g. ("3-7", "...texto de las páginas...").
+
+    Returns:
+        One summary per chunk, in the same order; None for chunks that failed.
+    '''
+    if not router.disponible("resumen_documento"):
+        logging.warning("LLM not available. Cannot summarize document chunks.")
+        return [None] * len(fragmentos)
+    if not fragmentos:
+        return []
+
+    resultados = router.batch(
+        "resumen_documento",
+        document_map_prompt,
+        [{"paginas": paginas, "texto_fragmento": texto} for paginas, texto in fragmentos],
+        max_concurrency=MAX_CONCURRENCIA_LLM,
+        return_exceptions=True
+    )
+    resumenes = []
+    for (paginas, _), resultado in zip(fragmentos, resultados):
+        if isinstance(resultado, Exception):
+            logging.error(f"Error al resumir fragmento (páginas {paginas}) con LLM: {resultado}")
+            resumenes.append(None)
+        else:
+            resumenes.append(resultado.strip())
+    return resumenes
+
+def reducir_resumenes(resumenes: list[str]) -> str | None:
+    '''
+    Reduce step: merges partial summaries hierarchically into a single summary.
+
+    Summaries are grouped so each reduce call fits MAX_TOKENS_REDUCCION, the groups of a
+    level are reduced concurrently, and levels repeat until one summary is left. Latency
+    is therefore bounded by the depth of the tree, not by the number of chunks.
+
+    Args:
+        resumenes: The partial summaries, in document order.
+
+    Returns:
+        The merged summary, or None if an error occurs or LLM is not available.
+    '''
+    if not router.disponible("resumen_documento"):
+        logging.warning("LLM not available. Cannot reduce summaries.")
+        return None
+    resumenes = [r for r in resumenes if r]
+    if not resumenes:
+        return ""
+    if len(resumenes) == 1:
+        return resumenes[0]
+
+    nivel = 0
+    while len(resumenes) > 1:
+        grupos = []
+        grupo_actual = []
+        tokens_grupo = 0
+        for resumen in resumenes:
+            tokens = estimar_tokens(resumen)
+            # Always put at least two summaries in a group so every level shrinks
+            if len(grupo_actual) >= 2 and tokens_grupo + tokens > MAX_TOKENS_REDUCCION:
+                grupos.append(grupo_actual)
+                grupo_actual, tokens_grupo = [], 0
+            grupo_actual.append(resumen)
+            tokens_grupo += tokens
+        grupos.append(grupo_actual)
+
+        nivel += 1
+        logging.info(f"Reducción nivel {nivel}: {len(resumenes)} resúmenes en {len(grupos)} grupo(s).")
+        a_reducir = [grupo for grupo in grupos if len(grupo) > 1]
+        try:
+            resultados = iter(router.batch(
+                "resumen_documento",
+                document_reduce_prompt,
+                [{"resumenes": "\n\n".join(f"[{i}] {r}" for i, r in enumerate(grupo, start=1))} for grupo in a_reducir],
+                max_concurrency=MAX_CONCURRENCIA_LLM
+            ))
+        except Exception as e:
+            logging.error(f"Error al reducir resúmenes con LLM: {e}")
+            return None
+        # A trailing group with a single summary passes to the next level unchanged
+        resumenes = [next(resultados).strip() if len(grupo) > 1 else grupo[0] for grupo in grupos]
+    return resumenes[0]
+
 # --- Example Usage (for testing this module directly) ---
 # if __name__ == "__main__":
 #     if not default_llm:
@@ -0,0 +1,106 @@
+'''
+Historical analytics over the Parquet snapshots (see app/services/parquet_export.py).
+
+Everything here is vectorized pandas/pyarrow over the columnar files: company and month
+filters prune whole partitions, only the needed columns are read, and the OLTP SQLite
+database is never touched.
+'''
+import logging
+import pandas as pd
+import pyarrow.compute as pc
+from app.services.parquet_export import PARQUET_DIR, dataset
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DIAS_SEMANA = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+def cargar_actuaciones(
+    columnas: list[str] | None = None,
+    empresas: list[str] | None = None,
+    desde_mes: str | None = None,
+    hasta_mes: str | None = None,
+    directorio: str = PARQUET_DIR,
+) -> pd.DataFrame:
+    '''
+    Loads the exported actuaciones, keeping only the last version of each one.
+
+    Args:
+        columnas: Optional. Columns to read (id and fecha_actualizacion_db are always added).
+        empresas: Optional. Companies (nombre_busqueda) to read; other partitions are skipped.
+        desde_mes / hasta_mes: Optional. Month range "YYYY-MM", applied to the partitions.
+        directorio: Optional. Root of the Parquet export.
+
+    Returns:
+        A DataFrame, empty if nothing was exported yet.
+    '''
+    datos = dataset("actuacion", directorio)
+    if datos is None:
+        return pd.DataFrame(columns=columnas or [])
+    filtro = None
+    for condicion in (
+        pc.field("empresa").isin(empresas) if empresas else None,
+        pc.field("mes") >= desde_mes if desde_mes else None,
+        pc.field("mes") <= hasta_mes if hasta_mes else None,
+    ):
+        if condicion is not None:
+            filtro = condicion if filtro is None else filtro & condicion
+    if columnas:
+        columnas = list(dict.fromkeys(["id", "fecha_actualizacion_db", *columnas]))
+    df = datos.to_table(columns=columnas, filter=filtro).to_pandas()
+    # Updated rows were appended again by later exports: keep the most recent version
+    return df.sort_values("fecha_actualizacion_db").drop_duplicates("id", keep="last").reset_index(drop=True)
+
+def tiempo_entre_actuaciones(df: pd.DataFrame, por: str = "despacho", minimo_actuaciones: int = 20) -> pd.DataFrame:
+    '''
+    Days between consecutive actuaciones of the same proceso, summarized per group
+    (despacho by default): which despachos are slowest.
+
+    Args:
+        df: Actuaciones with proceso_db_id, fechaActuacion and the grouping column.
+        por: Optional. Grouping column, e.g. "despacho" or "empresa".
+        minimo_actuaciones: Optional. Groups with fewer intervals are left out (too noisy).
+
+    Returns:
+        A DataFrame indexed by group with intervalos, mediana_dias, p90_dias and media_dias, slowest first.
+    '''
+    datos = df.dropna(subset=["fechaActuacion"]).sort_values(["proceso_db_id", "fechaActuacion"])
+    datos = datos.assign(dias=datos.groupby("proceso_db_id")["fechaActuacion"].diff().dt.days).dropna(subset=["dias"])
+    resumen = datos.groupby(datos[por].fillna("SIN DATO"))["dias"].agg(
+        intervalos="count",
+        mediana_dias="median",
+        p90_dias=lambda dias: dias.quantile(0.9),
+        media_dias="mean",
+    )
+    return resumen[resumen["intervalos"] >= minimo_actuaciones].sort_values("mediana_dias", ascending=False)
+
+def mapa_actividad(df: pd.DataFrame, filas: str = "dia_semana", columnas: str = "mes") -> pd.DataFrame:
+    '''
+    Activity heatmap: number of actuaciones per (row, column) cell.
+
+    Args:
+        df: Actuaciones with fechaActuacion (and empresa/despacho if used as an axis).
+        filas / columnas: Optional. "dia_semana", "mes", "anio", "empresa" or "despacho".
+
+    Returns:
+        A pivot table of counts, zero-filled.
+    '''
+    fechas = df["fechaActuacion"]
+    ejes = {
+        "dia_semana": pd.Categorical(fechas.dt.dayofweek.map(dict(enumerate(DIAS_SEMANA))), categories=DIAS_SEMANA, ordered=True),
+        "mes": fechas.dt.strftime("%Y-%m"),
+        "anio": fechas.dt.year,
+    }
+    eje_filas = ejes.get(filas, df.get(filas))
+    eje_columnas = ejes.get(columnas, df.get(columnas))
+    return pd.crosstab(eje_filas, eje_columnas, dropna=False).rename_axis(index=filas, columns=columnas)
+
+def distribucion_urgencias(df: pd.DataFrame, por: str = "empresa", normalizar: bool = True) -> pd.DataFrame:
+    '''Distribution of the AI urgency per group (share of each urgency, or counts if normalizar=False).'''
+    urgencia = df["clasificacion_urgencia_ia"].fillna("SIN CLASIFICAR")
+    return pd.crosstab(df[por].fillna("SIN DATO"), urgencia, normalize="index" if normalizar else False)
+
+def volumen_mensual(df: pd.DataFrame, por: str = "empresa") -> pd.DataFrame:
+    '''Number of actuaciones per month (rows) and group (columns): the volume trend of each company.'''
+    meses = df["fechaActuacion"].dt.to_period("M")
+    return pd.crosstab(meses, df[por].fillna("SIN DATO")).sort_index()
@@ -0,0 +1,248 @@
+'''
+Assistant that answers questions about the portfolio from the local database.
+
+Most questions ("¿Qué procesos activos tiene la empresa X?", "¿Qué actuaciones recientes
+son críticas?") are database queries, so they are mapped to a small set of parameterized
+queries (see the assistant queries in app/db/crud.py) instead of sending actuaciones to
+the LLM. The LLM is only used when the rules can't tell the intent, and optionally to
+phrase the answer from the few rows returned.
+'''
+import json
+import logging
+import re
+import time
+from datetime import date, timedelta
+from langchain_core.prompts import PromptTemplate
+from app.db import crud
+from app.models.models import ConsultaAsistente, RespuestaAsistente
+from app.services.llm_router import router
+from app.services.retrieval import buscar_contexto
+from app.services.sujetos import normalizar_nombre, ROL_DEMANDANTE, ROL_DEMANDADO
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INTENCIONES = ("procesos_por_parte", "procesos_activos", "actuaciones_criticas", "terminos_por_vencer", "conteo_urgencias", "actuaciones_proceso", "busqueda")
+
+DIAS_RECIENTES = 30 # Default window for "recientes"
+DIAS_PROCESO_ACTIVO = 365 # A process is active if it had an actuación in this window
+DIAS_TERMINOS = 15 # Default look-ahead for terms about to end
+MAX_FILAS = 50
+MAX_FILAS_PROMPT = 15 # Rows passed to the LLM when it phrases the answer
+
+# --- Intent rules (checked in order, the first match wins) ---
+REGLAS_INTENCION = [
+    ("terminos_por_vencer", re.compile(r"\b(t[eé]rminos?|vence[nr]?|vencimientos?|plazos?|audiencias?|agenda)\b", re.IGNORECASE)),
+    ("actuaciones_criticas", re.compile(r"\b(cr[ií]tic[oa]s?|urgentes?|urgencia alta|prioritari[oa]s?)\b", re.IGNORECASE)),
+    ("procesos_por_parte", re.compile(r"\b(demandad[oa]s?|demandantes?)\b", re.IGNORECASE)),
+    ("procesos_activos", re.compile(r"\bprocesos?\b.*\b(activos?|vigentes?|abiertos?)\b|\b(activos?|vigentes?)\b.*\bprocesos?\b", re.IGNORECASE)),
+    ("conteo_urgencias", re.compile(r"\b(cu[aá]nt[oa]s|resumen|estad[ií]sticas?|distribuci[oó]n)\b", re.IGNORECASE)),
+]
+PATRON_RADICADO = re.compile(r"\b\d{23}\b")
+PATRON_EMPRESA = re.compile(
+    r"\b(?:empresa|cliente|sociedad|compañ[ií]a|raz[oó]n social)\s+[\"“']?(.+?)[\"”']?\s*(?:\?|$|,|\b(?:en|de los|del|desde|durante|este|esta)\b)",
+    re.IGNORECASE
+)
+# "¿Dónde es demandada BANCOLOMBIA?", "procesos en los que ACME S.A. es demandante"
+PATRONES_PARTE = (
+    re.compile(r"\b(demandad[oa]|demandante)\s+(?:es\s+|a\s+|al?\s+)?[\"“']?(.+?)[\"”']?\s*(?:\?|$)", re.IGNORECASE),
+    re.compile(r"(?:donde|que|cuales)\s+[\"“']?(.+?)[\"”']?\s+(?:es|sea|está|esta|figura como|aparece como)\s+(demandad[oa]|demandante)", re.IGNORECASE),
+)
+PATRON_DIAS = re.compile(r"\b(\d{1,3})\s*d[ií]as\b", re.IGNORECASE)
+VENTANAS = (("hoy", 1), ("esta semana", 7), ("semana", 7), ("este mes", 30), ("mes", 30), ("este año", 365), ("año", 365))
+
+intent_template_text = """
+Eres el analizador de preguntas de un asistente legal sobre procesos judiciales colombianos.
+Clasifica la pregunta en una de estas intenciones: {intenciones}.
+Responde únicamente con un objeto JSON con las claves "intencion", "empresa" (o null),
+"numero_radicacion" (o null) y "dias" (entero o null).
+
+Pregunta: {pregunta}
+
+JSON:
+"""
+intent_prompt = PromptTemplate(
+    input_variables=["intenciones", "pregunta"],
+    template=intent_template_text
+)
+
+answer_template_text = """
+Eres un asistente legal experto en el sistema judicial colombiano.
+Responde la pregunta del usuario únicamente con los datos de la consulta a la base de datos que se muestran.
+Sé breve y concreto; menciona números de radicación y fechas cuando sean relevantes. No inventes datos.
+
+Pregunta: {pregunta}
+
+Datos ({total} resultados, se muestran hasta {mostrados}):
+{datos}
+
+Respuesta:
+"""
+answer_prompt = PromptTemplate(
+    input_variables=["pregunta", "total", "mostrados", "datos"],
+    template=answer_template_text
+)
+
+def _ventana_dias(pregunta: str) -> int | None:
+    coincidencia = PATRON_DIAS.search(pregunta)
+    if coincidencia:
+        return int(coincidencia.group(1))
+    texto = pregunta.lower()
+    for expresion, dias in VENTANAS:
+        if expresion in texto:
+            return dias
+    return None
+
+def _completar_parte(consulta: ConsultaAsistente, pregunta: str, rol: str) -> None:
+    # "demandada"/"demandados" -> DEMANDADO; the party name comes from "empresa X" or the role phrase
+    consulta.rol = ROL_DEMANDANTE if rol.lower().startswith("demandante") else ROL_DEMANDADO
+    if consulta.empresa:
+        return
+    for patron in PATRONES_PARTE:
+        coincidencia = patron.search(pregunta)
+        if coincidencia:
+            nombre = coincidencia.group(2) if coincidencia.group(1).lower().startswith("demand") else coincidencia.group(1)
+            consulta.empresa = nombre.strip(" ¿?")
+            return
+
+def interpretar_pregunta(pregunta: str, usar_llm: bool = True) -> ConsultaAsistente:
+    '''
+    Maps a question to an intent and its parameters.
+
+    Rules are tried first (no LLM call); the LLM is asked only if none matches, and the
+    question falls back to a semantic search if the LLM can't classify it either.
+
+    Args:
+        pregunta: The user question, in Spanish.
+        usar_llm: Optional. Whether the LLM may be used for questions the rules don't cover.
+
+    Returns:
+        The ConsultaAsistente with the intent and parameters.
+    '''
+    radicado = PATRON_RADICADO.search(pregunta)
+    empresa = PATRON_EMPRESA.search(pregunta)
+    consulta = ConsultaAsistente(
+        intencion="busqueda",
+        empresa=empresa.group(1).strip() if empresa else None,
+        numero_radicacion=radicado.group(0) if radicado else None,
+        dias=_ventana_dias(pregunta),
+        texto=pregunta
+    )
+    for intencion, patron in REGLAS_INTENCION:
+        coincidencia = patron.search(pregunta)
+        if coincidencia:
+            consulta.intencion = intencion
+            if intencion == "procesos_por_parte":
+                _completar_parte(consulta, pregunta, coincidencia.group(1))
+            return consulta
+    if consulta.numero_radicacion:
+        consulta.intencion = "actuaciones_proceso"
+        return consulta
+
+    if usar_llm and router.disponible("intencion_asistente"):
+        try:
+            salida = router.invoke("intencion_asistente", intent_prompt, {"intenciones": ", ".join(INTENCIONES), "pregunta": pregunta})
+            datos = json.loads(salida[salida.find("{"):salida.rfind("}") + 1])
+            if datos.get("intencion") in INTENCIONES:
+                consulta.intencion = datos["intencion"]
+                consulta.empresa = consulta.empresa or datos.get("empresa")
+                consulta.numero_radicacion = consulta.numero_radicacion or datos.get("numero_radicacion")
+                consulta.dias = consulta.dias or (int(datos["dias"]) if datos.get("dias") else None)
+        except Exception as e:
+            logging.warning(f"No se pudo interpretar la pregunta con el LLM, se usará búsqueda semántica: {e}")
+    return consulta
+
+def _fecha_iso(dias_atras: int) -> str:
+    return (date.today() - timedelta(days=dias_atras)).isoformat()
+
+def _cantidad(filas: list) -> str:
+    # Queries are capped at MAX_FILAS rows, so a full page means "at least"
+    return f"{len(filas)}+" if len(filas) >= MAX_FILAS else str(len(filas))
+
+def ejecutar_consulta(db_engine, consulta: ConsultaAsistente) -> tuple[str, list[dict]]:
+    '''
+    Runs the parameterized query of an intent.
+
+    Returns:
+        A tuple (answer built from a template, rows).
+    '''
+    sufijo_empresa = f" de '{consulta.empresa}'" if consulta.empresa else ""
+
+    if consulta.intencion == "procesos_por_parte" and consulta.empresa:
+        # Indexed lookup on the normalized party name (prefix, so "BANCOLOMBIA" also finds "BANCOLOMBIA SA")
+        filas = crud.get_procesos_by_sujeto(db_engine, nombre_normalizado=normalizar_nombre(consulta.empresa), rol=consulta.rol, prefijo=True, limit=MAX_FILAS)
+        rol = (consulta.rol or "parte").lower()
+        lineas = [f"- {f['numeroRadicacion'] or f['idProceso']} | {f['nombre']} | {f['despacho'] or 'N/A'}" for f in filas]
+        return f"{_cantidad(filas)} proceso(s) local(es) donde '{consulta.empresa}' es {rol}.\n" + "\n".join(lineas), filas
+
+    if consulta.intencion == "procesos_activos":
+        dias = consulta.dias or DIAS_PROCESO_ACTIVO
+        filas = crud.get_procesos_activos(db_engine, empresa=consulta.empresa, desde=_fecha_iso(dias), limit=MAX_FILAS)
+        lineas = [f"- {f['numeroRadicacion'] or f['idProceso']}: {f['demandante']} vs {f['demandado']} (última actuación {(f['ultima_actuacion'] or '')[:10]})" for f in filas]
+        return f"{_cantidad(filas)} proceso(s) activo(s){sufijo_empresa} en los últimos {dias} días.\n" + "\n".join(lineas), filas
+
+    if consulta.intencion == "actuaciones_criticas":
+        dias = consulta.dias or DIAS_RECIENTES
+        filas = crud.get_actuaciones_con_proceso(db_engine, empresa=consulta.empresa, urgencias=["ALTA"], desde=_fecha_iso(dias), limit=MAX_FILAS)
+        lineas = [f"- {(f['fechaActuacion'] or '')[:10]} | {f['numeroRadicacion'] or f['idProceso']} | {f['actuacion']}" for f in filas]
+        return f"{_cantidad(filas)} actuación(es) de urgencia ALTA{sufijo_empresa} en los últimos {dias} días.\n" + "\n".join(lineas), filas
+
+    if consulta.intencion == "terminos_por_vencer":
+        dias = consulta.dias or DIAS_TERMINOS
+        hoy = date.today()
+        filas = crud.get_eventos_entre(db_engine, hoy.isoformat(), (hoy + timedelta(days=dias)).isoformat() + "T23:59:59", empresa=consulta.empresa, limit=MAX_FILAS)
+        lineas = [f"- {f['fecha'][:16 if f['con_hora'] else 10].replace('T', ' ')} | {f['tipo']} | {f['numeroRadicacion'] or f['idProceso']} | {f['actuacion']}" for f in filas]
+        return f"{_cantidad(filas)} evento(s) (términos, audiencias, requerimientos){sufijo_empresa} en los próximos {dias} días.\n" + "\n".join(lineas), filas
+
+    if consulta.intencion == "conteo_urgencias":
+        desde = _fecha_iso(consulta.dias) if consulta.dias else None
+        conteo = crud.count_actuaciones_por_urgencia(db_engine, empresa=consulta.empresa, desde=desde)
+        filas = [{"urgencia": u, "total": conteo[u]} for u in sorted(conteo)]
+        periodo = f" en los últimos {consulta.dias} días" if consulta.dias else ""
+        detalle = ", ".join(f"{f['urgencia']}: {f['total']}" for f in filas) or "sin actuaciones"
+        return f"Actuaciones por urgencia{sufijo_empresa}{periodo}: {detalle}.", filas
+
+    if consulta.intencion == "actuaciones_proceso" and consulta.numero_radicacion:
+        filas = crud.get_actuaciones_con_proceso(db_engine, numero_radicacion=consulta.numero_radicacion, limit=MAX_FILAS)
+        lineas = [f"- {(f['fechaActuacion'] or '')[:10]} | {f['actuacion']} | urgencia {f['clasificacion_urgencia_ia'] or 'N/A'}" for f in filas]
+        return f"Últimas {len(filas)} actuación(es) del proceso {consulta.numero_radicacion}.\n" + "\n".join(lineas), filas
+
+    # Anything else: the most similar passages in the vector index
+    filas = buscar_contexto(db_engine, consulta.texto, k=5, empresa=consulta.empresa)
+    lineas = [f"- ({f['tipo']} {f['ref']}, {f['fecha'] or 's.f.'}) {f['texto'][:200]}" for f in filas]
+    return f"Pasajes más relacionados con la pregunta{sufijo_empresa}:\n" + "\n".join(lineas), filas
+
+def redactar_respuesta(pregunta: str, respuesta_base: str, filas: list[dict]) -> str:
+    '''Asks the LLM to phrase the answer from the query rows. Returns the template answer if it fails.'''
+    if not filas or not router.disponible("respuesta_asistente"):
+        return respuesta_base
+    try:
+        datos = "\n".join(json.dumps({k: v for k, v in f.items() if v is not None}, ensure_ascii=False, default=str) for f in filas[:MAX_FILAS_PROMPT])
+        respuesta = router.invoke("respuesta_asistente", answer_prompt, {
+            "pregunta": pregunta, "total": len(filas), "mostrados": min(len(filas), MAX_FILAS_PROMPT), "datos": datos
+        })
+        return respuesta.strip() or respuesta_base
+    except Exception as e:
+        logging.error(f"Error al redactar la respuesta con LLM: {e}")
+        return respuesta_base
+
+def responder_pregunta(db_engine, pregunta: str, redactar_con_ia: bool = False) -> RespuestaAsistente:
+    '''
+    Answers a question about the portfolio from the local database.
+
+    Args:
+        db_engine: The SQLAlchemy engine to query.
+        pregunta: The user question, in Spanish.
+        redactar_con_ia: Optional. Whether the LLM phrases the answer (slower) instead of the template.
+
+    Returns:
+        The RespuestaAsistente with the answer, the rows it is based on and how long it took.
+    '''
+    inicio = time.perf_counter()
+    consulta = interpretar_pregunta(pregunta)
+    respuesta, filas = ejecutar_consulta(db_engine, consulta)
+    if redactar_con_ia:
+        respuesta = redactar_respuesta(pregunta, respuesta, filas)
+    duracion_ms = (time.perf_counter() - inicio) * 1000
+    logging.info(f"Pregunta respondida como '{consulta.intencion}' en {duracion_ms:.0f} ms ({len(filas)} filas).")
+    return RespuestaAsistente(consulta=consulta, respuesta=respuesta, filas=filas, duracion_ms=duracion_ms)
@@ -0,0 +1,282 @@
+'''
+Headless bulk import of a client portfolio from a CSV or XLSX file of radicados and/or names.
+
+    python -m app.services.bulk_import cartera.csv [--cliente "ACME S.A." [--tenant]] [--sin-ia] [--hilos 8]
+
+Each row needs a radicado (column radicado, numero_radicacion or numero) or a name or NIT
+(column nombre, razon_social or nit); an optional tipo_persona column ("jur"/"nat") applies to
+names. Rows are resolved concurrently through the Rama Judicial search endpoints, as the first
+stage of the ingestion pipeline (app/services/ingestion.py), in blocks of rows.
+
+After each block the outcome of its rows is appended to a checkpoint file
+(data/importaciones/<file checksum>.jsonl). Running the same file again resumes after the
+last completed block and retries the rows that failed; re-ingesting part of a block after a
+crash is harmless, since procesos and actuaciones are upserted. XLSX files need openpyxl.
+With --tenant the portfolio is stored in the tenant database of the client (app/db/sharding.py)
+instead of the application database.
+'''
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from app.clients.rama_judicial_client import consultar_procesos_por_nombre, consultar_procesos_por_numero_radicacion, consultar_todas_las_paginas
+from app.db.database import DATA_DIR
+from app.services.ingestion import etapas_ingesta
+from app.services.pipeline import Etapa, Pipeline
+from app.services.sujetos import normalizar_texto
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+IMPORTACIONES_DIR = os.path.join(DATA_DIR, "importaciones")
+FILAS_POR_BLOQUE = 200 # Rows per checkpoint: at most this many are repeated after a crash
+MAX_PAGINAS = 10 # Result pages read per name (the API returns 20 procesos per page)
+
+# Accepted headers, compared normalized ("Número de Radicación" -> "NUMERO_DE_RADICACION")
+COLUMNAS_RADICADO = ("RADICADO", "NUMERO_RADICACION", "NUMERO_DE_RADICACION", "NUMERORADICACION", "NUMERO", "LLAVE_PROCESO")
+COLUMNAS_NOMBRE = ("NOMBRE", "RAZON_SOCIAL", "NOMBRE_RAZON_SOCIAL", "NIT", "EMPRESA", "DEMANDADO")
+COLUMNAS_TIPO_PERSONA = ("TIPO_PERSONA", "TIPOPERSONA")
+
+ESTADO_OK = "ok"
+ESTADO_SIN_RESULTADOS = "sin_resultados"
+ESTADO_ERROR = "error" # Retried when the import is resumed
+ESTADO_INVALIDA = "invalida" # Neither radicado nor name: not retried
+
+def _columna(encabezado: str) -> str:
+    return normalizar_texto(str(encabezado or "")).replace(" ", "_")
+
+def _valor(fila: dict, columnas: tuple) -> str | None:
+    for columna in columnas:
+        valor = fila.get(columna)
+        if valor is not None and str(valor).strip() and str(valor).strip().lower() != "nan":
+            return str(valor).strip()
+    return None
+
+def _filas_crudas(ruta: str):
+    if ruta.lower().endswith((".xlsx", ".xlsm", ".xls")):
+        import pandas as pd
+        yield from pd.read_excel(ruta, dtype=str).to_dict("records")
+        return
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        muestra = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t|")
+        except csv.Error:
+            dialecto = csv.excel
+        yield from csv.DictReader(f, dialect=dialecto)
+
+def leer_filas(ruta: str):
+    '''
+    Reads the rows of a portfolio file (lazily for CSV).
+
+    Yields:
+        {"fila": row number (1 = first data row), "radicado", "nombre", "tipo_persona"}; rows
+        without radicado or name are yielded too, so they are reported.
+    '''
+    for numero, cruda in enumerate(_filas_crudas(ruta), start=1):
+        fila = {_columna(k): v for k, v in cruda.items() if k is not None}
+        radicado = _valor(fila, COLUMNAS_RADICADO)
+        tipo_persona = (_valor(fila, COLUMNAS_TIPO_PERSONA) or "jur").lower()[:3]
+        yield {
+            "fila": numero,
+            "radicado": "".join(c for c in radicado if c.isdigit()) or None if radicado else None,
+            "nombre": _valor(fila, COLUMNAS_NOMBRE),
+            "tipo_persona": tipo_persona if tipo_persona in ("jur", "nat") else "jur",
+        }
+
+def ruta_checkpoint(ruta: str) -> str:
+    '''Checkpoint file of a portfolio file: named by the checksum of its content, so an edited file starts over.'''
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            sha.update(bloque)
+    return os.path.join(IMPORTACIONES_DIR, f"{sha.hexdigest()[:20]}.jsonl")
+
+def cargar_checkpoint(ruta: str) -> dict[int, dict]:
+    '''Last recorded outcome of each row ({fila: {"estado", "procesos", "error"}}).'''
+    filas = {}
+    if not os.path.exists(ruta):
+        return filas
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                continue # Line cut short by a crash
+            filas[registro["fila"]] = registro
+    return filas
+
+def _guardar_checkpoint(ruta: str, registros: list[dict]) -> None:
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, "a", encoding="utf-8") as f:
+        for registro in registros:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def resolver_fila(fila: dict, max_paginas: int = MAX_PAGINAS) -> list[dict] | None:
+    '''
+    Procesos of a portfolio row: by radicado when there is one, otherwise by name.
+
+    Returns:
+        The search results (dicts with idProceso and sujetosProcesales), or None if the API failed.
+    '''
+    if fila["radicado"]:
+        return consultar_todas_las_paginas(lambda p: consultar_procesos_por_numero_radicacion(fila["radicado"], pagina=p), max_paginas)
+    if fila["nombre"]:
+        return consultar_todas_las_paginas(
+            lambda p: consultar_procesos_por_nombre(fila["nombre"], tipo_persona=fila["tipo_persona"], solo_activos=False, pagina=p), max_paginas
+        )
+    return []
+
+def importar_cartera(
+    db_engine,
+    ruta: str,
+    cliente: str | None = None,
+    enriquecer: bool = True,
+    hilos_resolucion: int = 4,
+    hilos_fetch: int = 4,
+    hilos_ia: int = 4,
+    filas_por_bloque: int = FILAS_POR_BLOQUE,
+    max_paginas: int = MAX_PAGINAS,
+    reiniciar: bool = False
+) -> dict:
+    '''
+    Imports a portfolio file, resuming from its checkpoint.
+
+    Args:
+        db_engine: The SQLAlchemy engine to store the data in.
+        ruta: Path of the CSV or XLSX file.
+        cliente: Optional. Stored as nombre_busqueda of every proceso (default: the name of the row).
+        enriquecer: Optional. Also generate the AI fields of the actuaciones.
+        hilos_resolucion: Optional. Concurrent search requests.
+        hilos_fetch: Optional. Concurrent detail/actuaciones requests.
+        hilos_ia: Optional. Concurrent LLM calls.
+        filas_por_bloque: Optional. Rows per checkpoint.
+        max_paginas: Optional. Result pages read per name.
+        reiniciar: Optional. Ignore the checkpoint and import every row again.
+
+    Returns:
+        A summary: rows per outcome, procesos found and ingested, throughput and most frequent errors.
+    '''
+    checkpoint = ruta_checkpoint(ruta)
+    if reiniciar and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    hechas = {f for f, r in cargar_checkpoint(checkpoint).items() if r["estado"] != ESTADO_ERROR}
+    if hechas:
+        logging.info(f"Reanudando la importación de {ruta}: {len(hechas)} filas ya importadas.")
+
+    vistos, lock = set(), threading.Lock()
+    resultados: dict[int, dict] = {}
+
+    def resolver(fila: dict) -> list[dict]:
+        registro = {"fila": fila["fila"], "radicado": fila["radicado"], "nombre": fila["nombre"], "estado": ESTADO_OK, "procesos": 0}
+        if not fila["radicado"] and not fila["nombre"]:
+            registro.update(estado=ESTADO_INVALIDA, error="Fila sin radicado ni nombre")
+            procesos = []
+        else:
+            try:
+                procesos = resolver_fila(fila, max_paginas)
+            except Exception as e:
+                procesos, registro["error"] = None, f"{type(e).__name__}: {e}"
+            if procesos is None:
+                registro["estado"] = ESTADO_ERROR
+                registro.setdefault("error", "Error al consultar la API de la Rama Judicial")
+                procesos = []
+            elif not procesos:
+                registro["estado"] = ESTADO_SIN_RESULTADOS
+        nuevos = []
+        with lock:
+            resultados[fila["fila"]] = registro
+            registro["procesos"] = len(procesos)
+            for proceso in procesos:
+                id_proceso = str(proceso.get("idProceso") or "")
+                if id_proceso and id_proceso not in vistos: # Several rows may find the same proceso
+                    vistos.add(id_proceso)
+                    nuevos.append({"id_proceso": id_proceso, "nombre_busqueda": cliente or fila["nombre"],
+                                   "sujetos_procesales": proceso.get("sujetosProcesales")})
+        return nuevos
+
+    pendientes = (f for f in leer_filas(ruta) if f["fila"] not in hechas)
+    totales, errores_ingesta = Counter(), Counter()
+    inicio = time.monotonic()
+    while True:
+        bloque = list(itertools.islice(pendientes, filas_por_bloque))
+        if not bloque:
+            break
+        etapas = [Etapa("resolve", resolver, hilos=hilos_resolucion, capacidad=hilos_resolucion * 2)]
+        etapas += etapas_ingesta(db_engine, enriquecer, hilos_fetch, hilos_ia)
+        for metrica in Pipeline(etapas, intervalo_log=60.0).ejecutar(bloque):
+            totales[f"{metrica['etapa']}_recibidos"] += metrica["recibidos"]
+            totales[f"{metrica['etapa']}_errores"] += metrica["errores"]
+            errores_ingesta.update(metrica["ultimos_errores"])
+        registros = [resultados.pop(f["fila"]) for f in bloque if f["fila"] in resultados]
+        _guardar_checkpoint(checkpoint, registros)
+        for registro in registros:
+            totales[registro["estado"]] += 1
+            totales["procesos_encontrados"] += registro["procesos"]
+        segundos = time.monotonic() - inicio
+        logging.info(f"Importación: fila {bloque[-1]['fila']}, {totales['resolve_recibidos'] / segundos:.1f} filas/s, "
+                     f"{totales['persist_recibidos']} procesos ingeridos.")
+
+    segundos = time.monotonic() - inicio
+    errores_filas = Counter(r["error"] for r in cargar_checkpoint(checkpoint).values() if r["estado"] in (ESTADO_ERROR, ESTADO_INVALIDA))
+    procesos_ingeridos = totales["persist_recibidos"] - totales["persist_errores"]
+    resumen = {
+        "archivo": ruta,
+        "checkpoint": checkpoint,
+        "filas_omitidas": len(hechas),
+        "filas_procesadas": totales["resolve_recibidos"],
+        "filas_ok": totales[ESTADO_OK],
+        "filas_sin_resultados": totales[ESTADO_SIN_RESULTADOS],
+        "filas_error": totales[ESTADO_ERROR],
+        "filas_invalidas": totales[ESTADO_INVALIDA],
+        "procesos_encontrados": totales["procesos_encontrados"],
+        "procesos_distintos": len(vistos),
+        "procesos_ingeridos": procesos_ingeridos,
+        "procesos_con_error": totales["fetch_errores"] + totales["parse_errores"] + totales["persist_errores"],
+        "actuaciones_enriquecidas": totales["persist_ia_recibidos"] - totales["persist_ia_errores"],
+        "segundos": round(segundos, 1),
+        "filas_por_segundo": round(totales["resolve_recibidos"] / segundos, 2) if segundos else None,
+        "procesos_por_segundo": round(procesos_ingeridos / segundos, 2) if segundos else None,
+        "errores_filas": dict(errores_filas.most_common(5)),
+        "errores_ingesta": dict(errores_ingesta.most_common(5)),
+    }
+    logging.info(f"Importación de {ruta} terminada: {resumen['filas_procesadas']} filas, {procesos_ingeridos} procesos, "
+                 f"{resumen['filas_error']} filas con error, {resumen['segundos']} s.")
+    return resumen
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Importa una cartera de procesos (CSV o XLSX de radicados y/o nombres).")
+    parser.add_argument("archivo", help="Ruta del archivo CSV o XLSX.")
+    parser.add_argument("--cliente", default=None, help="Nombre de búsqueda con el que se guardan todos los procesos.")
+    parser.add_argument("--sin-ia", action="store_true", help="No generar los resúmenes y la urgencia con IA.")
+    parser.add_argument("--hilos", type=int, default=4, help="Consultas concurrentes a la API (búsqueda y detalle).")
+    parser.add_argument("--hilos-ia", type=int, default=4, help="Llamadas concurrentes al LLM.")
+    parser.add_argument("--bloque", type=int, default=FILAS_POR_BLOQUE, help="Filas por checkpoint.")
+    parser.add_argument("--max-paginas", type=int, default=MAX_PAGINAS, help="Páginas de resultados por nombre.")
+    parser.add_argument("--reiniciar", action="store_true", help="Ignorar el checkpoint e importar todo de nuevo.")
+    parser.add_argument("--tenant", action="store_true", help="Guardar en la base de datos del tenant del cliente (requiere --cliente).")
+    args = parser.parse_args()
+
+    if args.tenant:
+        if not args.cliente:
+            parser.error("--tenant requiere --cliente")
+        from app.db.sharding import engine_para_empresa
+        db_engine = engine_para_empresa(args.cliente)
+    else:
+        from app.db.database import engine as db_engine, create_db_and_tables
+        create_db_and_tables()
+    resumen = importar_cartera(
+        db_engine, args.archivo, cliente=args.cliente, enriquecer=not args.sin_ia, hilos_resolucion=args.hilos,
+        hilos_fetch=args.hilos, hilos_ia=args.hilos_ia, filas_por_bloque=args.bloque, max_paginas=args.max_paginas,
+        reiniciar=args.reiniciar
+    )
+    print(json.dumps(resumen, indent=2, ensure_ascii=False))
@@ -0,0 +1,202 @@
+'''
+Portfolio-level change detection between syncs of the watched companies.
+
+Every sync lists the active procesos of a company (search by name, SoloActivos) and reduces
+each search result to a fingerprint of its content (despacho, parties, fechaUltimaActuacion...).
+The snapshot is diffed against the previous one with set operations:
+
+    nuevos        = actual - anterior
+    desaparecidos = anterior - actual          (no longer active, or no longer found)
+    candidatos    = {p in actual & anterior whose fingerprint changed}
+
+A proceso can only be told apart from a missing page by a complete listing: when a result
+page after the first fails, or the result has more than max_paginas pages, the sync records
+new and changed procesos but no desaparecidos, and keeps the rest of the snapshot as it was.
+The first sync of a company needs a complete listing to set its baseline.
+
+Unchanged procesos are skipped entirely. Only new and changed ones get a detail request,
+whose fields (ubicación, ponente, clase...) are fingerprinted too and compared with the
+stored proceso to name the fields that changed; only then is the proceso written. The
+outcome is a compact change feed (`cambio_proceso`), and the fingerprints are stored in
+proceso.huella_busqueda / huella_detalle.
+
+    python -m app.services.change_detection [--empresa "ACME"]
+'''
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from app.clients.rama_judicial_client import consultar_procesos_por_nombre, consultar_detalle_proceso, consultar_todas_las_paginas
+from app.db import crud
+from app.models.models import CambioProceso, EmpresaVigilada, Proceso
+from app.services.ingestion import extraer_detalle, mapear_proceso
+from app.services.sujetos import indexar_sujetos
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MAX_PAGINAS = 50
+HILOS_DETALLE = 4
+
+# Fields of a search result that matter: a change in any of them triggers a detail request
+CAMPOS_BUSQUEDA = ("idProceso", "llaveProceso", "fechaProceso", "fechaUltimaActuacion", "despacho", "departamento", "sujetosProcesales", "esPrivado")
+# Stored fields compared after a detail request
+CAMPOS_DETALLE = ("numeroRadicacion", "despacho", "ponente", "sujetos", "fechaRadicacion", "tipoProceso", "claseProceso",
+                  "ubicacionExpediente", "demandante", "demandado")
+
+TIPO_NUEVO = "nuevo"
+TIPO_DESAPARECIDO = "desaparecido"
+TIPO_MODIFICADO = "modificado"
+
+def _huella(valores: dict) -> str:
+    contenido = json.dumps(valores, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+def huella_busqueda(resultado: dict) -> str:
+    '''Fingerprint of a search result (only the fields in CAMPOS_BUSQUEDA).'''
+    return _huella({campo: resultado.get(campo) for campo in CAMPOS_BUSQUEDA})
+
+def huella_detalle(proceso: Proceso) -> str:
+    '''Fingerprint of the detail fields of a proceso (CAMPOS_DETALLE).'''
+    return _huella({campo: getattr(proceso, campo) or None for campo in CAMPOS_DETALLE})
+
+def _consultar_detalle(id_proceso: str) -> dict | None:
+    try:
+        return extraer_detalle(consultar_detalle_proceso(id_proceso))
+    except Exception as e:
+        logging.error(f"Error al consultar el detalle del proceso {id_proceso}: {e}")
+        return None
+
+def sincronizar_empresa(db_engine, empresa: EmpresaVigilada, solo_activos: bool = True, max_paginas: int = MAX_PAGINAS,
+                        hilos: int = HILOS_DETALLE) -> dict | None:
+    '''
+    Lists the procesos of a watched company, diffs them against its previous snapshot and
+    records the changes. The first sync of a company only sets the baseline (no changes recorded).
+
+    Args:
+        db_engine: SQLAlchemy engine.
+        empresa: The watched company.
+        solo_activos: Optional. List only active procesos, so inactive ones show up as desaparecidos.
+        max_paginas: Optional. Maximum result pages read.
+        hilos: Optional. Concurrent detail requests.
+
+    Returns:
+        A summary {"empresa", "linea_base", "completo", "procesos", "nuevos", "desaparecidos", "modificados",
+        "sin_cambios", "detalles_consultados", "errores", "cambios": [CambioProceso]}, or None if the search
+        failed (or was incomplete on the first sync).
+    '''
+    resultados = consultar_todas_las_paginas(
+        lambda p: consultar_procesos_por_nombre(empresa.nombre, solo_activos=solo_activos, pagina=p), max_paginas
+    )
+    if resultados is None:
+        logging.error(f"No se pudo consultar la API para la empresa {empresa.nombre}.")
+        return None
+    actual = {str(r["idProceso"]): r for r in resultados if r.get("idProceso")}
+    huellas = {id_proceso: huella_busqueda(r) for id_proceso, r in actual.items()}
+    anterior = crud.get_snapshot_empresa(db_engine, empresa.id)
+    linea_base = not anterior
+    if not resultados.completo:
+        if linea_base:
+            logging.error(f"Listado incompleto para la empresa {empresa.nombre}; no se fija la línea base.")
+            return None
+        logging.warning(f"Listado incompleto para la empresa {empresa.nombre}; no se registran desaparecidos.")
+
+    nuevos = actual.keys() - anterior.keys()
+    desaparecidos = anterior.keys() - actual.keys() if resultados.completo else set()
+    candidatos = {p for p in actual.keys() & anterior.keys() if huellas[p] != anterior[p]["huella_busqueda"]}
+
+    # New to this company does not mean new to the database (e.g. found for another company):
+    # those already stored with the same fingerprint need no detail request either
+    almacenados = crud.get_procesos_by_idsrama(db_engine, nuevos | candidatos)
+    a_consultar = sorted(p for p in nuevos | candidatos if p not in almacenados or almacenados[p].huella_busqueda != huellas[p])
+    with ThreadPoolExecutor(max_workers=max(1, hilos)) as executor:
+        detalles = dict(zip(a_consultar, executor.map(_consultar_detalle, a_consultar)))
+
+    cambios, vistos, errores, huellas_sin_detalle = [], [], [], {}
+    for id_proceso in sorted(nuevos | candidatos):
+        resultado, guardado = actual[id_proceso], almacenados.get(id_proceso)
+        campos = {}
+        proceso_db_id = guardado.id if guardado else None
+        if id_proceso in detalles:
+            detalle = detalles[id_proceso]
+            if not detalle:
+                errores.append(id_proceso) # Left out of the snapshot, so it is retried next time
+                continue
+            proceso = mapear_proceso(detalle, None if guardado else empresa.nombre)
+            proceso.huella_busqueda = huellas[id_proceso]
+            proceso.huella_detalle = huella_detalle(proceso)
+            if guardado:
+                campos = {c: [getattr(guardado, c), getattr(proceso, c)] for c in CAMPOS_DETALLE
+                          if (getattr(guardado, c) or None) != (getattr(proceso, c) or None)}
+            if not guardado or guardado.huella_detalle != proceso.huella_detalle or guardado.huella_busqueda != proceso.huella_busqueda:
+                proceso_db_id = crud.create_proceso(db_engine, proceso)
+                if proceso_db_id and (not guardado or "sujetos" in campos):
+                    proceso.id = proceso_db_id
+                    indexar_sujetos(db_engine, proceso, detalle.get("sujetosProcesales") or resultado.get("sujetosProcesales"))
+        elif guardado and guardado.huella_busqueda != huellas[id_proceso]:
+            huellas_sin_detalle[id_proceso] = huellas[id_proceso]
+        fecha_anterior = anterior.get(id_proceso, {}).get("fechaUltimaActuacion")
+        if id_proceso in anterior and fecha_anterior != resultado.get("fechaUltimaActuacion"):
+            campos["fechaUltimaActuacion"] = [fecha_anterior, resultado.get("fechaUltimaActuacion")]
+        vistos.append({"idProceso": id_proceso, "huella_busqueda": huellas[id_proceso], "fechaUltimaActuacion": resultado.get("fechaUltimaActuacion")})
+        if id_proceso in nuevos:
+            cambios.append(CambioProceso(empresa_vigilada_id=empresa.id, idProceso=id_proceso, proceso_db_id=proceso_db_id, tipo=TIPO_NUEVO))
+        elif campos:
+            cambios.append(CambioProceso(empresa_vigilada_id=empresa.id, idProceso=id_proceso, proceso_db_id=proceso_db_id,
+                                         tipo=TIPO_MODIFICADO, campos=campos))
+    cambios += [CambioProceso(empresa_vigilada_id=empresa.id, idProceso=p, tipo=TIPO_DESAPARECIDO) for p in sorted(desaparecidos)]
+
+    crud.update_huellas_busqueda(db_engine, huellas_sin_detalle)
+    if not crud.apply_snapshot_empresa(db_engine, empresa.id, vistos, sorted(desaparecidos), [] if linea_base else cambios):
+        return None
+    resumen = {
+        "empresa": empresa.nombre,
+        "linea_base": linea_base,
+        "completo": resultados.completo,
+        "procesos": len(actual),
+        "nuevos": len(nuevos),
+        "desaparecidos": len(desaparecidos),
+        "modificados": sum(1 for c in cambios if c.tipo == TIPO_MODIFICADO),
+        "sin_cambios": len(actual) - len(nuevos) - len(candidatos),
+        "detalles_consultados": len(a_consultar),
+        "errores": len(errores),
+        "cambios": [] if linea_base else cambios,
+    }
+    logging.info(f"Sincronización de {empresa.nombre}: {resumen['procesos']} procesos, {resumen['nuevos']} nuevos, "
+                 f"{resumen['desaparecidos']} desaparecidos, {resumen['modificados']} modificados, "
+                 f"{resumen['detalles_consultados']} detalles consultados{' (línea base)' if linea_base else ''}.")
+    return resumen
+
+def sincronizar_vigiladas(db_engine, solo_activos: bool = True) -> list[dict]:
+    '''Syncs every watched company. Returns the summary of each one (see sincronizar_empresa).'''
+    resumenes = []
+    for empresa in crud.get_empresas_vigiladas(db_engine):
+        resumen = sincronizar_empresa(db_engine, empresa, solo_activos=solo_activos)
+        if resumen:
+            resumenes.append(resumen)
+    return resumenes
+
+def describir_cambio(cambio: CambioProceso) -> str:
+    '''One-line description of a change for the feed, e.g. "12345: ponente 'A' → 'B'".'''
+    if cambio.tipo == TIPO_NUEVO:
+        return f"{cambio.idProceso}: proceso nuevo"
+    if cambio.tipo == TIPO_DESAPARECIDO:
+        return f"{cambio.idProceso}: ya no aparece entre los procesos activos"
+    detalle = "; ".join(f"{campo} '{antes or ''}' → '{despues or ''}'" for campo, (antes, despues) in cambio.campos.items())
+    return f"{cambio.idProceso}: {detalle}"
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Detecta cambios en los procesos de las empresas vigiladas.")
+    parser.add_argument("--empresa", default=None, help="Sincronizar solo esta empresa vigilada (nombre exacto).")
+    parser.add_argument("--todos", action="store_true", help="Incluir procesos inactivos en la consulta.")
+    args = parser.parse_args()
+
+    from app.db.database import engine, create_db_and_tables
+    create_db_and_tables()
+    empresas = [e for e in crud.get_empresas_vigiladas(engine) if not args.empresa or e.nombre == args.empresa]
+    for empresa in empresas:
+        resumen = sincronizar_empresa(engine, empresa, solo_activos=not args.todos)
+        if resumen:
+            for cambio in resumen["cambios"]:
+                print(f"[{empresa.nombre}] {describir_cambio(cambio)}")
@@ -0,0 +1,252 @@
+'''
+Services for extracting and summarizing documents attached to judicial actions (actuaciones).
+
+PyMuPDF extraction is CPU-bound, so large PDFs are split by page ranges across a
+process pool. The result keeps per-page offsets, flags scanned (image-only) pages
+and is cached in the `documento` table keyed by the checksum of the file.
+Long documents are summarized map-reduce style over token-budgeted chunks.
+'''
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+from app.db import crud
+from app.models.models import Documento, PaginaDocumento, ChunkDocumento
+from app.services import ai_services
+from app.services.retrieval import indexar_documento
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PAGINAS_POR_BLOQUE = 20 # Pages handed to a worker per task
+MIN_PAGINAS_PARALELO = 40 # Below this, starting the pool costs more than it saves
+MIN_CARACTERES_PAGINA = 10 # Pages with less text than this and with images are treated as scanned
+SEPARADOR_PAGINAS = "\n\n"
+
+# Bytes of the PDF being processed, set once per worker process by `_inicializar_worker`
+_contenido_worker: bytes | None = None
+
+def _inicializar_worker(contenido: bytes) -> None:
+    global _contenido_worker
+    _contenido_worker = contenido
+
+def _extraer_paginas(contenido: bytes, inicio: int, fin: int) -> list[tuple[str, bool]]:
+    '''Extracts pages [inicio, fin) and returns (texto, es_imagen) for each one.'''
+    paginas = []
+    with fitz.open(stream=contenido, filetype="pdf") as doc:
+        for numero in range(inicio, min(fin, doc.page_count)):
+            page = doc.load_page(numero)
+            texto = page.get_text().strip()
+            es_imagen = len(texto) < MIN_CARACTERES_PAGINA and bool(page.get_images(full=False))
+            paginas.append(("" if es_imagen else texto, es_imagen))
+    return paginas
+
+def _extraer_rango_worker(inicio: int, fin: int) -> list[tuple[str, bool]]:
+    return _extraer_paginas(_contenido_worker, inicio, fin)
+
+def calcular_checksum(contenido: bytes) -> str:
+    '''Returns the SHA-256 hex digest used as the cache key of a document.'''
+    return hashlib.sha256(contenido).hexdigest()
+
+def extraer_texto_pdf(contenido: bytes, max_workers: int | None = None) -> Documento | None:
+    '''
+    Extracts the text of every page of a PDF, in parallel for large documents.
+
+    Args:
+        contenido: The binary content of the PDF.
+        max_workers: Optional. Maximum number of worker processes (defaults to the CPU count).
+
+    Returns:
+        An unsaved Documento with the full text and per-page offsets, or None if the PDF can't be read.
+    '''
+    try:
+        with fitz.open(stream=contenido, filetype="pdf") as doc:
+            num_paginas = doc.page_count
+    except Exception as e:
+        logging.error(f"No se pudo abrir el PDF: {e}")
+        return None
+
+    max_workers = max_workers or os.cpu_count() or 1
+    rangos = [(i, min(i + PAGINAS_POR_BLOQUE, num_paginas)) for i in range(0, num_paginas, PAGINAS_POR_BLOQUE)]
+
+    try:
+        if num_paginas < MIN_PAGINAS_PARALELO or max_workers == 1:
+            paginas_extraidas = _extraer_paginas(contenido, 0, num_paginas)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(max_workers, len(rangos)),
+                initializer=_inicializar_worker,
+                initargs=(contenido,)
+            ) as executor:
+                # map() preserves the order of the ranges, so pages come back in order
+                bloques = executor.map(_extraer_rango_worker, *zip(*rangos))
+                paginas_extraidas = [pagina for bloque in bloques for pagina in bloque]
+    except Exception as e:
+        logging.error(f"Error al extraer texto del PDF: {e}")
+        return None
+
+    partes = []
+    paginas = []
+    offset = 0
+    for numero, (texto, es_imagen) in enumerate(paginas_extraidas, start=1):
+        paginas.append(PaginaDocumento(numero=numero, inicio=offset, fin=offset + len(texto), es_imagen=es_imagen))
+        partes.append(texto)
+        offset += len(texto) + len(SEPARADOR_PAGINAS)
+
+    documento = Documento(
+        checksum=calcular_checksum(contenido),
+        num_paginas=num_paginas,
+        texto=SEPARADOR_PAGINAS.join(partes),
+        paginas=paginas
+    )
+    if documento.paginas_imagen:
+        logging.warning(f"{len(documento.paginas_imagen)} de {num_paginas} páginas parecen escaneadas (sin texto): {documento.paginas_imagen[:10]}")
+    logging.info(f"Texto extraído de {num_paginas} páginas ({len(documento.texto)} caracteres).")
+    return documento
+
+def obtener_texto_documento(
+    db_engine,
+    contenido: bytes,
+    id_reg_documento: str | None = None,
+    nombre: str | None = None,
+    actuacion_db_id: int | None = None
+) -> Documento | None:
+    '''
+    Returns the extracted text of a document, reusing the cached extraction when the
+    same file (same checksum) was already processed.
+
+    Args:
+        db_engine: The SQLAlchemy engine where extractions are cached.
+        contenido: The binary content of the PDF.
+        id_reg_documento: Optional. The document ID from the Rama Judicial API.
+        nombre: Optional. The document name from the Rama Judicial API.
+        actuacion_db_id: Optional. The DB ID of the actuación the document belongs to.
+
+    Returns:
+        The Documento (with its DB ID when it could be stored), or None if extraction fails.
+    '''
+    checksum = calcular_checksum(contenido)
+    documento = crud.get_documento_by_checksum(db_engine, checksum)
+    if documento:
+        logging.info(f"Texto del documento {checksum[:12]} obtenido de la caché.")
+        return documento
+
+    documento = extraer_texto_pdf(contenido)
+    if not documento:
+        return None
+    documento.idRegDocumento = id_reg_documento
+    documento.nombre = nombre
+    documento.actuacion_db_id = actuacion_db_id
+    documento.id = crud.create_documento(db_engine, documento)
+    indexar_documento(db_engine, documento)
+    return documento
+
+def _huella_chunk(texto: str) -> str:
+    # The map prompt is part of the fingerprint: editing it invalidates chunk summaries,
+    # while editing the reduce prompt only redoes the (cheap) reduce step.
+    contenido = ai_services.document_map_template_text + "\x00" + texto
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+def _partir_texto(texto: str, max_caracteres: int) -> list[str]:
+    '''Splits text longer than the budget on paragraph, then line, then hard boundaries.'''
+    if len(texto) <= max_caracteres:
+        return [texto]
+    for separador in ("\n\n", "\n", ". "):
+        bloques = texto.split(separador)
+        if len(bloques) > 1:
+            partes, actual = [], ""
+            for bloque in bloques:
+                candidato = f"{actual}{separador}{bloque}" if actual else bloque
+                if len(candidato) > max_caracteres and actual:
+                    partes.append(actual)
+                    candidato = bloque
+                actual = candidato
+            partes.append(actual)
+            # Recurse for blocks that were still too long on their own
+            return [p for parte in partes for p in _partir_texto(parte, max_caracteres)]
+    return [texto[i:i + max_caracteres] for i in range(0, len(texto), max_caracteres)]
+
+def dividir_documento_en_chunks(documento: Documento, max_tokens: int = ai_services.MAX_TOKENS_FRAGMENTO) -> list[ChunkDocumento]:
+    '''
+    Groups consecutive pages into chunks that fit the token budget of the map step.
+
+    Pages are never merged past the budget; a single page that exceeds it is split on
+    paragraph boundaries. Scanned pages without text are skipped.
+
+    Args:
+        documento: The extracted document.
+        max_tokens: Token budget of each chunk.
+
+    Returns:
+        The chunks in document order.
+    '''
+    max_caracteres = max_tokens * ai_services.CARACTERES_POR_TOKEN
+    piezas = [] # (pagina, texto)
+    for pagina in documento.paginas:
+        texto = documento.texto[pagina.inicio:pagina.fin].strip()
+        if texto:
+            piezas.extend((pagina.numero, parte) for parte in _partir_texto(texto, max_caracteres))
+
+    chunks = []
+    actual = []
+    tamano_actual = 0
+    for pagina, texto in piezas + [(None, None)]:
+        if actual and (texto is None or tamano_actual + len(texto) > max_caracteres):
+            texto_chunk = SEPARADOR_PAGINAS.join(t for _, t in actual)
+            chunks.append(ChunkDocumento(
+                documento_db_id=documento.id,
+                indice=len(chunks),
+                pagina_inicio=actual[0][0],
+                pagina_fin=actual[-1][0],
+                huella=_huella_chunk(texto_chunk),
+                texto=texto_chunk
+            ))
+            actual, tamano_actual = [], 0
+        if texto is not None:
+            actual.append((pagina, texto))
+            tamano_actual += len(texto) + len(SEPARADOR_PAGINAS)
+    return chunks
+
+def resumir_documento(db_engine, documento: Documento) -> str | None:
+    '''
+    Summarizes a (possibly very long) document with map-reduce over token-budgeted chunks.
+
+    Chunk summaries already stored for the same chunk text and map prompt are reused,
+    so only new or changed chunks hit the LLM. The final summary is stored in the
+    `documento` table when the documento has a DB ID.
+
+    Args:
+        db_engine: The SQLAlchemy engine where chunk summaries are stored.
+        documento: The extracted document.
+
+    Returns:
+        The document summary, or None if an error occurs or LLM is not available.
+    '''
+    chunks = dividir_documento_en_chunks(documento)
+    if not chunks:
+        logging.warning(f"Documento {documento.checksum[:12]} sin texto extraíble. No se generará resumen.")
+        return ""
+
+    if documento.id:
+        previos = {c.huella: c.resumen_ia for c in crud.get_chunks_by_documento_db_id(db_engine, documento.id) if c.resumen_ia}
+        for chunk in chunks:
+            chunk.resumen_ia = previos.get(chunk.huella)
+
+    pendientes = [c for c in chunks if not c.resumen_ia]
+    logging.info(f"Resumiendo documento en {len(chunks)} fragmento(s); {len(pendientes)} sin resumen previo.")
+    if pendientes:
+        resumenes = ai_services.resumir_fragmentos(
+            [(f"{c.pagina_inicio}-{c.pagina_fin}", c.texto) for c in pendientes]
+        )
+        for chunk, resumen in zip(pendientes, resumenes):
+            chunk.resumen_ia = resumen
+        if documento.id:
+            crud.create_documento_chunks(db_engine, [c for c in pendientes if c.resumen_ia])
+        if any(r is None for r in resumenes):
+            return None
+
+    resumen = ai_services.reducir_resumenes([c.resumen_ia for c in chunks])
+    if resumen is not None and documento.id:
+        crud.update_documento_resumen(db_engine, documento.id, resumen)
+    return resumen
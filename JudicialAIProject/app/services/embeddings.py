@@ -0,0 +1,85 @@
+'''
+Offline CPU text embeddings for the local retrieval index.
+
+The default backend is a feature-hashing embedder: accent-folded word unigrams, word
+bigrams and character trigrams are hashed into a fixed number of signed dimensions,
+weighted with sublinear term frequency and L2-normalized. It needs no model download,
+no network and no GPU, is deterministic across processes, and works well enough on the
+very repetitive vocabulary of judicial annotations. A sentence-transformers model can be
+plugged in instead through EMBEDDING_MODEL when it is installed locally.
+'''
+import logging
+import os
+import re
+import unicodedata
+import zlib
+from collections import Counter
+import numpy as np
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DIMENSION_HASHING = 512
+
+def normalizar_texto(texto: str) -> str:
+    '''Lower-cases and strips accents, e.g. "AUDIENCIA de CONCILIACIÓN" -> "audiencia de conciliacion".'''
+    texto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+class HashingEmbedder:
+    '''Deterministic feature-hashing embedder (no model files, CPU only).'''
+
+    def __init__(self, dim: int = DIMENSION_HASHING):
+        self.dim = dim
+        self.nombre = f"hashing-{dim}"
+
+    def _rasgos(self, texto: str) -> Counter:
+        palabras = re.findall(r"\w+", normalizar_texto(texto))
+        rasgos = Counter(palabras)
+        rasgos.update(f"{a} {b}" for a, b in zip(palabras, palabras[1:]))
+        for palabra in palabras:
+            if len(palabra) > 3:
+                relleno = f"#{palabra}#"
+                rasgos.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+        return rasgos
+
+    def embed(self, textos: list[str]) -> np.ndarray:
+        '''Returns a (len(textos), dim) float32 matrix of L2-normalized vectors.'''
+        matriz = np.zeros((len(textos), self.dim), dtype=np.float32)
+        for fila, texto in enumerate(textos):
+            for rasgo, frecuencia in self._rasgos(texto).items():
+                h = zlib.crc32(rasgo.encode("utf-8"))
+                signo = 1.0 if h & 0x80000000 else -1.0
+                matriz[fila, h % self.dim] += signo * (1.0 + np.log(frecuencia))
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        normas[normas == 0] = 1.0
+        return matriz / normas
+
+class SentenceTransformerEmbedder:
+    '''Local sentence-transformers model (optional dependency, loaded from disk/cache only).'''
+
+    def __init__(self, modelo: str):
+        from sentence_transformers import SentenceTransformer
+        self.modelo = SentenceTransformer(modelo, device="cpu")
+        self.dim = self.modelo.get_sentence_embedding_dimension()
+        self.nombre = f"st-{os.path.basename(modelo)}"
+
+    def embed(self, textos: list[str]) -> np.ndarray:
+        return self.modelo.encode(textos, batch_size=64, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+_embedder = None
+
+def obtener_embedder():
+    '''Returns the configured embedder (shared instance).'''
+    global _embedder
+    if _embedder is None:
+        modelo = os.getenv("EMBEDDING_MODEL")
+        if modelo:
+            try:
+                _embedder = SentenceTransformerEmbedder(modelo)
+                logging.info(f"Embeddings con el modelo local {modelo} (dim {_embedder.dim}).")
+            except Exception as e:
+                logging.warning(f"No se pudo cargar EMBEDDING_MODEL={modelo} ({e}). Se usará el embedder por hashing.")
+        if _embedder is None:
+            _embedder = HashingEmbedder()
+    return _embedder
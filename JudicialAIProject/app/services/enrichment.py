@@ -0,0 +1,197 @@
+'''
+Lazy, prioritized AI enrichment (summary and urgency) of stored actuaciones.
+
+Actuaciones are stored without AI fields and enqueued here. Background workers process
+the most valuable ones first (recent, and likely urgent according to cheap keyword
+heuristics), and the UI can enrich a single actuación on demand, ahead of the queue.
+'''
+import heapq
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta
+from app.db import crud
+from app.models.models import Actuacion
+from app.services.ai_services import generar_resumen_actuacion, clasificar_urgencia_actuacion
+from app.services.retrieval import indexar_actuaciones
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Cheap signals of urgency in the type/annotation of an actuación (upper case, accents kept)
+PALABRAS_PRIORITARIAS = (
+    "AUDIENCIA", "FIJA FECHA", "TÉRMINO", "TERMINO", "REQUIER", "TRASLADO", "SENTENCIA",
+    "MANDAMIENTO", "EMBARGO", "CITACI", "NOTIFICACI", "RECURSO", "FALLO",
+)
+PALABRAS_BAJA_PRIORIDAD = ("CONSTANCIA", "AL DESPACHO", "RECEPCIÓN MEMORIAL", "RECEPCION MEMORIAL", "ARCHIVO")
+
+DIAS_VIDA_MEDIA = 30 # Recency weight halves every this many days
+NUM_WORKERS = 2 # Concurrent background enrichments (bounded by the LLM rate limits)
+ESPERA_REINTENTO = timedelta(minutes=10) # Backoff after a failed enrichment, doubled on every further failure
+ESPERA_MAX_REINTENTO = timedelta(days=1)
+
+def parsear_fecha_api(valor: str | None) -> datetime | None:
+    '''Parses the API dates, e.g. "2024-05-20T00:00:00". Returns None if it can't be parsed.'''
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor[:19])
+    except ValueError:
+        return None
+
+def prioridad_actuacion(actuacion: Actuacion, ahora: datetime | None = None) -> float:
+    '''
+    Estimates how valuable it is to enrich an actuación soon. Higher is more urgent.
+
+    Combines recency (exponential decay on fechaActuacion), a pending term end
+    (fechaFinalizaTermino in the future) and keyword heuristics on the text.
+    '''
+    ahora = ahora or datetime.utcnow()
+    prioridad = 0.0
+
+    fecha = parsear_fecha_api(actuacion.fechaActuacion) or parsear_fecha_api(actuacion.fechaRegistro)
+    if fecha:
+        dias = max((ahora - fecha).days, 0)
+        prioridad += 10 * 0.5 ** (dias / DIAS_VIDA_MEDIA)
+
+    fin_termino = parsear_fecha_api(actuacion.fechaFinalizaTermino)
+    if fin_termino and fin_termino >= ahora:
+        prioridad += 8
+
+    texto = f"{actuacion.actuacion or ''} {actuacion.anotacion or ''}".upper()
+    if any(palabra in texto for palabra in PALABRAS_PRIORITARIAS):
+        prioridad += 5
+    elif any(palabra in texto for palabra in PALABRAS_BAJA_PRIORIDAD):
+        prioridad -= 2
+    return prioridad
+
+def generar_campos_ia(actuacion: Actuacion) -> Actuacion:
+    '''Fills the missing AI fields of an actuación (LLM calls only, nothing is stored). Returns the same model.'''
+    texto = actuacion.anotacion or actuacion.actuacion or ""
+    if not actuacion.resumen_ia:
+        actuacion.resumen_ia = generar_resumen_actuacion(texto)
+    if not actuacion.clasificacion_urgencia_ia:
+        actuacion.clasificacion_urgencia_ia = clasificar_urgencia_actuacion(texto)
+    return actuacion
+
+def enriquecer_actuacion(db_engine, actuacion: Actuacion) -> Actuacion:
+    '''
+    Generates and stores the missing AI fields of an actuación. Returns the updated model.
+
+    The actuación is re-indexed only when a field was actually generated. If a field is still
+    missing (the LLM failed or is unavailable) the attempt is recorded, so the actuación is
+    not enqueued again until its backoff expires.
+    '''
+    anteriores = (actuacion.resumen_ia, actuacion.clasificacion_urgencia_ia)
+    generar_campos_ia(actuacion)
+    if actuacion.id:
+        if (actuacion.resumen_ia, actuacion.clasificacion_urgencia_ia) != anteriores:
+            crud.update_actuacion_ia(db_engine, actuacion.id, actuacion.resumen_ia, actuacion.clasificacion_urgencia_ia)
+            # Re-index with the summary and urgency so retrieval can use and filter by them
+            indexar_actuaciones(db_engine, [actuacion])
+        if actuacion.resumen_ia is None or actuacion.clasificacion_urgencia_ia is None:
+            proximo = crud.update_actuacion_ia_fallida(db_engine, actuacion.id, datetime.utcnow(), ESPERA_REINTENTO, ESPERA_MAX_REINTENTO)
+            logging.warning(f"Enriquecimiento incompleto de la actuación {actuacion.id}; próximo intento: {proximo}.")
+    return actuacion
+
+class ColaEnriquecimiento:
+    '''Priority queue of actuaciones pending AI enrichment, drained by background threads.'''
+
+    def __init__(self, db_engine, num_workers: int = NUM_WORKERS):
+        self.db_engine = db_engine
+        self.num_workers = num_workers
+        self._heap = [] # (-prioridad, secuencia, actuacion_db_id)
+        self._pendientes = {} # actuacion_db_id -> Actuacion
+        self._en_proceso = set()
+        self._secuencia = itertools.count()
+        self._condicion = threading.Condition()
+        self._workers = []
+
+    def encolar(self, actuaciones: list[Actuacion], ahora: datetime | None = None) -> int:
+        '''Enqueues actuaciones missing AI fields. Returns how many were added.'''
+        agregadas = 0
+        with self._condicion:
+            for act in actuaciones:
+                if not act.id or act.id in self._pendientes or act.id in self._en_proceso:
+                    continue
+                if act.resumen_ia and act.clasificacion_urgencia_ia:
+                    continue
+                self._pendientes[act.id] = act
+                heapq.heappush(self._heap, (-prioridad_actuacion(act, ahora), next(self._secuencia), act.id))
+                agregadas += 1
+            self._condicion.notify_all()
+        self._iniciar_workers()
+        return agregadas
+
+    def pendientes(self) -> int:
+        with self._condicion:
+            return len(self._pendientes) + len(self._en_proceso)
+
+    def esta_pendiente(self, actuacion_db_id: int) -> bool:
+        with self._condicion:
+            return actuacion_db_id in self._pendientes or actuacion_db_id in self._en_proceso
+
+    def reclamar(self, actuacion_db_id: int) -> bool:
+        '''
+        Takes an actuación out of the queue to enrich it on demand (e.g. from the UI).
+        Returns False if a worker is already processing it.
+        '''
+        with self._condicion:
+            if actuacion_db_id in self._en_proceso:
+                return False
+            # The heap entry stays behind and is skipped when popped
+            self._pendientes.pop(actuacion_db_id, None)
+            self._en_proceso.add(actuacion_db_id)
+            return True
+
+    def liberar(self, actuacion_db_id: int) -> None:
+        with self._condicion:
+            self._en_proceso.discard(actuacion_db_id)
+
+    def enriquecer_ahora(self, actuacion: Actuacion) -> Actuacion | None:
+        '''Enriches one actuación immediately, bypassing the queue. Returns None if it is already in progress.'''
+        if not self.reclamar(actuacion.id):
+            return None
+        try:
+            return enriquecer_actuacion(self.db_engine, actuacion)
+        finally:
+            self.liberar(actuacion.id)
+
+    def _siguiente(self) -> Actuacion:
+        with self._condicion:
+            while True:
+                while self._heap:
+                    _, _, actuacion_db_id = heapq.heappop(self._heap)
+                    actuacion = self._pendientes.pop(actuacion_db_id, None)
+                    if actuacion is not None: # Otherwise it was claimed on demand
+                        self._en_proceso.add(actuacion_db_id)
+                        return actuacion
+                self._condicion.wait()
+
+    def _trabajar(self) -> None:
+        while True:
+            actuacion = self._siguiente()
+            try:
+                enriquecer_actuacion(self.db_engine, actuacion)
+            except Exception as e:
+                logging.error(f"Error al enriquecer la actuación {actuacion.id}: {e}")
+            finally:
+                self.liberar(actuacion.id)
+
+    def _iniciar_workers(self) -> None:
+        with self._condicion:
+            while len(self._workers) < self.num_workers:
+                worker = threading.Thread(target=self._trabajar, name=f"enriquecimiento-{len(self._workers)}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+_colas = {}
+_colas_lock = threading.Lock()
+
+def obtener_cola(db_engine) -> ColaEnriquecimiento:
+    '''Returns the process-wide enrichment queue of an engine (shared across Streamlit reruns and sessions).'''
+    with _colas_lock:
+        clave = str(db_engine.url)
+        if clave not in _colas:
+            _colas[clave] = ColaEnriquecimiento(db_engine)
+        return _colas[clave]
@@ -0,0 +1,235 @@
+'''
+Fuzzy resolution of company names.
+
+The same company is published as "BANCOLOMBIA S.A.", "BANCOLOMBIA SA" or "BANCO LOMBIA",
+so exact matches on sujeto.nombre_normalizado or proceso.nombre_busqueda miss procesos.
+Names are reduced to a comparison key (accents, punctuation, legal suffixes such as S.A.S.
+or LTDA and spaces removed) and indexed by character trigrams in an in-memory inverted
+index. A lookup adds up the posting lists of the query trigrams with NumPy and ranks the
+names by Dice similarity, which takes a few milliseconds over hundreds of thousands of names.
+
+The index is built from the sujeto table and the search names of the procesos, and is
+brought up to date incrementally (by ID) on every lookup. The search UI and the company
+watchlist (`empresa_vigilada`) use it to merge the aliases of a client.
+'''
+import logging
+import re
+import threading
+from collections import defaultdict
+import numpy as np
+from app.db import crud
+from app.models.models import CandidatoEmpresa, EmpresaVigilada
+from app.services.sujetos import normalizar_nombre
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+UMBRAL_SIMILITUD = 0.75 # Minimum similarity for a name to be considered the same company
+MAX_CANDIDATOS = 10
+TAMANO_LOTE = 20_000 # Rows read from SQLite per batch when updating the index
+
+# Legal forms and status words that do not identify the company (on normalized text: "S.A.S." -> "S A S")
+SUFIJOS_SOCIETARIOS = (
+    r"S ?A ?S", r"S ?A", r"S ?A ?E ?S ?P", r"E ?S ?P", r"LTDA", r"LIMITADA", r"S ?EN ?C ?S?", r"S ?C ?A", r"S ?C ?S",
+    r"SOCIEDAD ANONIMA", r"SOCIEDAD POR ACCIONES SIMPLIFICADA", r"Y CIA", r"CIA", r"E ?U", r"BIC",
+    r"EN LIQUIDACION(?: JUDICIAL| FORZOSA)?", r"EN REORGANIZACION", r"EN CONCORDATO",
+)
+PATRON_SUFIJOS = re.compile(r"(?:\s+(?:" + "|".join(SUFIJOS_SOCIETARIOS) + r"))+$")
+
+def clave_empresa(nombre: str) -> str:
+    '''
+    Comparison key of a company name: normalized, without NIT, legal suffixes or spaces,
+    e.g. "Bancolombia S.A." and "BANCO LOMBIA" -> "BANCOLOMBIA".
+    '''
+    return _clave_normalizada(normalizar_nombre(nombre or ""))
+
+def _clave_normalizada(normalizado: str) -> str:
+    # For names already normalized (sujeto.nombre_normalizado)
+    sin_sufijos = PATRON_SUFIJOS.sub("", normalizado) or normalizado
+    return sin_sufijos.replace(" ", "")
+
+def trigramas(clave: str) -> set[str]:
+    '''Character trigrams of a key, padded so that the first and last letters weigh as much as the rest.'''
+    relleno = f"##{clave}#"
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+class IndiceNombres:
+    '''In-memory trigram inverted index of the company and party names seen in the database.'''
+
+    def __init__(self):
+        self.nombres_normalizados: list[str] = [] # One entry per distinct sujeto.nombre_normalizado
+        self.nombres: list[dict] = [] # Spellings seen per entry -> count
+        self.nombres_busqueda: list[set] = [] # proceso.nombre_busqueda values per entry
+        self.apariciones: list[int] = []
+        self._posicion: dict[str, int] = {}
+        self._postings: dict[str, list[int]] = defaultdict(list)
+        self._tamanos: list[int] = [] # Number of trigrams per entry
+        self._arrays: dict[str, np.ndarray] = {} # Posting lists as arrays, rebuilt when they grow
+        self._tamanos_np = np.zeros(0, dtype=np.int32)
+        self._lock = threading.Lock()
+        self._lock_actualizacion = threading.Lock() # One update at a time, so no row is added twice
+        self.ultimo_sujeto_id = 0
+        self.ultimo_proceso_id = 0
+
+    def __len__(self) -> int:
+        return len(self.nombres_normalizados)
+
+    def _entrada(self, nombre_normalizado: str) -> int:
+        posicion = self._posicion.get(nombre_normalizado)
+        if posicion is not None:
+            return posicion
+        posicion = len(self.nombres_normalizados)
+        self._posicion[nombre_normalizado] = posicion
+        self.nombres_normalizados.append(nombre_normalizado)
+        self.nombres.append({})
+        self.nombres_busqueda.append(set())
+        self.apariciones.append(0)
+        grams = trigramas(_clave_normalizada(nombre_normalizado))
+        self._tamanos.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(posicion)
+            self._arrays.pop(gram, None)
+        return posicion
+
+    def agregar(self, nombre: str, nombre_normalizado: str | None = None, nombre_busqueda: str | None = None) -> None:
+        '''Adds one occurrence of a name (a party, or the name a proceso was searched by).'''
+        nombre_normalizado = nombre_normalizado or normalizar_nombre(nombre)
+        if not nombre_normalizado:
+            return
+        with self._lock:
+            posicion = self._entrada(nombre_normalizado)
+            self.nombres[posicion][nombre] = self.nombres[posicion].get(nombre, 0) + 1
+            self.apariciones[posicion] += 1
+            if nombre_busqueda:
+                self.nombres_busqueda[posicion].add(nombre_busqueda)
+
+    def actualizar(self, db_engine) -> int:
+        '''Adds the sujetos and procesos stored since the last update. Returns the number of rows read.'''
+        with self._lock_actualizacion:
+            leidas = 0
+            while True:
+                sujetos = crud.get_nombres_sujetos_after_id(db_engine, self.ultimo_sujeto_id, TAMANO_LOTE)
+                if not sujetos:
+                    break
+                for sujeto in sujetos:
+                    self.agregar(sujeto["nombre"], sujeto["nombre_normalizado"])
+                self.ultimo_sujeto_id = sujetos[-1]["id"]
+                leidas += len(sujetos)
+            while True:
+                procesos = crud.get_nombres_busqueda_after_id(db_engine, self.ultimo_proceso_id, TAMANO_LOTE)
+                if not procesos:
+                    break
+                for proceso in procesos:
+                    self.agregar(proceso["nombre_busqueda"], nombre_busqueda=proceso["nombre_busqueda"])
+                self.ultimo_proceso_id = procesos[-1]["id"]
+                leidas += len(procesos)
+            return leidas
+
+    def _posting(self, gram: str) -> np.ndarray:
+        array = self._arrays.get(gram)
+        if array is None:
+            array = np.asarray(self._postings.get(gram, ()), dtype=np.int32)
+            self._arrays[gram] = array
+        return array
+
+    def buscar(self, nombre: str, limite: int = MAX_CANDIDATOS, umbral: float = UMBRAL_SIMILITUD) -> list[CandidatoEmpresa]:
+        '''
+        Names most similar to `nombre`, most similar first.
+
+        Args:
+            nombre: Company name as typed by the user or published by the API.
+            limite: Optional. Maximum number of candidates.
+            umbral: Optional. Minimum Dice similarity of the trigram sets (0..1).
+
+        Returns:
+            A list of CandidatoEmpresa.
+        '''
+        grams = trigramas(clave_empresa(nombre))
+        with self._lock:
+            if not self.nombres_normalizados:
+                return []
+            if len(self._tamanos_np) != len(self._tamanos):
+                self._tamanos_np = np.asarray(self._tamanos, dtype=np.int32)
+            postings = [self._posting(g) for g in grams if g in self._postings]
+            if not postings:
+                return []
+            # Shared trigrams per entry, then Dice = 2|A∩B| / (|A| + |B|)
+            comunes = np.bincount(np.concatenate(postings), minlength=len(self._tamanos_np))
+            similitud = 2.0 * comunes / (len(grams) + self._tamanos_np)
+            candidatos = np.flatnonzero(similitud >= umbral)
+            if len(candidatos) > limite:
+                candidatos = candidatos[np.argpartition(-similitud[candidatos], limite)[:limite]]
+            candidatos = candidatos[np.argsort(-similitud[candidatos], kind="stable")]
+            return [CandidatoEmpresa(
+                nombre=max(self.nombres[i], key=self.nombres[i].get),
+                nombre_normalizado=self.nombres_normalizados[i],
+                similitud=round(float(similitud[i]), 3),
+                apariciones=self.apariciones[i],
+                nombres_busqueda=sorted(self.nombres_busqueda[i]),
+            ) for i in candidatos]
+
+_indices: dict[str, IndiceNombres] = {}
+_indices_lock = threading.Lock()
+
+def obtener_indice_nombres(db_engine) -> IndiceNombres:
+    '''Returns the name index of a database, built on first use and updated with the rows added since.'''
+    with _indices_lock:
+        indice = _indices.setdefault(str(db_engine.url), IndiceNombres())
+    leidas = indice.actualizar(db_engine)
+    if leidas:
+        logging.info(f"Índice de nombres actualizado: {leidas} filas nuevas, {len(indice)} nombres distintos.")
+    return indice
+
+def resolver_empresa(db_engine, nombre: str, limite: int = MAX_CANDIDATOS, umbral: float = UMBRAL_SIMILITUD) -> list[CandidatoEmpresa]:
+    '''
+    Resolves a company name against the names stored locally (parties and search names).
+
+    Args:
+        db_engine: SQLAlchemy engine.
+        nombre: Company name, with any spelling, accents or legal suffix.
+        limite: Optional. Maximum number of candidates.
+        umbral: Optional. Minimum similarity (0..1).
+
+    Returns:
+        The candidate aliases, most similar first.
+    '''
+    if not nombre or not nombre.strip():
+        return []
+    return obtener_indice_nombres(db_engine).buscar(nombre, limite=limite, umbral=umbral)
+
+def procesos_de_empresa(db_engine, nombre: str, umbral: float = UMBRAL_SIMILITUD, rol: str | None = None, limit: int = 100) -> tuple[list[CandidatoEmpresa], list[dict]]:
+    '''
+    Local procesos of a company under any of its aliases (as a party or as the search name).
+
+    Returns:
+        (aliases used, procesos).
+    '''
+    alias = resolver_empresa(db_engine, nombre, limite=50, umbral=umbral)
+    procesos = crud.get_procesos_by_alias(
+        db_engine,
+        [a.nombre_normalizado for a in alias],
+        sorted({b for a in alias for b in a.nombres_busqueda}),
+        rol=rol, limit=limit
+    )
+    return alias, procesos
+
+def vigilar_empresa(db_engine, nombre: str, umbral: float = UMBRAL_SIMILITUD) -> int | None:
+    '''Adds a company to the watchlist (or updates its threshold). Returns its database ID.'''
+    if not normalizar_nombre(nombre or ""):
+        return None
+    return crud.create_empresa_vigilada(db_engine, EmpresaVigilada(
+        nombre=nombre.strip(), nombre_normalizado=normalizar_nombre(nombre), umbral_similitud=umbral
+    ))
+
+def resumen_empresas_vigiladas(db_engine, limit: int = 100) -> list[dict]:
+    '''
+    For each watched company: its resolved aliases and its local procesos.
+
+    Returns:
+        A list of {"empresa": EmpresaVigilada, "alias": [CandidatoEmpresa], "procesos": [dict]}.
+    '''
+    resumen = []
+    for empresa in crud.get_empresas_vigiladas(db_engine):
+        alias, procesos = procesos_de_empresa(db_engine, empresa.nombre, umbral=empresa.umbral_similitud, limit=limit)
+        resumen.append({"empresa": empresa, "alias": alias, "procesos": procesos})
+    return resumen
@@ -0,0 +1,278 @@
+'''
+Extraction of dated events (term ends, hearings, requirement deadlines) from actuaciones.
+
+Runs at ingestion: the term dates of the API and the dates written in Spanish inside the
+`anotacion` ("SE FIJA FECHA PARA AUDIENCIA EL DÍA 20 DE JUNIO DE 2024 A LAS 09:00 AM")
+are parsed once and stored in the indexed `evento` table, so "what's due this week" is a
+range query instead of a scan of every annotation. The same index feeds an iCalendar export.
+'''
+import logging
+import re
+import unicodedata
+from datetime import date, datetime, timedelta
+from app.db import crud
+from app.models.models import Actuacion, Evento
+from app.services.enrichment import parsear_fecha_api
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TIPOS_EVENTO = ("AUDIENCIA", "VENCIMIENTO_TERMINO", "INICIO_TERMINO", "REQUERIMIENTO")
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7, "agosto": 8,
+    "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+
+# Patterns run over the annotation without accents and in lower case (see _normalizar).
+# "20 de junio de 2024", "veinte (20) de junio del año 2024", "1o de julio"
+PATRON_FECHA_TEXTO = re.compile(
+    r"\b(\d{1,2})\s*\)?\s*(?:o|º|°)?\s+de\s+(" + "|".join(MESES) + r")(?:\s+(?:de|del)\s+(?:ano\s+)?(\d{4}))?\b"
+)
+# "20/06/2024", "20-06-2024" (day first, as used in Colombia) and ISO "2024-06-20"
+PATRON_FECHA_NUMERICA = re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{4})\b")
+PATRON_FECHA_ISO = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+# "a las 9:00 a.m.", "a la 1 p.m.", "hora: 14:30", "a las 10 de la manana"
+PATRON_HORA = re.compile(
+    r"(?:a\s+las?|hora(?:s)?\s*:?)\s+(\d{1,2})(?:\s*[:.h]\s*(\d{2}))?\s*"
+    r"(a\.?\s*m\.?|p\.?\s*m\.?|de la manana|de la tarde|de la noche|del mediodia|m\.)?"
+)
+# "dentro de los cinco (5) dias siguientes", "en el termino de 10 dias habiles"
+PATRON_PLAZO_RELATIVO = re.compile(
+    r"(?:dentro\s+de|termino\s+de|plazo\s+de)\s+(?:los\s+)?(?:[a-z]+\s+)?\(?(\d{1,3})\)?\s+dias(\s+calendario)?"
+)
+
+# Words in the text just before a date that tell what kind of event it is; the closest one wins
+CONTEXTO_TIPO = (
+    ("AUDIENCIA", re.compile(r"audiencia|diligencia|inspeccion judicial|remate|interrogatorio|conciliacion|fija fecha")),
+    ("REQUERIMIENTO", re.compile(r"requier|requerimiento|a mas tardar|so pena|plazo|allegu|aport|hasta el")),
+)
+CARACTERES_CONTEXTO = 120 # Text before a date inspected to classify it
+CARACTERES_HORA = 60 # Text after a date searched for the time
+CARACTERES_DESCRIPCION = 80 # Text kept on each side of a date as the event description
+
+def _normalizar(texto: str) -> str:
+    '''Lower case without accents, keeping string length so offsets stay valid.'''
+    return "".join(c for c in unicodedata.normalize("NFD", texto.lower()) if unicodedata.category(c) != "Mn")
+
+def _hora(texto: str) -> tuple[int, int] | None:
+    coincidencia = PATRON_HORA.search(texto)
+    if not coincidencia:
+        return None
+    hora, minutos = int(coincidencia.group(1)), int(coincidencia.group(2) or 0)
+    sufijo = (coincidencia.group(3) or "").replace(".", "").replace(" ", "")
+    if sufijo in ("pm", "delatarde", "delanoche") and hora < 12:
+        hora += 12
+    elif sufijo in ("am", "delamanana") and hora == 12:
+        hora = 0
+    if hora > 23 or minutos > 59:
+        return None
+    return hora, minutos
+
+def _sumar_dias_habiles(inicio: date, dias: int) -> date:
+    '''Adds business days (Monday to Friday). Public holidays are not taken into account.'''
+    fecha = inicio
+    while dias > 0:
+        fecha += timedelta(days=1)
+        if fecha.weekday() < 5:
+            dias -= 1
+    return fecha
+
+def _fechas_en_texto(texto: str, referencia: date) -> list[tuple[int, int, date]]:
+    '''Finds the dates written in a normalized text. Returns (start, end, date) tuples.'''
+    encontradas = []
+    for coincidencia in PATRON_FECHA_TEXTO.finditer(texto):
+        dia, mes = int(coincidencia.group(1)), MESES[coincidencia.group(2)]
+        anio = int(coincidencia.group(3)) if coincidencia.group(3) else referencia.year
+        try:
+            fecha = date(anio, mes, dia)
+        except ValueError:
+            continue
+        if not coincidencia.group(3) and fecha < referencia:
+            # Without a year, a date before the actuación refers to next year
+            try:
+                fecha = date(anio + 1, mes, dia)
+            except ValueError:
+                continue
+        encontradas.append((coincidencia.start(), coincidencia.end(), fecha))
+    for patron, orden in ((PATRON_FECHA_NUMERICA, (3, 2, 1)), (PATRON_FECHA_ISO, (1, 2, 3))):
+        for coincidencia in patron.finditer(texto):
+            try:
+                fecha = date(*(int(coincidencia.group(i)) for i in orden))
+            except ValueError:
+                continue
+            encontradas.append((coincidencia.start(), coincidencia.end(), fecha))
+    return sorted(encontradas)
+
+def _tipo_por_contexto(contexto: str) -> str | None:
+    '''Event type of the keyword closest to the end of the context (i.e. to the date), if any.'''
+    mejor, posicion = None, -1
+    for tipo, patron in CONTEXTO_TIPO:
+        for coincidencia in patron.finditer(contexto):
+            if coincidencia.end() > posicion:
+                mejor, posicion = tipo, coincidencia.end()
+    return mejor
+
+def _descripcion(texto: str, inicio: int, fin: int) -> str:
+    fragmento = texto[max(inicio - CARACTERES_DESCRIPCION, 0):fin + CARACTERES_DESCRIPCION]
+    return " ".join(fragmento.split())
+
+def extraer_eventos(actuacion: Actuacion) -> list[Evento]:
+    '''
+    Extracts the dated events of an actuación: its API term dates and the hearing dates,
+    times and requirement deadlines written in the annotation.
+
+    Dates in the annotation before the date of the actuación are references to past
+    actions (e.g. "auto del 5 de mayo"), not events, and are skipped.
+
+    Args:
+        actuacion: The actuación; it must have its DB id and proceso_db_id.
+
+    Returns:
+        The list of Evento models (not stored).
+    '''
+    fecha_actuacion = parsear_fecha_api(actuacion.fechaActuacion) or parsear_fecha_api(actuacion.fechaRegistro)
+    referencia = fecha_actuacion.date() if fecha_actuacion else date.today()
+    eventos = {}
+
+    def agregar(tipo: str, fecha: datetime, con_hora: bool, fuente: str, descripcion: str | None, estimada: bool = False):
+        clave = (tipo, fecha.date())
+        # One event per type and day; keep the one that has a time
+        if clave in eventos and (eventos[clave].con_hora or not con_hora):
+            return
+        eventos[clave] = Evento(
+            actuacion_db_id=actuacion.id, proceso_db_id=actuacion.proceso_db_id, tipo=tipo,
+            fecha=fecha.isoformat(timespec="seconds"), con_hora=con_hora, estimada=estimada,
+            descripcion=descripcion, fuente=fuente
+        )
+
+    for campo, tipo in (("fechaFinalizaTermino", "VENCIMIENTO_TERMINO"), ("fechaIniciaTermino", "INICIO_TERMINO")):
+        fecha = parsear_fecha_api(getattr(actuacion, campo))
+        if fecha:
+            agregar(tipo, fecha, False, campo, actuacion.actuacion)
+
+    original = unicodedata.normalize("NFC", actuacion.anotacion or "")
+    texto = _normalizar(original)
+    es_audiencia = "audiencia" in _normalizar(actuacion.actuacion or "")
+    for inicio, fin, fecha in _fechas_en_texto(texto, referencia):
+        if fecha < referencia:
+            continue
+        contexto = texto[max(inicio - CARACTERES_CONTEXTO, 0):inicio]
+        tipo = _tipo_por_contexto(contexto) or ("AUDIENCIA" if es_audiencia else None)
+        if not tipo:
+            continue
+        hora = _hora(texto[fin:fin + CARACTERES_HORA]) if tipo == "AUDIENCIA" else None
+        momento = datetime.combine(fecha, datetime.min.time()).replace(hour=hora[0], minute=hora[1]) if hora else datetime.combine(fecha, datetime.min.time())
+        agregar(tipo, momento, hora is not None, "anotacion", _descripcion(original, inicio, fin))
+
+    # Relative deadlines ("dentro de los cinco (5) días") are estimated from the date of the actuación
+    for coincidencia in PATRON_PLAZO_RELATIVO.finditer(texto):
+        dias = int(coincidencia.group(1))
+        if coincidencia.group(2): # "días calendario"
+            vence = referencia + timedelta(days=dias)
+        else: # Procedural terms count business days
+            vence = _sumar_dias_habiles(referencia, dias)
+        agregar("REQUERIMIENTO", datetime.combine(vence, datetime.min.time()), False, "anotacion",
+                _descripcion(original, coincidencia.start(), coincidencia.end()), estimada=True)
+
+    return sorted(eventos.values(), key=lambda e: e.fecha)
+
+def indexar_eventos(db_engine, actuaciones: list[Actuacion]) -> int:
+    '''Extracts and stores (replacing the previous ones) the events of stored actuaciones. Returns how many were stored.'''
+    total = 0
+    for actuacion in actuaciones:
+        if not actuacion.id or not actuacion.proceso_db_id:
+            continue
+        guardados = crud.replace_eventos_actuacion(db_engine, actuacion.id, extraer_eventos(actuacion))
+        total += max(guardados, 0)
+    return total
+
+def reindexar_eventos(db_engine, tamano_lote: int = 1000) -> int:
+    '''Rebuilds the events of every stored actuación, e.g. after changing the extraction rules.'''
+    total, ultimo_id = 0, 0
+    while True:
+        lote = crud.get_actuaciones_after_id(db_engine, ultimo_id, tamano_lote)
+        if not lote:
+            break
+        total += indexar_eventos(db_engine, lote)
+        ultimo_id = lote[-1].id
+    logging.info(f"Eventos reindexados: {total} eventos hasta la actuación {ultimo_id}.")
+    return total
+
+# --- iCalendar (RFC 5545) export ---
+
+ZONA_HORARIA = "America/Bogota"
+VTIMEZONE_BOGOTA = [
+    "BEGIN:VTIMEZONE", f"TZID:{ZONA_HORARIA}",
+    "BEGIN:STANDARD", "DTSTART:19700101T000000", "TZOFFSETFROM:-0500", "TZOFFSETTO:-0500", "TZNAME:-05", "END:STANDARD",
+    "END:VTIMEZONE",
+]
+NOMBRES_TIPO = {
+    "AUDIENCIA": "Audiencia",
+    "VENCIMIENTO_TERMINO": "Vence término",
+    "INICIO_TERMINO": "Inicia término",
+    "REQUERIMIENTO": "Plazo de requerimiento",
+}
+
+def _escapar_ics(texto: str) -> str:
+    return texto.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def _plegar_ics(linea: str) -> list[str]:
+    '''Folds a content line into 75-octet lines, as required by RFC 5545.'''
+    partes, actual = [], ""
+    for caracter in linea:
+        limite = 75 if not partes else 74 # Continuation lines start with a space
+        if len((actual + caracter).encode("utf-8")) > limite:
+            partes.append(actual)
+            actual = ""
+        actual += caracter
+    partes.append(actual)
+    return [partes[0]] + [" " + p for p in partes[1:]]
+
+def generar_icalendar(eventos: list[dict], nombre_calendario: str = "Agenda judicial") -> str:
+    '''
+    Builds an iCalendar feed from event rows as returned by crud.get_eventos_entre.
+
+    Args:
+        eventos: The event rows.
+        nombre_calendario: Optional. Name shown by calendar applications.
+
+    Returns:
+        The .ics content (CRLF line endings).
+    '''
+    ahora = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    lineas = [
+        "BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//JudicialAIProject//Agenda judicial//ES", "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH", f"X-WR-CALNAME:{_escapar_ics(nombre_calendario)}", f"X-WR-TIMEZONE:{ZONA_HORARIA}",
+        *VTIMEZONE_BOGOTA,
+    ]
+    for evento in eventos:
+        inicio = datetime.fromisoformat(evento["fecha"])
+        radicado = evento.get("numeroRadicacion") or evento.get("idProceso") or ""
+        resumen = f"{NOMBRES_TIPO.get(evento['tipo'], evento['tipo'])} - {radicado}"
+        if evento.get("estimada"):
+            resumen += " (estimado)"
+        descripcion = "\n".join(t for t in (
+            evento.get("actuacion"), evento.get("descripcion"), evento.get("despacho"),
+            f"Empresa: {evento['nombre_busqueda']}" if evento.get("nombre_busqueda") else None
+        ) if t)
+        lineas += ["BEGIN:VEVENT", f"UID:evento-{evento['id']}@judicialaiproject", f"DTSTAMP:{ahora}"]
+        if evento.get("con_hora"):
+            lineas += [f"DTSTART;TZID={ZONA_HORARIA}:{inicio.strftime('%Y%m%dT%H%M%S')}", "DURATION:PT1H"]
+        else:
+            lineas += [f"DTSTART;VALUE=DATE:{inicio.strftime('%Y%m%d')}", f"DTEND;VALUE=DATE:{(inicio + timedelta(days=1)).strftime('%Y%m%d')}"]
+        lineas += [f"SUMMARY:{_escapar_ics(resumen)}", f"DESCRIPTION:{_escapar_ics(descripcion)}", f"CATEGORIES:{evento['tipo']}", "END:VEVENT"]
+    lineas.append("END:VCALENDAR")
+    return "\r\n".join(linea_plegada for linea in lineas for linea_plegada in _plegar_ics(linea)) + "\r\n"
+
+def obtener_calendario(db_engine, dias: int = 90, empresa: str | None = None, tipos: list[str] | None = None) -> str:
+    '''Returns the iCalendar feed of the events from today to `dias` days ahead.'''
+    hoy = date.today()
+    eventos = crud.get_eventos_entre(db_engine, hoy.isoformat(), (hoy + timedelta(days=dias)).isoformat() + "T23:59:59", tipos=tipos, empresa=empresa)
+    nombre = f"Agenda judicial - {empresa}" if empresa else "Agenda judicial"
+    return generar_icalendar(eventos, nombre)
+
+if __name__ == "__main__":
+    from app.db.database import engine, create_db_and_tables
+    create_db_and_tables()
+    reindexar_eventos(engine)
@@ -0,0 +1,246 @@
+'''
+Ingestion of processes and actuaciones from the Rama Judicial API into the local database.
+
+Ingestion only fetches, maps and stores the data: actuaciones are stored without AI fields
+so they can be rendered right away, and AI enrichment is scheduled separately
+(see app/services/enrichment.py). Parties and dated events (terms, hearings) are indexed here too.
+Bulk ingestion (whole companies) runs as a staged pipeline: ingerir_procesos.
+Every path that stores actuaciones reads all their pages through consultar_actuaciones_completas.
+'''
+import logging
+from typing import Callable
+from app.clients.rama_judicial_client import (
+    consultar_detalle_proceso, consultar_actuaciones_proceso, consultar_todas_las_paginas, ResultadoPaginado
+)
+from app.db import crud
+from app.models.models import Proceso, Actuacion
+from app.services.retrieval import indexar_actuaciones
+from app.services.event_extraction import indexar_eventos
+from app.services.sujetos import indexar_sujetos, sujetos_de_proceso
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MAX_PAGINAS_ACTUACIONES = 20 # Pages of actuaciones read per proceso
+
+def consultar_actuaciones_completas(id_proceso: str, max_paginas: int = MAX_PAGINAS_ACTUACIONES, hilos: int = 1,
+                                    esperar: Callable[[], None] | None = None) -> ResultadoPaginado | None:
+    '''
+    The actuaciones of every page of a proceso (the endpoint is paginated for long procesos).
+
+    Args:
+        id_proceso: The Rama Judicial ID of the process.
+        max_paginas: Optional. Maximum number of pages to read.
+        hilos: Optional. Concurrent requests for the pages after the first.
+        esperar: Optional. Called before each request, e.g. a rate limiter.
+
+    Returns:
+        The actuaciones in page order (check `completo`), or None if the first page could not be fetched.
+    '''
+    def consulta(pagina: int):
+        if esperar:
+            esperar()
+        return consultar_actuaciones_proceso(id_proceso, pagina=pagina)
+    return consultar_todas_las_paginas(consulta, max_paginas, hilos=hilos, clave="actuaciones")
+
+def extraer_detalle(detalle_raw) -> dict | None:
+    '''Normalizes the detail response, which may be a dict or a list with one element.'''
+    if isinstance(detalle_raw, list) and detalle_raw:
+        detalle_raw = detalle_raw[0]
+    if isinstance(detalle_raw, dict) and detalle_raw.get("idProceso"):
+        return detalle_raw
+    return None
+
+def extraer_lista_actuaciones(actuaciones_raw) -> list[dict]:
+    '''Normalizes the actuaciones response, which may be a list or a dict containing the list.'''
+    if isinstance(actuaciones_raw, list):
+        return actuaciones_raw
+    if isinstance(actuaciones_raw, dict):
+        for clave in ("actuaciones", "listaActuaciones"):
+            if isinstance(actuaciones_raw.get(clave), list):
+                return actuaciones_raw[clave]
+        logging.warning(f"Formato inesperado para actuaciones: claves {list(actuaciones_raw.keys())}")
+    return []
+
+def mapear_proceso(detalle_data: dict, nombre_busqueda: str | None = None) -> Proceso:
+    '''Creates a Proceso Pydantic model from the API detail data.'''
+    sujetos = detalle_data.get("sujetosProcesales")
+    return Proceso(
+        idProceso=str(detalle_data.get("idProceso")),
+        numeroRadicacion=detalle_data.get("numero") or detalle_data.get("llaveProceso"),
+        despacho=detalle_data.get("despacho"),
+        ponente=detalle_data.get("ponente"),
+        sujetos=str(sujetos) if sujetos is not None else None, # Convert list/dict to str if necessary
+        fechaRadicacion=detalle_data.get("fechaProceso") or detalle_data.get("fechaRadicacion"),
+        tipoProceso=detalle_data.get("tipoProceso"),
+        claseProceso=detalle_data.get("claseProceso"),
+        ubicacionExpediente=detalle_data.get("ubicacionExpediente") or detalle_data.get("ubicacion"),
+        demandante=detalle_data.get("demandanteNombre") or (sujetos[0].get("nombre") if isinstance(sujetos, list) and sujetos else "N/A"),
+        demandado=detalle_data.get("demandadoNombre") or (sujetos[1].get("nombre") if isinstance(sujetos, list) and len(sujetos) > 1 else "N/A"),
+        nombre_busqueda=nombre_busqueda
+    )
+
+def mapear_actuacion(act_raw: dict, proceso_db_id: int) -> Actuacion:
+    '''Creates an Actuacion Pydantic model (without AI fields) from the API data.'''
+    return Actuacion(
+        idRegActuacion=str(act_raw.get("idRegActuacion")),
+        proceso_db_id=proceso_db_id, # Use the DB id of the parent proceso
+        fechaActuacion=act_raw.get("fechaActuacion"),
+        actuacion=act_raw.get("actuacion"),
+        anotacion=act_raw.get("anotacion") or "",
+        fechaIniciaTermino=act_raw.get("fechaIniciaTermino"),
+        fechaFinalizaTermino=act_raw.get("fechaFinalizaTermino"),
+        fechaRegistro=act_raw.get("fechaRegistro"),
+        conDocumentos=act_raw.get("conDocumentos", False)
+    )
+
+def ingerir_proceso(db_engine, id_proceso: str, nombre_busqueda: str | None = None, sujetos_procesales=None,
+                    respuesta_detalle: dict | None = None, respuesta_actuaciones=None) -> Proceso | None:
+    '''
+    Fetches a process and its actuaciones from the API and stores them without AI fields.
+
+    Args:
+        db_engine: The SQLAlchemy engine to store the data in.
+        id_proceso: The Rama Judicial ID of the process.
+        nombre_busqueda: Optional. The name/NIT used to find the process.
+        sujetos_procesales: Optional. The parties from the search result, used when the detail doesn't include them.
+        respuesta_detalle: Optional. The detail response if already fetched (skips that request).
+        respuesta_actuaciones: Optional. The actuaciones (every page) if already fetched (skips those requests).
+
+    Returns:
+        The stored Proceso (with its DB ID), or None if the detail could not be fetched or stored.
+    '''
+    detalle_data = extraer_detalle(respuesta_detalle or consultar_detalle_proceso(id_proceso))
+    if not detalle_data:
+        logging.error(f"No se pudieron obtener los detalles para el proceso {id_proceso}.")
+        return None
+
+    proceso_db_id = crud.create_proceso(db_engine, mapear_proceso(detalle_data, nombre_busqueda))
+    if not proceso_db_id:
+        return None
+
+    actuaciones_list = extraer_lista_actuaciones(respuesta_actuaciones if respuesta_actuaciones is not None else consultar_actuaciones_completas(id_proceso))
+    # One transaction for all the actuaciones of the proceso
+    actuaciones = [mapear_actuacion(act_raw, proceso_db_id) for act_raw in actuaciones_list]
+    for actuacion, actuacion_db_id in zip(actuaciones, crud.create_actuaciones(db_engine, actuaciones)):
+        actuacion.id = actuacion_db_id
+    actuaciones = [a for a in actuaciones if a.id]
+    # Searchable right away by annotation; re-indexed with the AI fields once enriched
+    indexar_actuaciones(db_engine, actuaciones)
+    indexar_eventos(db_engine, actuaciones)
+    proceso = crud.get_proceso_by_db_id(db_engine, proceso_db_id)
+    if proceso:
+        indexar_sujetos(db_engine, proceso, detalle_data.get("sujetosProcesales") or sujetos_procesales)
+    logging.info(f"Proceso {id_proceso} ingerido con {len(actuaciones_list)} actuaciones (sin enriquecimiento IA).")
+    return proceso
+
+def _entrada_proceso(item) -> dict:
+    # Items may be bare idProceso values or dicts with the search context
+    if isinstance(item, dict):
+        return {"id_proceso": str(item.get("id_proceso") or item.get("idProceso")), "nombre_busqueda": item.get("nombre_busqueda"),
+                "sujetos_procesales": item.get("sujetos_procesales") or item.get("sujetosProcesales")}
+    return {"id_proceso": str(item), "nombre_busqueda": None, "sujetos_procesales": None}
+
+def _etapa_fetch(item) -> list[dict]:
+    entrada = _entrada_proceso(item)
+    detalle = extraer_detalle(consultar_detalle_proceso(entrada["id_proceso"]))
+    if not detalle:
+        raise RuntimeError(f"No se pudieron obtener los detalles para el proceso {entrada['id_proceso']}.")
+    entrada["detalle"] = detalle
+    entrada["actuaciones_raw"] = consultar_actuaciones_completas(entrada["id_proceso"])
+    return [entrada]
+
+def _etapa_parse(paquete: dict) -> list[dict]:
+    detalle = paquete.pop("detalle")
+    paquete["proceso"] = mapear_proceso(detalle, paquete["nombre_busqueda"])
+    paquete["sujetos_procesales"] = detalle.get("sujetosProcesales") or paquete["sujetos_procesales"]
+    # proceso_db_id is only known once the proceso is stored
+    paquete["actuaciones"] = [mapear_actuacion(a, None) for a in extraer_lista_actuaciones(paquete.pop("actuaciones_raw"))]
+    return [paquete]
+
+def _etapa_persist(db_engine, enriquecer: bool, paquetes: list[dict]) -> list[Actuacion]:
+    # One transaction for all the actuaciones (and another for the parties) of the batch
+    actuaciones, sujetos = [], {}
+    for paquete in paquetes:
+        proceso = paquete["proceso"]
+        proceso.id = crud.create_proceso(db_engine, proceso)
+        if not proceso.id:
+            logging.error(f"No se pudo guardar el proceso {proceso.idProceso}.")
+            continue
+        for actuacion in paquete["actuaciones"]:
+            actuacion.proceso_db_id = proceso.id
+        actuaciones.extend(paquete["actuaciones"])
+        sujetos[proceso.id] = sujetos_de_proceso(proceso, paquete["sujetos_procesales"])
+    for actuacion, actuacion_db_id in zip(actuaciones, crud.create_actuaciones(db_engine, actuaciones)):
+        actuacion.id = actuacion_db_id
+    actuaciones = [a for a in actuaciones if a.id]
+    crud.replace_sujetos_procesos(db_engine, sujetos)
+    indexar_actuaciones(db_engine, actuaciones)
+    indexar_eventos(db_engine, actuaciones)
+    if not enriquecer:
+        return []
+    # Actuaciones stored earlier may already carry their AI fields (the upsert keeps them)
+    pendientes = []
+    for proceso_db_id in sujetos:
+        pendientes.extend(crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id))
+    return pendientes
+
+def _etapa_persist_ia(db_engine, actuaciones: list[Actuacion]) -> None:
+    crud.update_actuaciones_ia(db_engine, [{
+        "id": a.id, "resumen_ia": a.resumen_ia, "clasificacion_urgencia_ia": a.clasificacion_urgencia_ia
+    } for a in actuaciones])
+    indexar_actuaciones(db_engine, actuaciones)
+
+def etapas_ingesta(db_engine, enriquecer: bool = True, hilos_fetch: int = 4, hilos_ia: int = 4, lote_db: int = 20) -> list:
+    '''
+    The stages of the ingestion pipeline (fetch -> parse -> persist [-> enrich -> persist AI]),
+    for callers that add their own stages in front (see ingerir_procesos for the arguments).
+    '''
+    from app.services.enrichment import generar_campos_ia
+    from app.services.pipeline import Etapa
+    etapas = [
+        Etapa("fetch", _etapa_fetch, hilos=hilos_fetch, capacidad=hilos_fetch * 2),
+        Etapa("parse", _etapa_parse, capacidad=hilos_fetch * 2),
+        Etapa("persist", lambda paquetes: _etapa_persist(db_engine, enriquecer, paquetes), capacidad=lote_db * 2, lote=lote_db),
+    ]
+    if enriquecer:
+        etapas += [
+            Etapa("enrich", lambda actuacion: [generar_campos_ia(actuacion)], hilos=hilos_ia, capacidad=hilos_ia * 25),
+            Etapa("persist_ia", lambda actuaciones: _etapa_persist_ia(db_engine, actuaciones), capacidad=lote_db * 10, lote=lote_db * 5),
+        ]
+    return etapas
+
+def ingerir_procesos(
+    db_engine,
+    procesos,
+    enriquecer: bool = True,
+    hilos_fetch: int = 4,
+    hilos_ia: int = 4,
+    lote_db: int = 20,
+    intervalo_log: float | None = 30.0
+) -> list[dict]:
+    '''
+    Ingests many procesos as a streaming pipeline: fetch -> parse -> persist -> enrich -> persist AI.
+
+    API calls, LLM calls and (batched) database writes run concurrently in separate stages
+    connected by bounded queues, so memory stays bounded and the slowest stage sets the pace
+    (see app/services/pipeline.py).
+
+    Args:
+        db_engine: The SQLAlchemy engine to store the data in.
+        procesos: Iterable (consumed lazily) of idProceso values or of dicts with id_proceso,
+            nombre_busqueda and sujetos_procesales (e.g. the results of a search).
+        enriquecer: Optional. Also generate the AI summary and urgency of the actuaciones.
+        hilos_fetch: Optional. Concurrent requests to the Rama Judicial API.
+        hilos_ia: Optional. Concurrent LLM calls.
+        lote_db: Optional. Procesos stored per transaction (actuaciones with AI fields: 5x this).
+        intervalo_log: Optional. Seconds between progress logs (None to disable).
+
+    Returns:
+        The metrics of each stage (items, errors, throughput, utilization, queue depth).
+    '''
+    from app.services.pipeline import Pipeline
+    etapas = etapas_ingesta(db_engine, enriquecer, hilos_fetch, hilos_ia, lote_db)
+    metricas = Pipeline(etapas, intervalo_log=intervalo_log).ejecutar(procesos)
+    logging.info("Ingesta terminada: " + ", ".join(f"{m['etapa']} {m['recibidos']} ({m['errores']} errores)" for m in metricas))
+    return metricas
@@ -0,0 +1,237 @@
+'''
+Latency- and error-aware routing of LLM calls across the configured providers.
+
+Each task (urgency classification, actuación summary, document summary) has an ordered
+list of preferred backends in llm_config, which reflects the quality each task needs. The
+router keeps moving averages of latency and error rate per task and backend, and picks, for
+every call, the most preferred backend that is healthy for the task: a backend is demoted
+only by its errors, never because it is slower than the next one. A call that takes longer
+than the router's timeout (LLM_TIMEOUT_S, also passed to the providers) counts as an error.
+Optionally, calls are hedged: if the chosen backend has not answered after its typical
+latency for the task, the same request is sent to the next candidate and the first answer wins;
+the caller waits at most the timeout for either.
+'''
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, AsyncIterator, Iterator
+from langchain_core.output_parsers import StrOutputParser
+from app.config.llm_config import LLM_PROVIDERS, LLM_TASK_PREFERENCES, LLM_HEDGING, LLM_TIMEOUT_S
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ALFA_EWMA = 0.2 # Weight of the newest observation in the moving averages
+MAX_TASA_ERROR = 0.5 # Backends above this error rate for a task go last while another one is healthy
+MIN_ESPERA_HEDGE_S = 0.5 # Never hedge before this delay
+
+class EstadisticasBackend:
+    '''Moving averages of the observed latency and error rate of one backend on one task.'''
+
+    def __init__(self):
+        self.latencia_s = None # EWMA of successful call latency
+        self.desviacion_s = 0.0 # EWMA of the absolute deviation, used for the hedge delay
+        self.tasa_error = 0.0
+        self.llamadas = 0
+
+    def registrar(self, latencia_s: float | None, error: bool) -> None:
+        self.llamadas += 1
+        self.tasa_error = (1 - ALFA_EWMA) * self.tasa_error + ALFA_EWMA * (1.0 if error else 0.0)
+        if latencia_s is None:
+            return
+        if self.latencia_s is None:
+            self.latencia_s = latencia_s
+        else:
+            self.desviacion_s = (1 - ALFA_EWMA) * self.desviacion_s + ALFA_EWMA * abs(latencia_s - self.latencia_s)
+            self.latencia_s = (1 - ALFA_EWMA) * self.latencia_s + ALFA_EWMA * latencia_s
+
+class LLMRouter:
+    def __init__(
+        self, providers: dict, preferencias: dict[str, list[str]], hedging: bool = False,
+        max_workers: int = 16, timeout_s: float | None = None
+    ):
+        self.providers = providers
+        self.preferencias = preferencias
+        self.hedging = hedging
+        self.timeout_s = timeout_s # Calls slower than this count as errors; None disables it
+        self.estadisticas = {} # (tarea, nombre) -> EstadisticasBackend
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-router")
+
+    def candidatos(self, tarea: str) -> list[str]:
+        '''Returns the available backends for a task, best first.'''
+        preferidos = [n for n in self.preferencias.get(tarea, []) if n in self.providers]
+        # Backends without an explicit preference for the task go last
+        preferidos += [n for n in self.providers if n not in preferidos]
+
+        with self._lock:
+            # Stable sort: failing backends go last, otherwise the preference order is kept
+            return sorted(preferidos, key=lambda nombre: self._estadisticas(tarea, nombre).tasa_error > MAX_TASA_ERROR)
+
+    def _estadisticas(self, tarea: str, nombre: str) -> EstadisticasBackend:
+        # Called with self._lock held
+        clave = (tarea, nombre)
+        if clave not in self.estadisticas:
+            self.estadisticas[clave] = EstadisticasBackend()
+        return self.estadisticas[clave]
+
+    def disponible(self, tarea: str) -> bool:
+        return bool(self.candidatos(tarea))
+
+    def seleccionar(self, tarea: str) -> tuple[str, Any] | tuple[None, None]:
+        '''Returns (name, chat model) of the backend to use for a task, or (None, None).'''
+        candidatos = self.candidatos(tarea)
+        if not candidatos:
+            return None, None
+        return candidatos[0], self.providers[candidatos[0]]
+
+    def registrar(self, tarea: str, nombre: str, latencia_s: float | None, error: bool) -> None:
+        if not error and self.timeout_s is not None and latencia_s is not None and latencia_s > self.timeout_s:
+            # Answered, but after the timeout (a provider that does not enforce it): counted as a timeout
+            logging.warning(f"Backend LLM '{nombre}' excedió {self.timeout_s} s para la tarea '{tarea}' ({latencia_s:.1f} s).")
+            latencia_s, error = None, True
+        with self._lock:
+            self._estadisticas(tarea, nombre).registrar(latencia_s, error)
+
+    def _invocar_en(self, tarea: str, nombre: str, prompt, entrada: dict) -> str:
+        chain = prompt | self.providers[nombre] | StrOutputParser()
+        inicio = time.perf_counter()
+        try:
+            resultado = chain.invoke(entrada)
+        except Exception:
+            self.registrar(tarea, nombre, None, error=True)
+            raise
+        self.registrar(tarea, nombre, time.perf_counter() - inicio, error=False)
+        return resultado
+
+    def _espera_hedge(self, tarea: str, nombre: str) -> float | None:
+        with self._lock:
+            stats = self._estadisticas(tarea, nombre)
+            if stats.latencia_s is None:
+                return None # Nothing observed yet: no basis to decide a call is slow (wait() without timeout)
+            return max(MIN_ESPERA_HEDGE_S, stats.latencia_s + 3 * stats.desviacion_s)
+
+    def invoke(self, tarea: str, prompt, entrada: dict, hedge: bool | None = None) -> str:
+        '''
+        Runs `prompt | llm | StrOutputParser()` on the best backend for the task.
+
+        Args:
+            tarea: Task name, e.g. "urgencia", "resumen_actuacion", "resumen_documento".
+            prompt: The PromptTemplate to use.
+            entrada: The prompt variables.
+            hedge: Optional. Overrides the configured hedging for this call.
+
+        Returns:
+            The model output. Falls back to the next backend on error; raises the last error if all fail.
+        '''
+        candidatos = self.candidatos(tarea)
+        if not candidatos:
+            raise RuntimeError(f"No hay modelos LLM disponibles para la tarea '{tarea}'.")
+        hedge = self.hedging if hedge is None else hedge
+
+        if hedge and len(candidatos) > 1:
+            return self._invoke_hedged(tarea, candidatos, prompt, entrada)
+
+        ultimo_error = None
+        for nombre in candidatos:
+            try:
+                return self._invocar_en(tarea, nombre, prompt, entrada)
+            except Exception as e:
+                logging.warning(f"Backend LLM '{nombre}' falló para la tarea '{tarea}': {e}")
+                ultimo_error = e
+        raise ultimo_error
+
+    def _invoke_hedged(self, tarea: str, candidatos: list[str], prompt, entrada: dict) -> str:
+        principal, respaldo = candidatos[0], candidatos[1]
+        limite = None if self.timeout_s is None else time.monotonic() + self.timeout_s
+        futuros = {self._executor.submit(self._invocar_en, tarea, principal, prompt, entrada): principal}
+        espera = self._espera_hedge(tarea, principal)
+        if self.timeout_s is not None:
+            espera = self.timeout_s if espera is None else min(espera, self.timeout_s)
+        hecho, _ = wait(futuros, timeout=espera)
+        if not hecho:
+            logging.info(f"Backend LLM '{principal}' lento; enviando solicitud de respaldo a '{respaldo}'.")
+            futuros[self._executor.submit(self._invocar_en, tarea, respaldo, prompt, entrada)] = respaldo
+
+        ultimo_error = None
+        pendientes = set(futuros)
+        while pendientes:
+            restante = None if limite is None else max(0.0, limite - time.monotonic())
+            hecho, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+            if not hecho:
+                # The hung calls are recorded as errors when they end (the providers enforce the timeout too)
+                raise TimeoutError(f"Ningún backend LLM respondió en {self.timeout_s} s para la tarea '{tarea}'.")
+            for futuro in hecho:
+                if futuro.exception() is None:
+                    # The losing request keeps running in the background; its result is discarded
+                    return futuro.result()
+                ultimo_error = futuro.exception()
+                if respaldo not in futuros.values():
+                    futuros[self._executor.submit(self._invocar_en, tarea, respaldo, prompt, entrada)] = respaldo
+                    pendientes.add(next(f for f, n in futuros.items() if n == respaldo))
+        raise ultimo_error
+
+    def stream(self, tarea: str, prompt, entrada: dict) -> Iterator[str]:
+        '''
+        Streams the output of `prompt | llm | StrOutputParser()` token by token.
+
+        Falls back to the next backend only if the chosen one fails before the first
+        token; once text has been yielded, errors are raised to the caller.
+        '''
+        ultimo_error = None
+        for nombre in self.candidatos(tarea):
+            chain = prompt | self.providers[nombre] | StrOutputParser()
+            inicio = time.perf_counter()
+            emitido = False
+            try:
+                for token in chain.stream(entrada):
+                    emitido = True
+                    yield token
+            except Exception as e:
+                self.registrar(tarea, nombre, None, error=True)
+                if emitido:
+                    raise
+                logging.warning(f"Backend LLM '{nombre}' falló al transmitir para la tarea '{tarea}': {e}")
+                ultimo_error = e
+                continue
+            self.registrar(tarea, nombre, time.perf_counter() - inicio, error=False)
+            return
+        raise ultimo_error or RuntimeError(f"No hay modelos LLM disponibles para la tarea '{tarea}'.")
+
+    async def astream(self, tarea: str, prompt, entrada: dict) -> AsyncIterator[str]:
+        '''Async variant of stream(), for async web frameworks.'''
+        ultimo_error = None
+        for nombre in self.candidatos(tarea):
+            chain = prompt | self.providers[nombre] | StrOutputParser()
+            inicio = time.perf_counter()
+            emitido = False
+            try:
+                async for token in chain.astream(entrada):
+                    emitido = True
+                    yield token
+            except Exception as e:
+                self.registrar(tarea, nombre, None, error=True)
+                if emitido:
+                    raise
+                logging.warning(f"Backend LLM '{nombre}' falló al transmitir para la tarea '{tarea}': {e}")
+                ultimo_error = e
+                continue
+            self.registrar(tarea, nombre, time.perf_counter() - inicio, error=False)
+            return
+        raise ultimo_error or RuntimeError(f"No hay modelos LLM disponibles para la tarea '{tarea}'.")
+
+    def batch(self, tarea: str, prompt, entradas: list[dict], max_concurrency: int, return_exceptions: bool = False) -> list:
+        '''Runs invoke() for several inputs concurrently, preserving their order.'''
+        def ejecutar(entrada):
+            try:
+                return self.invoke(tarea, prompt, entrada)
+            except Exception as e:
+                if return_exceptions:
+                    return e
+                raise
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(entradas)))) as executor:
+            return list(executor.map(ejecutar, entradas))
+
+# Shared router over the providers configured in llm_config
+router = LLMRouter(LLM_PROVIDERS, LLM_TASK_PREFERENCES, hedging=LLM_HEDGING, timeout_s=LLM_TIMEOUT_S)
@@ -0,0 +1,411 @@
+'''
+Push notifications of new and (re)classified actuaciones.
+
+Every path that stores actuaciones (ingestion, workers, bulk import, AI enrichment, the UIs)
+feeds the notificacion outbox through SQLite triggers (see database.py): a row when an
+actuacion is inserted ("nueva") and one when its urgency is set or changes ("clasificada").
+
+Inside a server process a single `Notificador` tails the outbox (one query every
+INTERVALO_SONDEO_S while someone is subscribed) and pushes each notification to the
+in-memory subscriptions whose filter (companies, procesos, urgencies) matches it. Connected
+clients (SSE in app/api/main.py and the Flask frontend, toasts in Streamlit) therefore cost
+one bounded queue each, not a query each: the database is read once per process whatever
+the number of subscribers. Notification IDs are the SSE event IDs, so a client that
+reconnects with Last-Event-ID gets what it missed from the outbox. The same thread purges the
+outbox once an hour (see `purgar`), from the moment the process first uses its notifier.
+
+Email and webhook sinks are delivered by a separate dispatcher, so that several server
+processes do not send the same email:
+
+    python -m app.services.notificaciones --despachar
+
+Sinks are configured with NOTIFICACIONES_WEBHOOK_URL and NOTIFICACIONES_CORREO_PARA (plus
+NOTIFICACIONES_SMTP / NOTIFICACIONES_CORREO_DE, default a local MTA on localhost:25); other
+sinks subclass `Sink`. Delivery is at least once: a batch is marked as delivered only after
+every sink accepted it. A sink that keeps failing pins its undelivered notifications for at most
+RETENCION_MAX_DIAS; without sinks nothing is delivered and they are kept RETENCION_DIAS.
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import requests
+from app.db import crud
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INTERVALO_SONDEO_S = 1.0 # How often the outbox is read while there are subscribers
+LOTE_SONDEO = 500 # Notifications read per query
+MAX_PENDIENTES = 500 # Notifications queued per subscription; a slower client loses the oldest
+SUSCRIPCION_INACTIVA_S = 300 # Subscriptions not read for this long are dropped (closed tabs, dead sessions)
+MAX_REPETICION = 1000 # Missed notifications replayed to a reconnecting client
+LARGO_ANOTACION = 200
+RETENCION_DIAS = 7 # Delivered outbox rows (all of them, without sinks) older than this are deleted
+RETENCION_MAX_DIAS = 90 # Undelivered rows older than this are deleted even with sinks (one may never recover)
+INTERVALO_PURGA_S = 3600.0
+INTERVALO_DESPACHO_S = 5.0
+SIN_CLASIFICAR = "SIN CLASIFICAR"
+
+def _notificacion(fila: dict) -> dict:
+    '''Outbox row -> notification pushed to the clients.'''
+    anotacion = fila.get("anotacion") or ""
+    return {
+        "id": fila["id"],
+        "tipo": fila["tipo"],
+        "urgencia": fila.get("urgencia") or SIN_CLASIFICAR,
+        "actuacion_db_id": fila["actuacion_db_id"],
+        "idProceso": fila.get("idProceso"),
+        "numeroRadicacion": fila.get("numeroRadicacion"),
+        "empresa": fila.get("nombre_busqueda"),
+        "fechaActuacion": fila.get("fechaActuacion"),
+        "actuacion": fila.get("actuacion"),
+        "anotacion": anotacion[:LARGO_ANOTACION] + ("…" if len(anotacion) > LARGO_ANOTACION else ""),
+        "fecha": fila["fecha_creacion_db"].isoformat() if fila.get("fecha_creacion_db") else None,
+    }
+
+class Filtro:
+    '''
+    Which notifications a subscriber wants. Empty criteria match everything; companies match as
+    a case-insensitive substring of the search name, like the crud `empresa` filters.
+    '''
+
+    def __init__(self, empresas: list[str] | None = None, procesos: list[str] | None = None, urgencias: list[str] | None = None):
+        self.empresas = [e.strip().upper() for e in empresas or [] if e and e.strip()]
+        self.procesos = {str(p) for p in procesos or [] if p}
+        self.urgencias = {u.upper() for u in urgencias or [] if u}
+
+    def acepta(self, notificacion: dict) -> bool:
+        if self.urgencias and notificacion["urgencia"] not in self.urgencias:
+            return False
+        if self.procesos and notificacion["idProceso"] not in self.procesos:
+            return False
+        if self.empresas:
+            empresa = (notificacion["empresa"] or "").upper()
+            return any(e in empresa for e in self.empresas)
+        return True
+
+class Suscripcion:
+    '''
+    Bounded queue of the notifications of one subscriber. Read it with `recibir` from a thread,
+    or with `recibir_async` from the event loop given as `loop`.
+    '''
+
+    def __init__(self, filtro: Filtro, desde_id: int, loop: asyncio.AbstractEventLoop | None = None):
+        self.filtro = filtro
+        self.ultimo_id = desde_id # Last notification queued or replayed
+        self.perdidas = 0 # Dropped because the client did not keep up
+        self.cerrada = False
+        self.ultimo_acceso = time.monotonic()
+        self._cola = deque()
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._aviso = asyncio.Event() if loop else threading.Event()
+
+    def _avisar(self) -> None:
+        if self._loop is None:
+            self._aviso.set()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._aviso.set)
+            except RuntimeError:
+                self.cerrada = True # The loop is closed: the client is gone
+
+    def entregar(self, notificaciones: list[dict]) -> None:
+        with self._lock:
+            for notificacion in notificaciones:
+                if notificacion["id"] <= self.ultimo_id:
+                    continue # Read before the subscription started, or replayed
+                if len(self._cola) >= MAX_PENDIENTES:
+                    self._cola.popleft()
+                    self.perdidas += 1
+                self._cola.append(notificacion)
+                self.ultimo_id = notificacion["id"]
+        self._avisar()
+
+    def _extraer(self) -> list[dict]:
+        with self._lock:
+            self.ultimo_acceso = time.monotonic()
+            notificaciones = list(self._cola)
+            self._cola.clear()
+            self._aviso.clear()
+            return notificaciones
+
+    def recibir(self, timeout: float | None = None) -> list[dict]:
+        '''Waits up to `timeout` seconds for notifications and returns them (possibly none).'''
+        if not self._cola:
+            self._aviso.wait(timeout)
+        return self._extraer()
+
+    async def recibir_async(self, timeout: float | None = None) -> list[dict]:
+        if not self._cola:
+            try:
+                await asyncio.wait_for(self._aviso.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._extraer()
+
+class Notificador:
+    '''Tails the outbox of a database and fans it out to the subscriptions (see module docstring).'''
+
+    def __init__(self, db_engine, intervalo_s: float = INTERVALO_SONDEO_S):
+        self.db_engine = db_engine
+        self.intervalo_s = intervalo_s
+        self._suscripciones = set()
+        self._ultimo_id = None # Last notification read; None while nobody is subscribed
+        self._condicion = threading.Condition()
+        self._hilo = None
+        self._ultima_purga = None # time.monotonic() of the last outbox purge
+
+    def iniciar(self) -> None:
+        '''Starts the polling thread, which also purges the outbox while nobody is subscribed.'''
+        with self._condicion:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, daemon=True, name="notificador")
+                self._hilo.start()
+
+    def suscribir(self, filtro: Filtro | None = None, ultimo_evento_id: int | None = None,
+                  loop: asyncio.AbstractEventLoop | None = None) -> Suscripcion:
+        '''
+        Registers a subscriber.
+
+        Args:
+            filtro: Optional. Notifications wanted (default: all).
+            ultimo_evento_id: Optional. Last notification the client saw (SSE Last-Event-ID):
+                the ones after it are replayed from the outbox, at most MAX_REPETICION.
+            loop: Optional. Event loop the subscription is read from (with recibir_async).
+
+        Returns:
+            The subscription; call `cancelar` when the client goes away.
+        '''
+        filtro = filtro or Filtro()
+        with self._condicion:
+            if self._ultimo_id is None:
+                self._ultimo_id = crud.get_ultimo_id_notificacion(self.db_engine) or 0
+            # Taken before the subscription is registered: the polling thread only delivers
+            # notifications after it, and the replay only the ones up to it
+            hasta_id = self._ultimo_id
+            suscripcion = Suscripcion(filtro, hasta_id, loop=loop)
+            self._suscripciones.add(suscripcion)
+            self._condicion.notify_all()
+        self.iniciar()
+        if ultimo_evento_id is not None and ultimo_evento_id < hasta_id:
+            self._repetir(suscripcion, ultimo_evento_id, hasta_id)
+        return suscripcion
+
+    def _repetir(self, suscripcion: Suscripcion, desde_id: int, hasta_id: int) -> None:
+        # Replayed notifications are older than any live one queued meanwhile: they go first
+        filas = crud.get_notificaciones_after_id(self.db_engine, max(desde_id, hasta_id - MAX_REPETICION), limit=MAX_REPETICION)
+        perdidas = [n for n in map(_notificacion, filas) if n["id"] <= hasta_id and suscripcion.filtro.acepta(n)]
+        with suscripcion._lock:
+            suscripcion._cola.extendleft(reversed(perdidas))
+        suscripcion._avisar()
+
+    def cancelar(self, suscripcion: Suscripcion) -> None:
+        suscripcion.cerrada = True
+        with self._condicion:
+            self._suscripciones.discard(suscripcion)
+            if not self._suscripciones:
+                self._ultimo_id = None
+
+    def publicar(self, notificaciones: list[dict]) -> int:
+        '''Pushes notifications to the matching subscriptions. Returns the number of deliveries.'''
+        limite_inactividad = time.monotonic() - SUSCRIPCION_INACTIVA_S
+        with self._condicion:
+            suscripciones = list(self._suscripciones)
+        entregas = 0
+        for suscripcion in suscripciones:
+            if suscripcion.cerrada or suscripcion.ultimo_acceso < limite_inactividad:
+                self.cancelar(suscripcion)
+                continue
+            aceptadas = [n for n in notificaciones if suscripcion.filtro.acepta(n)]
+            if aceptadas:
+                suscripcion.entregar(aceptadas)
+                entregas += 1
+        return entregas
+
+    def _purgar_si_toca(self) -> None:
+        if self._ultima_purga is not None and time.monotonic() - self._ultima_purga < INTERVALO_PURGA_S:
+            return
+        self._ultima_purga = time.monotonic()
+        # Without sinks nothing is ever marked as delivered: the outbox would only grow
+        borradas = purgar(self.db_engine, solo_despachadas=bool(sinks_configurados()))
+        if borradas > 0:
+            logging.info(f"Notificaciones antiguas borradas: {borradas}")
+
+    def _bucle(self) -> None:
+        while True:
+            self._purgar_si_toca()
+            with self._condicion:
+                if not self._suscripciones:
+                    self._condicion.wait(INTERVALO_PURGA_S)
+                    continue
+                ultimo_id = self._ultimo_id
+            filas = crud.get_notificaciones_after_id(self.db_engine, ultimo_id, limit=LOTE_SONDEO)
+            if filas:
+                with self._condicion:
+                    if self._ultimo_id is not None:
+                        self._ultimo_id = max(self._ultimo_id, filas[-1]["id"])
+                self.publicar([_notificacion(fila) for fila in filas])
+            if len(filas) < LOTE_SONDEO:
+                time.sleep(self.intervalo_s)
+
+    def num_suscripciones(self) -> int:
+        with self._condicion:
+            return len(self._suscripciones)
+
+_notificadores = {}
+_notificadores_lock = threading.Lock()
+
+def obtener_notificador(db_engine) -> Notificador:
+    '''Returns the process-wide notifier of a database, creating (and starting) it on first use.'''
+    clave = str(db_engine.url)
+    with _notificadores_lock:
+        if clave not in _notificadores:
+            _notificadores[clave] = Notificador(db_engine)
+            _notificadores[clave].iniciar()
+        return _notificadores[clave]
+
+def formato_sse(notificacion: dict) -> str:
+    '''Serializes a notification as a Server-Sent Event (its ID lets the client resume).'''
+    return f"id: {notificacion['id']}\nevent: {notificacion['tipo']}\ndata: {json.dumps(notificacion, ensure_ascii=False)}\n\n"
+
+# --- Sinks for the dispatcher ---
+
+class Sink:
+    '''Destination of the dispatched notifications. `enviar` raises on failure so the batch is retried.'''
+
+    def __init__(self, filtro: Filtro | None = None):
+        self.filtro = filtro or Filtro(urgencias=["ALTA"])
+
+    def enviar(self, notificaciones: list[dict]) -> None:
+        raise NotImplementedError
+
+class SinkWebhook(Sink):
+    '''POSTs each batch as {"notificaciones": [...]} to a URL.'''
+
+    def __init__(self, url: str, filtro: Filtro | None = None, timeout_s: float = 10.0):
+        super().__init__(filtro)
+        self.url = url
+        self.timeout_s = timeout_s
+
+    def enviar(self, notificaciones: list[dict]) -> None:
+        respuesta = requests.post(self.url, json={"notificaciones": notificaciones}, timeout=self.timeout_s)
+        respuesta.raise_for_status()
+
+class SinkCorreo(Sink):
+    '''Sends one email per batch through an SMTP server (by default a local MTA).'''
+
+    def __init__(self, destinatarios: list[str], remitente: str = "judicial-ai@localhost",
+                 servidor: str = "localhost", puerto: int = 25, filtro: Filtro | None = None):
+        super().__init__(filtro)
+        self.destinatarios = destinatarios
+        self.remitente = remitente
+        self.servidor = servidor
+        self.puerto = puerto
+
+    def enviar(self, notificaciones: list[dict]) -> None:
+        mensaje = EmailMessage()
+        mensaje["Subject"] = f"[Judicial AI] {len(notificaciones)} actuación(es) nueva(s) o reclasificada(s)"
+        mensaje["From"] = self.remitente
+        mensaje["To"] = ", ".join(self.destinatarios)
+        mensaje.set_content("\n\n".join(
+            f"[{n['urgencia']}] {n['empresa'] or '-'} · proceso {n['numeroRadicacion'] or n['idProceso']}\n"
+            f"{(n['fechaActuacion'] or '')[:10]} {n['actuacion'] or ''}: {n['anotacion']}"
+            for n in notificaciones
+        ))
+        with smtplib.SMTP(self.servidor, self.puerto, timeout=30) as smtp:
+            smtp.send_message(mensaje)
+
+def sinks_configurados() -> list[Sink]:
+    '''Sinks configured through environment variables (see module docstring).'''
+    urgencias = [u.strip() for u in os.getenv("NOTIFICACIONES_URGENCIAS", "ALTA").split(",") if u.strip()]
+    sinks = []
+    if os.getenv("NOTIFICACIONES_WEBHOOK_URL"):
+        sinks.append(SinkWebhook(os.getenv("NOTIFICACIONES_WEBHOOK_URL"), Filtro(urgencias=urgencias)))
+    if os.getenv("NOTIFICACIONES_CORREO_PARA"):
+        servidor, _, puerto = os.getenv("NOTIFICACIONES_SMTP", "localhost:25").partition(":")
+        sinks.append(SinkCorreo(
+            [d.strip() for d in os.getenv("NOTIFICACIONES_CORREO_PARA").split(",") if d.strip()],
+            remitente=os.getenv("NOTIFICACIONES_CORREO_DE", "judicial-ai@localhost"),
+            servidor=servidor, puerto=int(puerto or 25), filtro=Filtro(urgencias=urgencias)
+        ))
+    return sinks
+
+def despachar_pendientes(db_engine, sinks: list[Sink], lote: int = LOTE_SONDEO) -> int:
+    '''
+    Delivers the pending outbox notifications to the sinks, batch by batch.
+
+    Returns:
+        The number of notifications marked as delivered (stops at the first batch a sink rejects).
+    '''
+    total = 0
+    while True:
+        filas = crud.get_notificaciones_pendientes(db_engine, limit=lote)
+        if not filas:
+            return total
+        notificaciones = [_notificacion(fila) for fila in filas]
+        for sink in sinks:
+            aceptadas = [n for n in notificaciones if sink.filtro.acepta(n)]
+            if not aceptadas:
+                continue
+            try:
+                sink.enviar(aceptadas)
+            except Exception as e:
+                logging.error(f"Error al enviar {len(aceptadas)} notificaciones a {type(sink).__name__}: {e}")
+                return total
+        if crud.update_notificaciones_despachadas(db_engine, [n["id"] for n in notificaciones], datetime.utcnow()) < 0:
+            return total
+        total += len(notificaciones)
+        if len(filas) < lote:
+            return total
+
+def purgar(db_engine, dias: int = RETENCION_DIAS, solo_despachadas: bool = True, max_dias: int = RETENCION_MAX_DIAS) -> int:
+    '''
+    Deletes the outbox notifications older than `dias` days. Returns the number deleted (-1 on error).
+    Undelivered ones are kept (a sink may be down) until they are `max_dias` old, unless
+    `solo_despachadas` is False, which is meant for installations without sinks, where nothing
+    is ever delivered.
+    '''
+    ahora = datetime.utcnow()
+    borradas = crud.delete_notificaciones_anteriores(db_engine, ahora - timedelta(days=dias), solo_despachadas)
+    if borradas < 0 or not solo_despachadas:
+        return borradas
+    sin_despachar = crud.delete_notificaciones_anteriores(db_engine, ahora - timedelta(days=max_dias), solo_despachadas=False)
+    if sin_despachar > 0:
+        logging.warning(f"Borradas {sin_despachar} notificaciones sin despachar de más de {max_dias} días: revise los sinks.")
+    return borradas + max(sin_despachar, 0)
+
+if __name__ == "__main__":
+    from app.db.database import engine, create_db_and_tables
+    parser = argparse.ArgumentParser(description="Despacha las notificaciones de actuaciones a correo y webhooks.")
+    parser.add_argument("--despachar", action="store_true", help="Despacha continuamente las notificaciones pendientes")
+    parser.add_argument("--una-vez", action="store_true", help="Despacha las pendientes y termina")
+    parser.add_argument("--purgar", action="store_true", help=f"Borra las notificaciones despachadas (todas, si no hay sinks) de más de {RETENCION_DIAS} días")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    sinks = sinks_configurados()
+    if (args.despachar or args.una_vez) and not sinks:
+        print("No hay sinks configurados (NOTIFICACIONES_WEBHOOK_URL / NOTIFICACIONES_CORREO_PARA).")
+    elif args.una_vez:
+        print(f"Notificaciones despachadas: {despachar_pendientes(engine, sinks)}")
+    elif args.despachar:
+        ultima_purga = 0.0
+        while True:
+            despachadas = despachar_pendientes(engine, sinks)
+            if despachadas:
+                logging.info(f"Notificaciones despachadas: {despachadas}")
+            if time.monotonic() - ultima_purga > INTERVALO_PURGA_S:
+                purgar(engine)
+                ultima_purga = time.monotonic()
+            time.sleep(INTERVALO_DESPACHO_S)
+    if args.purgar:
+        print(f"Notificaciones borradas: {purgar(engine, solo_despachadas=bool(sinks))}")
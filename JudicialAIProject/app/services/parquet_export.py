@@ -0,0 +1,173 @@
+'''
+Incremental export of procesos and actuaciones to columnar Parquet snapshots.
+
+Rows created or updated since the last run (watermark on fecha_actualizacion_db) are
+appended as new files to Hive-partitioned datasets under data/parquet/:
+
+    data/parquet/actuacion/empresa=<nombre_busqueda>/mes=<YYYY-MM>/part-<lote>-<n>.parquet
+    data/parquet/proceso/empresa=<nombre_busqueda>/mes=<YYYY-MM>/part-<lote>-<n>.parquet
+
+An updated row is written again in a later file, so readers keep the last version of each
+ID (see app/services/analytics.py); `compactar` rewrites each partition without them.
+Long texts (anotación, AI summaries) are left out: the snapshots are for analytics.
+'''
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from app.db import crud
+from app.db.database import DATA_DIR
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PARQUET_DIR = os.path.join(DATA_DIR, "parquet")
+TAMANO_LOTE = 50_000 # Rows read from SQLite per batch
+SIN_EMPRESA = "SIN_EMPRESA"
+SIN_FECHA = "sin_fecha"
+
+ESQUEMAS = {
+    "proceso": pa.schema([
+        ("id", pa.int64()), ("idProceso", pa.string()), ("numeroRadicacion", pa.string()),
+        ("despacho", pa.string()), ("ponente", pa.string()), ("fechaRadicacion", pa.timestamp("s")),
+        ("tipoProceso", pa.string()), ("claseProceso", pa.string()), ("ubicacionExpediente", pa.string()),
+        ("demandante", pa.string()), ("demandado", pa.string()),
+        ("fecha_creacion_db", pa.timestamp("us")), ("fecha_actualizacion_db", pa.timestamp("us")),
+        ("empresa", pa.string()), ("mes", pa.string()),
+    ]),
+    "actuacion": pa.schema([
+        ("id", pa.int64()), ("proceso_db_id", pa.int64()), ("idRegActuacion", pa.string()),
+        ("fechaActuacion", pa.timestamp("s")), ("actuacion", pa.string()),
+        ("fechaIniciaTermino", pa.timestamp("s")), ("fechaFinalizaTermino", pa.timestamp("s")),
+        ("fechaRegistro", pa.timestamp("s")), ("conDocumentos", pa.bool_()),
+        ("clasificacion_urgencia_ia", pa.string()), ("despacho", pa.string()),
+        ("fecha_creacion_db", pa.timestamp("us")), ("fecha_actualizacion_db", pa.timestamp("us")),
+        ("empresa", pa.string()), ("mes", pa.string()),
+    ]),
+}
+# Column whose month partitions each table
+COLUMNA_MES = {"proceso": "fechaRadicacion", "actuacion": "fechaActuacion"}
+LECTORES = {"proceso": crud.get_procesos_modificados, "actuacion": crud.get_actuaciones_modificadas}
+
+def _ruta_estado(directorio: str) -> str:
+    return os.path.join(directorio, "_estado.json")
+
+def _leer_estado(directorio: str) -> dict:
+    ruta = _ruta_estado(directorio)
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+def _guardar_estado(directorio: str, estado: dict) -> None:
+    temporal = _ruta_estado(directorio) + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=2)
+    os.replace(temporal, _ruta_estado(directorio))
+
+def _a_tabla_arrow(tabla: str, filas: list[dict]) -> pa.Table:
+    '''Converts a batch of rows to Arrow with vectorized date parsing and the partition columns.'''
+    df = pd.DataFrame(filas)
+    esquema = ESQUEMAS[tabla]
+    for campo in esquema:
+        if campo.name in ("empresa", "mes"):
+            continue
+        if campo.name not in df:
+            df[campo.name] = None
+        if pa.types.is_timestamp(campo.type):
+            # API dates are ISO strings ("2024-05-20T00:00:00"); anything unparsable becomes null
+            df[campo.name] = pd.to_datetime(df[campo.name], errors="coerce")
+    empresa = df.pop("nombre_busqueda") if "nombre_busqueda" in df else pd.Series(None, index=df.index, dtype=object)
+    df["empresa"] = empresa.fillna("").str.strip().replace("", SIN_EMPRESA)
+    df["mes"] = df[COLUMNA_MES[tabla]].dt.strftime("%Y-%m").fillna(SIN_FECHA)
+    return pa.Table.from_pandas(df[esquema.names], schema=esquema, preserve_index=False)
+
+def exportar_tabla(db_engine, tabla: str, directorio: str = PARQUET_DIR, tamano_lote: int = TAMANO_LOTE) -> int:
+    '''
+    Appends the rows of `tabla` ("proceso" or "actuacion") modified since the last export.
+
+    The watermark is saved after every batch, so an interrupted export resumes where it stopped.
+
+    Returns:
+        The number of rows exported.
+    '''
+    estado = _leer_estado(directorio)
+    marca = estado.get(tabla, {})
+    desde = datetime.fromisoformat(marca["fecha"]) if marca.get("fecha") else None
+    ultimo_id = marca.get("id", 0)
+    destino = os.path.join(directorio, tabla)
+    lote_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    total, numero_lote = 0, 0
+
+    while True:
+        filas = LECTORES[tabla](db_engine, desde, ultimo_id, tamano_lote)
+        if not filas:
+            break
+        pq.write_to_dataset(
+            _a_tabla_arrow(tabla, filas), destino,
+            partitioning=["empresa", "mes"], partitioning_flavor="hive",
+            basename_template=f"part-{lote_id}-{numero_lote}-{{i}}.parquet",
+            compression="zstd", existing_data_behavior="overwrite_or_ignore"
+        )
+        desde, ultimo_id = filas[-1]["fecha_actualizacion_db"], filas[-1]["id"]
+        estado[tabla] = {"fecha": desde.isoformat() if desde else None, "id": ultimo_id}
+        _guardar_estado(directorio, estado)
+        total += len(filas)
+        numero_lote += 1
+
+    logging.info(f"Exportación Parquet de '{tabla}': {total} filas nuevas o modificadas.")
+    return total
+
+def exportar(db_engine, directorio: str = PARQUET_DIR) -> dict:
+    '''Runs the incremental export of procesos and actuaciones. Returns the rows exported per table.'''
+    os.makedirs(directorio, exist_ok=True)
+    return {tabla: exportar_tabla(db_engine, tabla, directorio) for tabla in ESQUEMAS}
+
+def dataset(tabla: str, directorio: str = PARQUET_DIR) -> ds.Dataset | None:
+    '''Opens the Parquet dataset of a table, with its Hive partitions. None if nothing was exported yet.'''
+    ruta = os.path.join(directorio, tabla)
+    if not os.path.isdir(ruta):
+        return None
+    return ds.dataset(ruta, format="parquet", schema=ESQUEMAS[tabla], partitioning="hive")
+
+def compactar(tabla: str, directorio: str = PARQUET_DIR) -> int:
+    '''
+    Rewrites every partition of a table as a single file with only the last version of each row.
+    Returns the number of partitions compacted.
+    '''
+    raiz = os.path.join(directorio, tabla)
+    if not os.path.isdir(raiz):
+        return 0
+    compactadas = 0
+    for carpeta_empresa in os.listdir(raiz):
+        for carpeta_mes in os.listdir(os.path.join(raiz, carpeta_empresa)):
+            ruta = os.path.join(raiz, carpeta_empresa, carpeta_mes)
+            archivos = sorted(f for f in os.listdir(ruta) if f.endswith(".parquet"))
+            if len(archivos) < 2:
+                continue
+            # Partition columns are encoded in the path, not stored in the files
+            esquema_archivo = pa.schema([c for c in ESQUEMAS[tabla] if c.name not in ("empresa", "mes")])
+            datos = pa.concat_tables(pq.read_table(os.path.join(ruta, f), schema=esquema_archivo) for f in archivos)
+            df = datos.to_pandas().sort_values("fecha_actualizacion_db").drop_duplicates("id", keep="last")
+            temporal = ruta + ".compactando"
+            os.makedirs(temporal, exist_ok=True)
+            pq.write_table(pa.Table.from_pandas(df, schema=esquema_archivo, preserve_index=False), os.path.join(temporal, "part-compactado-0.parquet"), compression="zstd")
+            shutil.rmtree(ruta)
+            os.replace(temporal, ruta)
+            compactadas += 1
+    logging.info(f"Compactación Parquet de '{tabla}': {compactadas} particiones reescritas.")
+    return compactadas
+
+if __name__ == "__main__":
+    import sys
+    from app.db.database import engine
+    print(exportar(engine))
+    if "--compactar" in sys.argv:
+        for nombre_tabla in ESQUEMAS:
+            compactar(nombre_tabla)
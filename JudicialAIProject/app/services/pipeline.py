@@ -0,0 +1,232 @@
+'''
+Staged streaming pipeline with bounded queues, backpressure and per-stage metrics.
+
+A pipeline is a chain of stages (`Etapa`), each with its own threads and a bounded input
+queue. Every stage function receives one item (or a batch of up to `lote` items) and returns
+an iterable with the items for the next stage: none (filter), one (map) or many (fan-out, e.g.
+one proceso -> its actuaciones). When a queue is full the stages feeding it block, so a slow
+stage throttles everything upstream (down to the input iterator) and memory stays bounded by
+the queue capacities, however many items flow through.
+
+    pipeline = Pipeline([
+        Etapa("fetch", descargar, hilos=4, capacidad=20),
+        Etapa("persist", guardar, lote=50),
+    ])
+    metricas = pipeline.ejecutar(ids)
+
+The ingestion of whole companies is built on it (app/services/ingestion.py: ingerir_procesos).
+'''
+import logging
+import queue
+import threading
+import time
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_FIN = object() # End-of-stream marker: the last thread of a stage sends one per thread of the next
+ESPERA_PUT_S = 0.5 # How often a blocked thread checks whether the pipeline was stopped
+MAX_ERRORES_GUARDADOS = 20
+
+class Etapa:
+    '''
+    A pipeline stage.
+
+    Args:
+        nombre: Name used in logs and metrics.
+        funcion: Callable taking an item (or a list of items if lote > 1) and returning an iterable of output items, or None.
+        hilos: Optional. Threads running the function concurrently.
+        capacidad: Optional. Size of the input queue (backpressure threshold).
+        lote: Optional. Maximum batch size; > 1 makes the function receive lists.
+        espera_lote: Optional. Seconds to wait for a batch to fill before processing it partially.
+    '''
+
+    def __init__(self, nombre: str, funcion, hilos: int = 1, capacidad: int = 100, lote: int = 1, espera_lote: float = 0.5):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.hilos = max(1, hilos)
+        self.capacidad = max(1, capacidad)
+        self.lote = max(1, lote)
+        self.espera_lote = espera_lote
+        self.cola: queue.Queue | None = None
+        self._reiniciar_metricas()
+
+    def _reiniciar_metricas(self) -> None:
+        self.recibidos = 0
+        self.emitidos = 0
+        self.errores = 0
+        self.lotes = 0
+        self.segundos_ocupado = 0.0
+        self.segundos_bloqueado = 0.0 # Waiting for room in the next queue (backpressure)
+        self.profundidad_maxima = 0
+        self.ultimos_errores: list[str] = []
+        self._lock = threading.Lock()
+        self._hilos_vivos = 0
+
+    def metricas(self, segundos: float) -> dict:
+        '''Counters of the stage; throughput is items received per second of pipeline run time.'''
+        with self._lock:
+            return {
+                "etapa": self.nombre,
+                "hilos": self.hilos,
+                "recibidos": self.recibidos,
+                "emitidos": self.emitidos,
+                "errores": self.errores,
+                "lotes": self.lotes,
+                "items_por_segundo": round(self.recibidos / segundos, 2) if segundos else None,
+                "utilizacion": round(self.segundos_ocupado / (segundos * self.hilos), 3) if segundos else None, # 1.0 = always busy: the bottleneck
+                "bloqueo": round(self.segundos_bloqueado / (segundos * self.hilos), 3) if segundos else None, # Throttled by a slower stage downstream
+                "profundidad_cola": self.cola.qsize() if self.cola is not None else 0,
+                "profundidad_maxima": self.profundidad_maxima,
+                "capacidad_cola": self.capacidad,
+                "ultimos_errores": list(self.ultimos_errores),
+            }
+
+class Pipeline:
+    '''Runs items through a chain of stages connected by bounded queues (see module docstring).'''
+
+    def __init__(self, etapas: list[Etapa], intervalo_log: float | None = None):
+        if not etapas:
+            raise ValueError("Un pipeline necesita al menos una etapa.")
+        self.etapas = etapas
+        self.intervalo_log = intervalo_log
+        self._detener = threading.Event()
+        self._inicio: float | None = None
+        self._fin: float | None = None
+
+    def _poner(self, cola: queue.Queue, item, etapa: Etapa | None = None) -> bool:
+        # Blocks while the queue is full (backpressure) unless the pipeline is stopped
+        while not self._detener.is_set():
+            try:
+                cola.put(item, timeout=ESPERA_PUT_S)
+            except queue.Full:
+                continue
+            if etapa is not None:
+                profundidad = cola.qsize()
+                if profundidad > etapa.profundidad_maxima:
+                    etapa.profundidad_maxima = profundidad
+            return True
+        return False
+
+    def _tomar_lote(self, etapa: Etapa) -> tuple[list, bool]:
+        # Returns (items, end of stream reached)
+        while True:
+            try:
+                item = etapa.cola.get(timeout=ESPERA_PUT_S)
+                break
+            except queue.Empty:
+                if self._detener.is_set():
+                    return [], True
+        if item is _FIN:
+            return [], True
+        items = [item]
+        limite = time.monotonic() + etapa.espera_lote
+        while len(items) < etapa.lote:
+            restante = limite - time.monotonic()
+            try:
+                item = etapa.cola.get(timeout=restante) if restante > 0 else etapa.cola.get_nowait()
+            except queue.Empty:
+                break
+            if item is _FIN:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _trabajar(self, indice: int) -> None:
+        etapa = self.etapas[indice]
+        siguiente = self.etapas[indice + 1] if indice + 1 < len(self.etapas) else None
+        fin = False
+        try:
+            while not fin and not self._detener.is_set():
+                items, fin = self._tomar_lote(etapa)
+                if not items:
+                    continue
+                inicio = time.perf_counter()
+                emitidos, bloqueado = 0, 0.0
+                try:
+                    salida = etapa.funcion(items if etapa.lote > 1 else items[0])
+                    for resultado in salida or ():
+                        emitidos += 1
+                        if siguiente is None:
+                            continue
+                        inicio_bloqueo = time.perf_counter()
+                        puesto = self._poner(siguiente.cola, resultado, siguiente)
+                        bloqueado += time.perf_counter() - inicio_bloqueo
+                        if not puesto:
+                            break
+                except Exception as e:
+                    logging.error(f"Error en la etapa '{etapa.nombre}': {e}")
+                    with etapa._lock:
+                        etapa.errores += len(items)
+                        etapa.ultimos_errores = (etapa.ultimos_errores + [f"{type(e).__name__}: {e}"])[-MAX_ERRORES_GUARDADOS:]
+                with etapa._lock:
+                    etapa.recibidos += len(items)
+                    etapa.emitidos += emitidos
+                    etapa.lotes += 1
+                    etapa.segundos_ocupado += time.perf_counter() - inicio - bloqueado
+                    etapa.segundos_bloqueado += bloqueado
+        finally:
+            with etapa._lock:
+                etapa._hilos_vivos -= 1
+                ultimo = etapa._hilos_vivos == 0
+            if ultimo and siguiente is not None:
+                for _ in range(siguiente.hilos):
+                    self._poner(siguiente.cola, _FIN)
+
+    def _registrar_periodicamente(self) -> None:
+        while not self._detener.wait(self.intervalo_log):
+            logging.info("Pipeline: " + " | ".join(
+                f"{m['etapa']} {m['recibidos']} ({m['items_por_segundo']}/s, cola {m['profundidad_cola']}/{m['capacidad_cola']})"
+                for m in self.metricas()
+            ))
+
+    def ejecutar(self, entradas) -> list[dict]:
+        '''
+        Feeds the items of `entradas` (any iterable, consumed lazily) through the stages and waits
+        until every stage has drained.
+
+        Returns:
+            The metrics of every stage (see metricas()).
+        '''
+        self._detener.clear()
+        for etapa in self.etapas:
+            etapa._reiniciar_metricas()
+            etapa.cola = queue.Queue(maxsize=etapa.capacidad)
+            etapa._hilos_vivos = etapa.hilos
+        self._inicio, self._fin = time.monotonic(), None
+        hilos = [
+            threading.Thread(target=self._trabajar, args=(i,), name=f"pipeline-{etapa.nombre}-{n}", daemon=True)
+            for i, etapa in enumerate(self.etapas) for n in range(etapa.hilos)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        if self.intervalo_log:
+            threading.Thread(target=self._registrar_periodicamente, name="pipeline-metricas", daemon=True).start()
+        primera = self.etapas[0]
+        try:
+            for item in entradas:
+                if not self._poner(primera.cola, item, primera):
+                    break
+            for _ in range(primera.hilos):
+                self._poner(primera.cola, _FIN)
+            for hilo in hilos:
+                while hilo.is_alive():
+                    hilo.join(timeout=1.0)
+        except KeyboardInterrupt:
+            logging.info("Pipeline interrumpido; se descartan los items en cola.")
+            raise
+        finally:
+            self._fin = time.monotonic()
+            self._detener.set()
+        return self.metricas()
+
+    def detener(self) -> None:
+        '''Stops the pipeline: the threads finish their current item and the queued items are dropped.'''
+        self._detener.set()
+
+    def metricas(self) -> list[dict]:
+        '''Per-stage metrics: items received and emitted, errors, throughput, utilization and queue depth.'''
+        if self._inicio is None:
+            return []
+        segundos = (self._fin or time.monotonic()) - self._inicio
+        return [etapa.metricas(segundos) for etapa in self.etapas]
@@ -0,0 +1,326 @@
+'''
+Adaptive per-proceso polling frequency within a global daily request budget.
+
+Most procesos are dormant for months while a few move every week, so polling all of them at
+the same cadence spends the API budget where nothing happens. Here every proceso gets:
+
+- an activity rate λ (actuaciones per day): an exponentially decayed count of its stored
+  actuaciones (half-life VIDA_MEDIA_DIAS) with a weak prior, so sparse histories do not give
+  zero; procesos with activity in the last 30 days (own history, or the fechaUltimaActuacion of
+  the watched-company snapshots, see change_detection.py) get at least TASA_MINIMA_RECIENTE;
+- a weight w: boosted when the proceso has an upcoming hearing or deadline (evento table);
+- a check frequency f ∝ sqrt(w·λ), clamped to [FRECUENCIA_MINIMA, FRECUENCIA_MAXIMA] and
+  scaled so that Σ f · SOLICITUDES_POR_CONSULTA equals the daily budget. With Poisson
+  arrivals the expected delay before a new actuación is seen is 1/(2f), and this allocation
+  minimizes the weighted total delay Σ w·λ/(2f) for the given budget.
+
+`planificar` stores the schedule (sondeo_proceso), `encolar_vencidas` turns the checks that
+are due into fetch-process jobs (app/services/workers.py), and `simular` compares the policy
+against fixed-interval polling with the same budget.
+
+    python -m app.services.polling --planificar [--presupuesto 5000]
+    python -m app.services.polling --encolar
+    python -m app.services.polling --simular [--sintetico 20000] [--dias 90]
+'''
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+import numpy as np
+from app.db import crud
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PRESUPUESTO_DIARIO = int(os.getenv("PRESUPUESTO_SOLICITUDES_DIA", "5000")) # Requests per day to the Rama Judicial API
+SOLICITUDES_POR_CONSULTA = 2 # A check is a detail request plus an actuaciones request
+VIDA_MEDIA_DIAS = 90.0 # Old actuaciones count half every this many days
+PRIOR_ACTUACIONES = 0.5 # Weak Gamma prior: 0.5 actuaciones in 60 days
+PRIOR_DIAS = 60.0
+DIAS_RECIENTE = 30
+TASA_MINIMA_RECIENTE = 1 / 30 # Activity in the last 30 days: at least one actuación a month expected
+HORIZONTE_PLAZOS_DIAS = 15
+REFUERZO_PLAZO = 4.0 # Weight of a proceso with an event today: 1 + REFUERZO_PLAZO
+ESCALA_PLAZO_DIAS = 5.0 # The boost decays exponentially with the days to the event
+ANTICIPACION_PLAZO_DIAS = 1.0 # A check is scheduled at least this long before an event
+FRECUENCIA_MINIMA = 1 / 30 # Checks per day: every proceso is checked at least monthly...
+FRECUENCIA_MAXIMA = 3.0 # ...and at most three times a day
+
+def estimar_tasas(indices: np.ndarray, edades: np.ndarray, n: int) -> np.ndarray:
+    '''
+    Activity rate (actuaciones per day) of n procesos from the ages (days) of their actuaciones.
+
+    Args:
+        indices: Position (0..n-1) of the proceso of each actuación.
+        edades: Age in days of each actuación.
+        n: Number of procesos.
+
+    Returns:
+        The posterior mean rate of each proceso: (prior + decayed count) / (prior days + decayed exposure).
+    '''
+    k = math.log(2) / VIDA_MEDIA_DIAS
+    edades = np.maximum(np.asarray(edades, dtype=float), 0.0) # Future dates (typos) count as today
+    indices = np.asarray(indices, dtype=np.int64)
+    conteo = np.bincount(indices, weights=np.exp(-k * edades), minlength=n)
+    historia = np.zeros(n)
+    if len(edades):
+        np.maximum.at(historia, indices, edades) # Observed span: since the oldest actuación
+    exposicion = (1 - np.exp(-k * historia)) / k
+    return (PRIOR_ACTUACIONES + conteo) / (PRIOR_DIAS + exposicion)
+
+def pesos_por_plazo(dias_evento: np.ndarray) -> np.ndarray:
+    '''Weight of each proceso from the days to its next event (NaN if none within the horizon).'''
+    refuerzo = REFUERZO_PLAZO * np.exp(-np.nan_to_num(dias_evento, nan=np.inf).clip(min=0) / ESCALA_PLAZO_DIAS)
+    return 1.0 + refuerzo
+
+def asignar_frecuencias(tasas: np.ndarray, pesos: np.ndarray, consultas_dia: float,
+                        minima: float = FRECUENCIA_MINIMA, maxima: float = FRECUENCIA_MAXIMA) -> np.ndarray:
+    '''
+    Checks per day of each proceso: f ∝ sqrt(peso · tasa), clamped to [minima, maxima] (water-filling)
+    and adding up to `consultas_dia`. If the budget cannot give every proceso the minimum, the
+    minimum is lowered to an even share.
+    '''
+    n = len(tasas)
+    if n == 0 or consultas_dia <= 0:
+        return np.zeros(n)
+    minima = min(minima, consultas_dia / n)
+    maxima = max(maxima, minima)
+    puntaje = np.sqrt(np.asarray(tasas, dtype=float) * np.asarray(pesos, dtype=float))
+    frecuencias = np.empty(n)
+    libres = np.ones(n, dtype=bool)
+    restante = consultas_dia
+    for _ in range(100):
+        total = puntaje[libres].sum()
+        frecuencias[libres] = restante * puntaje[libres] / total if total > 0 else restante / libres.sum()
+        bajas = libres & (frecuencias < minima)
+        altas = libres & (frecuencias > maxima)
+        if not bajas.any() and not altas.any():
+            break
+        # Clamp the violators and share what is left among the others
+        frecuencias[bajas], frecuencias[altas] = minima, maxima
+        libres &= ~(bajas | altas)
+        if not libres.any():
+            break
+        restante = max(consultas_dia - frecuencias[~libres].sum(), 0.0)
+    return frecuencias
+
+def calcular_politica(db_engine, presupuesto_diario: int = PRESUPUESTO_DIARIO, ahora: datetime | None = None) -> dict:
+    '''
+    Computes the rate, weight and check frequency of every stored proceso.
+
+    Returns:
+        {"ids": [proceso_db_id], "tasas", "pesos", "frecuencias", "dias_evento" (NaN if none), "recientes"}
+        as NumPy arrays aligned with "ids".
+    '''
+    ahora = ahora or datetime.utcnow()
+    ids = crud.get_proceso_db_ids(db_engine)
+    posicion = {proceso_db_id: i for i, proceso_db_id in enumerate(ids)}
+    edades = [(posicion[p], edad) for p, edad in crud.get_edades_actuaciones(db_engine, ahora) if p in posicion]
+    indices = np.array([i for i, _ in edades], dtype=np.int64)
+    valores = np.array([e for _, e in edades], dtype=float)
+    tasas = estimar_tasas(indices, valores, len(ids))
+
+    recientes = np.zeros(len(ids), dtype=bool)
+    recientes[indices[(valores >= 0) & (valores <= DIAS_RECIENTE)]] = True
+    for proceso_db_id in crud.get_procesos_actividad_reciente(db_engine, ahora - timedelta(days=DIAS_RECIENTE)):
+        if proceso_db_id in posicion:
+            recientes[posicion[proceso_db_id]] = True
+    tasas[recientes] = np.maximum(tasas[recientes], TASA_MINIMA_RECIENTE)
+
+    dias_evento = np.full(len(ids), np.nan)
+    for proceso_db_id, dias in crud.get_dias_proximo_evento(db_engine, ahora, HORIZONTE_PLAZOS_DIAS).items():
+        if proceso_db_id in posicion:
+            dias_evento[posicion[proceso_db_id]] = dias
+    pesos = pesos_por_plazo(dias_evento)
+    frecuencias = asignar_frecuencias(tasas, pesos, presupuesto_diario / SOLICITUDES_POR_CONSULTA)
+    return {"ids": ids, "tasas": tasas, "pesos": pesos, "frecuencias": frecuencias, "dias_evento": dias_evento, "recientes": recientes}
+
+def planificar(db_engine, presupuesto_diario: int = PRESUPUESTO_DIARIO, ahora: datetime | None = None) -> dict:
+    '''
+    Recomputes the polling schedule of every proceso and stores it (sondeo_proceso). The next
+    check is the last check plus the new interval; procesos never checked are spread over their
+    first interval, and a check is brought forward to ANTICIPACION_PLAZO_DIAS before an upcoming event.
+
+    Args:
+        db_engine: SQLAlchemy engine.
+        presupuesto_diario: Optional. Requests per day to the Rama Judicial API.
+        ahora: Optional. Reference time (UTC).
+
+    Returns:
+        A summary: procesos, requests per day, frequency percentiles and expected detection delay vs. fixed interval.
+    '''
+    ahora = ahora or datetime.utcnow()
+    politica = calcular_politica(db_engine, presupuesto_diario, ahora)
+    anteriores = crud.get_sondeos(db_engine)
+    rng = np.random.default_rng()
+    filas = []
+    for i, proceso_db_id in enumerate(politica["ids"]):
+        intervalo = timedelta(days=1 / politica["frecuencias"][i])
+        ultima = (anteriores.get(proceso_db_id) or {}).get("ultima_consulta")
+        proxima = ultima + intervalo if ultima else ahora + intervalo * rng.uniform()
+        if not np.isnan(politica["dias_evento"][i]):
+            objetivo = ahora + timedelta(days=politica["dias_evento"][i] - ANTICIPACION_PLAZO_DIAS)
+            if proxima > objetivo and (ultima is None or ultima < objetivo - timedelta(days=ANTICIPACION_PLAZO_DIAS)):
+                proxima = max(ahora, objetivo)
+        filas.append({
+            "proceso_db_id": proceso_db_id,
+            "tasa_estimada": float(politica["tasas"][i]),
+            "peso": float(politica["pesos"][i]),
+            "frecuencia_dia": float(politica["frecuencias"][i]),
+            "ultima_consulta": ultima,
+            "proxima_consulta": proxima,
+        })
+    crud.replace_sondeos(db_engine, filas)
+    resumen = resumen_politica(politica, presupuesto_diario)
+    logging.info(f"Plan de sondeo: {resumen['procesos']} procesos, {resumen['solicitudes_dia']:.0f} solicitudes/día, "
+                 f"retraso esperado {resumen['retraso_esperado_dias']} días (intervalo fijo: {resumen['retraso_fijo_dias']}).")
+    return resumen
+
+def resumen_politica(politica: dict, presupuesto_diario: int) -> dict:
+    '''Summary of a policy computed by calcular_politica (see planificar).'''
+    frecuencias, tasas, pesos = politica["frecuencias"], politica["tasas"], politica["pesos"]
+    n = len(frecuencias)
+    if n == 0:
+        return {"procesos": 0, "solicitudes_dia": 0, "retraso_esperado_dias": None, "retraso_fijo_dias": None}
+    consultas = frecuencias.sum()
+    # Expected delay until a new actuación is seen, weighted by activity and deadline boost
+    importancia = (pesos * tasas).sum()
+    retraso = float((pesos * tasas / (2 * frecuencias)).sum() / importancia)
+    retraso_fijo = float(n / (2 * consultas))
+    return {
+        "procesos": n,
+        "presupuesto_dia": presupuesto_diario,
+        "solicitudes_dia": round(float(consultas * SOLICITUDES_POR_CONSULTA), 1),
+        "intervalo_dias_p10": round(float(np.percentile(1 / frecuencias, 10)), 2),
+        "intervalo_dias_mediana": round(float(np.median(1 / frecuencias)), 2),
+        "intervalo_dias_p90": round(float(np.percentile(1 / frecuencias, 90)), 2),
+        "con_plazo_proximo": int((~np.isnan(politica["dias_evento"])).sum()),
+        "con_actividad_reciente": int(politica["recientes"].sum()),
+        "retraso_esperado_dias": round(retraso, 2),
+        "retraso_fijo_dias": round(retraso_fijo, 2),
+    }
+
+def encolar_vencidas(db_engine, cola=None, ahora: datetime | None = None, limite: int | None = None) -> int:
+    '''
+    Enqueues a fetch-process job for every proceso whose check is due and schedules its next check.
+
+    Args:
+        db_engine: SQLAlchemy engine.
+        cola: Optional. Job queue backend (default: app/db/job_queue.obtener_backend).
+        ahora: Optional. Reference time (UTC).
+        limite: Optional. Maximum number of checks enqueued (most overdue first).
+
+    Returns:
+        The number of checks enqueued.
+    '''
+    from app.db.job_queue import obtener_backend
+    from app.services.workers import encolar_proceso
+    ahora = ahora or datetime.utcnow()
+    cola = cola or obtener_backend(db_engine)
+    proximas = {}
+    for sondeo in crud.get_sondeos_vencidos(db_engine, ahora, limite):
+        # The version makes each check a new job; the same check enqueued twice is a no-op
+        version = sondeo["proxima_consulta"].strftime("%Y%m%d%H%M")
+        if encolar_proceso(cola, sondeo["idProceso"], nombre_busqueda=sondeo["nombre_busqueda"], version=version):
+            proximas[sondeo["proceso_db_id"]] = ahora + timedelta(days=1 / sondeo["frecuencia_dia"])
+    crud.update_sondeos_consultados(db_engine, proximas, ahora)
+    if proximas:
+        logging.info(f"{len(proximas)} consultas de sondeo encoladas.")
+    return len(proximas)
+
+def poblacion_sintetica(n: int, semilla: int = 0) -> np.ndarray:
+    '''Activity rates of a synthetic portfolio: mostly dormant procesos, some active and a few very active.'''
+    rng = np.random.default_rng(semilla)
+    grupo = rng.choice(3, size=n, p=[0.7, 0.25, 0.05])
+    medias = np.array([1 / 365, 1 / 30, 1 / 4])[grupo]
+    return medias * rng.lognormal(0, 0.5, size=n)
+
+def _evaluar(indices: np.ndarray, tiempos: np.ndarray, frecuencias: np.ndarray, dias: float, rng) -> dict:
+    # Polls of proceso i at fase_i + k·intervalo_i; every change is seen at the next poll
+    intervalos = 1 / frecuencias
+    fases = rng.uniform(0, intervalos)
+    solicitudes = int((np.floor((dias - fases) / intervalos) + 1).clip(min=0).sum()) * SOLICITUDES_POR_CONSULTA
+    intervalo, fase = intervalos[indices], fases[indices]
+    retrasos = (fase - tiempos) % intervalo
+    # Staleness: from the first unseen change of each poll interval until the poll
+    tramo = np.floor((tiempos - fase) / intervalo)
+    orden = np.lexsort((tiempos, tramo, indices))
+    primero = np.ones(len(orden), dtype=bool)
+    primero[1:] = (indices[orden][1:] != indices[orden][:-1]) | (tramo[orden][1:] != tramo[orden][:-1])
+    sel = orden[primero]
+    fin_tramo = np.minimum(fase[sel] + (tramo[sel] + 1) * intervalo[sel], dias)
+    desactualizado = np.clip(fin_tramo - tiempos[sel], 0, None).sum()
+    frescura = 1 - desactualizado / (len(frecuencias) * dias)
+    return {
+        "solicitudes": solicitudes,
+        "cambios": int(len(tiempos)),
+        "retraso_medio_dias": round(float(retrasos.mean()), 2) if len(retrasos) else None,
+        "retraso_p90_dias": round(float(np.percentile(retrasos, 90)), 2) if len(retrasos) else None,
+        "vistos_en_24h": round(float((retrasos <= 1).mean()), 3) if len(retrasos) else None,
+        "frescura": round(float(frescura), 4), # Share of proceso-time with the local copy up to date
+        "frescura_por_1000_solicitudes": round(float(frescura / solicitudes * 1000), 5) if solicitudes else None,
+    }
+
+def simular(tasas: np.ndarray, presupuesto_diario: int = PRESUPUESTO_DIARIO, dias: int = 90, dias_historial: int = 365, semilla: int = 0) -> dict:
+    '''
+    Simulates the adaptive policy and fixed-interval polling with the same budget.
+
+    The true rates `tasas` generate a past history (from which the adaptive policy estimates
+    its rates, as it would from the database) and the future actuaciones (Poisson) over `dias`;
+    each policy polls with random phases and every change is detected at the next poll.
+    Deadline boosts are not simulated.
+
+    Returns:
+        {"fija": metrics, "adaptativa": metrics, "presupuesto_fijo_equivalente": requests/day a fixed
+        interval would need to match the adaptive mean delay}.
+    '''
+    rng = np.random.default_rng(semilla)
+    tasas = np.asarray(tasas, dtype=float)
+    n = len(tasas)
+    conteos = rng.poisson(tasas * dias_historial)
+    edades = rng.uniform(0, dias_historial, size=conteos.sum())
+    indices_historia = np.repeat(np.arange(n), conteos)
+    estimadas = estimar_tasas(indices_historia, edades, n)
+    recientes = np.zeros(n, dtype=bool)
+    recientes[indices_historia[edades <= DIAS_RECIENTE]] = True
+    estimadas[recientes] = np.maximum(estimadas[recientes], TASA_MINIMA_RECIENTE)
+
+    conteos = rng.poisson(tasas * dias)
+    tiempos = rng.uniform(0, dias, size=conteos.sum())
+    indices = np.repeat(np.arange(n), conteos)
+    consultas_dia = presupuesto_diario / SOLICITUDES_POR_CONSULTA
+    resultado = {
+        "procesos": n,
+        "dias": dias,
+        "presupuesto_dia": presupuesto_diario,
+        "fija": _evaluar(indices, tiempos, np.full(n, consultas_dia / n), dias, rng),
+        "adaptativa": _evaluar(indices, tiempos, asignar_frecuencias(estimadas, np.ones(n), consultas_dia), dias, rng),
+    }
+    retraso = resultado["adaptativa"]["retraso_medio_dias"]
+    if retraso:
+        # A fixed interval I has a mean delay of I/2, i.e. n / (2 · checks per day)
+        resultado["presupuesto_fijo_equivalente"] = round(n / (2 * retraso) * SOLICITUDES_POR_CONSULTA)
+    return resultado
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description="Sondeo adaptativo de procesos.")
+    parser.add_argument("--planificar", action="store_true", help="Recalcular el plan de sondeo de todos los procesos.")
+    parser.add_argument("--encolar", action="store_true", help="Encolar las consultas vencidas en la cola de trabajos.")
+    parser.add_argument("--limite", type=int, default=None, help="Con --encolar: máximo de consultas a encolar.")
+    parser.add_argument("--simular", action="store_true", help="Comparar la política adaptativa con un intervalo fijo.")
+    parser.add_argument("--sintetico", type=int, default=0, help="Con --simular: cartera sintética de N procesos en vez de la base de datos.")
+    parser.add_argument("--dias", type=int, default=90, help="Con --simular: días simulados.")
+    parser.add_argument("--presupuesto", type=int, default=PRESUPUESTO_DIARIO, help="Solicitudes por día a la API.")
+    args = parser.parse_args()
+
+    from app.db.database import engine, create_db_and_tables
+    create_db_and_tables()
+    if args.planificar:
+        print(json.dumps(planificar(engine, args.presupuesto), indent=2))
+    if args.encolar:
+        print(f"{encolar_vencidas(engine, limite=args.limite)} consultas encoladas.")
+    if args.simular:
+        tasas = poblacion_sintetica(args.sintetico) if args.sintetico else calcular_politica(engine, args.presupuesto)["tasas"]
+        print(json.dumps(simular(tasas, args.presupuesto, args.dias), indent=2))
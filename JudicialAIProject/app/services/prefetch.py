@@ -0,0 +1,196 @@
+'''
+Speculative prefetch of the procesos a user is likely to open after a search.
+
+As soon as a search returns, the first PRECARGA_POR_BUSQUEDA results that are not stored yet
+are fetched (detail + actuaciones) and stored without AI fields by background threads, so
+selecting one of them in the UI usually finds it in the database. Speculative load is capped:
+few results per search, a bounded process-wide queue (MAX_PENDIENTES), few threads and its own
+rate limit on the Rama Judicial API.
+
+A new search of the same session cancels the pending prefetches of the previous one (fetches
+already running are left to finish: their result is stored anyway). The UI also ingests the
+proceso the user selects through `solicitar`: it goes ahead of the speculative ones, outside
+the caps, and a proceso already queued or running is never fetched twice. `estado` lets the
+page poll the ingestion instead of blocking on it.
+'''
+import logging
+import threading
+from collections import deque
+from app.db import crud
+from app.services.ingestion import ingerir_proceso
+from app.services.workers import LimitadorTasa
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PRECARGA_POR_BUSQUEDA = 5 # Top search results prefetched
+MAX_PENDIENTES = 20 # Prefetches queued at once, across all sessions
+NUM_HILOS = 2
+TASA_PRECARGA = 1.0 # Prefetches per second (two API requests each)
+MAX_ERRORES_GUARDADOS = 100 # Failed requested ingestions remembered for the UI
+
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_EN_CURSO = "en_curso"
+ESTADO_ERROR = "error"
+
+class Precargador:
+    '''Queue of speculative proceso fetches, one generation per session (see module docstring).'''
+
+    def __init__(self, db_engine, num_hilos: int = NUM_HILOS, max_pendientes: int = MAX_PENDIENTES):
+        self.db_engine = db_engine
+        self.num_hilos = num_hilos
+        self.max_pendientes = max_pendientes
+        self.limitador = LimitadorTasa(TASA_PRECARGA)
+        self._pendientes = deque() # (sesion, generacion, entrada)
+        self._en_curso = set() # id_proceso being fetched
+        self._generaciones = {} # sesion -> current generation
+        self._errores = {} # id_proceso -> error of a requested ingestion
+        self._condicion = threading.Condition()
+        self._hilos = []
+        self.estadisticas = {"encoladas": 0, "completadas": 0, "canceladas": 0, "descartadas": 0, "errores": 0}
+
+    def precargar(self, sesion: str, resultados: list[dict], nombre_busqueda: str | None = None,
+                  limite: int = PRECARGA_POR_BUSQUEDA) -> int:
+        '''
+        Cancels the pending prefetches of `sesion` and enqueues the first `limite` search results
+        that are not stored yet.
+
+        Args:
+            sesion: Identifier of the UI session (one active search per session).
+            resultados: The search results, in display order (dicts with idProceso and sujetosProcesales).
+            nombre_busqueda: Optional. The name/NIT used in the search.
+            limite: Optional. Maximum results prefetched.
+
+        Returns:
+            How many prefetches were enqueued.
+        '''
+        candidatos = []
+        for resultado in resultados[:limite]:
+            if resultado.get("idProceso") and not resultado.get("esPrivado"):
+                candidatos.append({"id_proceso": str(resultado["idProceso"]), "nombre_busqueda": nombre_busqueda,
+                                   "sujetos_procesales": resultado.get("sujetosProcesales")})
+        almacenados = crud.get_procesos_by_idsrama(self.db_engine, {c["id_proceso"] for c in candidatos}) if candidatos else {}
+        encoladas = 0
+        with self._condicion:
+            generacion = self._generaciones.get(sesion, 0) + 1
+            self._generaciones[sesion] = generacion
+            self._cancelar(sesion)
+            en_cola = {entrada["id_proceso"] for _, _, entrada in self._pendientes}
+            for entrada in candidatos:
+                if entrada["id_proceso"] in almacenados or entrada["id_proceso"] in self._en_curso or entrada["id_proceso"] in en_cola:
+                    continue
+                if len(self._pendientes) >= self.max_pendientes:
+                    self.estadisticas["descartadas"] += 1
+                    continue
+                self._pendientes.append((sesion, generacion, entrada))
+                en_cola.add(entrada["id_proceso"])
+                encoladas += 1
+            self.estadisticas["encoladas"] += encoladas
+            self._condicion.notify_all()
+        self._iniciar_hilos()
+        return encoladas
+
+    def cancelar(self, sesion: str) -> int:
+        '''Drops the pending prefetches of a session. Returns how many were dropped.'''
+        with self._condicion:
+            self._generaciones[sesion] = self._generaciones.get(sesion, 0) + 1
+            return self._cancelar(sesion)
+
+    def _cancelar(self, sesion: str) -> int:
+        # Caller holds the lock
+        antes = len(self._pendientes)
+        self._pendientes = deque(p for p in self._pendientes if p[0] != sesion)
+        canceladas = antes - len(self._pendientes)
+        self.estadisticas["canceladas"] += canceladas
+        return canceladas
+
+    def solicitar(self, id_proceso: str, nombre_busqueda: str | None = None, sujetos_procesales=None) -> None:
+        '''
+        Ingests a proceso the user selected: ahead of the speculative prefetches, outside the caps
+        and the rate limit, and not cancelled by new searches. A queued prefetch of the same proceso
+        moves to the front; a running one is left alone.
+        '''
+        entrada = {"id_proceso": str(id_proceso), "nombre_busqueda": nombre_busqueda,
+                   "sujetos_procesales": sujetos_procesales, "solicitado": True}
+        with self._condicion:
+            self._errores.pop(entrada["id_proceso"], None)
+            if entrada["id_proceso"] not in self._en_curso:
+                self._pendientes = deque(p for p in self._pendientes if p[2]["id_proceso"] != entrada["id_proceso"])
+                self._pendientes.appendleft((None, None, entrada))
+                self._condicion.notify_all()
+        self._iniciar_hilos()
+
+    def estado(self, id_proceso: str) -> str | None:
+        '''ESTADO_PENDIENTE, ESTADO_EN_CURSO, ESTADO_ERROR (a requested ingestion failed), or None (idle).'''
+        id_proceso = str(id_proceso)
+        with self._condicion:
+            if id_proceso in self._en_curso:
+                return ESTADO_EN_CURSO
+            if any(p[2]["id_proceso"] == id_proceso for p in self._pendientes):
+                return ESTADO_PENDIENTE
+            return ESTADO_ERROR if id_proceso in self._errores else None
+
+    def error(self, id_proceso: str) -> str | None:
+        with self._condicion:
+            return self._errores.get(str(id_proceso))
+
+    def pendientes(self) -> int:
+        with self._condicion:
+            return len(self._pendientes) + len(self._en_curso)
+
+    def _siguiente(self) -> dict:
+        with self._condicion:
+            while True:
+                while self._pendientes:
+                    sesion, generacion, entrada = self._pendientes.popleft()
+                    cancelada = sesion is not None and self._generaciones.get(sesion) != generacion
+                    if cancelada or entrada["id_proceso"] in self._en_curso:
+                        continue
+                    self._en_curso.add(entrada["id_proceso"])
+                    return entrada
+                self._condicion.wait()
+
+    def _trabajar(self) -> None:
+        while True:
+            entrada = self._siguiente()
+            error = None
+            try:
+                # It may have been stored meanwhile (by another session, or by another ingestion)
+                if not crud.get_proceso_by_idrama(self.db_engine, entrada["id_proceso"]):
+                    if not entrada.get("solicitado"):
+                        self.limitador.esperar()
+                    if ingerir_proceso(self.db_engine, entrada["id_proceso"], nombre_busqueda=entrada["nombre_busqueda"],
+                                       sujetos_procesales=entrada["sujetos_procesales"]):
+                        self.estadisticas["completadas"] += 1
+                    else:
+                        error = "No se pudieron obtener o guardar los detalles del proceso."
+            except Exception as e:
+                error = str(e)
+                logging.error(f"Error al precargar el proceso {entrada['id_proceso']}: {e}")
+            finally:
+                with self._condicion:
+                    self._en_curso.discard(entrada["id_proceso"])
+                    if error:
+                        self.estadisticas["errores"] += 1
+                        if entrada.get("solicitado"):
+                            self._errores[entrada["id_proceso"]] = error
+                            if len(self._errores) > MAX_ERRORES_GUARDADOS:
+                                self._errores.pop(next(iter(self._errores)))
+
+    def _iniciar_hilos(self) -> None:
+        with self._condicion:
+            while len(self._hilos) < self.num_hilos:
+                hilo = threading.Thread(target=self._trabajar, name=f"precarga-{len(self._hilos)}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+
+_precargadores = {}
+_precargadores_lock = threading.Lock()
+
+def obtener_precargador(db_engine) -> Precargador:
+    '''Returns the process-wide prefetcher of an engine (shared across Streamlit reruns and sessions).'''
+    with _precargadores_lock:
+        clave = str(db_engine.url)
+        if clave not in _precargadores:
+            _precargadores[clave] = Precargador(db_engine)
+        return _precargadores[clave]
@@ -0,0 +1,181 @@
+'''
+Retrieval API over actuaciones and documents, backed by the local vector index.
+
+Actuaciones are indexed when they are ingested and re-indexed (with their AI summary and
+urgency) once enriched; actuaciones whose text and metadata did not change since they were
+indexed are skipped, so re-ingesting a proceso does not grow the index. Document chunks are
+indexed once a document is extracted, so the index grows incrementally with ingestion.
+The assistant and the UI call `buscar_contexto` to get the most relevant passages,
+optionally filtered by company, process, urgency and date.
+
+Each database has its own index, next to the database file (data/vector_index_<embedder>/
+for the application database, data/tenants/<clave>/vector_index_<embedder>/ for a tenant),
+since the index refers to rows by their database IDs.
+
+    python -m app.services.retrieval --entrenar --compactar   # IVF training and compaction on demand
+'''
+import argparse
+import hashlib
+import logging
+import os
+import threading
+from app.db import crud
+from app.db.vector_index import IndiceVectorial, INDEX_DIR
+from app.models.models import Actuacion, Documento
+from app.services.embeddings import obtener_embedder
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TOKENS_CHUNK_INDICE = 500 # Smaller than summarization chunks: short passages retrieve more precisely
+
+_indices = {} # URL of the database -> IndiceVectorial
+_indice_lock = threading.Lock()
+
+def directorio_indice(db_engine, nombre_embedder: str) -> str:
+    '''Directory of the vector index of a database: next to its file (INDEX_DIR for non-file databases).'''
+    ruta_db = db_engine.url.database
+    base = os.path.join(os.path.dirname(os.path.abspath(ruta_db)), "vector_index") if ruta_db and ruta_db != ":memory:" else INDEX_DIR
+    # One directory per embedder: vectors of different models are not comparable
+    return f"{base}_{nombre_embedder}"
+
+def obtener_indice(db_engine) -> IndiceVectorial:
+    '''Returns the vector index of a database, opening it on first use.'''
+    clave = str(db_engine.url)
+    with _indice_lock:
+        if clave not in _indices:
+            embedder = obtener_embedder()
+            _indices[clave] = IndiceVectorial(directorio_indice(db_engine, embedder.nombre), embedder.dim)
+        return _indices[clave]
+
+def _texto_actuacion(actuacion: Actuacion) -> str:
+    return "\n".join(t for t in (actuacion.actuacion, actuacion.anotacion, actuacion.resumen_ia) if t)
+
+def _huella(texto: str, meta: dict) -> int:
+    # 64-bit fingerprint of what the index stores for a source; never 0, which marks rows without one
+    contenido = "\x1f".join([texto] + [str(meta.get(c) or "") for c in ("empresa", "proceso_db_id", "urgencia", "fecha")])
+    huella = int.from_bytes(hashlib.blake2b(contenido.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+    return huella or 1
+
+def indexar_actuaciones(db_engine, actuaciones: list[Actuacion]) -> int:
+    '''Adds (or refreshes) actuaciones in the vector index, skipping unchanged ones. Returns how many were indexed.'''
+    actuaciones = [a for a in actuaciones if a.id and _texto_actuacion(a)]
+    if not actuaciones:
+        return 0
+    procesos = {}
+    for act in actuaciones:
+        if act.proceso_db_id not in procesos:
+            procesos[act.proceso_db_id] = crud.get_proceso_by_db_id(db_engine, act.proceso_db_id)
+    try:
+        indice = obtener_indice(db_engine)
+        metadatos = []
+        for act in actuaciones:
+            meta = {
+                "tipo": "actuacion",
+                "ref": act.id,
+                "empresa": procesos[act.proceso_db_id].nombre_busqueda if procesos[act.proceso_db_id] else None,
+                "proceso_db_id": act.proceso_db_id,
+                "urgencia": act.clasificacion_urgencia_ia,
+                "fecha": act.fechaActuacion,
+            }
+            meta["huella"] = _huella(_texto_actuacion(act), meta)
+            metadatos.append(meta)
+        vigentes = indice.huellas("actuacion", [m["ref"] for m in metadatos])
+        cambiadas = [(act, meta) for act, meta, huella in zip(actuaciones, metadatos, vigentes) if huella != meta["huella"]]
+        if not cambiadas:
+            return 0
+        vectores = obtener_embedder().embed([_texto_actuacion(act) for act, _ in cambiadas])
+        indice.agregar(vectores, [meta for _, meta in cambiadas])
+        return len(cambiadas)
+    except Exception as e:
+        logging.error(f"Error al indexar actuaciones: {e}")
+        return 0
+
+def _chunks_indexables(documento: Documento) -> list:
+    # Imported here because document_services indexes documents through this module
+    from app.services.document_services import dividir_documento_en_chunks
+    return dividir_documento_en_chunks(documento, max_tokens=TOKENS_CHUNK_INDICE)
+
+def indexar_documento(db_engine, documento: Documento) -> int:
+    '''Adds the chunks of an extracted documento to the vector index. Returns how many were indexed.'''
+    if not documento.id:
+        return 0
+    chunks = _chunks_indexables(documento)
+    if not chunks:
+        return 0
+
+    actuacion = crud.get_actuacion_by_db_id(db_engine, documento.actuacion_db_id) if documento.actuacion_db_id else None
+    proceso = crud.get_proceso_by_db_id(db_engine, actuacion.proceso_db_id) if actuacion else None
+    try:
+        vectores = obtener_embedder().embed([c.texto for c in chunks])
+        obtener_indice(db_engine).agregar(vectores, [{
+            "tipo": "documento_chunk",
+            # Chunks are addressed as documento ID + chunk position, packed in one integer
+            "ref": documento.id * 100_000 + c.indice,
+            "empresa": proceso.nombre_busqueda if proceso else None,
+            "proceso_db_id": proceso.id if proceso else None,
+            "urgencia": actuacion.clasificacion_urgencia_ia if actuacion else None,
+            "fecha": actuacion.fechaActuacion if actuacion else documento.fecha_creacion_db,
+        } for c in chunks])
+        return len(chunks)
+    except Exception as e:
+        logging.error(f"Error al indexar el documento {documento.id}: {e}")
+        return 0
+
+def buscar_contexto(
+    db_engine,
+    consulta: str,
+    k: int = 8,
+    empresa: str | None = None,
+    proceso_db_id: int | None = None,
+    urgencias: list[str] | None = None,
+    fecha_desde=None,
+    fecha_hasta=None,
+) -> list[dict]:
+    '''
+    Returns the k passages most similar to the query, with their text and metadata.
+
+    Args:
+        db_engine: The SQLAlchemy engine used to load the text of the results.
+        consulta: The natural-language query.
+        k: Number of results.
+        empresa: Optional. Company (nombre_busqueda) filter.
+        proceso_db_id: Optional. Process filter.
+        urgencias: Optional. e.g. ["ALTA", "MEDIA"].
+        fecha_desde / fecha_hasta: Optional. Date range (date, datetime or ISO string).
+
+    Returns:
+        A list of dicts with puntaje, tipo, ref, proceso_db_id, urgencia, fecha and texto.
+    '''
+    vector = obtener_embedder().embed([consulta])[0]
+    resultados = obtener_indice(db_engine).buscar(
+        vector, k=k, empresa=empresa, proceso_db_id=proceso_db_id,
+        urgencias=urgencias, fecha_desde=fecha_desde, fecha_hasta=fecha_hasta
+    )
+    chunks_por_documento = {}
+    for resultado in resultados:
+        if resultado["tipo"] == "actuacion":
+            act = crud.get_actuacion_by_db_id(db_engine, resultado["ref"])
+            resultado["texto"] = _texto_actuacion(act) if act else ""
+        else:
+            documento_db_id, indice = divmod(resultado["ref"], 100_000)
+            if documento_db_id not in chunks_por_documento:
+                documento = crud.get_documento_by_db_id(db_engine, documento_db_id)
+                chunks_por_documento[documento_db_id] = _chunks_indexables(documento) if documento else []
+            chunks = chunks_por_documento[documento_db_id]
+            resultado["texto"] = chunks[indice].texto if indice < len(chunks) else ""
+    return resultados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento del índice vectorial.")
+    parser.add_argument("--entrenar", action="store_true", help="Entrena (o reentrena) las listas IVF")
+    parser.add_argument("--compactar", action="store_true", help="Descarta las filas inactivas")
+    args = parser.parse_args()
+
+    from app.db.database import engine
+    indice = obtener_indice(engine)
+    if args.compactar:
+        print(f"Filas inactivas descartadas: {indice.compactar()}")
+    if args.entrenar:
+        indice.entrenar_ivf()
+        print(f"Listas IVF: {indice.n_listas} sobre {indice.filas} filas")
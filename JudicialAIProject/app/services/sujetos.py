@@ -0,0 +1,137 @@
+'''
+Parsing and normalization of the sujetos procesales (parties) of a proceso.
+
+The API returns the parties in different shapes: a pipe-separated string in the search
+results ("Demandante: BANCOLOMBIA S.A. | Demandado: JUAN PEREZ"), or a list of dicts in
+the detail; older rows store the Python repr of that list. Everything is parsed here into
+Sujeto models, stored in the indexed `sujeto` table at ingestion.
+'''
+import ast
+import logging
+import re
+import unicodedata
+from app.db import crud
+from app.models.models import Proceso, Sujeto
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ROL_DEMANDANTE = "DEMANDANTE"
+ROL_DEMANDADO = "DEMANDADO"
+ROL_DESCONOCIDO = "SIN ROL"
+
+# Keys used by the API dicts, in order of preference
+CLAVES_ROL = ("tipoSujeto", "tipo", "rol")
+CLAVES_NOMBRE = ("nombreRazonSocial", "nombre", "razonSocial")
+CLAVES_IDENTIFICACION = ("identificacion", "numeroIdentificacion", "nit", "documento")
+
+PATRON_NIT = re.compile(r"\bNIT\.?\s*(?:N[Ooº°]\.?\s*)?:?\s*(\d[\d.\s]{4,14}\d)(?:\s*-\s*\d)?", re.IGNORECASE)
+PATRON_NO_ALFANUMERICO = re.compile(r"[^A-Z0-9 ]+")
+
+def normalizar_texto(texto: str) -> str:
+    '''Upper case, without accents, punctuation or repeated spaces.'''
+    sin_acentos = "".join(c for c in unicodedata.normalize("NFD", texto.upper()) if unicodedata.category(c) != "Mn")
+    return " ".join(PATRON_NO_ALFANUMERICO.sub(" ", sin_acentos).split())
+
+def normalizar_rol(rol: str | None) -> str:
+    return normalizar_texto(rol or "") or ROL_DESCONOCIDO
+
+def normalizar_nombre(nombre: str) -> str:
+    '''Lookup key of a party name: without its NIT and normalized.'''
+    return normalizar_texto(PATRON_NIT.sub(" ", nombre))
+
+def extraer_nit(texto: str | None) -> str | None:
+    '''Returns the NIT digits (without the verification digit) found in a name or identification.'''
+    if not texto:
+        return None
+    texto = str(texto)
+    coincidencia = PATRON_NIT.search(texto)
+    if coincidencia:
+        digitos = re.sub(r"\D", "", coincidencia.group(1))
+    elif re.fullmatch(r"[\d.\s-]+", texto.strip()):
+        # A bare identification number, e.g. "890.903.938-8"
+        digitos = re.sub(r"\D", "", texto.split("-")[0])
+    else:
+        return None
+    return digitos or None
+
+def _valor(datos: dict, claves: tuple) -> str | None:
+    return next((str(datos[clave]).strip() for clave in claves if datos.get(clave)), None)
+
+def parsear_sujetos(valor) -> list[Sujeto]:
+    '''
+    Parses the sujetos procesales in any of the shapes returned by the API (or stored in proceso.sujetos).
+
+    Args:
+        valor: A list of dicts, its Python repr, or a "Rol: Nombre | Rol: Nombre" string.
+
+    Returns:
+        The parties as Sujeto models (without proceso_db_id), without duplicates.
+    '''
+    if isinstance(valor, str) and valor.strip().startswith(("[", "{")):
+        try:
+            valor = ast.literal_eval(valor.strip())
+        except (ValueError, SyntaxError):
+            pass
+    if isinstance(valor, dict):
+        valor = [valor]
+
+    partes = [] # (rol, nombre, identificacion)
+    if isinstance(valor, list):
+        for item in valor:
+            if isinstance(item, dict):
+                partes.append((_valor(item, CLAVES_ROL), _valor(item, CLAVES_NOMBRE), _valor(item, CLAVES_IDENTIFICACION)))
+            elif isinstance(item, str):
+                partes.extend((p[0], p[1], None) for p in _partes_texto(item))
+    elif isinstance(valor, str):
+        partes.extend((p[0], p[1], None) for p in _partes_texto(valor))
+
+    sujetos, vistos = [], set()
+    for rol, nombre, identificacion in partes:
+        if not nombre:
+            continue
+        nombre_normalizado = normalizar_nombre(nombre)
+        clave = (normalizar_rol(rol), nombre_normalizado)
+        if not nombre_normalizado or clave in vistos:
+            continue
+        vistos.add(clave)
+        sujetos.append(Sujeto(
+            rol=clave[0], nombre=" ".join(nombre.split()), nombre_normalizado=nombre_normalizado,
+            nit=extraer_nit(identificacion) or extraer_nit(nombre)
+        ))
+    return sujetos
+
+def _partes_texto(texto: str) -> list[tuple[str | None, str]]:
+    # "Demandante: X | Demandado: Y"; a part without "Rol:" keeps an unknown role
+    partes = []
+    for parte in texto.split("|"):
+        rol, separador, nombre = parte.partition(":")
+        if separador:
+            partes.append((rol.strip(), nombre.strip()))
+        elif parte.strip():
+            partes.append((None, parte.strip()))
+    return partes
+
+def nombres_por_rol(sujetos: list[Sujeto], rol: str) -> list[str]:
+    '''Names of the parties with a role, e.g. nombres_por_rol(sujetos, ROL_DEMANDADO).'''
+    return [s.nombre for s in sujetos if s.rol == rol]
+
+def sujetos_de_proceso(proceso: Proceso, sujetos_procesales=None) -> list[Sujeto]:
+    '''
+    Parties of a proceso: the ones in `sujetos_procesales` (raw API value) or proceso.sujetos,
+    plus demandante/demandado when they are not already among them.
+    '''
+    sujetos = parsear_sujetos(sujetos_procesales if sujetos_procesales is not None else proceso.sujetos)
+    claves = {(s.rol, s.nombre_normalizado) for s in sujetos}
+    for rol, nombre in ((ROL_DEMANDANTE, proceso.demandante), (ROL_DEMANDADO, proceso.demandado)):
+        if nombre and nombre != "N/A" and (rol, normalizar_nombre(nombre)) not in claves:
+            sujetos.extend(parsear_sujetos([{"tipoSujeto": rol, "nombre": nombre}]))
+    for sujeto in sujetos:
+        sujeto.proceso_db_id = proceso.id
+    return sujetos
+
+def indexar_sujetos(db_engine, proceso: Proceso, sujetos_procesales=None) -> int:
+    '''Parses and stores (replacing the previous ones) the parties of a stored proceso. Returns how many were stored.'''
+    if not proceso.id:
+        return 0
+    return max(crud.replace_sujetos_proceso(db_engine, proceso.id, sujetos_de_proceso(proceso, sujetos_procesales)), 0)
@@ -0,0 +1,306 @@
+'''
+Ingestion workers that drain the durable job queue (app/db/job_queue.py).
+
+The ingestion pipeline is split into jobs, each idempotent (stored with upserts or
+checksum caches, and skipped when its output already exists):
+
+    fetch-process      -> detail of a proceso and its parties; enqueues fetch-actuaciones
+    fetch-actuaciones  -> actuaciones and their events; enqueues enrich-ai (and download-document)
+    download-document  -> lists and downloads the documents of an actuación; enqueues extract-text
+    extract-text       -> PDF text extraction (cached by checksum) and indexing
+    enrich-ai          -> AI summary and urgency of an actuación
+
+Run any number of workers, on one or more machines sharing the queue database:
+
+    python -m app.services.workers --hilos 4 [--tipos fetch-process,fetch-actuaciones]
+
+Each worker process runs `hilos` threads that claim one job at a time, plus a heartbeat
+thread that renews the leases of the jobs in progress. Calls to the Rama Judicial API go
+through a per-process rate limiter (TASA_API_POR_WORKER requests per second), so the total
+rate is workers x that limit: add workers until it reaches the upstream limit.
+'''
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from app.clients.rama_judicial_client import consultar_documentos_actuacion, descargar_documento_actuacion
+from app.db import crud
+from app.db.database import DATA_DIR
+from app.db.job_queue import BackendCola, obtener_backend, clave_trabajo, LEASE_SEGUNDOS
+from app.models.models import Trabajo
+
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TASA_API_POR_WORKER = float(os.getenv("TASA_API_POR_WORKER", "2")) # Requests per second to the Rama Judicial API
+ESPERA_VACIA_S = (0.5, 10.0) # Poll interval when the queue is empty: starts low, doubles up to the max
+DOCUMENTOS_DIR = os.path.join(DATA_DIR, "documentos")
+PRIORIDAD = {"fetch-process": 30, "fetch-actuaciones": 20, "download-document": 5, "extract-text": 10, "enrich-ai": 0}
+
+class LimitadorTasa:
+    '''Token bucket shared by the threads of a worker process.'''
+
+    def __init__(self, por_segundo: float, rafaga: int = 1):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self.rafaga = rafaga
+        self._siguiente = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self) -> None:
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            # Unused capacity accumulates up to `rafaga` requests
+            self._siguiente = max(self._siguiente, ahora - self.intervalo * (self.rafaga - 1))
+            espera = self._siguiente - ahora
+            self._siguiente += self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+limitador_api = LimitadorTasa(TASA_API_POR_WORKER)
+
+class ErrorPermanente(Exception):
+    '''A job that can never succeed (bad payload, missing row): failed without retries.'''
+
+def _fetch_process(db_engine, cola: BackendCola, payload: dict) -> dict:
+    from app.clients.rama_judicial_client import consultar_detalle_proceso
+    from app.services.ingestion import extraer_detalle, mapear_proceso
+    from app.services.sujetos import indexar_sujetos
+    id_proceso = str(payload["id_proceso"])
+    limitador_api.esperar()
+    detalle = extraer_detalle(consultar_detalle_proceso(id_proceso))
+    if not detalle:
+        raise RuntimeError(f"Sin detalle para el proceso {id_proceso}")
+    proceso_db_id = crud.create_proceso(db_engine, mapear_proceso(detalle, payload.get("nombre_busqueda"))) # Upsert by idProceso
+    if not proceso_db_id:
+        raise RuntimeError(f"No se pudo guardar el proceso {id_proceso}")
+    proceso = crud.get_proceso_by_db_id(db_engine, proceso_db_id)
+    indexar_sujetos(db_engine, proceso, detalle.get("sujetosProcesales") or payload.get("sujetos_procesales"))
+    cola.encolar("fetch-actuaciones", {"id_proceso": id_proceso, "proceso_db_id": proceso_db_id, "documentos": payload.get("documentos", False)},
+                 clave=clave_trabajo("fetch-actuaciones", id_proceso, payload.get("version", "")), prioridad=PRIORIDAD["fetch-actuaciones"])
+    return {"proceso_db_id": proceso_db_id}
+
+def _fetch_actuaciones(db_engine, cola: BackendCola, payload: dict) -> dict:
+    from app.services.ingestion import consultar_actuaciones_completas, extraer_lista_actuaciones, mapear_actuacion
+    from app.services.retrieval import indexar_actuaciones
+    from app.services.event_extraction import indexar_eventos
+    respuesta = consultar_actuaciones_completas(str(payload["id_proceso"]), esperar=limitador_api.esperar)
+    if respuesta is None:
+        raise RuntimeError(f"Sin respuesta de actuaciones para el proceso {payload['id_proceso']}")
+    actuaciones = [mapear_actuacion(act_raw, payload["proceso_db_id"]) for act_raw in extraer_lista_actuaciones(respuesta)]
+    # One transaction, upserting by (idRegActuacion, proceso)
+    for actuacion, actuacion_db_id in zip(actuaciones, crud.create_actuaciones(db_engine, actuaciones)):
+        actuacion.id = actuacion_db_id
+    actuaciones = [a for a in actuaciones if a.id]
+    indexar_actuaciones(db_engine, actuaciones)
+    indexar_eventos(db_engine, actuaciones)
+    for actuacion in crud.get_actuaciones_sin_enriquecer(db_engine, payload["proceso_db_id"]):
+        cola.encolar("enrich-ai", {"actuacion_db_id": actuacion.id}, clave=clave_trabajo("enrich-ai", actuacion.id), prioridad=PRIORIDAD["enrich-ai"])
+    if payload.get("documentos"):
+        for actuacion in actuaciones:
+            if actuacion.conDocumentos and actuacion.idRegActuacion:
+                cola.encolar("download-document", {"id_reg_actuacion": actuacion.idRegActuacion, "actuacion_db_id": actuacion.id},
+                             clave=clave_trabajo("download-document", actuacion.idRegActuacion), prioridad=PRIORIDAD["download-document"])
+    return {"actuaciones": len(actuaciones)}
+
+def _ruta_documento(id_reg_documento: str) -> str:
+    return os.path.join(DOCUMENTOS_DIR, f"{id_reg_documento}.pdf")
+
+def _descargar(id_reg_documento: str) -> bytes:
+    # Reuses the file when another job (or an earlier attempt) already downloaded it
+    ruta = _ruta_documento(id_reg_documento)
+    if os.path.exists(ruta):
+        with open(ruta, "rb") as f:
+            return f.read()
+    limitador_api.esperar()
+    contenido = descargar_documento_actuacion(id_reg_documento)
+    if not contenido:
+        raise RuntimeError(f"No se pudo descargar el documento {id_reg_documento}")
+    os.makedirs(DOCUMENTOS_DIR, exist_ok=True)
+    temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(contenido)
+    os.replace(temporal, ruta) # Atomic: a concurrent reader never sees a partial file
+    return contenido
+
+def _download_document(db_engine, cola: BackendCola, payload: dict) -> dict:
+    limitador_api.esperar()
+    documentos = consultar_documentos_actuacion(str(payload["id_reg_actuacion"]))
+    if documentos is None:
+        raise RuntimeError(f"Sin respuesta de documentos para la actuación {payload['id_reg_actuacion']}")
+    if not isinstance(documentos, list):
+        raise ErrorPermanente(f"Respuesta inesperada de documentos: {type(documentos).__name__}")
+    descargados = 0
+    for documento in documentos:
+        id_reg_documento = documento.get("idRegDocumento")
+        if not id_reg_documento:
+            continue
+        _descargar(str(id_reg_documento))
+        descargados += 1
+        cola.encolar("extract-text", {
+            "id_reg_documento": str(id_reg_documento), "nombre": documento.get("nombre"), "actuacion_db_id": payload.get("actuacion_db_id")
+        }, clave=clave_trabajo("extract-text", id_reg_documento), prioridad=PRIORIDAD["extract-text"])
+    return {"documentos": descargados}
+
+def _extract_text(db_engine, cola: BackendCola, payload: dict) -> dict:
+    from app.services.document_services import obtener_texto_documento
+    # On another machine the file is not there yet: download it again
+    contenido = _descargar(payload["id_reg_documento"])
+    documento = obtener_texto_documento(db_engine, contenido, payload["id_reg_documento"], payload.get("nombre"), payload.get("actuacion_db_id"))
+    if not documento:
+        raise ErrorPermanente(f"No se pudo extraer el texto del documento {payload['id_reg_documento']}")
+    return {"documento_db_id": documento.id, "caracteres": len(documento.texto or "")}
+
+def _enrich_ai(db_engine, cola: BackendCola, payload: dict) -> dict:
+    from app.services.enrichment import enriquecer_actuacion
+    actuacion = crud.get_actuacion_by_db_id(db_engine, payload["actuacion_db_id"])
+    if actuacion is None:
+        raise ErrorPermanente(f"La actuación {payload['actuacion_db_id']} no existe")
+    if actuacion.resumen_ia and actuacion.clasificacion_urgencia_ia:
+        return {"omitido": True} # Already enriched (e.g. on demand from the UI)
+    actuacion = enriquecer_actuacion(db_engine, actuacion)
+    return {"urgencia": actuacion.clasificacion_urgencia_ia}
+
+MANEJADORES = {
+    "fetch-process": _fetch_process,
+    "fetch-actuaciones": _fetch_actuaciones,
+    "download-document": _download_document,
+    "extract-text": _extract_text,
+    "enrich-ai": _enrich_ai,
+}
+
+def encolar_proceso(cola: BackendCola, id_proceso: str, nombre_busqueda: str | None = None, sujetos_procesales=None,
+                    documentos: bool = False, version: str | None = None) -> int | None:
+    '''
+    Enqueues the ingestion of a proceso (detail, then actuaciones, AI enrichment and optionally documents).
+
+    Args:
+        cola: The job queue backend.
+        id_proceso: The Rama Judicial ID of the process.
+        nombre_busqueda: Optional. The name/NIT used to find the process.
+        sujetos_procesales: Optional. The parties from the search result.
+        documentos: Optional. Also download and extract the documents of the actuaciones.
+        version: Optional. Part of the idempotency key: a new value (e.g. the date) re-ingests a proceso already done.
+
+    Returns:
+        The job ID, or None if it could not be enqueued.
+    '''
+    return cola.encolar("fetch-process", {
+        "id_proceso": str(id_proceso), "nombre_busqueda": nombre_busqueda, "sujetos_procesales": sujetos_procesales,
+        "documentos": documentos, "version": version or "",
+    }, clave=clave_trabajo("fetch-process", id_proceso, version or ""), prioridad=PRIORIDAD["fetch-process"])
+
+class Worker:
+    '''Claims and runs jobs with `hilos` threads; a heartbeat thread keeps their leases alive.'''
+
+    def __init__(self, db_engine, cola: BackendCola | None = None, tipos: list[str] | None = None,
+                 hilos: int = 4, lease_segundos: int = LEASE_SEGUNDOS, nombre: str | None = None):
+        self.db_engine = db_engine
+        self.cola = cola or obtener_backend(db_engine)
+        self.tipos = tipos
+        self.hilos = hilos
+        self.lease_segundos = lease_segundos
+        self.nombre = nombre or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.procesados = 0
+        self.fallidos = 0
+        self._en_curso = set()
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+
+    def ejecutar(self, trabajo: Trabajo) -> bool:
+        '''Runs one claimed job and records the outcome. Returns True if it completed.'''
+        manejador = MANEJADORES.get(trabajo.tipo)
+        try:
+            if manejador is None:
+                raise ErrorPermanente(f"Sin manejador para el tipo {trabajo.tipo}")
+            resultado = manejador(self.db_engine, self.cola, trabajo.payload)
+        except ErrorPermanente as e:
+            logging.error(f"Trabajo {trabajo.id} ({trabajo.tipo}) descartado: {e}")
+            self.cola.fallar(trabajo.id, self.nombre, str(e), reintentar=False)
+            return False
+        except Exception as e:
+            logging.warning(f"Trabajo {trabajo.id} ({trabajo.tipo}) falló en el intento {trabajo.intentos}: {e}")
+            self.cola.fallar(trabajo.id, self.nombre, f"{type(e).__name__}: {e}")
+            return False
+        return self.cola.completar(trabajo.id, self.nombre, resultado)
+
+    def _hilo_trabajo(self, hasta_vaciar: bool) -> None:
+        espera = ESPERA_VACIA_S[0]
+        while not self._detener.is_set():
+            trabajos = self.cola.reclamar(self.nombre, self.tipos, limite=1, lease_segundos=self.lease_segundos)
+            if not trabajos:
+                # Other threads or workers may still enqueue follow-ups, and retries wait for their backoff
+                if hasta_vaciar and not self.cola.hay_trabajo(self.tipos):
+                    return
+                self._detener.wait(espera)
+                espera = min(espera * 2, ESPERA_VACIA_S[1])
+                continue
+            espera = ESPERA_VACIA_S[0]
+            trabajo = trabajos[0]
+            with self._lock:
+                self._en_curso.add(trabajo.id)
+            try:
+                completado = self.ejecutar(trabajo)
+            finally:
+                with self._lock:
+                    self._en_curso.discard(trabajo.id)
+            with self._lock:
+                self.procesados += completado
+                self.fallidos += not completado
+
+    def _latido(self) -> None:
+        while not self._detener.wait(self.lease_segundos / 3):
+            with self._lock:
+                ids = list(self._en_curso)
+            self.cola.renovar(ids, self.nombre, self.lease_segundos)
+
+    def iniciar(self, hasta_vaciar: bool = False) -> None:
+        '''
+        Runs the worker until detener() is called (or, with hasta_vaciar, until no job is pendiente or en_proceso).
+        Blocks the calling thread.
+        '''
+        logging.info(f"Worker {self.nombre} iniciado con {self.hilos} hilos (tipos: {self.tipos or 'todos'}).")
+        latido = threading.Thread(target=self._latido, name=f"latido-{self.nombre}", daemon=True)
+        latido.start()
+        hilos = [threading.Thread(target=self._hilo_trabajo, args=(hasta_vaciar,), name=f"trabajo-{i}", daemon=True) for i in range(self.hilos)]
+        for hilo in hilos:
+            hilo.start()
+        try:
+            for hilo in hilos:
+                while hilo.is_alive():
+                    hilo.join(timeout=1.0)
+        except KeyboardInterrupt:
+            logging.info("Deteniendo worker: se terminan los trabajos en curso...")
+        finally:
+            self.detener()
+            for hilo in hilos:
+                hilo.join()
+        logging.info(f"Worker {self.nombre} detenido: {self.procesados} completados, {self.fallidos} fallidos.")
+
+    def detener(self) -> None:
+        self._detener.set()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de la cola de ingesta.")
+    parser.add_argument("--hilos", type=int, default=4, help="Trabajos en paralelo en este proceso.")
+    parser.add_argument("--tipos", default="", help="Tipos de trabajo separados por comas (por defecto, todos).")
+    parser.add_argument("--hasta-vaciar", action="store_true", help="Terminar cuando no queden trabajos pendientes ni en proceso.")
+    parser.add_argument("--encolar", nargs="*", default=[], metavar="ID_PROCESO", help="Encolar la ingesta de estos procesos y salir.")
+    parser.add_argument("--documentos", action="store_true", help="Con --encolar: descargar también los documentos.")
+    parser.add_argument("--estadisticas", action="store_true", help="Mostrar el estado de la cola y salir.")
+    args = parser.parse_args()
+
+    from app.db.database import engine, create_db_and_tables
+    create_db_and_tables()
+    cola = obtener_backend(engine)
+    if args.encolar:
+        for id_proceso in args.encolar:
+            print(id_proceso, encolar_proceso(cola, id_proceso, documentos=args.documentos))
+    elif args.estadisticas:
+        print(cola.estadisticas())
+    else:
+        Worker(engine, cola, tipos=[t for t in args.tipos.split(",") if t] or None, hilos=args.hilos).iniciar(hasta_vaciar=args.hasta_vaciar)
@@ -0,0 +1,41 @@
+'''
+Shared fixtures. Tests run offline (deterministic fake LLM) against a temporary SQLite
+database; zstd dictionaries and the vector index are written to temporary directories.
+'''
+import os
+
+os.environ["LLM_OFFLINE"] = "1" # Read by app.config.llm_config at import time
+
+import pytest
+from sqlalchemy import create_engine
+from app.db import compression
+from app.db.database import create_db_and_tables
+from app.models.models import Actuacion, Proceso
+
+@pytest.fixture
+def db_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, "directorio_diccionarios", lambda: str(tmp_path / "zstd_dicts"))
+    monkeypatch.setattr(compression, "_diccionarios", {})
+    monkeypatch.setattr(compression, "_diccionario_activo", None)
+    monkeypatch.setattr(compression, "_rutas_cargadas", {})
+    monkeypatch.setattr(compression, "_proxima_recarga", 0.0)
+    db_engine = create_engine(f"sqlite:///{tmp_path / 'test.sqlite'}", connect_args={"check_same_thread": False})
+    create_db_and_tables(db_engine)
+    yield db_engine
+    db_engine.dispose()
+
+@pytest.fixture
+def crear_proceso(db_engine):
+    '''Stores a proceso and returns its database ID.'''
+    from app.db import crud
+
+    def crear(id_proceso: str = "1", nombre_busqueda: str = "ACME SA", **campos) -> int:
+        return crud.create_proceso(db_engine, Proceso(idProceso=id_proceso, nombre_busqueda=nombre_busqueda, **campos))
+    return crear
+
+def actuaciones(proceso_db_id: int, n: int, inicio: int = 0, **campos) -> list[Actuacion]:
+    return [
+        Actuacion(proceso_db_id=proceso_db_id, idRegActuacion=str(i), fechaActuacion=f"2024-01-{i % 28 + 1:02d}T00:00:00",
+                  actuacion="Auto", anotacion=f"AUTO QUE ORDENA SEGUIR ADELANTE LA EJECUCIÓN número {i}", **campos)
+        for i in range(inicio, inicio + n)
+    ]
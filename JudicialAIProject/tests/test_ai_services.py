@@ -0,0 +1,23 @@
+from app.services import ai_services
+
+def test_reducir_resumenes_agrupa_por_presupuesto(monkeypatch):
+    llamadas = []
+    batch = ai_services.router.batch
+
+    def espia(tarea, prompt, entradas, **kwargs):
+        llamadas.append(len(entradas))
+        return batch(tarea, prompt, entradas, **kwargs)
+
+    monkeypatch.setattr(ai_services.router, "batch", espia)
+    monkeypatch.setattr(ai_services, "MAX_TOKENS_REDUCCION", 100)
+    resumenes = [f"resumen {i} " + "x" * 150 for i in range(9)] # ~40 tokens each: 2 per group
+
+    resultado = ai_services.reducir_resumenes(resumenes)
+
+    assert resultado
+    # 9 -> 5 (4 groups of 2 + 1 passed through) -> 3 -> 2 -> 1
+    assert llamadas == [4, 2, 1, 1]
+
+def test_reducir_resumenes_casos_triviales():
+    assert ai_services.reducir_resumenes([]) == ""
+    assert ai_services.reducir_resumenes(["", "unico"]) == "unico"
@@ -0,0 +1,37 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from app.api import main
+from app.auth.oauth2_login_fastapi import generar_clave_api
+from app.db import crud
+from conftest import actuaciones
+
+@pytest.fixture
+def cliente(db_engine):
+    clave = generar_clave_api(db_engine, "pruebas")
+    with TestClient(main.crear_app(db_engine), headers={"Authorization": f"Bearer {clave}"}) as cliente:
+        yield cliente
+
+def test_exportacion_pagina_por_procesos_resueltos(cliente, crear_proceso, db_engine, monkeypatch):
+    monkeypatch.setattr(main, "TAMANO_LOTE_EXPORTACION", 3)
+    monkeypatch.setattr(main, "PROCESOS_POR_CONSULTA", 2)
+    empresa = [crear_proceso("1", "ACME SA"), crear_proceso("2", "ACME S.A."), crear_proceso("3", "ACME SA")]
+    otra = crear_proceso("4", "OTRA LTDA")
+    esperados = []
+    for ronda in range(4): # Interleaved IDs, so batches cross procesos
+        for proceso_db_id in empresa + [otra]:
+            ids = crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 2, inicio=ronda * 2))
+            if proceso_db_id != otra:
+                esperados += ids
+
+    respuesta = cliente.get("/exportaciones/actuaciones", params={"empresa": "acme sa"})
+    assert respuesta.status_code == 200
+    filas = [json.loads(linea) for linea in respuesta.text.splitlines()]
+    assert sorted(f["id"] for f in filas) == sorted(esperados) # No gaps, no duplicates
+    procesos = cliente.get("/procesos", params={"empresa": "acme sa"}).json()["procesos"]
+    assert {f["idProceso"] for f in filas} == {p["idProceso"] for p in procesos} == {"1", "2", "3"}
+
+def test_exportacion_sin_procesos_solo_encabezado(cliente):
+    respuesta = cliente.get("/exportaciones/actuaciones", params={"empresa": "nadie sa", "formato": "csv"})
+    assert respuesta.status_code == 200
+    assert respuesta.text.splitlines() == [",".join(main.COLUMNAS_EXPORTACION)]
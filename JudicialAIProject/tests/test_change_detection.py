@@ -0,0 +1,79 @@
+import pytest
+from app.clients.rama_judicial_client import consultar_todas_las_paginas
+from app.db import crud
+from app.models.models import EmpresaVigilada
+from app.services import change_detection
+
+def _resultado(id_proceso: str, fecha: str = "2024-01-01") -> dict:
+    return {"idProceso": id_proceso, "llaveProceso": f"0500131030{id_proceso}", "despacho": "JUZGADO 1 CIVIL",
+            "fechaUltimaActuacion": fecha, "sujetosProcesales": "Demandante: ACME SA | Demandado: PEREZ"}
+
+def _paginas(resultados: list[dict], por_pagina: int = 2, fallan: tuple = ()):
+    cantidad = max(1, -(-len(resultados) // por_pagina))
+    def consulta(pagina):
+        if pagina in fallan:
+            return None
+        inicio = (pagina - 1) * por_pagina
+        return {"procesos": resultados[inicio:inicio + por_pagina], "paginacion": {"cantidadPaginas": cantidad}}
+    return consulta
+
+@pytest.fixture
+def empresa(db_engine):
+    empresa = EmpresaVigilada(nombre="ACME SA", nombre_normalizado="acme")
+    empresa.id = crud.create_empresa_vigilada(db_engine, empresa)
+    return empresa
+
+@pytest.fixture
+def api(monkeypatch):
+    estado = {"resultados": [], "fallan": ()}
+    monkeypatch.setattr(change_detection, "consultar_procesos_por_nombre",
+                        lambda nombre, solo_activos=True, pagina=1: _paginas(estado["resultados"], fallan=estado["fallan"])(pagina))
+    monkeypatch.setattr(change_detection, "_consultar_detalle",
+                        lambda id_proceso: {**_resultado(id_proceso), "ponente": estado.get(("ponente", id_proceso))})
+    return estado
+
+def test_paginador_marca_listados_incompletos():
+    resultados = [_resultado(str(i)) for i in range(6)]
+    assert consultar_todas_las_paginas(_paginas(resultados), 10).completo
+    parcial = consultar_todas_las_paginas(_paginas(resultados, fallan=(2,)), 10)
+    assert [r["idProceso"] for r in parcial] == ["0", "1"] and not parcial.completo
+    truncado = consultar_todas_las_paginas(_paginas(resultados), 2, hilos=2)
+    assert len(truncado) == 4 and not truncado.completo
+    assert consultar_todas_las_paginas(_paginas(resultados, fallan=(1,)), 10) is None
+
+def test_diff_entre_sincronizaciones(db_engine, empresa, api):
+    api["resultados"] = [_resultado("1"), _resultado("2"), _resultado("3")]
+    base = change_detection.sincronizar_empresa(db_engine, empresa, hilos=1)
+    assert base["linea_base"] and base["procesos"] == 3 and base["cambios"] == []
+
+    api["resultados"] = [_resultado("1"), _resultado("2", fecha="2024-02-01"), _resultado("4")]
+    api[("ponente", "2")] = "DRA. GOMEZ"
+    resumen = change_detection.sincronizar_empresa(db_engine, empresa, hilos=1)
+    tipos = {c.idProceso: c.tipo for c in resumen["cambios"]}
+    assert tipos == {"2": "modificado", "3": "desaparecido", "4": "nuevo"}
+    campos = next(c.campos for c in resumen["cambios"] if c.idProceso == "2")
+    assert campos["ponente"] == [None, "DRA. GOMEZ"]
+    assert campos["fechaUltimaActuacion"] == ["2024-01-01", "2024-02-01"]
+    assert resumen["sin_cambios"] == 1 and resumen["detalles_consultados"] == 2
+    assert set(crud.get_snapshot_empresa(db_engine, empresa.id)) == {"1", "2", "4"}
+
+    sin_cambios = change_detection.sincronizar_empresa(db_engine, empresa, hilos=1)
+    assert sin_cambios["cambios"] == [] and sin_cambios["detalles_consultados"] == 0
+
+def test_listado_incompleto_no_registra_desaparecidos(db_engine, empresa, api):
+    api["resultados"] = [_resultado(str(i)) for i in range(1, 6)]
+    change_detection.sincronizar_empresa(db_engine, empresa, hilos=1)
+
+    api["resultados"] = [_resultado("0")] + api["resultados"]
+    api["fallan"] = (3,) # Procesos 4 and 5 are on the missing page
+    resumen = change_detection.sincronizar_empresa(db_engine, empresa, hilos=1)
+    assert not resumen["completo"] and resumen["desaparecidos"] == 0
+    assert {c.idProceso for c in resumen["cambios"]} == {"0"}
+    assert set(crud.get_snapshot_empresa(db_engine, empresa.id)) == {"0", "1", "2", "3", "4", "5"}
+    assert crud.get_cambios_proceso(db_engine, empresa.id, tipos=["desaparecido"]) == []
+
+def test_linea_base_requiere_listado_completo(db_engine, empresa, api):
+    api["resultados"] = [_resultado(str(i)) for i in range(1, 6)]
+    api["fallan"] = (3,)
+    assert change_detection.sincronizar_empresa(db_engine, empresa, hilos=1) is None
+    assert crud.get_snapshot_empresa(db_engine, empresa.id) == {}
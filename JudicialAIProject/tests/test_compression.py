@@ -0,0 +1,68 @@
+import random
+from app.db import compression, crud
+from app.models.models import Actuacion
+
+TIPOS = ["AUTO QUE ORDENA SEGUIR ADELANTE LA EJECUCIÓN", "SE FIJA EN LISTA DE TRASLADO", "AUTO ADMITE DEMANDA",
+         "RECEPCIÓN MEMORIAL DEL APODERADO", "AUTO DECRETA MEDIDA CAUTELAR DE EMBARGO", "FIJACIÓN ESTADO"]
+
+def _anotaciones(n: int, semilla: int) -> list[str]:
+    rng = random.Random(semilla)
+    return [f"{rng.choice(TIPOS)} DENTRO DEL PROCESO {rng.randint(1000, 99999)} DE {rng.choice(['ACME SA', 'BANCO XYZ', 'PEREZ'])} "
+            f"CONTRA {rng.choice(['JUAN GOMEZ', 'MARIA LOPEZ', 'COMERCIAL ABC'])}; SE NOTIFICA POR ESTADO No. {rng.randint(1, 200)}"
+            for _ in range(n)]
+
+def _guardar(db_engine, proceso_db_id: int, textos: list[str], inicio: int) -> list[int]:
+    return crud.create_actuaciones(db_engine, [
+        Actuacion(proceso_db_id=proceso_db_id, idRegActuacion=str(inicio + i), actuacion="Auto", anotacion=t)
+        for i, t in enumerate(textos)
+    ])
+
+def _leer(db_engine, ids: list[int]) -> list[str]:
+    return [crud.get_actuacion_by_db_id(db_engine, i).anotacion for i in ids]
+
+def test_ida_y_vuelta_tras_reentrenar(db_engine, crear_proceso):
+    proceso_db_id = crear_proceso()
+    textos = _anotaciones(700, 1)
+    ids = _guardar(db_engine, proceso_db_id, textos, 0)
+
+    primero = compression.entrenar_diccionario(db_engine, tamano=8192)
+    assert primero and compression.comprimir_existentes(db_engine) == 700
+    assert isinstance(compression.comprimir(textos[0]), bytes)
+    assert _leer(db_engine, ids[:50]) == textos[:50]
+
+    nuevos = _anotaciones(100, 2)
+    ids_nuevos = _guardar(db_engine, proceso_db_id, nuevos, 1000)
+    segundo = compression.entrenar_diccionario(db_engine, tamano=8192)
+    assert segundo not in (None, primero)
+    mas = _anotaciones(20, 3)
+    ids_mas = _guardar(db_engine, proceso_db_id, mas, 2000)
+    assert _leer(db_engine, ids[:50] + ids_nuevos + ids_mas) == textos[:50] + nuevos + mas
+
+def test_diccionario_entrenado_por_otro_proceso(db_engine, crear_proceso, monkeypatch):
+    proceso_db_id = crear_proceso()
+    textos = _anotaciones(700, 4)
+    ids = _guardar(db_engine, proceso_db_id, textos, 0)
+    primero = compression.entrenar_diccionario(db_engine, tamano=8192)
+    antes = (dict(compression._diccionarios), dict(compression._rutas_cargadas))
+
+    # Another process trains a newer dictionary and writes rows with it; this one has not rescanned yet
+    segundo = compression.entrenar_diccionario(db_engine, tamano=8192)
+    nuevos = _anotaciones(10, 5)
+    ids_nuevos = _guardar(db_engine, proceso_db_id, nuevos, 1000)
+    monkeypatch.setattr(compression, "_diccionarios", antes[0])
+    monkeypatch.setattr(compression, "_rutas_cargadas", antes[1])
+    monkeypatch.setattr(compression, "_diccionario_activo", primero)
+    monkeypatch.setattr(compression, "_proxima_recarga", float("inf"))
+    compression._estado.descompresores = {}
+
+    assert _leer(db_engine, ids_nuevos) == nuevos
+    assert segundo in compression._diccionarios and compression._diccionario_activo == segundo
+    assert _leer(db_engine, ids[:10]) == textos[:10]
+
+def test_sin_diccionario_no_reescanea_en_cada_escritura(db_engine, monkeypatch):
+    exploraciones = []
+    monkeypatch.setattr(compression.glob, "glob", lambda patron: exploraciones.append(patron) or [])
+    texto = _anotaciones(1, 6)[0]
+    for _ in range(200):
+        assert compression.comprimir(texto) == texto # Plain text until a dictionary exists
+    assert len(exploraciones) <= 1
@@ -0,0 +1,18 @@
+import pytest
+from app.db import crud
+from conftest import actuaciones
+
+@pytest.mark.parametrize("empresa, esperados", [
+    ("ACME_SA", {"ACME_SA"}),
+    ("100%", {"CEMENTOS 100% SAS"}),
+    ("acme", {"ACME_SA", "ACMEXSA"}),
+])
+def test_filtro_empresa_toma_comodines_literalmente(db_engine, crear_proceso, empresa, esperados):
+    for i, nombre in enumerate(["ACME_SA", "ACMEXSA", "CEMENTOS 100% SAS", "CEMENTOS 1000 SAS"]):
+        crud.create_actuaciones(db_engine, actuaciones(crear_proceso(str(i), nombre), 1))
+    assert {p["nombre_busqueda"] for p in crud.get_procesos_activos(db_engine, empresa=empresa)} == esperados
+
+def test_agregados_toman_comodines_literalmente(db_engine, crear_proceso):
+    for i, nombre in enumerate(["ACME_SA", "ACMEXSA"]):
+        crud.create_actuaciones(db_engine, actuaciones(crear_proceso(str(i), nombre), 2))
+    assert crud.count_actuaciones_por_urgencia(db_engine, empresa="ACME_SA") == {"SIN CLASIFICAR": 2}
@@ -0,0 +1,18 @@
+import fitz
+from app.services.document_services import extraer_texto_pdf
+
+def _pdf(paginas: list[str]) -> bytes:
+    with fitz.open() as doc:
+        for texto in paginas:
+            doc.new_page().insert_text((72, 72), texto)
+        return doc.tobytes()
+
+def test_extraer_texto_pdf_conserva_orden_y_offsets():
+    textos = [f"Pagina numero {i}" for i in range(45)] # Above MIN_PAGINAS_PARALELO: uses the process pool
+    documento = extraer_texto_pdf(_pdf(textos), max_workers=2)
+    assert documento.num_paginas == 45
+    for pagina, texto in zip(documento.paginas, textos):
+        assert documento.texto[pagina.inicio:pagina.fin].strip() == texto
+
+def test_extraer_texto_pdf_invalido():
+    assert extraer_texto_pdf(b"no es un pdf") is None
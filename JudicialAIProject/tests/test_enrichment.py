@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+import pytest
+from app.db import crud
+from app.services import enrichment
+from conftest import actuaciones
+
+@pytest.fixture
+def indexadas(monkeypatch):
+    indexadas = []
+    monkeypatch.setattr(enrichment, "indexar_actuaciones", lambda db_engine, acts: indexadas.extend(a.id for a in acts))
+    return indexadas
+
+def test_enriquecer_guarda_e_indexa_una_vez(db_engine, crear_proceso, indexadas):
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 1))
+    actuacion = crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id)[0]
+
+    enrichment.enriquecer_actuacion(db_engine, actuacion)
+    guardada = crud.get_actuacion_by_db_id(db_engine, actuacion.id)
+    assert guardada.resumen_ia and guardada.clasificacion_urgencia_ia
+    assert indexadas == [actuacion.id]
+
+    enrichment.enriquecer_actuacion(db_engine, guardada) # Nothing missing: no LLM call, no re-index
+    assert indexadas == [actuacion.id]
+    assert crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id) == []
+
+def test_fallo_no_reindexa_y_aplica_espera(db_engine, crear_proceso, indexadas, monkeypatch):
+    monkeypatch.setattr(enrichment, "generar_resumen_actuacion", lambda texto: None)
+    monkeypatch.setattr(enrichment, "clasificar_urgencia_actuacion", lambda texto: None)
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 2))
+    actuacion = crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id)[0]
+
+    antes = datetime.utcnow()
+    enrichment.enriquecer_actuacion(db_engine, actuacion)
+    assert indexadas == []
+    pendientes = crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id)
+    assert [a.id for a in pendientes] != [] and actuacion.id not in [a.id for a in pendientes]
+    despues_espera = antes + enrichment.ESPERA_REINTENTO + timedelta(seconds=5)
+    assert actuacion.id in [a.id for a in crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id, ahora=despues_espera)]
+
+    # A second failure doubles the wait
+    proximo = crud.update_actuacion_ia_fallida(db_engine, actuacion.id, antes, enrichment.ESPERA_REINTENTO, enrichment.ESPERA_MAX_REINTENTO)
+    assert proximo == antes + 2 * enrichment.ESPERA_REINTENTO
+
+def test_exito_parcial_indexa_y_aplica_espera(db_engine, crear_proceso, indexadas, monkeypatch):
+    monkeypatch.setattr(enrichment, "clasificar_urgencia_actuacion", lambda texto: None)
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 1))
+    actuacion = crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id)[0]
+
+    enrichment.enriquecer_actuacion(db_engine, actuacion)
+    assert indexadas == [actuacion.id]
+    assert crud.get_actuacion_by_db_id(db_engine, actuacion.id).resumen_ia
+    assert crud.get_actuaciones_sin_enriquecer(db_engine, proceso_db_id) == []
@@ -0,0 +1,74 @@
+import os
+import pytest
+from flask import Flask
+from app.frontend_2da_opt import routes
+
+@pytest.fixture
+def cliente(db_engine, monkeypatch):
+    monkeypatch.setattr(routes, "engine", db_engine)
+    app = Flask(__name__, template_folder=os.path.join(os.path.dirname(routes.__file__), "templates"))
+    app.register_blueprint(routes.main_bp)
+    return app.test_client()
+
+@pytest.mark.parametrize("dias, esperado", [("abc", 90), ("0", 1), ("100000", routes.MAX_DIAS_CALENDARIO), ("30", 30)])
+def test_calendario_acota_dias(cliente, monkeypatch, dias, esperado):
+    pedidos = []
+    monkeypatch.setattr(routes, "obtener_calendario", lambda db_engine, dias, **kwargs: pedidos.append(dias) or "BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n")
+    respuesta = cliente.get(f"/calendario.ics?dias={dias}")
+    assert respuesta.status_code == 200 and pedidos == [esperado]
+
+def test_procesos_avisa_resultados_truncados(cliente, monkeypatch):
+    monkeypatch.setattr(routes, "MAX_PAGINAS_API", 2)
+    def consultar(nombre, pagina=1, **kwargs):
+        return {"procesos": [{"idProceso": f"{nombre}-{pagina}-{i}", "sujetosProcesales": ""} for i in range(2)],
+                "paginacion": {"cantidadPaginas": 5 if nombre == "TRUNCADO SA" else 2}}
+    monkeypatch.setattr(routes, "consultar_procesos_por_nombre", consultar)
+
+    truncada = cliente.get("/procesos?nombre=TRUNCADO SA")
+    assert truncada.status_code == 200 and "Resultados incompletos" in truncada.get_data(as_text=True)
+    completa = cliente.get("/procesos?nombre=COMPLETO SA")
+    assert "Resultados incompletos" not in completa.get_data(as_text=True)
+
+def _esperar_almacenamiento():
+    routes._almacenamiento.submit(lambda: None).result()
+
+def test_proceso_vencido_se_refresca_en_segundo_plano(cliente, crear_proceso, db_engine, monkeypatch):
+    from datetime import datetime, timedelta
+    from sqlalchemy import update
+    from app.db.database import proceso_table
+    monkeypatch.setattr(routes, "_refrescos", {})
+    ingeridos = []
+    monkeypatch.setattr(routes, "_detalle_api", lambda id_proceso: ({"idProceso": id_proceso}, datetime.utcnow()))
+    monkeypatch.setattr(routes, "_actuaciones_api", lambda id_proceso: ([], datetime.utcnow()))
+    monkeypatch.setattr(routes, "ingerir_proceso", lambda db_engine, id_proceso, **kwargs: ingeridos.append(id_proceso))
+    crear_proceso("77")
+
+    assert cliente.get("/actuaciones/77").status_code == 200
+    _esperar_almacenamiento()
+    assert ingeridos == [] # Fresh copy: served from the DB only
+
+    with db_engine.connect() as connection:
+        connection.execute(update(proceso_table).values(fecha_actualizacion_db=datetime.utcnow() - timedelta(seconds=routes.TTL_PROCESO_S + 1)))
+        connection.commit()
+    assert cliente.get("/actuaciones/77").status_code == 200
+    assert cliente.get("/detalle/77").status_code == 200
+    _esperar_almacenamiento()
+    assert ingeridos == ["77"] # Once, even though the (mocked) store did not update the timestamp
+
+def test_refrescos_descarta_entradas_vencidas(crear_proceso, db_engine, monkeypatch):
+    import time
+    from datetime import datetime, timedelta
+    from app.db import crud
+    ahora = time.monotonic()
+    refrescos = {"viejo": ahora - routes.TTL_PROCESO_S - 1, "reciente": ahora - 10}
+    monkeypatch.setattr(routes, "_refrescos", refrescos)
+    monkeypatch.setattr(routes, "engine", db_engine)
+    monkeypatch.setattr(routes, "_detalle_api", lambda id_proceso: ({"idProceso": id_proceso}, datetime.utcnow()))
+    monkeypatch.setattr(routes, "_actuaciones_api", lambda id_proceso: ([], datetime.utcnow()))
+    monkeypatch.setattr(routes, "ingerir_proceso", lambda db_engine, id_proceso, **kwargs: None)
+    crear_proceso("77")
+    proceso = crud.get_proceso_by_idrama(db_engine, "77")
+    proceso.fecha_actualizacion_db = datetime.utcnow() - timedelta(seconds=routes.TTL_PROCESO_S + 1)
+    routes._refrescar_si_vencido(proceso)
+    _esperar_almacenamiento()
+    assert set(refrescos) == {"reciente", "77"}
@@ -0,0 +1,37 @@
+import pytest
+from app.db import crud
+from app.services import ingestion
+
+DETALLE = {"idProceso": 77, "llaveProceso": "11001310300120240000100", "despacho": "JUZGADO 1 CIVIL",
+           "sujetosProcesales": "Demandante: ACME SA | Demandado: BETA LTDA"}
+
+def _actuaciones_api(n: int, inicio: int = 0) -> list[dict]:
+    return [{"idRegActuacion": i, "fechaActuacion": f"2024-02-{i % 28 + 1:02d}T00:00:00", "actuacion": "Auto",
+             "anotacion": f"AUTO QUE FIJA FECHA número {i}"} for i in range(inicio, inicio + n)]
+
+@pytest.fixture
+def indexadas(monkeypatch):
+    indexadas = []
+    monkeypatch.setattr(ingestion, "indexar_actuaciones", lambda db_engine, acts: indexadas.append([a.id for a in acts]))
+    return indexadas
+
+def test_ingerir_proceso_guarda_actuaciones_en_un_lote(db_engine, indexadas, monkeypatch):
+    monkeypatch.setattr(crud, "create_actuacion", lambda *args: pytest.fail("una transacción por actuación"))
+    proceso = ingestion.ingerir_proceso(db_engine, "77", "ACME SA", respuesta_detalle=DETALLE, respuesta_actuaciones=_actuaciones_api(5))
+    ids = [a.id for a in crud.get_actuaciones_by_proceso_db_id(db_engine, proceso.id)]
+    assert len(ids) == 5 and sorted(indexadas[0]) == sorted(ids)
+
+    # Re-ingesting updates the same rows (matched by idRegActuacion) and adds the new ones
+    ingestion.ingerir_proceso(db_engine, "77", "ACME SA", respuesta_detalle=DETALLE, respuesta_actuaciones=_actuaciones_api(6))
+    nuevos = [a.id for a in crud.get_actuaciones_by_proceso_db_id(db_engine, proceso.id)]
+    assert len(nuevos) == 6 and set(ids) < set(nuevos)
+
+def test_ingerir_proceso_lee_todas_las_paginas(db_engine, indexadas, monkeypatch):
+    paginas = []
+    def consultar(id_proceso, pagina=1):
+        paginas.append(pagina)
+        return {"actuaciones": _actuaciones_api(40, inicio=(pagina - 1) * 40), "paginacion": {"cantidadPaginas": 3}}
+    monkeypatch.setattr(ingestion, "consultar_actuaciones_proceso", consultar)
+    proceso = ingestion.ingerir_proceso(db_engine, "77", "ACME SA", respuesta_detalle=DETALLE)
+    assert sorted(paginas) == [1, 2, 3]
+    assert len(crud.get_actuaciones_by_proceso_db_id(db_engine, proceso.id)) == 120
@@ -0,0 +1,56 @@
+from datetime import datetime
+import pytest
+from app.db import job_queue
+from app.db.job_queue import BackendColaSQL
+
+@pytest.fixture
+def cola(db_engine):
+    return BackendColaSQL(db_engine)
+
+def test_clave_idempotente(cola):
+    primero = cola.encolar("fetch-process", {"id_proceso": "1"})
+    assert cola.encolar("fetch-process", {"id_proceso": "1"}) == primero
+    assert cola.encolar("fetch-process", {"id_proceso": "1", "version": "2"}) != primero
+    assert cola.encolar("fetch-process", {"otro": True}, clave="fetch-process:1") == cola.encolar("fetch-process", {}, clave="fetch-process:1")
+    (trabajo,) = cola.reclamar("w1", limite=1)
+    assert cola.completar(trabajo.id, "w1", {"ok": True})
+    assert cola.encolar("fetch-process", {"id_proceso": "1"}) == primero # Completed work is not repeated
+    assert cola.obtener(primero).estado == "completado"
+
+def test_lease_vencido_se_reclama_y_el_worker_anterior_pierde_el_resultado(cola):
+    trabajo_id = cola.encolar("fetch-process", {"id_proceso": "1"}, max_intentos=2)
+    assert [t.id for t in cola.reclamar("muerto", lease_segundos=-1)] == [trabajo_id]
+    (trabajo,) = cola.reclamar("vivo")
+    assert trabajo.id == trabajo_id and trabajo.intentos == 2
+    assert not cola.completar(trabajo_id, "muerto")
+    assert cola.completar(trabajo_id, "vivo")
+
+def test_lease_vencido_en_el_ultimo_intento_falla(cola):
+    trabajo_id = cola.encolar("fetch-process", {"id_proceso": "1"}, max_intentos=2)
+    cola.reclamar("w1", lease_segundos=-1)
+    cola.reclamar("w2", lease_segundos=-1) # Crashed its worker twice
+    assert cola.reclamar("w3") == []
+    trabajo = cola.obtener(trabajo_id)
+    assert trabajo.estado == "fallido" and "Lease vencido" in trabajo.ultimo_error
+    assert not cola.hay_trabajo()
+
+def test_reintento_con_espera_hasta_max_intentos(cola, monkeypatch):
+    monkeypatch.setattr(job_queue, "espera_reintento", lambda intentos: 60)
+    trabajo_id = cola.encolar("fetch-process", {"id_proceso": "1"}, max_intentos=2)
+    (trabajo,) = cola.reclamar("w1")
+    assert cola.fallar(trabajo.id, "w1", "timeout")
+    pendiente = cola.obtener(trabajo_id)
+    assert pendiente.estado == "pendiente" and pendiente.disponible_en > datetime.utcnow()
+    assert cola.reclamar("w1") == [] and cola.hay_trabajo() # Waiting for its backoff
+
+    with cola.db_engine.connect() as connection:
+        connection.execute(job_queue.trabajo_table.update().values(disponible_en=datetime.utcnow()))
+        connection.commit()
+    (trabajo,) = cola.reclamar("w1")
+    assert cola.fallar(trabajo.id, "w1", "timeout")
+    assert cola.obtener(trabajo_id).estado == "fallido" and not cola.hay_trabajo()
+
+def test_espera_reintento_exponencial_y_acotada():
+    assert job_queue.BACKOFF_BASE_SEGUNDOS * 0.8 <= job_queue.espera_reintento(1) <= job_queue.BACKOFF_BASE_SEGUNDOS * 1.2
+    assert job_queue.espera_reintento(3) >= 4 * job_queue.BACKOFF_BASE_SEGUNDOS * 0.8
+    assert job_queue.espera_reintento(50) <= job_queue.BACKOFF_MAX_SEGUNDOS * 1.2
@@ -0,0 +1,76 @@
+import time
+import pytest
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableLambda
+from app.config.fake_llm import DeterministicFakeChatModel
+from app.services.llm_router import MAX_TASA_ERROR, LLMRouter
+
+PROMPT = PromptTemplate.from_template("Resuma: {texto}")
+
+def _caido(_):
+    raise ConnectionError("backend caído")
+
+@pytest.fixture
+def router():
+    providers = {
+        "pro": DeterministicFakeChatModel(latencia_ms=30),
+        "flash": DeterministicFakeChatModel(),
+        "caido": RunnableLambda(_caido),
+    }
+    return LLMRouter(providers, {
+        "resumen_documento": ["pro", "flash"],
+        "urgencia": ["caido", "flash", "pro"],
+    })
+
+def test_respaldo_cuando_falla_el_preferido(router):
+    assert router.candidatos("urgencia")[0] == "caido"
+    assert router.invoke("urgencia", PROMPT, {"texto": "FIJA FECHA DE AUDIENCIA"})
+    # Every failure is a fallback to the next candidate; once the error rate crosses the limit the backend goes last
+    for _ in range(3):
+        router.invoke("urgencia", PROMPT, {"texto": "traslado"})
+    assert router.estadisticas[("urgencia", "caido")].tasa_error > MAX_TASA_ERROR
+    assert router.candidatos("urgencia") == ["flash", "pro", "caido"]
+
+def test_todos_fallan(router):
+    solo_caido = LLMRouter({"caido": RunnableLambda(_caido)}, {"urgencia": ["caido"]})
+    with pytest.raises(ConnectionError):
+        solo_caido.invoke("urgencia", PROMPT, {"texto": "x"})
+    with pytest.raises(RuntimeError):
+        LLMRouter({}, {}).invoke("urgencia", PROMPT, {"texto": "x"})
+
+def test_la_latencia_no_cambia_la_preferencia(router):
+    for _ in range(5):
+        router.invoke("resumen_documento", PROMPT, {"texto": "un documento largo"})
+        router.invoke("urgencia", PROMPT, {"texto": "auto"})
+    # pro is measurably slower than flash, but stays first for documents
+    assert router.estadisticas[("resumen_documento", "pro")].latencia_s > 0.02
+    assert router.candidatos("resumen_documento")[0] == "pro"
+
+def test_errores_de_una_tarea_no_degradan_otras(router):
+    for _ in range(5):
+        router.registrar("urgencia", "pro", None, error=True)
+    assert router.candidatos("urgencia")[-1] == "pro"
+    assert router.candidatos("resumen_documento")[0] == "pro"
+
+def test_respaldo_con_hedging(router):
+    router.registrar("resumen_documento", "pro", 0.001, error=False) # Hedge after MIN_ESPERA_HEDGE_S
+    assert router.invoke("resumen_documento", PROMPT, {"texto": "x"}, hedge=True)
+    assert router.invoke("urgencia", PROMPT, {"texto": "x"}, hedge=True) # caido fails: flash answers
+
+def test_llamada_lenta_cuenta_como_error():
+    lento = LLMRouter({"lento": DeterministicFakeChatModel(latencia_ms=50), "flash": DeterministicFakeChatModel()},
+                      {"urgencia": ["lento", "flash"]}, timeout_s=0.01)
+    for _ in range(4):
+        assert lento.invoke("urgencia", PROMPT, {"texto": "auto"}) # The late answer is still returned
+    assert lento.estadisticas[("urgencia", "lento")].tasa_error > MAX_TASA_ERROR
+    assert lento.candidatos("urgencia") == ["flash", "lento"]
+
+def test_hedging_no_espera_mas_que_el_timeout():
+    colgado = RunnableLambda(lambda _: time.sleep(0.6) or "tarde")
+    hedged = LLMRouter({"a": colgado, "b": colgado}, {"urgencia": ["a", "b"]}, timeout_s=0.2)
+    inicio = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        hedged.invoke("urgencia", PROMPT, {"texto": "x"}, hedge=True)
+    assert time.perf_counter() - inicio < 0.5
+    hedged._executor.shutdown(wait=True)
+    assert hedged.estadisticas[("urgencia", "a")].tasa_error > 0 # Recorded once the hung call ended
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from app.db import crud
+from app.db.database import notificacion_table
+from app.services import notificaciones
+from app.services.notificaciones import Filtro, Notificador
+from conftest import actuaciones
+
+def _ids(suscripcion) -> list[int]:
+    return [n["id"] for n in suscripcion.recibir(0)]
+
+def test_repeticion_sin_duplicados(db_engine, crear_proceso):
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 3))
+    notificador = Notificador(db_engine, intervalo_s=3600) # The polling thread reads once, then sleeps
+    primera = notificador.suscribir()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 2, inicio=3))
+
+    # The polling thread delivers 4 and 5 to the new subscription before its replay runs
+    repetir = notificador._repetir
+    def repetir_tras_sondeo(suscripcion, *args):
+        notificador.publicar([notificaciones._notificacion(f) for f in crud.get_notificaciones_after_id(db_engine, 3)])
+        repetir(suscripcion, *args)
+    notificador._repetir = repetir_tras_sondeo
+
+    segunda = notificador.suscribir(ultimo_evento_id=1)
+    assert _ids(segunda) == [2, 3, 4, 5]
+    assert _ids(primera) == [4, 5]
+
+def test_repeticion_filtrada(db_engine, crear_proceso):
+    otro = crear_proceso("2", nombre_busqueda="BANCO XYZ")
+    acme = crear_proceso("1")
+    crud.create_actuaciones(db_engine, actuaciones(otro, 2) + actuaciones(acme, 2, inicio=2))
+    notificador = Notificador(db_engine, intervalo_s=3600)
+    suscripcion = notificador.suscribir(Filtro(empresas=["acme"]), ultimo_evento_id=0)
+    assert _ids(suscripcion) == [3, 4]
+    notificador.cancelar(suscripcion)
+    assert notificador.num_suscripciones() == 0
+
+def test_purgar_conserva_las_no_despachadas(db_engine, crear_proceso):
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 4))
+    with db_engine.connect() as connection:
+        connection.execute(update(notificacion_table).values(fecha_creacion_db=datetime.utcnow() - timedelta(days=30)))
+        connection.commit()
+    crud.update_notificaciones_despachadas(db_engine, [1, 2], datetime.utcnow())
+
+    assert notificaciones.purgar(db_engine) == 2
+    assert [f["id"] for f in crud.get_notificaciones_pendientes(db_engine)] == [3, 4]
+    assert notificaciones.purgar(db_engine, solo_despachadas=False) == 2
+    assert crud.get_notificaciones_after_id(db_engine, 0) == []
+
+def test_purgar_limita_las_no_despachadas(db_engine, crear_proceso):
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 3))
+    with db_engine.connect() as connection:
+        dias = notificaciones.RETENCION_MAX_DIAS + 1
+        connection.execute(update(notificacion_table).where(notificacion_table.c.id < 3).values(fecha_creacion_db=datetime.utcnow() - timedelta(days=dias)))
+        connection.commit()
+
+    assert notificaciones.purgar(db_engine) == 2 # A sink that never recovers does not pin them forever
+    assert [f["id"] for f in crud.get_notificaciones_pendientes(db_engine)] == [3]
+
+def test_notificador_purga_sin_suscriptores_ni_sinks(db_engine, crear_proceso, monkeypatch):
+    for variable in ("NOTIFICACIONES_WEBHOOK_URL", "NOTIFICACIONES_CORREO_PARA"):
+        monkeypatch.delenv(variable, raising=False)
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 2))
+    def envejecer():
+        with db_engine.connect() as connection:
+            connection.execute(update(notificacion_table).values(fecha_creacion_db=datetime.utcnow() - timedelta(days=notificaciones.RETENCION_DIAS + 1)))
+            connection.commit()
+    envejecer()
+
+    notificador = Notificador(db_engine)
+    notificador._purgar_si_toca()
+    assert crud.get_notificaciones_after_id(db_engine, 0) == []
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 1, inicio=2))
+    envejecer()
+    notificador._purgar_si_toca() # Not again until INTERVALO_PURGA_S has passed
+    assert len(crud.get_notificaciones_after_id(db_engine, 0)) == 1
@@ -0,0 +1,26 @@
+import pytest
+from app.db import crud
+from app.db.vector_index import IndiceVectorial
+from app.services import retrieval
+from app.services.embeddings import obtener_embedder
+from conftest import actuaciones
+
+@pytest.fixture
+def indice(tmp_path, monkeypatch):
+    indice = IndiceVectorial(str(tmp_path / "vector_index"), obtener_embedder().dim)
+    monkeypatch.setattr(retrieval, "obtener_indice", lambda *args: indice)
+    return indice
+
+def test_reindexar_sin_cambios_no_agrega_filas(db_engine, crear_proceso, indice):
+    proceso_db_id = crear_proceso()
+    crud.create_actuaciones(db_engine, actuaciones(proceso_db_id, 3))
+    guardadas = crud.get_actuaciones_by_proceso_db_id(db_engine, proceso_db_id)
+    assert retrieval.indexar_actuaciones(db_engine, guardadas) == 3
+    assert retrieval.indexar_actuaciones(db_engine, guardadas) == 0
+    assert indice.filas == 3
+
+    guardadas[0].resumen_ia, guardadas[1].clasificacion_urgencia_ia = "Resumen nuevo", "ALTA"
+    assert retrieval.indexar_actuaciones(db_engine, guardadas) == 2
+    assert indice.filas == 5
+    resultados = retrieval.buscar_contexto(db_engine, "Resumen nuevo", k=10)
+    assert sorted(r["ref"] for r in resultados) == sorted(a.id for a in guardadas)
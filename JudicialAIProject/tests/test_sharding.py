@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import pytest
+from app.db import crud, sharding
+from app.models.models import Proceso
+from app.services import retrieval
+from conftest import actuaciones
+
+@pytest.fixture
+def tenants(db_engine, tmp_path, monkeypatch):
+    # db_engine redirects the zstd dictionaries that the tenant migrations use
+    monkeypatch.setattr(sharding, "CATALOGO_URL", f"sqlite:///{tmp_path / 'catalogo.sqlite'}")
+    monkeypatch.setattr(sharding, "TENANTS_DIR", str(tmp_path / "tenants"))
+    monkeypatch.setattr(sharding, "_catalogo", None)
+    monkeypatch.setattr(sharding, "_engines", {})
+    monkeypatch.setattr(retrieval, "_indices", {})
+    yield sharding
+    for engine in sharding._engines.values():
+        engine.dispose()
+
+def _poblar(clave: str, empresa: str, anotacion: str, n: int = 2) -> None:
+    db_engine = sharding.engine_tenant(clave)
+    proceso_db_id = crud.create_proceso(db_engine, Proceso(idProceso=f"{clave}-1", nombre_busqueda=empresa))
+    nuevas = actuaciones(proceso_db_id, n)
+    for actuacion in nuevas:
+        actuacion.anotacion = f"{anotacion} {actuacion.idRegActuacion}"
+    crud.create_actuaciones(db_engine, nuevas)
+    retrieval.indexar_actuaciones(db_engine, crud.get_actuaciones_by_proceso_db_id(db_engine, proceso_db_id))
+
+def test_enrutamiento_por_nombre_normalizado(tenants):
+    clave = tenants.registrar_tenant("Banco Unión S.A.", ["BU"])
+    assert tenants.tenant_de_empresa("BANCO UNION S.A.") == clave
+    assert tenants.engine_para_empresa("bu") is tenants.engine_tenant(clave)
+    assert tenants.tenant_de_empresa("Otra Empresa", crear=False) is None
+    otra = tenants.engine_para_empresa("Otra Empresa")
+    assert otra is not tenants.engine_tenant(clave)
+    assert [t["clave"] for t in tenants.listar_tenants()] == sorted([clave, tenants.tenant_de_empresa("Otra Empresa")])
+
+def test_consultas_en_todos_los_tenants(tenants):
+    acme, beta = tenants.registrar_tenant("ACME SA"), tenants.registrar_tenant("BETA LTDA")
+    _poblar(acme, "ACME SA", "AUTO QUE ADMITE DEMANDA", n=3)
+    _poblar(beta, "BETA LTDA", "SENTENCIA DE PRIMERA INSTANCIA", n=2)
+
+    conteos = tenants.fusionar_conteos(tenants.consultar_todos(crud.count_actuaciones_por_urgencia))
+    assert conteos == {"SIN CLASIFICAR": 5}
+    filas = tenants.fusionar_filas(tenants.consultar_todos(crud.get_procesos_activos), orden="nombre_busqueda")
+    assert [(f["tenant"], f["nombre_busqueda"]) for f in filas] == [(acme, "ACME SA"), (beta, "BETA LTDA")]
+
+    # Actuación IDs repeat across tenants: each tenant is searched in its own index
+    for clave in (acme, beta):
+        assert retrieval.obtener_indice(tenants.engine_tenant(clave)).directorio.startswith(tenants.ruta_tenant(clave))
+    resultados = tenants.consultar_todos(retrieval.buscar_contexto, "sentencia de primera instancia", k=10)
+    assert len(resultados[acme]) == 3 and len(resultados[beta]) == 2
+    assert all("SENTENCIA" in r["texto"] for r in resultados[beta])
+    assert all("ADMITE" in r["texto"] for r in resultados[acme])
+
+def test_exportar_y_eliminar(tenants, tmp_path):
+    clave = tenants.registrar_tenant("ACME SA")
+    _poblar(clave, "ACME SA", "AUTO QUE ADMITE DEMANDA", n=4)
+
+    destino = tenants.exportar_tenant(clave, str(tmp_path / "exportes" / "acme.sqlite"))
+    with sqlite3.connect(destino) as copia:
+        assert copia.execute("SELECT COUNT(*) FROM actuacion").fetchone()[0] == 4
+
+    assert tenants.eliminar_tenant(clave)
+    assert not os.path.exists(tenants.ruta_tenant(clave))
+    assert tenants.listar_tenants() == [] and tenants.tenant_de_empresa("ACME SA", crear=False) is None
+    assert not tenants.eliminar_tenant(clave)
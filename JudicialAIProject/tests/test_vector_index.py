@@ -0,0 +1,84 @@
+import threading
+import numpy as np
+from app.db import vector_index
+from app.db.vector_index import IndiceVectorial
+
+DIM = 8
+
+def _vectores(n: int, semilla: int) -> np.ndarray:
+    vectores = np.random.default_rng(semilla).normal(size=(n, DIM)).astype(np.float32)
+    return vectores / np.linalg.norm(vectores, axis=1, keepdims=True)
+
+def _metadatos(refs, empresa="ACME SA") -> list[dict]:
+    return [{"tipo": "actuacion", "ref": r, "empresa": empresa, "proceso_db_id": 1, "urgencia": "ALTA", "fecha": "2024-05-01"} for r in refs]
+
+def test_dos_procesos_no_se_sobrescriben(tmp_path):
+    # Two instances over one directory behave like two processes: each has its own in-memory state
+    a = IndiceVectorial(str(tmp_path), DIM)
+    b = IndiceVectorial(str(tmp_path), DIM)
+    vectores_a, vectores_b = _vectores(3, 1), _vectores(2, 2)
+    a.agregar(vectores_a, _metadatos([1, 2, 3]))
+    b.agregar(vectores_b, _metadatos([4, 5], empresa="BANCO XYZ"))
+
+    assert a.buscar(vectores_b[0], k=1, empresa="BANCO XYZ")[0]["ref"] == 4
+    assert b.buscar(vectores_a[0], k=1)[0]["ref"] == 1
+    assert IndiceVectorial(str(tmp_path), DIM).filas == 5
+
+    # Re-indexing in one instance replaces the row the other one wrote
+    b.agregar(vectores_a[:1], _metadatos([1]))
+    refs = [r["ref"] for r in a.buscar(vectores_a[0], k=10)]
+    assert sorted(refs) == [1, 2, 3, 4, 5]
+
+def test_escrituras_concurrentes(tmp_path):
+    indices = [IndiceVectorial(str(tmp_path), DIM) for _ in range(4)]
+
+    def escribir(i):
+        for lote in range(10):
+            refs = [i * 1000 + lote * 10 + j for j in range(10)]
+            indices[i].agregar(_vectores(10, refs[0]), _metadatos(refs))
+
+    hilos = [threading.Thread(target=escribir, args=(i,)) for i in range(len(indices))]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    final = IndiceVectorial(str(tmp_path), DIM)
+    assert final.filas == 400
+    assert len({int(r) for r in final._meta["ref"][:final.filas]}) == 400 # No row overwritten by another writer
+    assert len(final.buscar(_vectores(1, 0)[0], k=1000)) == 400
+
+def test_compactar_conserva_filas_activas(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "MIN_FILAS_COMPACTAR", 10)
+    a = IndiceVectorial(str(tmp_path), DIM)
+    b = IndiceVectorial(str(tmp_path), DIM)
+    vectores = _vectores(12, 1)
+    a.agregar(vectores, _metadatos(range(12)))
+    b.buscar(vectores[0], k=1) # b has read the rows before they move
+    a.agregar(vectores[:6], _metadatos(range(6)))
+    a.agregar(vectores[:6], _metadatos(range(6))) # Re-indexed twice: 12 of 24 rows inactive
+    assert a.filas == 24
+    a.agregar(vectores[6:7], _metadatos([6])) # 13 of 25: compacted
+    assert a.filas == 12 and a.generacion == 1
+
+    # The other instance rebuilds its keys: re-indexing there replaces the moved row, it does not duplicate it
+    b.agregar(vectores[11:12], _metadatos([11]))
+    assert sorted(r["ref"] for r in a.buscar(vectores[0], k=100)) == list(range(12))
+    assert a.buscar(vectores[11], k=1)[0]["ref"] == 11
+
+def test_ivf_se_entrena_al_crecer(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "MIN_FILAS_IVF", 200)
+    indice = IndiceVectorial(str(tmp_path), DIM)
+    indice.agregar(_vectores(150, 1), _metadatos(range(150)))
+    assert indice.centroides is None
+    indice.agregar(_vectores(100, 2), _metadatos(range(150, 250)))
+    assert indice.filas_entrenadas == 250 and indice.n_listas > 1
+    assert set(indice._meta["lista"][:indice.filas].tolist()) <= set(range(indice.n_listas))
+    consulta = _vectores(100, 2)[0]
+    assert indice.buscar(consulta, k=1)[0]["ref"] == 150
+    assert IndiceVectorial(str(tmp_path), DIM).n_listas == indice.n_listas
+
+def test_huellas(tmp_path):
+    indice = IndiceVectorial(str(tmp_path), DIM)
+    indice.agregar(_vectores(2, 1), [{**m, "huella": 10 + m["ref"]} for m in _metadatos([1, 2])])
+    assert indice.huellas("actuacion", [1, 2, 3]) == [11, 12, None]
@@ -0,0 +1,52 @@
+import threading
+import time
+from app.db import job_queue
+from app.db.job_queue import BackendColaSQL
+from app.services import workers
+
+def test_hasta_vaciar_espera_seguimientos_y_reintentos(db_engine, monkeypatch):
+    monkeypatch.setattr(workers, "ESPERA_VACIA_S", (0.02, 0.1))
+    monkeypatch.setattr(job_queue, "espera_reintento", lambda intentos: 0.3)
+    hilos_seguimiento, fallos = set(), []
+
+    def proceso(db_engine, cola, payload):
+        time.sleep(0.2) # The other thread finds nothing to claim meanwhile
+        for i in range(4):
+            cola.encolar("fetch-actuaciones", {"i": i})
+        return {}
+
+    def actuaciones(db_engine, cola, payload):
+        if payload["i"] == 0 and not fallos:
+            fallos.append(1)
+            raise RuntimeError("API caída") # Retried after its backoff
+        time.sleep(0.1)
+        hilos_seguimiento.add(threading.current_thread().name)
+        return {}
+
+    monkeypatch.setitem(workers.MANEJADORES, "fetch-process", proceso)
+    monkeypatch.setitem(workers.MANEJADORES, "fetch-actuaciones", actuaciones)
+    cola = BackendColaSQL(db_engine)
+    cola.encolar("fetch-process", {"id_proceso": "1"})
+
+    worker = workers.Worker(db_engine, cola, hilos=2, lease_segundos=30)
+    worker.iniciar(hasta_vaciar=True)
+
+    assert cola.estadisticas() == {"fetch-process": {"completado": 1}, "fetch-actuaciones": {"completado": 4}}
+    assert worker.procesados == 5 and worker.fallidos == 1
+    assert len(hilos_seguimiento) == 2 # Both threads stayed to drain the follow-ups
+
+def test_fetch_actuaciones_guarda_en_un_lote(db_engine, crear_proceso, monkeypatch):
+    from app.db import crud
+    from app.services import ingestion
+    proceso_db_id = crear_proceso()
+    monkeypatch.setattr(workers.limitador_api, "intervalo", 0.0)
+    monkeypatch.setattr(ingestion, "consultar_actuaciones_proceso", lambda id_proceso, *args, **kwargs: {"actuaciones": [
+        {"idRegActuacion": i, "fechaActuacion": "2024-03-01T00:00:00", "actuacion": "Auto", "anotacion": f"AUTO {i}"} for i in range(3)
+    ]})
+    def por_fila(*args):
+        raise AssertionError("una transacción por actuación")
+    monkeypatch.setattr(crud, "create_actuacion", por_fila)
+    cola = BackendColaSQL(db_engine)
+    resultado = workers._fetch_actuaciones(db_engine, cola, {"id_proceso": "1", "proceso_db_id": proceso_db_id})
+    assert resultado == {"actuaciones": 3}
+    assert cola.estadisticas() == {"enrich-ai": {"pendiente": 3}}